@@ -0,0 +1,57 @@
+import json
+import logging
+import sys
+from lib.perf.benchmark import (BenchmarkRunner, Scenario, compare,
+                                format_results, load_results, run_clients,
+                                save_results)
+from lib.utils.log_setup import configure_logger
+from lib.utils.parser import parse_benchmark_args
+
+
+# Runs the clients of a scenario for the benchmark in another process
+def run_worker():
+    logging.basicConfig(level=logging.ERROR)
+    spec = json.load(sys.stdin)
+    json.dump(run_clients(spec), sys.stdout)
+
+
+def main():
+    args = parse_benchmark_args()
+    if args.worker:
+        run_worker()
+        return
+    configure_logger(args, "benchmark.log")
+
+    baseline = None
+    if args.baseline:
+        try:
+            baseline = load_results(args.baseline)
+        except (OSError, ValueError) as e:
+            logging.error("Error loading baseline: " + str(e))
+            exit(1)
+
+    scenarios = Scenario.matrix(args.protocols, args.directions, args.sizes,
+                                args.clients, args.loss, args.seed)
+    runner = BenchmarkRunner(args.repeat, args.in_process, args.timeout)
+    try:
+        results = runner.run(scenarios)
+    except KeyboardInterrupt:
+        logging.error("Benchmark interrupted")
+        exit(1)
+
+    print("\n".join(format_results(results)))
+    if args.output:
+        save_results(results, args.output)
+        logging.info(f"[BENCHMARK] Results saved to {args.output}")
+
+    if baseline:
+        lines, regressions = compare(results, baseline, args.threshold)
+        print("\n".join(lines))
+        if regressions:
+            logging.error(
+                f"[BENCHMARK] {regressions} metrics regressed more than {args.threshold}%")
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,12 @@
+import logging
+from contextlib import nullcontext
 from lib.client import ClientRDT
+from lib.perf.profiler import Profiler
+from lib.sockets_rdt.segment_trace import SegmentTracer
+from lib.sockets_rdt.stream_rdt import StreamRDT
+from lib.utils.compression import COMPRESSION_BY_NAME
 from lib.utils.constant import SelectedProtocol
+from lib.utils.file_selection import download_destinations
 from lib.utils.log_setup import configure_logger
 from lib.utils.parser import parse_download_args
 
@@ -11,5 +18,43 @@ if __name__ == "__main__":
 
     protocol = SelectedProtocol.SELECTIVE_REPEAT if args.selective_repeat else SelectedProtocol.STOP_AND_WAIT
 
-    client = ClientRDT(args.host, args.port, protocol)
-    client.download(args.dst, args.name)
+    compression = COMPRESSION_BY_NAME[args.compression]
+
+    if args.trace:
+        try:
+            StreamRDT.tracer = SegmentTracer.open(args.trace, "client")
+        except OSError as e:
+            logging.error("[CLIENT DOWNLOAD] Error opening trace file: " + str(e))
+            exit(1)
+
+    profiler = None
+    if args.profile:
+        try:
+            profiler = Profiler.open(args.profile, args.profile_dir)
+        except OSError as e:
+            logging.error("[CLIENT DOWNLOAD] Error creating profile directory: " + str(e))
+            exit(1)
+    profile = profiler.profile("download", all_threads=True) if profiler \
+        else nullcontext()
+
+    client = ClientRDT(args.host, args.port, protocol,
+                       compression, args.compression_level)
+    files = download_destinations(args.name, args.dst)
+    failed = []
+    with profile:
+        try:
+            if len(files) == 1:
+                client.download(*files[0], args.streams, args.resume,
+                                args.offset, args.length)
+            else:
+                failed = client.download_files(files, args.streams, args.resume,
+                                               args.multiplex)
+        finally:
+            client.close()
+            if StreamRDT.tracer:
+                StreamRDT.tracer.close()
+    if profiler:
+        profiler.close()
+    logging.info(f"[CLIENT DOWNLOAD] Summary: {client.pool.stats.summary()}")
+    if failed:
+        exit(1)
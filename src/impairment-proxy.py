@@ -0,0 +1,54 @@
+import logging
+import signal
+from lib.perf.impairment_proxy import (GilbertElliottLoss, ImpairmentProxy,
+                                       LinkImpairments)
+from lib.utils.log_setup import configure_logger
+from lib.utils.parser import parse_proxy_args
+
+
+def link_impairments(args) -> LinkImpairments:
+    loss = GilbertElliottLoss(good_loss=args.loss / 100)
+    if args.burst_loss:
+        p, r = args.burst_loss
+        loss = GilbertElliottLoss(
+            p / 100, r / 100, args.loss / 100, args.bad_state_loss / 100)
+
+    return LinkImpairments(
+        loss=loss,
+        delay=args.delay / 1000,
+        jitter=args.jitter / 1000,
+        reorder=args.reorder / 100,
+        reorder_gap=args.reorder_gap / 1000,
+        duplicate=args.duplicate / 100,
+        corrupt=args.corrupt / 100,
+        bandwidth=args.bandwidth * 1000 / 8,
+        queue_size=args.queue,
+    )
+
+
+def main():
+    args = parse_proxy_args()
+    configure_logger(args, "proxy.log")
+
+    impairments = link_impairments(args)
+    upstream = impairments if args.direction != "down" else LinkImpairments()
+    downstream = impairments if args.direction != "up" else LinkImpairments()
+
+    try:
+        proxy = ImpairmentProxy(args.host, args.port, args.server_host,
+                                args.server_port, upstream, downstream,
+                                args.seed)
+    except OSError as e:
+        logging.error("Error starting proxy: " + str(e))
+        exit(1)
+
+    signal.signal(signal.SIGTERM, lambda *_: proxy.close())
+    try:
+        proxy.run()
+    except KeyboardInterrupt:
+        logging.debug("[PROXY] Keyboard interrupt received, closing proxy")
+        proxy.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import os
+from lib.utils.constant import SelectedProtocol, SelectedTransferType
+from lib.utils.exceptions import RequestRejectedError
+from lib.utils.file_handling import FileHandler
+from lib.segment_encoding.application_header import ApplicationHeaderRDT
+from lib.sockets_rdt.async_stream_rdt import AsyncStreamRDT
+from lib.transference_handler.async_transfer import AsyncDownloader, \
+    AsyncUploader, read_app_header
+
+
+# asyncio version of ClientRDT, to upload and download files from an
+# asyncio service without a thread per transference. Each transference
+# goes on a connection of its own, always uncompressed, and its errors are
+# raised instead of logged. Returns the stats of the connection
+class AsyncClientRDT:
+
+    def __init__(self, external_host, external_port,
+                 protocol=SelectedProtocol.STOP_AND_WAIT):
+        self.external_host = external_host
+        self.external_port = external_port
+        self.protocol = protocol
+
+    async def upload(self, file_path, file_name):
+        logging.info(
+            f"[CLIENT UPLOAD] Starting upload from file path: {file_path}")
+        file_handler = await asyncio.get_running_loop().run_in_executor(
+            None, FileHandler, file_path, file_name, "rb")
+        try:
+            stream = await self._connect()
+            try:
+                await AsyncUploader(
+                    stream, file_handler, read_answer=True).run()
+            finally:
+                await stream.close()
+        finally:
+            file_handler.close()
+        logging.info(f"[CLIENT UPLOAD] Uploaded {file_name}")
+        return stream.stats
+
+    # A length of 0 downloads from offset until the end of the file
+    async def download(self, file_path, file_name, offset=0, length=0):
+        logging.info(
+            f"[CLIENT DOWNLOAD] Starting download with file name: {file_name}")
+        stream = await self._connect()
+        try:
+            app_header = ApplicationHeaderRDT(
+                SelectedTransferType.DOWNLOAD, file_name, 0, offset, length)
+            await stream.send(app_header.as_bytes())
+
+            response, initial_data = await read_app_header(stream)
+            if response.is_error():
+                raise RequestRejectedError(
+                    f"[CLIENT DOWNLOAD] Request rejected by the server: {response.file_name}")
+            if response.file_name != file_name:
+                raise FileNotFoundError(
+                    f"[CLIENT DOWNLOAD] Requested file does not exist: {file_name}")
+
+            if os.path.dirname(file_path):
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            file_handler = await asyncio.get_running_loop().run_in_executor(
+                None, FileHandler, file_path, file_name, "wb")
+            try:
+                await AsyncDownloader(stream, file_handler).run(initial_data)
+            finally:
+                file_handler.close()
+        finally:
+            await stream.close()
+        logging.info(f"[CLIENT DOWNLOAD] Downloaded {file_name}")
+        return stream.stats
+
+    # ======================== FOR PRIVATE USE ========================
+
+    async def _connect(self):
+        return await AsyncStreamRDT.connect(
+            self.protocol, self.external_host, self.external_port)
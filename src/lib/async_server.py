@@ -0,0 +1,253 @@
+import asyncio
+import logging
+from lib.utils.exceptions import ExternalConnectionClosed
+from lib.utils.constant import DEFAULT_SV_CACHE_SIZE, DEFAULT_SV_MAX_CONNECTIONS, DEFAULT_SV_RETRY_AFTER, DEFAULT_SV_STORAGE, SelectedCompression, SelectedProtocol, SelectedTransferType
+from lib.utils.file_handling import FileHandler
+from lib.segment_encoding.application_header import ApplicationHeaderRDT
+
+from lib.server import ServerRDT
+from lib.sockets_rdt.async_listener_rdt import AsyncListenerRDT
+from lib.sockets_rdt.async_stream_rdt import AsyncStreamRDT
+from lib.sockets_rdt.listener_rdt import SYN_COOKIES_AUTO, AccepterRDT
+from lib.transference_handler.async_transfer import AsyncDownloader, \
+    AsyncUploader, read_app_header
+
+
+# asyncio version of ServerRDT: serve() runs every connection as a task of
+# the event loop instead of on a thread of its own, so it can be embedded
+# in an asyncio service and keep thousands of transferences going. It
+# serves the uploads, downloads and stats of the clients, always
+# uncompressed. Multiplexed connections, delta and striped uploads, the
+# rate limits and the fair scheduler are only served by ServerRDT: delta
+# and striped uploads, and the requests to multiplex a connection, are
+# answered with an error header
+class AsyncServerRDT(ServerRDT):
+
+    DELTA_NOT_SUPPORTED = "Delta uploads not supported"
+    STRIPES_NOT_SUPPORTED = "Striped uploads not supported"
+    TYPE_NOT_SUPPORTED = "Transference type not supported"
+
+    TRANSFER_TYPES = (SelectedTransferType.UPLOAD,
+                      SelectedTransferType.DELTA_UPLOAD,
+                      SelectedTransferType.DOWNLOAD,
+                      SelectedTransferType.STAT)
+
+    def __init__(self, host, port, protocol=SelectedProtocol.STOP_AND_WAIT,
+                 cache_size=DEFAULT_SV_CACHE_SIZE,
+                 syn_cookies=SYN_COOKIES_AUTO,
+                 max_connections=DEFAULT_SV_MAX_CONNECTIONS,
+                 retry_after=DEFAULT_SV_RETRY_AFTER):
+        super().__init__(host, port, protocol, cache_size,
+                         syn_cookies=syn_cookies,
+                         max_connections=max_connections,
+                         retry_after=retry_after)
+        self.connection_tasks = set()
+
+    # Serves until cancelled, then waits for the open connections to finish
+    async def serve(self):
+        logging.info("[SERVER] Starting server")
+        async_listener = AsyncListenerRDT(
+            self.host, self.port, self.protocol, self._start_connection,
+            syn_cookies=self.syn_cookies,
+            max_connections=self.max_connections,
+            retry_after=self.retry_after)
+
+        logging.info("[SERVER] Listening for connections")
+        try:
+            await asyncio.get_running_loop().create_future()
+        finally:
+            async_listener.close()
+            logging.info("[SERVER] Waiting for connections to finish")
+            await asyncio.gather(*self.connection_tasks,
+                                 return_exceptions=True)
+            logging.info(
+                f"[SERVER] All connections finished, {async_listener.listener}")
+
+    # ======================== FOR PRIVATE USE ========================
+
+    def _start_connection(self, accepter: AccepterRDT):
+        task = asyncio.ensure_future(self._handle_connection(accepter))
+        self.connection_tasks.add(task)
+        task.add_done_callback(self.connection_tasks.discard)
+
+    # A connection carries a session of requests, one after the other,
+    # until the client closes it. The reads of a stream give a dead client
+    # up by themselves, there is no need for the reaper
+    async def _handle_connection(self, accepter: AccepterRDT):
+        name = f"{accepter.external_host}:{accepter.external_port}"
+        try:
+            logging.info(
+                f"[PORT HANDLER] Accepting connection from client {name}")
+            stream = await AsyncStreamRDT.accept(
+                self.protocol, (accepter.external_host, accepter.external_port),
+                accepter.first_segment)
+        except Exception as e:
+            logging.error(
+                "[PORT HANDLER] Error starting connection: " + str(e))
+            accepter.release()
+            return
+        accepter.set_established()
+        logging.info(f"[LISTENER] Connection established with ({name})")
+
+        with self.stats_lock:
+            self.open_connections[id(stream)] = (name, stream.stats)
+        try:
+            await self._serve_session(stream)
+        except Exception as e:
+            logging.error(
+                "[PORT HANDLER] Error handling transference: " + str(e))
+        finally:
+            await stream.close()
+            accepter.release()
+            with self.stats_lock:
+                del self.open_connections[id(stream)]
+                self.closed_stats.add(stream.stats, samples=False)
+        logging.info(
+            f"[PORT HANDLER] Connection with {name} closed: {stream.stats.summary()}")
+
+    async def _serve_session(self, stream: AsyncStreamRDT):
+        leftover = b''
+        requests = 0
+        while True:
+            try:
+                app_header, initial_data = await read_app_header(
+                    stream, leftover)
+            except ExternalConnectionClosed:
+                if requests == 0:
+                    raise
+                logging.info(
+                    f"[PORT HANDLER] Session closed by the client after {requests} requests")
+                return
+            logging.info(
+                f"[PORT HANDLER] Reading Applicaton Header: {app_header}")
+            requests += 1
+            leftover = await self._serve_request(
+                stream, app_header, initial_data)
+
+    # Returns the data received after the request, that belongs to the
+    # next one
+    async def _serve_request(self, stream: AsyncStreamRDT,
+                             app_header: ApplicationHeaderRDT,
+                             initial_data: bytes):
+        file_name = app_header.file_name
+        transfer_type = app_header.transfer_type
+        if transfer_type not in self.TRANSFER_TYPES:
+            await self._send_error_async(stream, self.TYPE_NOT_SUPPORTED)
+            return b''
+        error = self._file_name_error(file_name)
+        if error is not None:
+            await self._send_error_async(stream, error)
+            return b''
+        if transfer_type in self.WRITE_TRANSFER_TYPES:
+            logging.info("[PORT HANDLER] Transference type: UPLOAD")
+            return await self._receive_file(stream, app_header, initial_data)
+        if transfer_type == SelectedTransferType.DOWNLOAD:
+            logging.info("[PORT HANDLER] Transference type: DOWNLOAD")
+            await self._send_file(stream, app_header)
+        else:
+            logging.info("[PORT HANDLER] Transference type: STAT")
+            await self._send_stat(stream, file_name)
+        return initial_data[ApplicationHeaderRDT.size():]
+
+    async def _receive_file(self, stream: AsyncStreamRDT,
+                            app_header: ApplicationHeaderRDT,
+                            initial_data: bytes):
+        initial_data = await self._accept_upload_async(
+            stream, app_header, initial_data)
+        if initial_data is None:
+            return b''
+        file_name = app_header.file_name
+        loop = asyncio.get_running_loop()
+        logging.info("[PORT HANDLER] Opening file to download")
+        if app_header.offset > 0:
+            file_handler = await loop.run_in_executor(
+                None, self._open_file_to_resume, app_header)
+        else:
+            file_handler = await loop.run_in_executor(
+                None, FileHandler, DEFAULT_SV_STORAGE + file_name, file_name,
+                "wb")
+        try:
+            return await AsyncDownloader(stream, file_handler).run(
+                initial_data)
+        finally:
+            file_handler.close()
+            self._invalidate_cache(file_name)
+
+    # asyncio version of ServerRDT._accept_upload
+    async def _accept_upload_async(self, stream: AsyncStreamRDT,
+                                   app_header: ApplicationHeaderRDT,
+                                   initial_data: bytes):
+        error = self._upload_error(app_header)
+        if error is not None:
+            await self._send_error_async(stream, error)
+            return None
+        accepted = self._accepted_header(app_header)
+        logging.info(f"[PORT HANDLER] Accepting upload: {accepted}")
+        await stream.send(accepted.as_bytes())
+        self._prepare_to_write(app_header.file_name)
+        return accepted.as_bytes() + initial_data[ApplicationHeaderRDT.size():]
+
+    def _upload_error(self, app_header: ApplicationHeaderRDT):
+        if app_header.transfer_type == SelectedTransferType.DELTA_UPLOAD:
+            return self.DELTA_NOT_SUPPORTED
+        if app_header.is_striped():
+            return self.STRIPES_NOT_SUPPORTED
+        return super()._upload_error(app_header)
+
+    # The data is always received uncompressed
+    def _accepted_header(self, app_header: ApplicationHeaderRDT):
+        accepted = super()._accepted_header(app_header)
+        accepted.compression = SelectedCompression.NONE
+        accepted.compression_level = None
+        return accepted
+
+    # The range is sent uncompressed even if the client asked for a
+    # compression, the header of the answer tells it so
+    async def _send_file(self, stream: AsyncStreamRDT,
+                         app_header: ApplicationHeaderRDT):
+        file_name = app_header.file_name
+        logging.info("[PORT HANDLER] Checking file existence")
+        if not await self._check_if_file_exists_async(file_name, stream):
+            return
+        error = self._download_error(app_header)
+        if error is not None:
+            await self._send_error_async(stream, error)
+            return
+
+        logging.info("[PORT HANDLER] Opening file to upload")
+        file_handler = await asyncio.get_running_loop().run_in_executor(
+            None, self._open_file_to_upload, file_name)
+        try:
+            await AsyncUploader(stream, file_handler, app_header.offset,
+                                app_header.length or None).run()
+        finally:
+            file_handler.close()
+
+    async def _send_stat(self, stream: AsyncStreamRDT, file_name):
+        if not await self._check_if_file_exists_async(file_name, stream):
+            return
+
+        app_header = ApplicationHeaderRDT(
+            SelectedTransferType.STAT, file_name,
+            self._file_size(DEFAULT_SV_STORAGE + file_name), length=0)
+        logging.info(f"[PORT HANDLER] Sending file stat: {app_header}")
+        await stream.send(app_header.as_bytes())
+
+    async def _check_if_file_exists_async(self, file_name,
+                                          stream: AsyncStreamRDT):
+        if self._file_exists(DEFAULT_SV_STORAGE + file_name):
+            return True
+
+        app_header = ApplicationHeaderRDT(
+            SelectedTransferType.DOWNLOAD, self.NO_SUCH_FILE, 0)
+        await stream.send(app_header.as_bytes())
+
+        logging.error(
+            f"[SERVER UPLOAD] Sending App Header, file does not exist: {app_header}")
+        return False
+
+    async def _send_error_async(self, stream: AsyncStreamRDT, message):
+        app_header = ApplicationHeaderRDT.error(message)
+        await stream.send(app_header.as_bytes())
+        logging.error(
+            f"[PORT HANDLER] Request rejected, sending App Header: {app_header}")
@@ -1,9 +1,19 @@
 import logging
-from lib.utils.constant import SelectedProtocol, SelectedTransferType
+import os
+import random
+from collections import deque
+from threading import Thread
+from lib.utils.constant import SelectedCompression, SelectedProtocol, SelectedTransferType
+from lib.utils.exceptions import RequestRejectedError
+from lib.transference_handler.delta_sync import DeltaUploader
 from lib.transference_handler.downloader import Downloader
+from lib.transference_handler.striped_transfer import split_in_stripes
+from lib.utils.compression import negotiate
 from lib.utils.file_handling import FileHandler
 from lib.segment_encoding.application_header import ApplicationHeaderRDT
-from lib.sockets_rdt.stream_rdt import StreamRDT
+from lib.sockets_rdt.connection_pool import ConnectionPool
+from lib.sockets_rdt.multiplexed_connection import MultiplexedConnection, SubStreamProvider
+from lib.sockets_rdt.stream_reader import StreamReader
 from crc import Calculator, Crc8
 
 from lib.transference_handler.uploader import Uploader
@@ -14,74 +24,410 @@ calculator = Calculator(Crc8.CCITT, optimized=True)
 class ClientRDT:
 
     def __init__(self, external_host, external_port,
-                 protocol=SelectedProtocol.STOP_AND_WAIT):
+                 protocol=SelectedProtocol.STOP_AND_WAIT,
+                 compression=SelectedCompression.NONE, compression_level=None):
         self.external_host = external_host
         self.external_port = external_port
         self.protocol = protocol
+        self.compression = compression
+        self.compression_level = compression_level
+        self.pool = ConnectionPool(protocol, external_host, external_port)
 
-    def upload(self, file_path, file_name):
+    # Closes the connections kept open by the pool
+    def close(self):
+        self.pool.close()
+
+    # With delta only the parts of the file that changed from the copy in
+    # the server are sent
+    def upload(self, file_path, file_name, streams=1, resume=False,
+               delta=False):
+        try:
+            self._upload_file(file_path, file_name, streams, resume, delta)
+        except Exception as e:
+            logging.error("[CLIENT UPLOAD] Error uploading file: " + str(e))
+            exit(1)
+
+    # A length of 0 downloads from offset until the end of the file
+    def download(self, file_path, file_name, streams=1, resume=False,
+                 offset=0, length=0):
+        try:
+            self._download_file(
+                file_path, file_name, streams, resume, offset, length)
+        except Exception as e:
+            logging.error(
+                "[CLIENT DOWNLOAD] Error downloading file: " + str(e))
+            exit(1)
+
+    # Uploads each (file path, file name) pair over the same connections.
+    # With multiplex > 1 that many files are sent at the same time over the
+    # streams of a single connection. Returns the names of the files that
+    # failed
+    def upload_files(self, files, streams=1, resume=False, delta=False,
+                     multiplex=1):
+        def upload_file(file_path, file_name, connections):
+            self._upload_file(file_path, file_name, streams, resume, delta,
+                              connections)
+
+        failed = self._transfer_files(upload_file, files, multiplex)
+        logging.info(
+            f"[CLIENT UPLOAD] Uploaded {len(files) - len(failed)} of {len(files)} files")
+        return failed
+
+    # Downloads each (file path, file name) pair the same way as
+    # upload_files(). Returns the names of the files that failed
+    def download_files(self, files, streams=1, resume=False, multiplex=1):
+        def download_file(file_path, file_name, connections):
+            self._download_file(file_path, file_name, streams, resume,
+                                connections=connections)
+
+        failed = self._transfer_files(download_file, files, multiplex)
+        logging.info(
+            f"[CLIENT DOWNLOAD] Downloaded {len(files) - len(failed)} of {len(files)} files")
+        return failed
+
+    # ======================== FOR PRIVATE USE ========================
+
+    def _transfer_files(self, transfer_file, files, multiplex):
+        if multiplex > 1 and len(files) > 1:
+            return self._transfer_multiplexed(transfer_file, files, multiplex)
+
+        failed = []
+        for file_path, file_name in files:
+            if not self._transfer_file(
+                    transfer_file, file_path, file_name, self.pool):
+                failed.append(file_name)
+        return failed
+
+    # Returns whether the file was transferred
+    def _transfer_file(self, transfer_file, file_path, file_name,
+                       connections):
+        try:
+            transfer_file(file_path, file_name, connections)
+            return True
+        except Exception as e:
+            logging.error(
+                f"[CLIENT] Error transferring file {file_name}: {e}")
+            return False
+
+    # Each of the multiplex threads takes the next pending file and
+    # transfers it over its own stream of the connection
+    def _transfer_multiplexed(self, transfer_file, files, multiplex):
+        stream = self.pool.acquire()
+        try:
+            connection = self._start_multiplexing(stream)
+        except Exception:
+            self.pool.discard(stream)
+            raise
+
+        pending = deque(files)
+        failed = []
+
+        def transfer_pending_files():
+            connections = SubStreamProvider(connection)
+            try:
+                while True:
+                    try:
+                        file_path, file_name = pending.popleft()
+                    except IndexError:
+                        return
+                    if not self._transfer_file(
+                            transfer_file, file_path, file_name, connections):
+                        failed.append(file_name)
+            finally:
+                connections.close()
+
+        threads = [Thread(target=transfer_pending_files)
+                   for _ in range(min(multiplex, len(files)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        connection.close()
+        self.pool.discard(stream)
+        return failed
+
+    # Asks the server to multiplex the connection. Once it answers, both
+    # ends stop using the stream directly
+    def _start_multiplexing(self, stream):
+        app_header = ApplicationHeaderRDT(
+            SelectedTransferType.MULTIPLEX, "", 0, length=0)
+        logging.info("[CLIENT] Multiplexing connection")
+        stream.send(app_header.as_bytes())
+        response = ApplicationHeaderRDT.from_bytes(
+            self._read_response(stream))
+        if response.transfer_type != SelectedTransferType.MULTIPLEX:
+            raise ValueError(
+                "[CLIENT] The server can't multiplex the connection")
+        return MultiplexedConnection(stream)
+
+    # connections is where the streams are taken from, the pool by default
+    def _upload_file(self, file_path, file_name, streams, resume, delta,
+                     connections=None):
+        connections = connections or self.pool
         logging.info(
             f"[CLIENT UPLOAD] Starting upload from file path: {file_path}")
         logging.info(
             f"[CLIENT UPLOAD] Starting upload with file name: {file_name}")
+        self._check_file_name(file_name)
+
+        if streams > 1:
+            stripes = split_in_stripes(
+                FileHandler.file_size(file_path), streams)
+            if len(stripes) > 1:
+                self._upload_striped(file_path, file_name, stripes,
+                                     connections)
+                return
+            logging.info(
+                "[CLIENT UPLOAD] File too small to split, uploading over a single stream")
 
         file_handler = None
-        stream = None
         try:
             logging.info("[CLIENT UPLOAD] Opening file to upload")
             file_handler = FileHandler(file_path, file_name, "rb")
 
-            logging.info("[CLIENT UPLOAD] Connecting to server")
-            stream = StreamRDT.connect(
-                self.protocol, self.external_host, self.external_port,
-            )
+            offset = 0
+            if resume:
+                offset = self._get_upload_resume_offset(
+                    file_handler, connections)
+                if offset == file_handler.size():
+                    logging.info(
+                        "[CLIENT UPLOAD] File already uploaded, nothing to resume")
+                    return
 
-            uploader = Uploader(stream, file_handler)
-            uploader.run()
-        except Exception as e:
-            logging.error("[CLIENT UPLOAD] Error uploading file: " + str(e))
-            exit(1)
+            # A rejected upload leaves the session ready for the next one
+            with connections.connection(
+                    keep_on=RequestRejectedError) as stream:
+                if delta:
+                    uploader = DeltaUploader(stream, file_handler)
+                else:
+                    uploader = Uploader(
+                        stream, file_handler, offset,
+                        compression=self.compression,
+                        compression_level=self.compression_level,
+                        read_answer=True)
+                uploader.run()
         finally:
             if (file_handler):
                 file_handler.close()
-            if (stream):
-                stream.close()
 
-    def download(self, file_path, file_name):
+    def _download_file(self, file_path, file_name, streams, resume,
+                       offset=0, length=0, connections=None):
+        connections = connections or self.pool
         logging.info(
             f"[CLIENT DOWNLOAD] Starting download from file path: {file_path}")
         logging.info(
             f"[CLIENT DOWNLOAD] Starting download with file name: {file_name}")
+        self._check_file_name(file_name)
+        if os.path.dirname(file_path):
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        if streams > 1:
+            file_size = self._request_file_size(file_name, connections)
+            if file_size is None:
+                raise ValueError(
+                    f"[CLIENT DOWNLOAD] Requested file does not exist: {file_name}")
+            stripes = split_in_stripes(file_size, streams)
+            if len(stripes) > 1:
+                self._download_striped(
+                    file_path, file_name, file_size, stripes, connections)
+                return
+            logging.info(
+                "[CLIENT DOWNLOAD] File too small to split, downloading over a single stream")
 
         file_handler = None
-        stream = None
         try:
-            logging.info("[CLIENT DOWNLOAD] Creating file to download")
-            file_handler = FileHandler(file_path, file_name, "wb")
+            if resume:
+                file_handler, offset = self._open_download_to_resume(
+                    file_path, file_name, connections)
+                if file_handler is None:
+                    logging.info(
+                        "[CLIENT DOWNLOAD] File already downloaded, nothing to resume")
+                    return
+            else:
+                logging.info("[CLIENT DOWNLOAD] Creating file to download")
+                file_handler = FileHandler(file_path, file_name, "wb")
 
-            logging.info("[CLIENT UPLOAD] Connecting to server")
-            stream = StreamRDT.connect(
-                self.protocol, self.external_host, self.external_port,
-            )
+            self._download_range(file_handler, file_name, offset, length,
+                                 connections=connections)
+        except (FileNotFoundError, RequestRejectedError):
+            # Nothing was received, the file created for the download is
+            # removed instead of being left empty
+            if file_handler and file_handler.mode == "wb":
+                file_handler.close()
+                file_handler = None
+                os.remove(file_path)
+            raise
+        finally:
+            if (file_handler):
+                file_handler.close()
+
+    def _check_file_name(self, file_name):
+        if len(file_name.encode('utf-8')) > ApplicationHeaderRDT.MAX_FILE_NAME:
+            raise ValueError(
+                f"[CLIENT] File name longer than {ApplicationHeaderRDT.MAX_FILE_NAME} bytes: {file_name}")
+
+    # The server keeps whatever was received of a failed upload, so the
+    # upload continues from the size of its partial copy
+    def _get_upload_resume_offset(self, file_handler, connections):
+        remote_size = self._request_file_size(
+            file_handler.get_file_name(), connections)
+        if remote_size is None or remote_size > file_handler.size():
+            logging.info(
+                "[CLIENT UPLOAD] No partial upload to resume, starting from zero")
+            return 0
+        logging.info(
+            f"[CLIENT UPLOAD] Resuming upload from byte {remote_size}")
+        return remote_size
+
+    # Returns the file opened at the position where the download has to
+    # continue, or None if the local copy is already complete
+    def _open_download_to_resume(self, file_path, file_name, connections):
+        remote_size = self._request_file_size(file_name, connections)
+        if remote_size is None:
+            raise ValueError(
+                f"[CLIENT DOWNLOAD] Requested file does not exist: {file_name}")
 
+        local_size = 0
+        if FileHandler.file_exists(file_path):
+            local_size = FileHandler.file_size(file_path)
+        if local_size == remote_size:
+            return None, local_size
+        if local_size == 0 or local_size > remote_size:
+            logging.info(
+                "[CLIENT DOWNLOAD] No partial download to resume, starting from zero")
+            return FileHandler(file_path, file_name, "wb"), 0
+
+        logging.info(
+            f"[CLIENT DOWNLOAD] Resuming download from byte {local_size}")
+        file_handler = FileHandler(file_path, file_name, "r+b")
+        file_handler.seek(local_size)
+        return file_handler, local_size
+
+    # A missing file or a rejected request keep the connection in the pool,
+    # as the server only answers with a header and goes on with the session
+    def _download_range(self, file_handler, file_name, offset=0, length=0,
+                        transfer_id=ApplicationHeaderRDT.NO_TRANSFER_ID,
+                        connections=None):
+        connections = connections or self.pool
+        # Only a compression this host can decompress is asked for
+        compression, compression_level = negotiate(
+            self.compression, self.compression_level)
+        with connections.connection(
+                keep_on=(FileNotFoundError, RequestRejectedError)) as stream:
             app_header = ApplicationHeaderRDT(
-                SelectedTransferType.DOWNLOAD, file_handler.get_file_name
-                (), 0
+                SelectedTransferType.DOWNLOAD, file_name, 0,
+                offset, length, transfer_id,
+                compression, compression_level
             )
             logging.info(
                 f"[CLIENT DOWNLOAD] Sending Application Header: {app_header}")
             stream.send(app_header.as_bytes())
 
-            initial_data = stream.read()
-            logging.info(f"[CLIENT DOWNLOAD] Receiving data: {initial_data}")
+            initial_data = self._read_response(stream)
+            response = ApplicationHeaderRDT.from_bytes(
+                initial_data[:ApplicationHeaderRDT.size()])
+            if response.is_error():
+                raise RequestRejectedError(
+                    f"[CLIENT DOWNLOAD] Request rejected by the server: {response.file_name}")
+            if response.file_name != file_name:
+                raise FileNotFoundError(
+                    f"[CLIENT DOWNLOAD] Requested file does not exist: {file_name}")
 
             downloader = Downloader(stream, file_handler)
-            downloader.run(initial_data)
-        except Exception as e:
-            logging.error(
-                "[CLIENT DOWNLOAD] Error downloading file: " + str(e))
-        finally:
-            if (file_handler):
+            if downloader.run(initial_data):
+                raise ValueError(
+                    "[CLIENT DOWNLOAD] Received more data than requested")
+
+    # Returns None if the file does not exist in the server
+    def _request_file_size(self, file_name, connections=None):
+        connections = connections or self.pool
+        with connections.connection() as stream:
+            logging.info(f"[CLIENT STAT] Requesting stat of {file_name}")
+            stream.send(ApplicationHeaderRDT(
+                SelectedTransferType.STAT, file_name, 0).as_bytes())
+
+            app_header = ApplicationHeaderRDT.from_bytes(
+                self._read_response(stream))
+            logging.info(f"[CLIENT STAT] Received file stat: {app_header}")
+
+        if app_header.file_name != file_name:
+            return None
+        return app_header.file_size
+
+    # Returns the header answered by the server, with the data received
+    # after it
+    def _read_response(self, stream):
+        reader = StreamReader(stream)
+        app_header_bytes = reader.read_exact(ApplicationHeaderRDT.size())
+        return app_header_bytes + reader.take_buffered()
+
+    # Each stripe takes a stream of its own from connections at the same
+    # time, as the pool gives them
+    def _upload_striped(self, file_path, file_name, stripes, connections):
+        transfer_id = random.getrandbits(32) or 1
+        logging.info(
+            f"[CLIENT UPLOAD] Uploading in {len(stripes)} stripes, transfer {transfer_id}")
+
+        def upload_stripe(offset, length):
+            file_handler = FileHandler(file_path, file_name, "rb")
+            try:
+                with connections.connection(
+                        keep_on=RequestRejectedError) as stream:
+                    uploader = Uploader(
+                        stream, file_handler, offset, length, transfer_id,
+                        self.compression, self.compression_level,
+                        read_answer=True)
+                    uploader.run()
+            finally:
                 file_handler.close()
-            if (stream):
-                stream.close()
+
+        self._run_stripes(upload_stripe, stripes)
+
+    def _download_striped(self, file_path, file_name, file_size, stripes,
+                          connections):
+        transfer_id = random.getrandbits(32) or 1
+        logging.info(
+            f"[CLIENT DOWNLOAD] Downloading in {len(stripes)} stripes, transfer {transfer_id}")
+
+        file_handler = FileHandler(file_path, file_name, "wb")
+        file_handler.truncate(file_size)
+        file_handler.close()
+
+        def download_stripe(offset, length):
+            file_handler = FileHandler(file_path, file_name, "r+b")
+            try:
+                file_handler.seek(offset)
+                self._download_range(
+                    file_handler, file_name, offset, length, transfer_id,
+                    connections)
+            finally:
+                file_handler.close()
+
+        # The file already has its full size, so if a stripe fails it can't
+        # be told apart from a complete one and is removed
+        try:
+            self._run_stripes(download_stripe, stripes)
+        except Exception:
+            os.remove(file_path)
+            raise
+
+    def _run_stripes(self, transfer_stripe, stripes):
+        errors = []
+
+        def run_stripe(offset, length):
+            try:
+                transfer_stripe(offset, length)
+            except Exception as e:
+                logging.error(
+                    f"[CLIENT STRIPE] Error transferring stripe offset={offset} length={length}: {e}")
+                errors.append(e)
+
+        threads = [Thread(target=run_stripe, args=stripe) for stripe in stripes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
@@ -0,0 +1,516 @@
+import filecmp
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timezone
+from threading import Thread, Timer
+from lib.client import ClientRDT
+from lib.sockets_rdt.stats_export import COUNTER_METRICS
+from lib.utils.constant import (DEFAULT_SV_STORAGE, LOCALHOST,
+                                SelectedProtocol)
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+SERVER_SCRIPT = os.path.join(SRC_DIR, "start-server.py")
+PROXY_SCRIPT = os.path.join(SRC_DIR, "impairment-proxy.py")
+BENCHMARK_SCRIPT = os.path.join(SRC_DIR, "benchmark.py")
+
+PROTOCOLS = {
+    "saw": SelectedProtocol.STOP_AND_WAIT,
+    "sr": SelectedProtocol.SELECTIVE_REPEAT,
+}
+
+RESULTS_VERSION = 1
+
+# Metrics compared against a baseline, and whether bigger values are better
+COMPARED_METRICS = {
+    "goodput_mb_s": True,
+    "transfer_time_p50_s": False,
+    "ttfb_p50_s": False,
+    "handshake_p50_s": False,
+    "close_p50_s": False,
+    "retransmission_ratio": False,
+    "duplicate_ratio": False,
+    "client_cpu_s": False,
+    "server_cpu_s": False,
+    "client_peak_rss_mb": False,
+    "server_peak_rss_mb": False,
+}
+
+
+# One cell of the benchmark matrix: clients transferring a file of
+# file_size bytes each at the same time, through a link with loss percent
+# of the segments lost
+class Scenario:
+
+    def __repr__(self):
+        return f"Scenario({self.key()})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __init__(self, protocol, direction, file_size, clients=1, loss=0.0,
+                 seed=0):
+        if protocol not in PROTOCOLS:
+            raise ValueError(f"Unknown protocol: {protocol}")
+        if direction not in ("upload", "download"):
+            raise ValueError(f"Unknown direction: {direction}")
+        self.protocol = protocol
+        self.direction = direction
+        self.file_size = file_size
+        self.clients = clients
+        self.loss = loss
+        self.seed = seed
+
+    # Identifies the scenario among the results of a run and its baseline
+    def key(self):
+        return f"{self.protocol}/{self.direction}/{self.file_size}B/{self.clients}c/{self.loss:g}%loss"
+
+    def as_dict(self):
+        return {
+            "protocol": self.protocol,
+            "direction": self.direction,
+            "file_size": self.file_size,
+            "clients": self.clients,
+            "loss": self.loss,
+            "seed": self.seed,
+        }
+
+    @classmethod
+    def matrix(cls, protocols, directions, file_sizes, clients, losses,
+               seed=0):
+        return [cls(protocol, direction, file_size, client_count, loss, seed)
+                for protocol in protocols
+                for direction in directions
+                for file_size in file_sizes
+                for client_count in clients
+                for loss in losses]
+
+
+# Runs each scenario against a server started for it on loopback, behind an
+# impairment proxy if it has loss. The clients run in a worker subprocess,
+# so the CPU time and peak memory of each side are measured apart, or in
+# this process with in_process, where they can be profiled together
+class BenchmarkRunner:
+
+    SERVER_START_TIME = 0.3  # seconds
+    STATS_TIMEOUT = 5  # seconds
+
+    def __init__(self, repeat=1, in_process=False, timeout=600):
+        self.repeat = repeat
+        self.in_process = in_process
+        self.timeout = timeout
+
+    # ======================== FOR PUBLIC USE ========================
+
+    def run(self, scenarios):
+        results = []
+        for scenario in scenarios:
+            runs = []
+            for i in range(self.repeat):
+                logging.info(
+                    f"[BENCHMARK] Running {scenario.key()} ({i + 1}/{self.repeat})")
+                runs.append(self.run_scenario(scenario))
+            result = dict(scenario.as_dict(), key=scenario.key(),
+                          **_median_of_runs(runs))
+            logging.info(f"[BENCHMARK] {scenario.key()}: {result}")
+            results.append(result)
+
+        return {
+            "version": RESULTS_VERSION,
+            "created": datetime.now(timezone.utc).isoformat(),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "in_process": self.in_process,
+            "results": results,
+        }
+
+    def run_scenario(self, scenario: Scenario):
+        work_dir = tempfile.mkdtemp(prefix="rdt-benchmark-")
+        processes = []
+        try:
+            spec = self._prepare_files(scenario, work_dir)
+            port = _free_udp_port()
+            stats_port = _free_tcp_port()
+            server = _start_process(
+                [SERVER_SCRIPT, "-q", "-" + scenario.protocol, "-p", str(port),
+                 "--stats-port", str(stats_port)],
+                work_dir)
+            processes.append(server)
+            spec["port"] = port
+
+            proxy = None
+            if scenario.loss > 0:
+                spec["port"] = _free_udp_port()
+                proxy = _start_process(
+                    [PROXY_SCRIPT, "-q", "-p", str(spec["port"]),
+                     "--server-port", str(port), "--loss", str(scenario.loss),
+                     "--seed", str(scenario.seed)],
+                    work_dir)
+                processes.append(proxy)
+            time.sleep(self.SERVER_START_TIME)
+
+            if self.in_process:
+                client_run = run_clients(spec)
+                client_usage = None
+            else:
+                client_run, client_usage = self._run_worker(spec, work_dir)
+
+            server_stats = _server_stats(stats_port, self.STATS_TIMEOUT)
+            server_peak_rss_kb = _peak_rss_kb(server.pid)
+            server_usage = _stop_process(server, signal.SIGINT)
+            if proxy:
+                _stop_process(proxy, signal.SIGTERM)
+            processes = []
+            return _metrics(scenario, spec, client_run, client_usage,
+                            server_stats, server_usage, server_peak_rss_kb)
+        finally:
+            for process in processes:
+                process.kill()
+                process.wait()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    # ======================== FOR PRIVATE USE ========================
+
+    # Writes the file to transfer, and for downloads a copy per client in
+    # the server storage. Returns the description of the clients' work
+    def _prepare_files(self, scenario: Scenario, work_dir):
+        storage = os.path.join(work_dir, DEFAULT_SV_STORAGE)
+        downloads = os.path.join(work_dir, "downloads")
+        os.makedirs(storage)
+        os.makedirs(downloads)
+        source = os.path.join(work_dir, "source.bin")
+        _write_random_file(source, scenario.file_size, scenario.seed)
+
+        transfers = []
+        for i in range(scenario.clients):
+            file_name = f"benchmark_{i}.bin"
+            if scenario.direction == "upload":
+                transfers.append((source, file_name,
+                                  os.path.join(storage, file_name)))
+            else:
+                os.link(source, os.path.join(storage, file_name))
+                transfers.append((os.path.join(downloads, file_name),
+                                  file_name, os.path.join(downloads, file_name)))
+
+        return {
+            "protocol": scenario.protocol,
+            "direction": scenario.direction,
+            "source": source,
+            "transfers": transfers,
+        }
+
+    def _run_worker(self, spec, work_dir):
+        worker = _start_process([BENCHMARK_SCRIPT, "--worker"], work_dir,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        # The worker is waited for with os.wait4() to get its resource
+        # usage, so it is killed by a timer instead of a wait timeout
+        timer = Timer(self.timeout, worker.kill)
+        timer.start()
+        try:
+            worker.stdin.write(json.dumps(spec).encode())
+            worker.stdin.close()
+            output = worker.stdout.read()
+            worker.stdout.close()
+        finally:
+            timer.cancel()
+        usage = _wait_for_usage(worker)
+        if not output:
+            raise TimeoutError(
+                f"[BENCHMARK] Clients did not finish after {self.timeout} seconds")
+        return json.loads(output), usage
+
+
+# Runs the transfers of spec, one client and connection each, at the same
+# time. Used by the worker subprocess and by in process runs
+def run_clients(spec):
+    protocol = PROTOCOLS[spec["protocol"]]
+    client_runs = [None] * len(spec["transfers"])
+    start_cpu = time.process_time()
+
+    def run_client(i, file_path, file_name):
+        start = time.monotonic()
+        client = ClientRDT(LOCALHOST, spec["port"], protocol)
+        if spec["direction"] == "upload":
+            failed = client.upload_files([(file_path, file_name)])
+        else:
+            failed = client.download_files([(file_path, file_name)])
+        transferred = time.monotonic()
+        client.close()
+        stats = client.pool.stats
+        client_runs[i] = {
+            "failed": bool(failed),
+            "start": start,
+            "end": transferred,
+            "transfer_time": transferred - start,
+            "ttfb": None if stats.first_segment_at is None
+            else stats.first_segment_at - start,
+            "stats": stats.as_dict(),
+        }
+
+    threads = [Thread(target=run_client, args=(i, file_path, file_name))
+               for i, (file_path, file_name, _) in enumerate(spec["transfers"])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return {
+        "clients": client_runs,
+        "cpu_time": time.process_time() - start_cpu,
+        "peak_rss_kb": _peak_rss_kb("self"),
+    }
+
+
+def load_results(file_path):
+    with open(file_path) as file:
+        results = json.load(file)
+    if results.get("version") != RESULTS_VERSION:
+        raise ValueError(
+            f"Unsupported benchmark results version in {file_path}")
+    return results
+
+
+def save_results(results, file_path):
+    with open(file_path, "w") as file:
+        json.dump(results, file, indent=2)
+
+
+# Returns the lines of the comparison of each result with the one of the
+# same scenario in the baseline, and the number of metrics that got worse
+# by more than threshold percent
+def compare(results, baseline, threshold):
+    baseline_results = {result["key"]: result
+                        for result in baseline["results"]}
+    lines = []
+    regressions = 0
+    for result in results["results"]:
+        old_result = baseline_results.get(result["key"])
+        if old_result is None:
+            lines.append(f"{result['key']}: not in the baseline")
+            continue
+        lines.append(f"{result['key']}:")
+        for metric, bigger_is_better in COMPARED_METRICS.items():
+            old, new = old_result.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            change = _percent_change(old, new)
+            worse = -change if bigger_is_better else change
+            flag = ""
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            elif worse < -threshold:
+                flag = "  improvement"
+            lines.append(
+                f"  {metric:<22} {old:>12.4f} -> {new:>12.4f} ({change:+.1f}%){flag}")
+    return lines, regressions
+
+
+def format_results(results):
+    lines = [f"{'scenario':<40} {'goodput MB/s':>12} {'p50 s':>8} {'ttfb s':>8} "
+             f"{'retrans':>8} {'dup':>8} {'cli cpu':>8} {'sv cpu':>8} "
+             f"{'cli MB':>7} {'sv MB':>7} ok"]
+    for result in results["results"]:
+        lines.append(
+            f"{result['key']:<40} {result['goodput_mb_s']:>12.3f} "
+            f"{result['transfer_time_p50_s']:>8.3f} "
+            f"{_format_optional(result['ttfb_p50_s'])} "
+            f"{_format_optional(result['retransmission_ratio'])} "
+            f"{_format_optional(result['duplicate_ratio'])} "
+            f"{result['client_cpu_s']:>8.3f} "
+            f"{result['server_cpu_s']:>8.3f} "
+            f"{result['client_peak_rss_mb']:>7.1f} "
+            f"{result['server_peak_rss_mb']:>7.1f} "
+            f"{result['failed'] == 0 and result['verified']}")
+    return lines
+
+
+# ======================== FOR PRIVATE USE ========================
+
+def _metrics(scenario: Scenario, spec, client_run, client_usage,
+             server_stats, server_usage, server_peak_rss_kb):
+    clients = [client for client in client_run["clients"] if client]
+    succeeded = [client for client in clients if not client["failed"]]
+    stats = [client["stats"] for client in clients]
+
+    wall_time = max(client["end"] for client in clients) - \
+        min(client["start"] for client in clients)
+    # The retransmissions are counted by the end that sends the data: the
+    # clients in uploads and the server in downloads, where the clients
+    # only see the retransmissions that arrived twice
+    duplicate_ratio = None
+    if scenario.direction == "upload":
+        retransmission_ratio = _ratio(stats, "retransmitted_segments",
+                                      "data_segments_sent")
+    else:
+        retransmission_ratio = _ratio([server_stats], "retransmitted_segments",
+                                      "data_segments_sent")
+        duplicate_ratio = _ratio(stats, "duplicate_segments_received",
+                                 "data_segments_received")
+
+    client_cpu = client_run["cpu_time"]
+    if client_usage:
+        client_cpu = client_usage.ru_utime + client_usage.ru_stime
+
+    return {
+        "failed": scenario.clients - len(succeeded),
+        "verified": _verify(spec, succeeded, scenario.clients),
+        "wall_time_s": wall_time,
+        "goodput_mb_s": len(succeeded) * scenario.file_size / wall_time / 1e6,
+        "transfer_time_p50_s": _median(
+            [client["transfer_time"] for client in succeeded]),
+        "transfer_time_max_s": max(
+            [client["transfer_time"] for client in succeeded], default=None),
+        "ttfb_p50_s": _median([client["ttfb"] for client in succeeded]),
+        "handshake_p50_s": _median(
+            [t for client_stats in stats for t in client_stats["handshake_times"]]),
+        "close_p50_s": _median(
+            [t for client_stats in stats for t in client_stats["close_times"]]),
+        "retransmission_ratio": retransmission_ratio,
+        "duplicate_ratio": duplicate_ratio,
+        "client_cpu_s": client_cpu,
+        "client_peak_rss_mb": client_run["peak_rss_kb"] / 1024,
+        "server_cpu_s": server_usage.ru_utime + server_usage.ru_stime,
+        "server_peak_rss_mb": server_peak_rss_kb / 1024,
+    }
+
+
+def _ratio(stats, counter, total_counter):
+    total = sum(client_stats[total_counter] for client_stats in stats)
+    if total == 0:
+        return 0.0
+    return sum(client_stats[counter] for client_stats in stats) / total
+
+
+def _verify(spec, succeeded, clients):
+    if len(succeeded) != clients:
+        return False
+    return all(filecmp.cmp(spec["source"], destination, shallow=False)
+               for _, _, destination in spec["transfers"])
+
+
+# Each metric is the median of its values in the runs
+def _median_of_runs(runs):
+    if len(runs) == 1:
+        return runs[0]
+    result = {}
+    for metric in runs[0]:
+        values = [run[metric] for run in runs if run[metric] is not None]
+        if metric == "verified":
+            result[metric] = all(values)
+        elif metric == "failed":
+            result[metric] = max(values)
+        else:
+            result[metric] = _median(values)
+    return result
+
+
+def _median(values):
+    values = [value for value in values if value is not None]
+    return statistics.median(values) if values else None
+
+
+def _percent_change(old, new):
+    if old == 0:
+        return 0.0 if new == 0 else float("inf")
+    return (new - old) / old * 100
+
+
+def _format_optional(value):
+    return f"{'-':>8}" if value is None else f"{value:>8.3f}"
+
+
+def _write_random_file(file_path, size, seed):
+    rng = random.Random(seed)
+    block_size = 1024 * 1024
+    with open(file_path, "wb") as file:
+        written = 0
+        while written < size:
+            block = rng.randbytes(min(block_size, size - written))
+            file.write(block)
+            written += len(block)
+
+
+# The ru_maxrss of a child process starts from the memory of its parent
+# when it was forked, so the peak of each process is read from /proc
+# instead, where available
+def _peak_rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    if pid == "self":
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return 0
+
+
+def _free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("", 0))
+        return sock.getsockname()[1]
+
+
+def _free_tcp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((LOCALHOST, 0))
+        return sock.getsockname()[1]
+
+
+# The counters of all the connections of the server, read from its stats
+# endpoint: the series without labels of each counter of StreamStats
+def _server_stats(stats_port, timeout):
+    url = f"http://{LOCALHOST}:{stats_port}/metrics"
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        lines = response.read().decode("utf-8").splitlines()
+    counters = {metric: counter
+                for counter, (metric, _) in COUNTER_METRICS.items()}
+    stats = {}
+    for line in lines:
+        metric, _, value = line.partition(" ")
+        if metric in counters:
+            stats[counters[metric]] = float(value)
+    return stats
+
+
+def _start_process(args, cwd, stdin=subprocess.DEVNULL,
+                   stdout=subprocess.DEVNULL):
+    return subprocess.Popen([sys.executable] + args, cwd=cwd, stdin=stdin,
+                            stdout=stdout)
+
+
+# Stops the process with the signal, and kills it if it does not exit in
+# time. Returns its resource usage
+def _stop_process(process, stop_signal, grace_time=5):
+    process.send_signal(stop_signal)
+    deadline = time.monotonic() + grace_time
+    while time.monotonic() < deadline:
+        pid, _, usage = os.wait4(process.pid, os.WNOHANG)
+        if pid != 0:
+            process.returncode = 0
+            return usage
+        time.sleep(0.05)
+    logging.error(f"[BENCHMARK] Process {process.pid} did not stop, killing it")
+    process.kill()
+    return _wait_for_usage(process)
+
+
+def _wait_for_usage(process):
+    _, _, usage = os.wait4(process.pid, 0)
+    process.returncode = 0
+    return usage
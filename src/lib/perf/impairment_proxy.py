@@ -0,0 +1,349 @@
+import heapq
+import logging
+import random
+import selectors
+import socket
+import time
+from collections import deque
+from threading import Thread
+
+
+# Two state Markov chain for bursty losses. In the good state segments are
+# lost with good_loss probability and in the bad state with bad_loss. After
+# each segment the chain moves from good to bad with probability p and back
+# with probability r, so losses come in bursts of 1 / r segments on average.
+# With p = 0 it is a plain independent loss of good_loss
+class GilbertElliottLoss:
+
+    def __repr__(self):
+        return f"GilbertElliottLoss(p={self.p}, r={self.r}, good_loss={self.good_loss}, bad_loss={self.bad_loss})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __init__(self, p=0.0, r=1.0, good_loss=0.0, bad_loss=1.0):
+        for probability in (p, r, good_loss, bad_loss):
+            if not 0 <= probability <= 1:
+                raise ValueError("Probabilities must be between 0 and 1")
+        self.p = p
+        self.r = r
+        self.good_loss = good_loss
+        self.bad_loss = bad_loss
+        self.bad = False
+
+    def is_lost(self, rng: random.Random) -> bool:
+        lost = rng.random() < (self.bad_loss if self.bad else self.good_loss)
+        if self.bad:
+            self.bad = rng.random() >= self.r
+        else:
+            self.bad = rng.random() < self.p
+        return lost
+
+    def copy(self):
+        return GilbertElliottLoss(self.p, self.r, self.good_loss, self.bad_loss)
+
+
+# Impairments of one direction of the link. Times in seconds, bandwidth in
+# bytes per second (0 for unlimited) and probabilities between 0 and 1
+class LinkImpairments:
+
+    def __repr__(self):
+        return f"LinkImpairments(loss={self.loss}, delay={self.delay}, jitter={self.jitter}, reorder={self.reorder}, duplicate={self.duplicate}, corrupt={self.corrupt}, bandwidth={self.bandwidth}, queue_size={self.queue_size})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __init__(self, loss: GilbertElliottLoss = None, delay=0.0, jitter=0.0,
+                 reorder=0.0, reorder_gap=0.01, duplicate=0.0, corrupt=0.0,
+                 bandwidth=0, queue_size=100):
+        for probability in (reorder, duplicate, corrupt):
+            if not 0 <= probability <= 1:
+                raise ValueError("Probabilities must be between 0 and 1")
+        if delay < 0 or jitter < 0 or reorder_gap < 0 or bandwidth < 0:
+            raise ValueError("Times and bandwidth can't be negative")
+        self.loss = loss or GilbertElliottLoss()
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder = reorder
+        self.reorder_gap = reorder_gap
+        self.duplicate = duplicate
+        self.corrupt = corrupt
+        self.bandwidth = bandwidth
+        self.queue_size = queue_size
+
+
+# One direction of the emulated link, shared by every connection through
+# the proxy as a bottleneck link would be. Decides what happens to each
+# datagram and when it comes out of the link
+class ImpairedLink:
+
+    def __init__(self, name, impairments: LinkImpairments, seed=None):
+        self.name = name
+        self.impairments = impairments
+        self.loss = impairments.loss.copy()
+        self.rng = random.Random(seed)
+        self.link_free_at = 0.0
+        self.in_queue = deque()  # times at which queued datagrams leave
+
+        self.stats = {
+            "datagrams": 0,
+            "bytes": 0,
+            "lost": 0,
+            "queue_drops": 0,
+            "duplicated": 0,
+            "corrupted": 0,
+            "reordered": 0,
+        }
+
+    # Returns the (delivery time, datagram) pairs the datagram turns into:
+    # none if it is lost, two if it is duplicated
+    def transmit(self, data: bytes, now) -> list:
+        impairments = self.impairments
+        self.stats["datagrams"] += 1
+        self.stats["bytes"] += len(data)
+
+        if self.loss.is_lost(self.rng):
+            self.stats["lost"] += 1
+            return []
+
+        departure = now
+        if impairments.bandwidth > 0:
+            while self.in_queue and self.in_queue[0] <= now:
+                self.in_queue.popleft()
+            if len(self.in_queue) >= impairments.queue_size:
+                self.stats["queue_drops"] += 1
+                return []
+            departure = max(now, self.link_free_at) + \
+                len(data) / impairments.bandwidth
+            self.link_free_at = departure
+            self.in_queue.append(departure)
+
+        copies = 1
+        if self.rng.random() < impairments.duplicate:
+            self.stats["duplicated"] += 1
+            copies = 2
+
+        deliveries = []
+        for _ in range(copies):
+            datagram = data
+            if self.rng.random() < impairments.corrupt:
+                self.stats["corrupted"] += 1
+                datagram = self._flip_random_bit(data)
+            deliveries.append((departure + self._latency(), datagram))
+        return deliveries
+
+    def _latency(self):
+        impairments = self.impairments
+        latency = impairments.delay
+        if impairments.jitter > 0:
+            latency += self.rng.uniform(-impairments.jitter, impairments.jitter)
+        if self.rng.random() < impairments.reorder:
+            self.stats["reordered"] += 1
+            latency += impairments.reorder_gap
+        return max(latency, 0.0)
+
+    def _flip_random_bit(self, data: bytes) -> bytes:
+        if not data:
+            return data
+        corrupted = bytearray(data)
+        corrupted[self.rng.randrange(len(corrupted))] ^= \
+            1 << self.rng.randrange(8)
+        return bytes(corrupted)
+
+
+# What the proxy knows of one client socket. The server answers each new
+# connection from a new port, and the client then sends to the port the
+# answer came from. So for every server port the proxy opens a port of its
+# own towards the client, and forwards what arrives there to that server
+# port through the upstream socket of the client. What comes from the port
+# of the listener itself, a cookie or a retry after, goes out of the
+# listening port of the proxy, as it would from the server
+class ProxySession:
+
+    def __init__(self, client_address, upstream: socket.socket):
+        self.client_address = client_address
+        self.upstream = upstream
+        self.ports = {}  # server port -> client side socket
+        self.server_ports = {}  # client side socket -> server port
+        self.last_activity = time.monotonic()
+
+    def sockets(self):
+        return [self.upstream] + list(self.server_ports)
+
+
+# UDP proxy that forwards the segments between clients and a server on
+# this host through an ImpairedLink in each direction. Clients connect to
+# the port of the proxy instead of the server's. With the same seed and
+# the same traffic, the same segments are lost, delayed and corrupted
+class ImpairmentProxy:
+
+    MAX_DATAGRAM_SIZE = 65535
+    SESSION_TIMEOUT = 30  # seconds
+    SELECT_TIMEOUT = 0.5  # seconds
+
+    def __init__(self, host, port, server_host, server_port,
+                 upstream: LinkImpairments, downstream: LinkImpairments = None,
+                 seed=None):
+        self.server_address = (socket.gethostbyname(server_host), server_port)
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.listener.bind((host, port))
+        self.listener.setblocking(False)
+        self.host = host
+        self.port = self.listener.getsockname()[1]
+
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+        self.upstream = ImpairedLink("upstream", upstream, seed * 2)
+        self.downstream = ImpairedLink(
+            "downstream", downstream or upstream, seed * 2 + 1)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.sessions = {}  # client address -> ProxySession
+        self.owners = {}  # socket -> ProxySession
+        self.pending = []  # heap of (delivery time, order, socket, data, address)
+        self.order = 0
+        self.running = False
+        self.thread = None
+
+    # ======================== FOR PUBLIC USE ========================
+
+    def run(self):
+        logging.info(
+            f"[PROXY] Forwarding port {self.port} to {self.server_address[0]}:{self.server_address[1]} with seed {self.seed}")
+        logging.info(f"[PROXY] Upstream: {self.upstream.impairments}")
+        logging.info(f"[PROXY] Downstream: {self.downstream.impairments}")
+        self.running = True
+        next_cleanup = time.monotonic() + self.SESSION_TIMEOUT
+        try:
+            while self.running:
+                now = time.monotonic()
+                self._deliver_due(now)
+                timeout = self.SELECT_TIMEOUT
+                if self.pending:
+                    timeout = min(timeout, max(self.pending[0][0] - now, 0))
+                for key, _ in self.selector.select(timeout):
+                    self._receive(key.fileobj)
+                if now > next_cleanup:
+                    self._close_idle_sessions(now)
+                    next_cleanup = now + self.SESSION_TIMEOUT
+        finally:
+            self._close_sockets()
+
+    # Runs the proxy in a background thread, for benchmarks and tests
+    def start(self):
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        logging.info(f"[PROXY] Closed. {self.stats()}")
+
+    def stats(self):
+        return {
+            "upstream": dict(self.upstream.stats),
+            "downstream": dict(self.downstream.stats),
+            "sessions": len(self.sessions),
+        }
+
+    # ======================== FOR PRIVATE USE ========================
+
+    def _receive(self, sock: socket.socket):
+        try:
+            data, address = sock.recvfrom(self.MAX_DATAGRAM_SIZE)
+        except (BlockingIOError, ConnectionError):
+            return
+        now = time.monotonic()
+
+        if sock is self.listener:
+            session = self._get_session(address)
+            self._schedule(self.upstream, data, now,
+                           session.upstream, self.server_address)
+            return
+
+        session = self.owners.get(sock)
+        if session is None:
+            return
+        session.last_activity = now
+        if sock is session.upstream:
+            if address[1] == self.server_address[1]:
+                client_side = self.listener
+            else:
+                client_side = self._get_client_side_socket(
+                    session, address[1])
+            self._schedule(self.downstream, data, now,
+                           client_side, session.client_address)
+        else:
+            server_address = (self.server_address[0],
+                              session.server_ports[sock])
+            self._schedule(self.upstream, data, now,
+                           session.upstream, server_address)
+
+    def _schedule(self, link: ImpairedLink, data, now, sock, address):
+        for delivery_time, datagram in link.transmit(data, now):
+            heapq.heappush(self.pending,
+                           (delivery_time, self.order, sock, datagram, address))
+            self.order += 1
+
+    def _deliver_due(self, now):
+        while self.pending and self.pending[0][0] <= now:
+            _, _, sock, data, address = heapq.heappop(self.pending)
+            try:
+                sock.sendto(data, address)
+            except OSError as e:
+                logging.debug(f"[PROXY] Error forwarding to {address}: {e}")
+
+    def _get_session(self, client_address) -> ProxySession:
+        session = self.sessions.get(client_address)
+        if session is None:
+            session = ProxySession(client_address, self._open_socket())
+            self.sessions[client_address] = session
+            self._register(session.upstream, session)
+            logging.debug(f"[PROXY] New client {client_address}")
+        session.last_activity = time.monotonic()
+        return session
+
+    def _get_client_side_socket(self, session: ProxySession, server_port):
+        sock = session.ports.get(server_port)
+        if sock is None:
+            sock = self._open_socket()
+            session.ports[server_port] = sock
+            session.server_ports[sock] = server_port
+            self._register(sock, session)
+            logging.debug(
+                f"[PROXY] Server port {server_port} of {session.client_address} mapped to {sock.getsockname()[1]}")
+        return sock
+
+    def _open_socket(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((self.host, 0))
+        sock.setblocking(False)
+        return sock
+
+    def _register(self, sock, session):
+        self.owners[sock] = session
+        self.selector.register(sock, selectors.EVENT_READ)
+
+    def _close_idle_sessions(self, now):
+        for address, session in list(self.sessions.items()):
+            if now - session.last_activity < self.SESSION_TIMEOUT:
+                continue
+            del self.sessions[address]
+            for sock in session.sockets():
+                self._close_socket(sock)
+
+    def _close_socket(self, sock):
+        self.owners.pop(sock, None)
+        self.selector.unregister(sock)
+        sock.close()
+
+    def _close_sockets(self):
+        for sock in list(self.owners):
+            self._close_socket(sock)
+        self.sessions.clear()
+        self.selector.close()
+        self.listener.close()
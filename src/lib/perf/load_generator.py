@@ -0,0 +1,349 @@
+import asyncio
+import json
+import logging
+import math
+import random
+import resource
+import time
+from lib.segment_encoding.application_header import ApplicationHeaderRDT
+from lib.sockets_rdt.async_stream_rdt import AsyncStreamRDT
+from lib.sockets_rdt.stream_stats import StreamStats
+from lib.transference_handler.async_transfer import read_upload_answer_async
+from lib.utils.constant import SelectedTransferType
+
+SIZE_DISTRIBUTIONS = ["fixed", "exponential", "lognormal"]
+
+# sigma of the lognormal file sizes, with their mean kept at the given size
+LOGNORMAL_SIGMA = 1.0
+
+# The server does not take files over 500 MB
+MAX_FILE_SIZE = 500 * 1024 * 1024
+
+# Files uploaded before the run for the downloads to pick from
+WARM_UP_FILES = 8
+
+FILE_PREFIX = "loadgen/"
+
+RESULTS_VERSION = 1
+
+
+# Many clients, each one a connection that uploads or downloads a single
+# file, arriving as a Poisson process of rate clients per second (all at
+# once with rate 0). All of them run on one event loop, so the generator
+# can keep far more connections open than threads would allow
+class LoadGenerator:
+
+    def __repr__(self):
+        return f"LoadGenerator(clients={self.clients}, rate={self.rate}, max_concurrent={self.max_concurrent})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __init__(self, host, port, protocol, clients, rate=0,
+                 max_concurrent=None, file_size=64 * 1024,
+                 size_distribution="fixed", upload_ratio=0.5, interval=1.0,
+                 seed=0):
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.clients = clients
+        self.rate = rate
+        self.max_concurrent = max_concurrent or clients
+        self.file_size = file_size
+        self.size_distribution = size_distribution
+        self.upload_ratio = upload_ratio
+        self.interval = interval
+        self.seed = seed
+        self.rng = random.Random(seed)
+
+    def run(self):
+        return asyncio.run(self._run())
+
+    # ======================== FOR PRIVATE USE ========================
+
+    async def _run(self):
+        kinds, sizes, arrivals = self._plan()
+        self.payload = self.rng.randbytes(
+            max(sizes + [self.file_size], default=0))
+        self.semaphore = asyncio.Semaphore(self.max_concurrent)
+        self.start = time.monotonic()
+
+        warm_up_files = []
+        if self.upload_ratio < 1:
+            warm_up_files = await self._upload_warm_up_files()
+
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        self.start = time.monotonic()
+        tasks = []
+        for client_id, (kind, size, arrival) in \
+                enumerate(zip(kinds, sizes, arrivals)):
+            file_name = f"{FILE_PREFIX}{client_id}.bin"
+            if kind == "download":
+                file_name, size = self.rng.choice(warm_up_files)
+            tasks.append(asyncio.ensure_future(
+                self._run_client(kind, file_name, size, arrival)))
+        records = await asyncio.gather(*tasks)
+        duration = time.monotonic() - self.start
+        usage_after = resource.getrusage(resource.RUSAGE_SELF)
+
+        cpu_time = usage_after.ru_utime - usage_before.ru_utime + \
+            usage_after.ru_stime - usage_before.ru_stime
+        return self._results(records, duration, cpu_time)
+
+    # Returns the kind, size and arrival time of each client
+    def _plan(self):
+        kinds, sizes, arrivals = [], [], []
+        arrival = 0.0
+        for _ in range(self.clients):
+            if self.rate > 0:
+                arrival += self.rng.expovariate(self.rate)
+            kinds.append("upload" if self.rng.random() < self.upload_ratio
+                         else "download")
+            sizes.append(self._file_size())
+            arrivals.append(arrival)
+        return kinds, sizes, arrivals
+
+    def _file_size(self):
+        if self.size_distribution == "exponential":
+            size = self.rng.expovariate(1 / self.file_size)
+        elif self.size_distribution == "lognormal":
+            mu = math.log(self.file_size) - LOGNORMAL_SIGMA ** 2 / 2
+            size = self.rng.lognormvariate(mu, LOGNORMAL_SIGMA)
+        else:
+            size = self.file_size
+        return min(max(int(size), 1), MAX_FILE_SIZE)
+
+    # Returns the (file name, size) of the files uploaded for the downloads
+    async def _upload_warm_up_files(self):
+        files = [(f"{FILE_PREFIX}warm_up_{i}.bin", self._file_size())
+                 for i in range(WARM_UP_FILES)]
+        self.payload = self.payload.ljust(max(size for _, size in files),
+                                          b'\0')
+        logging.info(
+            f"[LOAD GENERATOR] Uploading {len(files)} files for the downloads")
+        records = await asyncio.gather(*[
+            self._run_client("upload", file_name, size, 0)
+            for file_name, size in files])
+        failed = [record for record in records if record["failure"]]
+        if failed:
+            raise ValueError(
+                f"[LOAD GENERATOR] Warm up upload failed: {failed[0]['error']}")
+        return files
+
+    # Returns what happened to the client, with the times relative to the
+    # start of the run
+    async def _run_client(self, kind, file_name, size, arrival):
+        await asyncio.sleep(max(arrival - self._now(), 0))
+        record = {"kind": kind, "size": size, "arrival": arrival,
+                  "start": None, "connected": None, "end": None,
+                  "failure": None, "error": None, "stats": StreamStats()}
+        async with self.semaphore:
+            record["start"] = self._now()
+            try:
+                stream = await AsyncStreamRDT.connect(
+                    self.protocol, self.host, self.port, record["stats"])
+            except (TimeoutError, OSError) as e:
+                record["end"] = self._now()
+                record["failure"], record["error"] = "handshake", str(e)
+                return record
+
+            record["connected"] = self._now()
+            try:
+                if kind == "upload":
+                    await self._upload(stream, file_name, size)
+                else:
+                    await self._download(stream, file_name, size)
+            except Exception as e:
+                record["failure"], record["error"] = "transfer", str(e)
+            finally:
+                await stream.close()
+            record["end"] = self._now()
+        return record
+
+    async def _upload(self, stream: AsyncStreamRDT, file_name, size):
+        app_header = ApplicationHeaderRDT(
+            SelectedTransferType.UPLOAD, file_name, size)
+        await stream.send(app_header.as_bytes())
+        await read_upload_answer_async(stream)
+        await stream.send(memoryview(self.payload)[:size])
+        await stream.flush()
+
+    # The data is compared with what was uploaded instead of being kept
+    async def _download(self, stream: AsyncStreamRDT, file_name, size):
+        app_header = ApplicationHeaderRDT(
+            SelectedTransferType.DOWNLOAD, file_name, 0)
+        await stream.send(app_header.as_bytes())
+
+        data = b''
+        while len(data) < ApplicationHeaderRDT.size():
+            data += await stream.read()
+        response = ApplicationHeaderRDT.from_bytes(
+            data[:ApplicationHeaderRDT.size()])
+        if response.file_name != file_name:
+            raise FileNotFoundError(
+                f"[LOAD GENERATOR] Requested file does not exist: {file_name}")
+        if response.length != size:
+            raise ValueError(
+                f"[LOAD GENERATOR] Expected {size} bytes of {file_name}, the server sends {response.length}")
+
+        data = data[ApplicationHeaderRDT.size():]
+        received = 0
+        while True:
+            if data != self.payload[received:received + len(data)]:
+                raise ValueError(
+                    f"[LOAD GENERATOR] Corrupted data at byte {received} of {file_name}")
+            received += len(data)
+            if received >= size:
+                break
+            data = await stream.read()
+
+    def _now(self):
+        return time.monotonic() - self.start
+
+    def _results(self, records, duration, cpu_time):
+        connected = [record for record in records
+                     if record["failure"] != "handshake"]
+        succeeded = [record for record in records if not record["failure"]]
+        stats = StreamStats()
+        for record in connected:
+            stats.add(record["stats"])
+
+        results = {
+            "version": RESULTS_VERSION,
+            "config": {
+                "clients": self.clients,
+                "rate": self.rate,
+                "max_concurrent": self.max_concurrent,
+                "file_size": self.file_size,
+                "size_distribution": self.size_distribution,
+                "upload_ratio": self.upload_ratio,
+                "seed": self.seed,
+            },
+            "duration_s": duration,
+            "connections": len(connected),
+            "failed_handshakes": len(records) - len(connected),
+            "failed_transfers": len(connected) - len(succeeded),
+            "connection_attempts": sum(
+                record["stats"].connection_attempts for record in records),
+            "busy_answers": sum(
+                record["stats"].busy_answers for record in records),
+            "setup_rate": len(connected) / duration if duration else 0.0,
+            "handshake_p50_s": _percentile(stats.handshake_times, 50),
+            "handshake_p99_s": _percentile(stats.handshake_times, 99),
+            "queue_p99_s": _percentile(
+                [record["start"] - record["arrival"] for record in records],
+                99),
+            "goodput_mb_s": sum(record["size"] for record in succeeded)
+            / duration / 1024 / 1024 if duration else 0.0,
+            "retransmission_ratio": stats.retransmission_ratio(),
+            "duplicate_ratio": stats.duplicate_ratio(),
+            "generator_cpu_utilization": cpu_time / duration
+            if duration else 0.0,
+            "errors": _count_errors(records),
+            "timeline": _timeline(records, self.interval),
+        }
+        for kind in ["all", "upload", "download"]:
+            times = [record["end"] - record["start"] for record in succeeded
+                     if kind in ("all", record["kind"])]
+            results[f"{kind}_transfers"] = len(times)
+            results[f"{kind}_p50_s"] = _percentile(times, 50)
+            results[f"{kind}_p99_s"] = _percentile(times, 99)
+        return results
+
+
+def save_results(results, file_path):
+    with open(file_path, "w") as file:
+        json.dump(results, file, indent=2)
+
+
+def format_results(results):
+    lines = [
+        f"duration              {results['duration_s']:.2f} s",
+        f"connections           {results['connections']} "
+        f"({results['setup_rate']:.1f}/s, "
+        f"{results['failed_handshakes']} failed handshakes)",
+        f"handshake p50/p99     {_format_seconds(results['handshake_p50_s'])} / "
+        f"{_format_seconds(results['handshake_p99_s'])}",
+        f"connection attempts   {results['connection_attempts']} "
+        f"({results['busy_answers']} busy answers)",
+        f"queued p99            {_format_seconds(results['queue_p99_s'])}",
+        f"failed transfers      {results['failed_transfers']}",
+    ]
+    for kind in ["all", "upload", "download"]:
+        lines.append(
+            f"{kind + ' p50/p99':<22}{_format_seconds(results[f'{kind}_p50_s'])} / "
+            f"{_format_seconds(results[f'{kind}_p99_s'])} "
+            f"({results[f'{kind}_transfers']} transfers)")
+    lines += [
+        f"goodput               {results['goodput_mb_s']:.3f} MB/s",
+        f"retransmission ratio  {results['retransmission_ratio']:.3f}",
+        f"duplicate ratio       {results['duplicate_ratio']:.3f}",
+        f"generator cpu         {results['generator_cpu_utilization'] * 100:.0f}%",
+    ]
+    for error, count in results["errors"].items():
+        lines.append(f"  {count} x {error}")
+
+    lines.append(f"{'time s':>8} {'setups':>7} {'done':>6} {'failed':>7} "
+                 f"{'active':>7} {'MB/s':>8}")
+    for bucket in results["timeline"]:
+        lines.append(
+            f"{bucket['time']:>8.1f} {bucket['setups']:>7} "
+            f"{bucket['completed']:>6} {bucket['failed']:>7} "
+            f"{bucket['active']:>7.1f} {bucket['mb_s']:>8.3f}")
+    return lines
+
+
+# ======================== FOR PRIVATE USE ========================
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(math.ceil(len(values) * percent / 100) - 1, len(values) - 1)
+    return values[max(index, 0)]
+
+
+def _format_seconds(value):
+    return "-" if value is None else f"{value:.3f} s"
+
+
+def _count_errors(records):
+    errors = {}
+    for record in records:
+        if record["failure"]:
+            error = f"{record['failure']}: {record['error']}"
+            errors[error] = errors.get(error, 0) + 1
+    return errors
+
+
+# Splits the run in buckets of interval seconds. The bytes of each
+# transfer are spread evenly over its duration, and active is the mean
+# number of open connections in the bucket
+def _timeline(records, interval):
+    end = max((record["end"] for record in records), default=0)
+    buckets = [{"time": i * interval, "setups": 0, "completed": 0,
+                "failed": 0, "active": 0.0, "mb_s": 0.0}
+               for i in range(int(end / interval) + 1)]
+
+    def bucket(moment):
+        return buckets[min(int(moment / interval), len(buckets) - 1)]
+
+    for record in records:
+        if record["connected"] is not None:
+            bucket(record["connected"])["setups"] += 1
+        done = bucket(record["end"])
+        if record["failure"]:
+            done["failed"] += 1
+        else:
+            done["completed"] += 1
+
+        start, end = record["start"], record["end"]
+        for i in range(int(start / interval), int(end / interval) + 1):
+            overlap = min(end, (i + 1) * interval) - max(start, i * interval)
+            if i >= len(buckets) or overlap <= 0 or end <= start:
+                continue
+            buckets[i]["active"] += overlap / interval
+            if not record["failure"]:
+                buckets[i]["mb_s"] += record["size"] * overlap / \
+                    (end - start) / interval / 1024 / 1024
+    return buckets
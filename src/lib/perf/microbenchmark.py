@@ -0,0 +1,261 @@
+import gc
+import random
+import time
+import tracemalloc
+from lib.protocols.utils.buffer_sorter import BufferSorter
+from lib.protocols.utils.sliding_window import SlidingWindow
+from lib.segment_encoding.application_header import ApplicationHeaderRDT
+from lib.segment_encoding.header_rdt import HeaderRDT, calculator
+from lib.segment_encoding.segment_rdt import SegmentRDT
+from lib.utils.constant import SelectedProtocol, SelectedTransferType
+
+WINDOW_SIZES = [1, 8, 64, 512, 4096]
+
+# Segments added to a BufferSorter before each pop in the reordered runs
+REORDER_BATCH = 256
+
+RESULTS_VERSION = 1
+
+
+# A per packet primitive to time. make_call(calls) prepares the state for
+# that many calls and returns the function to call, which runs
+# ops_per_call operations each time
+class Microbenchmark:
+
+    def __repr__(self):
+        return f"Microbenchmark({self.name})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __init__(self, name, make_call, ops_per_call=1):
+        self.name = name
+        self.make_call = make_call
+        self.ops_per_call = ops_per_call
+
+    # Returns the best time per operation, in nanoseconds, of repeat runs
+    # of as many calls as fit in min_time seconds
+    def time_per_op(self, repeat=5, min_time=0.2):
+        calls = self._calibrate(min_time)
+        best = min(self._time_calls(calls) for _ in range(repeat))
+        return best / (calls * self.ops_per_call) * 1e9
+
+    # CPython does not count allocations, so tracemalloc gives the bytes
+    # allocated at the peak of each call and the blocks still alive after
+    # them, both per operation. What an empty call measures is discounted
+    def allocations_per_op(self, calls=200):
+        peak_bytes, retained_blocks = _traced_allocations(
+            self.make_call(calls + 1), calls)
+        empty_peak_bytes, empty_retained_blocks = _traced_allocations(
+            lambda: None, calls)
+        ops = calls * self.ops_per_call
+        return max(peak_bytes - empty_peak_bytes, 0) / ops, \
+            (retained_blocks - empty_retained_blocks) / ops
+
+    def _calibrate(self, min_time):
+        calls = 1
+        while True:
+            elapsed = self._time_calls(calls)
+            if elapsed >= min_time:
+                return calls
+            if elapsed <= 0:
+                calls *= 10
+            else:
+                calls = max(calls + 1, int(calls * min_time / elapsed * 1.2))
+
+    def _time_calls(self, calls):
+        call = self.make_call(calls)
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for _ in range(calls):
+                call()
+            return time.perf_counter() - start
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+
+# Returns the microbenchmarks of the encoding and of the window data
+# structures, with the windows in each of window_sizes
+def microbenchmarks(window_sizes=WINDOW_SIZES, seed=0):
+    benchmarks = _encoding_benchmarks()
+    for window_size in window_sizes:
+        benchmarks += _sliding_window_benchmarks(window_size)
+    benchmarks += _buffer_sorter_benchmarks(seed)
+    return benchmarks
+
+
+def run_microbenchmarks(benchmarks, repeat=5, min_time=0.2,
+                        allocations=True):
+    results = []
+    for benchmark in benchmarks:
+        result = {
+            "name": benchmark.name,
+            "ns_per_op": benchmark.time_per_op(repeat, min_time),
+        }
+        if allocations:
+            peak_bytes, retained_blocks = benchmark.allocations_per_op()
+            result["peak_bytes_per_op"] = peak_bytes
+            result["retained_blocks_per_op"] = retained_blocks
+        results.append(result)
+    return {"version": RESULTS_VERSION, "results": results}
+
+
+def format_results(results):
+    lines = [f"{'benchmark':<52} {'ns/op':>12} {'peak B/op':>10} {'blocks/op':>10}"]
+    for result in results["results"]:
+        line = f"{result['name']:<52} {result['ns_per_op']:>12.1f}"
+        if "peak_bytes_per_op" in result:
+            line += f" {result['peak_bytes_per_op']:>10.1f} {result['retained_blocks_per_op']:>10.2f}"
+        lines.append(line)
+    return lines
+
+
+# Returns the lines comparing the time per operation of each benchmark
+# with the baseline, and how many got slower by more than threshold percent
+def compare(results, baseline, threshold):
+    baseline_results = {result["name"]: result
+                        for result in baseline["results"]}
+    lines = []
+    regressions = 0
+    for result in results["results"]:
+        old_result = baseline_results.get(result["name"])
+        if old_result is None:
+            lines.append(f"{result['name']:<52} not in the baseline")
+            continue
+        old, new = old_result["ns_per_op"], result["ns_per_op"]
+        change = (new - old) / old * 100
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -threshold:
+            flag = "  improvement"
+        lines.append(
+            f"{result['name']:<52} {old:>12.1f} -> {new:>12.1f} ns/op ({change:+.1f}%){flag}")
+    return lines, regressions
+
+
+# ======================== FOR PRIVATE USE ========================
+
+# Returns the sum of the peak bytes of the calls and the blocks left alive
+# by them. The first call is left out of the measure, as a warm up
+def _traced_allocations(call, calls):
+    call()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        peak_bytes = 0
+        for _ in range(calls):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            call()
+            peak_bytes += tracemalloc.get_traced_memory()[1] - current
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    retained_blocks = sum(stat.count_diff
+                          for stat in after.compare_to(before, "filename"))
+    return peak_bytes, retained_blocks
+
+
+def _encoding_benchmarks():
+    data = bytes(SegmentRDT.MAX_DATA_SIZE)
+    header = HeaderRDT(SelectedProtocol.SELECTIVE_REPEAT, len(data),
+                       1000, 2000, False, False)
+    header_bytes = header.as_bytes()
+    segment = SegmentRDT(header, data)
+    segment_bytes = segment.as_bytes()
+    packed_header, checksum = header_bytes[:-1], header_bytes[-1]
+    app_header = ApplicationHeaderRDT(
+        SelectedTransferType.DOWNLOAD, "some/directory/file_name.bin",
+        500 * 1024 * 1024, 1024, 4096, 7)
+    app_header_bytes = app_header.as_bytes()
+
+    def constant(function):
+        return lambda calls: function
+
+    return [
+        Microbenchmark("HeaderRDT.as_bytes", constant(header.as_bytes)),
+        Microbenchmark("HeaderRDT.from_bytes",
+                       constant(lambda: HeaderRDT.from_bytes(header_bytes))),
+        Microbenchmark("SegmentRDT.as_bytes", constant(segment.as_bytes)),
+        Microbenchmark("SegmentRDT.from_bytes",
+                       constant(lambda: SegmentRDT.from_bytes(segment_bytes))),
+        Microbenchmark("ApplicationHeaderRDT.as_bytes",
+                       constant(app_header.as_bytes)),
+        Microbenchmark(
+            "ApplicationHeaderRDT.from_bytes",
+            constant(lambda: ApplicationHeaderRDT.from_bytes(app_header_bytes))),
+        Microbenchmark(
+            "CRC8 verify (header)",
+            constant(lambda: calculator.verify(packed_header, checksum))),
+    ]
+
+
+def _sliding_window_benchmarks(window_size):
+    # Acks in order the first segment of a full window, which slides it
+    # one segment
+    def make_set_ack(calls):
+        window = SlidingWindow(window_size)
+        window.add_data([b'x'] * (calls + window_size))
+        for seq_num in range(window_size):
+            window.set_sent(seq_num, True)
+        return lambda: window.set_ack(window.get_current_seq_num())
+
+    # The only segment not sent yet is the last one of the window
+    def make_get_first_available(calls):
+        window = SlidingWindow(window_size)
+        window.add_data([b'x'] * window_size)
+        for seq_num in range(window_size - 1):
+            window.set_sent(seq_num, True)
+        return window.get_first_available_segment
+
+    return [
+        Microbenchmark(f"SlidingWindow.set_ack[window={window_size}]",
+                       make_set_ack),
+        Microbenchmark(
+            f"SlidingWindow.get_first_available_segment[window={window_size}]",
+            make_get_first_available),
+    ]
+
+
+def _buffer_sorter_benchmarks(seed):
+    data = bytes(SegmentRDT.MAX_DATA_SIZE)
+
+    def make_in_order(calls):
+        sorter = BufferSorter(0)
+        seq_nums = iter(range(calls))
+
+        def add_and_pop():
+            sorter.add_segment(next(seq_nums), data)
+            sorter.pop_available_data()
+        return add_and_pop
+
+    # Each call adds a batch of segments in a random order, so most of them
+    # wait in the buffer, and then pops the whole batch
+    def make_reordered(calls):
+        sorter = BufferSorter(0)
+        rng = random.Random(seed)
+        batches = []
+        for i in range(calls):
+            batch = list(range(i * REORDER_BATCH, (i + 1) * REORDER_BATCH))
+            rng.shuffle(batch)
+            batches.append(batch)
+        batches = iter(batches)
+
+        def add_batch_and_pop():
+            for seq_num in next(batches):
+                sorter.add_segment(seq_num, data)
+            sorter.pop_available_data()
+        return add_batch_and_pop
+
+    return [
+        Microbenchmark("BufferSorter add+pop (in order)", make_in_order),
+        Microbenchmark(
+            f"BufferSorter add+pop (shuffled batches of {REORDER_BATCH})",
+            make_reordered, REORDER_BATCH),
+    ]
@@ -0,0 +1,244 @@
+import cProfile
+import logging
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from threading import Event, Lock, Thread, get_ident
+
+CPROFILE = "cprofile"
+SAMPLE = "sample"
+MEMORY = "memory"
+
+TOP_ENTRIES_LOGGED = 5
+
+
+# Profiles the connections of a process, writing a profile of each one to
+# the directory when it is closed:
+#   - cprofile: a cProfile of the thread of the connection (.prof, for
+#     pstats or snakeviz)
+#   - sample: the stacks of the thread of the connection sampled every
+#     SamplingProfiler.INTERVAL, as collapsed stacks for flamegraph.pl or
+#     speedscope (.folded)
+#   - memory: a tracemalloc snapshot taken at the close (.tracemalloc) and
+#     the lines that allocated the most since the connection started (.txt)
+class Profiler:
+
+    MODES = (CPROFILE, SAMPLE, MEMORY)
+    EXTENSION = ""
+
+    def __repr__(self):
+        return f"{type(self).__name__}(directory={self.directory}, profiles={self.profiles})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = Lock()
+        self.profiles = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def open(cls, mode, directory) -> 'Profiler':
+        profilers = {CPROFILE: CProfileProfiler, SAMPLE: SamplingProfiler,
+                     MEMORY: MemoryProfiler}
+        if mode not in profilers:
+            raise ValueError(f"[PROFILE] Invalid profile mode: {mode}")
+        return profilers[mode](directory)
+
+    # Profiles the block run by the calling thread. With all_threads the
+    # sampling profiler takes the stacks of every thread of the process
+    @contextmanager
+    def profile(self, name, all_threads=False):
+        session = self._start(all_threads)
+        try:
+            yield
+        finally:
+            if session is not None:
+                with self.lock:
+                    self.profiles += 1
+                    file_path = os.path.join(
+                        self.directory,
+                        f"{self.profiles:04d}-{_file_name(name)}{self.EXTENSION}")
+                try:
+                    top = self._stop(session, file_path)
+                    logging.info(
+                        f"[PROFILE] Profile of {name} written to {file_path}, top: {top}")
+                except OSError as e:
+                    logging.error(
+                        f"[PROFILE] Error writing profile of {name}: {e}")
+
+    def close(self):
+        pass
+
+    # ======================== FOR PRIVATE USE ========================
+
+    # Returns what _stop() needs, None to leave the block unprofiled
+    def _start(self, all_threads):
+        raise NotImplementedError
+
+    # Writes the profile and returns a line with what dominated it
+    def _stop(self, session, file_path):
+        raise NotImplementedError
+
+
+class CProfileProfiler(Profiler):
+
+    EXTENSION = ".prof"
+
+    def _start(self, all_threads):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Since Python 3.12 a single cProfile may run at a time
+            logging.warning(
+                f"[PROFILE] Connection not profiled, another one is: {e}")
+            return None
+        return profile
+
+    def _stop(self, profile, file_path):
+        profile.disable()
+        profile.dump_stats(file_path)
+        stats = pstats.Stats(profile).stats
+        total = sum(entry[2] for entry in stats.values()) or 1
+        top = sorted(stats.items(), key=lambda item: item[1][2],
+                     reverse=True)[:TOP_ENTRIES_LOGGED]
+        return ", ".join(
+            f"{_frame_name(*function)} {entry[2] / total:.0%}"
+            for function, entry in top)
+
+
+# A single thread samples the stacks of the threads being profiled, so the
+# profiled code runs untouched between samples. The sampler only runs when
+# the profiled thread gives up the GIL, usually on a socket call, so the
+# time spent computing before that call is charged to its stack: the self
+# time of pure Python functions such as the CRC is better seen with cprofile
+class SamplingProfiler(Profiler):
+
+    INTERVAL = 0.005  # seconds
+    EXTENSION = ".folded"
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        # thread id, or None for every thread -> Counter of the stacks
+        self.sessions = {}
+        self.stopping = Event()
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stopping.set()
+        self.thread.join()
+
+    # ======================== FOR PRIVATE USE ========================
+
+    def _start(self, all_threads):
+        session = (None if all_threads else get_ident(), Counter())
+        with self.lock:
+            self.sessions[id(session)] = session
+        return session
+
+    def _stop(self, session, file_path):
+        with self.lock:
+            del self.sessions[id(session)]
+        stacks = session[1]
+        with open(file_path, "w") as file:
+            for stack, count in stacks.items():
+                file.write(";".join(_code_name(code) for code in stack)
+                           + f" {count}\n")
+
+        samples = sum(stacks.values()) or 1
+        leaves = Counter()
+        for stack, count in stacks.items():
+            leaves[stack[-1]] += count
+        return ", ".join(
+            f"{_code_name(code)} {count / samples:.0%}"
+            for code, count in leaves.most_common(TOP_ENTRIES_LOGGED))
+
+    def _run(self):
+        own_thread = get_ident()
+        while not self.stopping.wait(self.INTERVAL):
+            with self.lock:
+                sessions = list(self.sessions.values())
+            if not sessions:
+                continue
+            frames = sys._current_frames()
+            stacks = {thread: _stack(frame)
+                      for thread, frame in frames.items()
+                      if thread != own_thread}
+            for thread, counter in sessions:
+                if thread is None:
+                    counter.update(stacks.values())
+                elif thread in stacks:
+                    counter[stacks[thread]] += 1
+
+
+# tracemalloc traces the whole process, so the allocations of the
+# connections open at the same time end up in the profile of each of them
+class MemoryProfiler(Profiler):
+
+    EXTENSION = ".tracemalloc"
+    REPORT_LINES = 30
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def close(self):
+        tracemalloc.stop()
+
+    # ======================== FOR PRIVATE USE ========================
+
+    def _start(self, all_threads):
+        return (time.monotonic(), self._snapshot())
+
+    def _stop(self, session, file_path):
+        start, start_snapshot = session
+        snapshot = self._snapshot()
+        snapshot.dump(file_path)
+        differences = snapshot.compare_to(start_snapshot, "lineno")
+        current, peak = tracemalloc.get_traced_memory()
+        with open(os.path.splitext(file_path)[0] + ".txt", "w") as file:
+            file.write(
+                f"{time.monotonic() - start:.3f} s, {current} bytes traced, {peak} bytes peak\n")
+            for difference in differences[:self.REPORT_LINES]:
+                file.write(f"{difference}\n")
+        return ", ".join(
+            f"{difference.traceback[0].filename}:{difference.traceback[0].lineno} {difference.size_diff:+} B"
+            for difference in differences[:TOP_ENTRIES_LOGGED])
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+
+# The code objects of the stack of frame, outermost first
+def _stack(frame):
+    stack = []
+    while frame is not None:
+        stack.append(frame.f_code)
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+def _code_name(code):
+    return _frame_name(code.co_filename, code.co_firstlineno, code.co_name)
+
+
+def _frame_name(file_name, line, function):
+    if file_name == "~":  # built in functions in cProfile
+        return function
+    return f"{function} ({os.path.basename(file_name)}:{line})"
+
+
+def _file_name(name):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
@@ -0,0 +1,537 @@
+import heapq
+import itertools
+import json
+import logging
+import math
+import random
+import socket
+import time
+from collections import deque
+from threading import Event, Semaphore, Thread
+from lib.perf.impairment_proxy import (GilbertElliottLoss, ImpairedLink,
+                                       LinkImpairments)
+from lib.sockets_rdt.listener_rdt import ListenerRDT
+from lib.sockets_rdt.stream_rdt import StreamRDT
+from lib.utils.constant import DEFAULT_SV_PORT, SelectedProtocol
+from lib.utils.exceptions import ExternalConnectionClosed, SimulationEnded
+
+CLIENT_HOST = "10.0.0.1"
+SERVER_HOST = "10.0.0.2"
+FIRST_EPHEMERAL_PORT = 49152
+
+PROTOCOLS = {
+    "saw": SelectedProtocol.STOP_AND_WAIT,
+    "sr": SelectedProtocol.SELECTIVE_REPEAT,
+}
+
+UPLOAD = "upload"
+DOWNLOAD = "download"
+
+
+# Time of a simulation, in seconds since it started
+class VirtualClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+# UDP socket of a simulation, with the part of the socket API that
+# StreamRDT and ListenerRDT use. It belongs to the host of the thread that
+# creates it
+class SimulatedSocket:
+
+    def __repr__(self):
+        return f"SimulatedSocket(address={self.address}, queued={len(self.inbox)})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __init__(self, simulation: 'Simulation'):
+        self.simulation = simulation
+        self.host = simulation.current.host
+        self.address = None
+        self.timeout = None
+        self.inbox = deque()  # (datagram, source address)
+        self.waiter = None  # SimulatedThread blocked on recvfrom()
+        self.closed = False
+
+    def bind(self, address):
+        self.simulation._bind(self, address[1])
+
+    def getsockname(self):
+        return self.address
+
+    def settimeout(self, seconds):
+        self.timeout = seconds
+
+    def gettimeout(self):
+        return self.timeout
+
+    def sendto(self, data, address):
+        if self.address is None:
+            self.bind(('', 0))
+        self.simulation._transmit(bytes(data), self.address, address)
+        return len(data)
+
+    def recvfrom(self, buffer_size):
+        while not self.inbox:
+            if self.closed:
+                raise OSError("Socket closed")
+            if self.timeout == 0:
+                raise BlockingIOError("No datagram queued")
+            if not self.simulation._wait_for_datagram(self):
+                raise socket.timeout("timed out")
+        data, address = self.inbox.popleft()
+        return data[:buffer_size], address
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.simulation._unbind(self)
+
+
+# A thread of a simulation. Only one of them runs at a time: the running
+# one hands the baton to the next when it blocks or ends
+class SimulatedThread:
+
+    def __repr__(self):
+        return f"SimulatedThread(name={self.name}, host={self.host}, done={self.done})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __init__(self, simulation: 'Simulation', host, target, args,
+                 background):
+        self.simulation = simulation
+        self.host = host
+        self.name = getattr(target, "__name__", "thread")
+        self.target = target
+        self.args = args
+        self.background = background
+        self.baton = Semaphore(0)
+        # Each wait gets a new id, so the timeout of an earlier one that
+        # ended with a datagram is ignored
+        self.wait_id = 0
+        self.woken_by_datagram = False
+        self.result = None
+        self.error = None
+        self.done = False
+        self.finished_at = None
+        self.thread = Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        self.baton.acquire()
+        simulation = self.simulation
+        if not simulation.ended:
+            try:
+                self.result = self.target(*self.args)
+            except SimulationEnded:
+                pass
+            except Exception as e:
+                self.error = e
+        self.done = True
+        self.finished_at = simulation.clock.now
+        simulation._thread_finished(self)
+
+
+# Runs StreamRDTs over an in-memory network with a virtual clock. The
+# streams run on their own threads as they do for real, but one at a time:
+# when the running thread blocks on a socket the next one runs, and when
+# all of them are blocked the clock jumps straight to the next datagram
+# delivery or socket timeout. Timeouts then cost no real time, and with
+# the same seed every run loses, delays and reorders the same segments.
+# The datagrams of the client host go through the upstream ImpairedLink
+# and those of the server host through the downstream one. Computing
+# takes no virtual time
+class Simulation:
+
+    def __repr__(self):
+        return f"Simulation(now={self.clock.now}, threads={len(self.threads)}, seed={self.seed})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    # stream_settings are class attributes of StreamRDT, such as
+    # SELECTIVE_REPEAT_WINDOW_SIZE, to use while the simulation runs. It
+    # ends when time_limit virtual seconds pass
+    def __init__(self, upstream: LinkImpairments = None,
+                 downstream: LinkImpairments = None, seed=0,
+                 stream_settings=None, time_limit=3600):
+        upstream = upstream or LinkImpairments()
+        self.seed = seed
+        self.upstream = ImpairedLink("upstream", upstream, seed * 2)
+        self.downstream = ImpairedLink(
+            "downstream", downstream or upstream, seed * 2 + 1)
+        self.stream_settings = stream_settings or {}
+        self.time_limit = time_limit
+
+        self.clock = VirtualClock()
+        self.events = []  # heap of (time, order, callback, args)
+        self.order = itertools.count()
+        self.sockets = {}  # (host, port) -> SimulatedSocket
+        self.ports = itertools.count(FIRST_EPHEMERAL_PORT)
+        self.ready = deque()  # threads that can run, in order
+        self.threads = []
+        self.current = None
+        self.ended = False
+        self.timed_out = False
+        self.finished = Event()
+
+    # ======================== FOR PUBLIC USE ========================
+
+    # Adds a thread running target(*args) on host. The simulation ends when
+    # every thread that is not a background one has ended
+    def spawn(self, host, target, *args, background=False) -> SimulatedThread:
+        thread = SimulatedThread(self, host, target, args, background)
+        self.threads.append(thread)
+        self.ready.append(thread)
+        thread.thread.start()
+        return thread
+
+    # Socket factory for StreamRDT
+    def socket(self, family=socket.AF_INET, type=socket.SOCK_DGRAM):
+        return SimulatedSocket(self)
+
+    def run(self):
+        saved_settings = {name: getattr(StreamRDT, name)
+                          for name in self.stream_settings}
+        factory, clock, rng = \
+            StreamRDT.socket_factory, StreamRDT.clock, StreamRDT.rng
+        for name, value in self.stream_settings.items():
+            setattr(StreamRDT, name, value)
+        StreamRDT.socket_factory = self.socket
+        StreamRDT.clock = self.clock.monotonic
+        StreamRDT.rng = random.Random(self.seed)
+        try:
+            self._switch(None)
+            self.finished.wait()
+            for thread in self.threads:
+                thread.thread.join()
+        finally:
+            for name, value in saved_settings.items():
+                setattr(StreamRDT, name, value)
+            StreamRDT.socket_factory, StreamRDT.clock, StreamRDT.rng = \
+                factory, clock, rng
+
+    def stats(self):
+        return {
+            "upstream": dict(self.upstream.stats),
+            "downstream": dict(self.downstream.stats),
+        }
+
+    # ======================== FOR PRIVATE USE ========================
+
+    def _bind(self, sock: SimulatedSocket, port):
+        if port == 0:
+            port = next(self.ports)
+        address = (sock.host, port)
+        if address in self.sockets:
+            raise OSError(f"Address already in use: {address}")
+        sock.address = address
+        self.sockets[address] = sock
+
+    def _unbind(self, sock: SimulatedSocket):
+        if self.sockets.get(sock.address) is sock:
+            del self.sockets[sock.address]
+
+    def _transmit(self, data, source, destination):
+        if self.ended:
+            return
+        link = self.downstream if source[0] == SERVER_HOST else self.upstream
+        for delivery_time, datagram in link.transmit(data, self.clock.now):
+            self._schedule(delivery_time, self._deliver,
+                           destination, datagram, source)
+
+    def _deliver(self, destination, data, source):
+        sock = self.sockets.get(destination)
+        if sock is None:
+            return
+        sock.inbox.append((data, source))
+        thread = sock.waiter
+        if thread is not None:
+            sock.waiter = None
+            thread.wait_id += 1
+            thread.woken_by_datagram = True
+            self.ready.append(thread)
+
+    def _expire(self, thread: SimulatedThread, wait_id, sock):
+        if thread.wait_id != wait_id or sock.waiter is not thread:
+            return
+        sock.waiter = None
+        thread.wait_id += 1
+        self.ready.append(thread)
+
+    # Blocks the running thread until a datagram arrives at the socket or
+    # its timeout passes. Returns False on timeout
+    def _wait_for_datagram(self, sock: SimulatedSocket):
+        if self.ended:
+            raise SimulationEnded()
+        thread = self.current
+        thread.wait_id += 1
+        thread.woken_by_datagram = False
+        sock.waiter = thread
+        if sock.timeout is not None:
+            self._schedule(self.clock.now + sock.timeout, self._expire,
+                           thread, thread.wait_id, sock)
+        self._switch(thread)
+        return thread.woken_by_datagram
+
+    def _schedule(self, at, callback, *args):
+        heapq.heappush(self.events, (at, next(self.order), callback, args))
+
+    # Hands the baton to the next thread that can run and, if the caller is
+    # a simulated thread, waits until it gets it back
+    def _switch(self, thread: SimulatedThread):
+        next_thread = self._next_ready_thread()
+        if next_thread is None:
+            self._end()
+        elif next_thread is not thread:
+            self.current = next_thread
+            next_thread.baton.release()
+            if thread is None:
+                return
+            thread.baton.acquire()
+        if self.ended and thread is not None:
+            raise SimulationEnded()
+
+    # Moves the clock through the events until some thread can run. None if
+    # every thread is blocked for good or the time limit passed
+    def _next_ready_thread(self):
+        while not self.ready:
+            if not self.events:
+                return None
+            at, _, callback, args = heapq.heappop(self.events)
+            if at > self.time_limit:
+                self.timed_out = True
+                return None
+            self.clock.now = max(self.clock.now, at)
+            callback(*args)
+        return self.ready.popleft()
+
+    def _thread_finished(self, thread: SimulatedThread):
+        if self.ended:
+            return
+        if all(other.done or other.background for other in self.threads):
+            self._end()
+        else:
+            self._switch(None)
+
+    # The threads still blocked are woken up to raise SimulationEnded
+    def _end(self):
+        if self.ended:
+            return
+        self.ended = True
+        for thread in self.threads:
+            if not thread.done:
+                thread.baton.release()
+        self.finished.set()
+
+
+# Transfers size random bytes between a client and a server through a
+# simulated network, and returns whether they arrived intact, in how much
+# virtual and real time, and the stats of both ends and of the links
+def simulate_transfer(protocol, direction, size, upstream=None,
+                      downstream=None, seed=0, stream_settings=None,
+                      time_limit=3600):
+    if protocol not in PROTOCOLS:
+        raise ValueError(f"Unknown protocol: {protocol}")
+    if direction not in (UPLOAD, DOWNLOAD):
+        raise ValueError(f"Unknown direction: {direction}")
+    payload = random.Random(seed).randbytes(size)
+    simulation = Simulation(upstream, downstream, seed, stream_settings,
+                            time_limit)
+    handlers = []
+    simulation.spawn(SERVER_HOST, _serve, simulation, PROTOCOLS[protocol],
+                     direction, payload, handlers, background=True)
+    client = simulation.spawn(CLIENT_HOST, _run_client, PROTOCOLS[protocol],
+                              direction, payload)
+
+    start = time.perf_counter()
+    simulation.run()
+    wall_time = time.perf_counter() - start
+
+    client_stats = client.result["stats"] if client.result else None
+    if direction == UPLOAD:
+        received = [handler.result["data"] for handler in handlers
+                    if handler.result is not None]
+        arrived = payload in received
+    else:
+        arrived = client.result is not None and \
+            client.result["data"] == payload
+    error = None if client.error is None else str(client.error)
+    if client.result is not None and not arrived:
+        # The header CRC does not cover the data, so corrupted data may
+        # get through
+        error = "The data received is not the data sent"
+    completed = client.result is not None and error is None
+
+    return {
+        "completed": completed,
+        "error": error,
+        "timed_out": simulation.timed_out,
+        "transfer_time_s": client.finished_at if completed else None,
+        "simulated_time_s": simulation.clock.now,
+        "wall_time_s": wall_time,
+        "connections": len(handlers),
+        "retransmitted_segments": _total(
+            client_stats, handlers, "retransmitted_segments"),
+        "retransmission_timeouts": _total(
+            client_stats, handlers, "retransmission_timeouts"),
+        "duplicate_segments_received": _total(
+            client_stats, handlers, "duplicate_segments_received"),
+        "links": simulation.stats(),
+    }
+
+
+# Runs simulate_transfer() runs times for every combination of the
+# parameters, with seeds seed, seed + 1, ... The same seeds are used for
+# every combination, so they all face the same sequence of losses
+def sweep(protocols, directions, sizes, losses, window_sizes, timeouts,
+          impairments: LinkImpairments, runs=1, seed=0, time_limit=3600):
+    results = []
+    for protocol, direction, size, loss, window_size, timeout in \
+            itertools.product(protocols, directions, sizes, losses,
+                              window_sizes, timeouts):
+        link = LinkImpairments(
+            loss=GilbertElliottLoss(good_loss=loss / 100), delay=impairments.delay,
+            jitter=impairments.jitter, reorder=impairments.reorder,
+            reorder_gap=impairments.reorder_gap,
+            duplicate=impairments.duplicate, corrupt=impairments.corrupt,
+            bandwidth=impairments.bandwidth,
+            queue_size=impairments.queue_size)
+        settings = {"SELECTIVE_REPEAT_WINDOW_SIZE": window_size,
+                    "RETRANSMISSION_TIMEOUT": timeout}
+        transfers = [simulate_transfer(protocol, direction, size, link,
+                                       link, seed + i, settings, time_limit)
+                     for i in range(runs)]
+        window = window_size if protocol == "sr" else 1
+        key = f"{protocol}/{direction}/{size}B/{loss:g}%loss/w{window}/rto{timeout * 1000:g}ms"
+        result = dict(
+            key=key, protocol=protocol, direction=direction, file_size=size,
+            loss=loss, window_size=window, retransmission_timeout=timeout,
+            **_summary(transfers, size))
+        logging.info(f"[SIMULATOR] {key}: {result}")
+        results.append(result)
+    return {"runs": runs, "seed": seed, "results": results}
+
+
+def save_results(results, file_path):
+    with open(file_path, "w") as file:
+        json.dump(results, file, indent=2)
+
+
+def format_results(results):
+    lines = [f"{'scenario':<48} {'done':>7} {'p50 s':>8} {'p99 s':>8} "
+             f"{'MB/s':>8} {'retrans':>8} {'timeouts':>8} {'speedup':>8}"]
+    for result in results["results"]:
+        lines.append(
+            f"{result['key']:<48} "
+            f"{result['completed']:>3}/{results['runs']:<3} "
+            f"{_format_optional(result['transfer_time_p50_s'])} "
+            f"{_format_optional(result['transfer_time_p99_s'])} "
+            f"{_format_optional(result['goodput_mb_s'])} "
+            f"{result['retransmitted_segments_mean']:>8.1f} "
+            f"{result['retransmission_timeouts_mean']:>8.1f} "
+            f"{result['speedup']:>7.0f}x")
+    return lines
+
+
+# ======================== FOR PRIVATE USE ========================
+
+def _serve(simulation: Simulation, protocol, direction, payload, handlers):
+    listener = ListenerRDT(SERVER_HOST, DEFAULT_SV_PORT, protocol)
+    while True:
+        accepter = listener.listen()
+        handlers.append(simulation.spawn(
+            SERVER_HOST, _handle_connection, accepter, direction, payload))
+
+
+def _handle_connection(accepter, direction, payload):
+    try:
+        stream = accepter.accept()
+        try:
+            if direction == DOWNLOAD:
+                stream.send(payload)
+            return {"data": _read_until_closed(stream), "stats": stream.stats}
+        finally:
+            stream.close()
+    finally:
+        accepter.release()
+
+
+def _run_client(protocol, direction, payload):
+    stream = StreamRDT.connect(protocol, SERVER_HOST, DEFAULT_SV_PORT)
+    try:
+        data = b''
+        if direction == UPLOAD:
+            stream.send(payload)
+            stream.flush()
+        else:
+            received = bytearray()
+            while len(received) < len(payload):
+                received += stream.read() or b''
+            data = bytes(received)
+    finally:
+        stream.close()
+    return {"data": data, "stats": stream.stats}
+
+
+def _read_until_closed(stream):
+    received = bytearray()
+    try:
+        while True:
+            received += stream.read() or b''
+    except ExternalConnectionClosed:
+        return bytes(received)
+
+
+def _total(client_stats, handlers, counter):
+    stats = [client_stats] + [handler.result["stats"] for handler in handlers
+                              if handler.result is not None]
+    return sum(getattr(stream_stats, counter) for stream_stats in stats
+               if stream_stats is not None)
+
+
+def _summary(transfers, size):
+    completed = [transfer for transfer in transfers if transfer["completed"]]
+    times = [transfer["transfer_time_s"] for transfer in completed]
+    simulated_time = sum(transfer["simulated_time_s"]
+                         for transfer in transfers)
+    wall_time = sum(transfer["wall_time_s"] for transfer in transfers)
+    time_p50 = _percentile(times, 50)
+    return {
+        "completed": len(completed),
+        "transfer_time_p50_s": time_p50,
+        "transfer_time_p99_s": _percentile(times, 99),
+        "goodput_mb_s": size / time_p50 / 1024 / 1024
+        if time_p50 else None,
+        "retransmitted_segments_mean": _mean(
+            transfer["retransmitted_segments"] for transfer in transfers),
+        "retransmission_timeouts_mean": _mean(
+            transfer["retransmission_timeouts"] for transfer in transfers),
+        "simulated_time_s": simulated_time,
+        "wall_time_s": wall_time,
+        "speedup": simulated_time / wall_time if wall_time else 0.0,
+        "errors": sorted({transfer["error"] for transfer in transfers
+                          if transfer["error"]}),
+    }
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(math.ceil(len(values) * percent / 100) - 1, len(values) - 1)
+    return values[max(index, 0)]
+
+
+def _mean(values):
+    values = list(values)
+    return sum(values) / len(values) if values else 0.0
+
+
+def _format_optional(value):
+    return f"{'-':>8}" if value is None else f"{value:>8.3f}"
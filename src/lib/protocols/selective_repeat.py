@@ -1,3 +1,4 @@
+from lib.utils.exceptions import ExternalConnectionClosed
 from lib.protocols.utils.buffer_sorter import BufferSorter
 
 from lib.protocols.utils.sliding_window import SlidingWindow
@@ -7,54 +8,62 @@ class SelectiveRepeat:
 
     MAX_TIMEOUT_RETRIES = 15
 
-    def __init__(self, stream, window_size, mss: int):
+    # Max amount of segments that send() can leave queued (not yet acked)
+    # before blocking. Must be bigger than the window so it never drains
+    # between consecutive send() calls
+    SEND_BUFFER_SIZE = 128
+
+    # Segments are paced to go out evenly along a round trip, at
+    # PACING_GAIN times the rate of a window per round trip
+    PACING_GAIN = 1.25
+    # Weight of each RTT sample in the smoothed RTT, as in RFC 6298
+    RTT_SAMPLE_WEIGHT = 1 / 8
+    # Shorter waits before sending cost more than the bursts they avoid
+    MIN_SEND_DELAY = 0.001  # seconds
+
+    def __init__(self, stream, window_size, mss: int,
+                 send_buffer_size=SEND_BUFFER_SIZE):
         self.stream = stream
         self.window_size = window_size
         self.mss = mss
+        self.send_buffer_size = max(send_buffer_size, window_size)
 
         self.window = SlidingWindow(self.window_size, self.stream.seq_num)
 
         self.buffer_sorter = BufferSorter(self.stream.ack_num)
+        # Send time of the segments sent once, for the RTT samples. As in
+        # Karn's algorithm a retransmitted segment gives no sample
+        self.send_times = {}
+        self.smoothed_rtt = None
+        self.next_send_time = 0
 
     # ======================== FOR PUBLIC USE ========================
 
+    # Enqueues the segments in the send buffer and returns as soon as they
+    # fit in it. The segments are pushed out by the pump on this and the
+    # following send() calls, flush() waits for all of them to be acked
     def send(self, data_segments):
-        self.window.add_data(data_segments)
-        retries = 0
-        while not self.window.finished() and retries < SelectiveRepeat.MAX_TIMEOUT_RETRIES:
-            if not self.window.has_available_segments_to_send():
-                try:
-                    received_segment, external_address = self.stream.read_segment(
-                        True)
-                    self._update_protocol(
-                        received_segment, external_address, self.window)
-                    self._send_ack(received_segment)
-                    retries = 0
-                    continue
-                except TimeoutError:
-                    self.window.reset_sent_segments()
-                    retries += 1
-                    continue
-                except ValueError:
-                    continue
-
-            self._send_segment(self.window)
-
-            received_segment, external_address = self.stream.read_segment_non_blocking(
-                True)
-            if received_segment is None:
+        position = 0
+        while position < len(data_segments):
+            free_space = self.send_buffer_size - self.window.pending_segments()
+            if free_space <= 0:
+                self._pump(self.send_buffer_size - 1)
                 continue
+            self.window.add_data(data_segments[position:position + free_space])
+            position += free_space
 
-            self._update_protocol(
-                received_segment, external_address, self.window)
-            retries = 0
+        self._send_available_segments()
 
-        if retries >= SelectiveRepeat.MAX_TIMEOUT_RETRIES:
-            raise TimeoutError(
-                "[PROTOCOL] Multiple timeouts while tryng to send data and receive corresponding acks"
-            )
+    def flush(self):
+        self._pump(0)
 
     def read(self):
+        self.flush()
+        # Segments received while sending are already in the buffer
+        data = self._pop_available_data()
+        if data:
+            return data
+
         retries = 0
         while retries < SelectiveRepeat.MAX_TIMEOUT_RETRIES:
             try:
@@ -67,9 +76,8 @@ class SelectiveRepeat:
             except ValueError:
                 continue
 
-            self._send_ack(received_segment)
-            self.stream.ack_num, data = self.buffer_sorter.pop_available_data()
-            return data
+            self._process_segment(received_segment)
+            return self._pop_available_data()
 
         if retries >= SelectiveRepeat.MAX_TIMEOUT_RETRIES:
             raise TimeoutError(
@@ -77,20 +85,142 @@ class SelectiveRepeat:
 
     # ======================== FOR PRIVATE USE ========================
 
-    def _update_protocol(self, received_segment, external_addresss, window: SlidingWindow):
+    # Keeps the window full until at most max_pending_segments are left
+    # without ack
+    def _pump(self, max_pending_segments):
+        retries = 0
+        while self.window.pending_segments() > max_pending_segments:
+            if retries >= SelectiveRepeat.MAX_TIMEOUT_RETRIES:
+                raise TimeoutError(
+                    "[PROTOCOL] Multiple timeouts while tryng to send data and receive corresponding acks"
+                )
+
+            if self.window.has_available_segments_to_send():
+                delay, rate_limited = self._send_delay()
+                if delay > 0:
+                    if self._hold_back(delay, rate_limited):
+                        retries = 0
+                    continue
+                self._send_segment(self.window)
+                received_segment, _ = self.stream.read_segment_non_blocking(
+                    True)
+                if received_segment is not None:
+                    self._process_segment(received_segment)
+                    retries = 0
+                continue
+
+            try:
+                received_segment, _ = self.stream.read_segment(True)
+            except TimeoutError:
+                self.window.reset_sent_segments()
+                self.stream.stats.retransmission_timeouts += 1
+                retries += 1
+                continue
+            except ValueError:
+                continue
+
+            self._process_segment(received_segment)
+            retries = 0
+
+    def _send_available_segments(self):
+        try:
+            while self.window.has_available_segments_to_send():
+                delay, rate_limited = self._send_delay()
+                if delay > 0:
+                    self._hold_back(delay, rate_limited)
+                    continue
+                self._send_segment(self.window)
+
+            received_segment, _ = self.stream.read_segment_non_blocking(True)
+            while received_segment is not None:
+                self._process_segment(received_segment)
+                received_segment, _ = self.stream.read_segment_non_blocking(
+                    True)
+        except ExternalConnectionClosed:
+            # Closing after acking everything is a normal end for the peer
+            if not self.window.finished():
+                raise
+
+    def _pop_available_data(self):
+        ack_num, data = self.buffer_sorter.pop_available_data()
+        if data:
+            self.stream.ack_num = ack_num
+        return data
+
+    def _process_segment(self, received_segment):
+        self._update_protocol(received_segment, self.window)
+        self._send_ack(received_segment)
+
+    def _update_protocol(self, received_segment, window: SlidingWindow):
+        if not received_segment.data:
+            sent_at = self.send_times.pop(received_segment.header.ack_num, None)
+            if sent_at is not None:
+                self._add_rtt_sample(self.stream.clock() - sent_at)
         window.set_ack(received_segment.header.ack_num)
         self.stream.seq_num = window.get_current_seq_num()
 
     def _send_segment(self, window: SlidingWindow):
         sent_seq_num, segment = window.get_first_available_segment()
+        stats = self.stream.stats
+        if window.is_retransmission(sent_seq_num):
+            stats.retransmitted_segments += 1
+            self.send_times.pop(sent_seq_num, None)
+        else:
+            self.send_times[sent_seq_num] = self.stream.clock()
+        stats.window_occupancy.observe(
+            sent_seq_num - window.get_current_seq_num() + 1)
         self.stream.send_segment(
             segment, sent_seq_num, self.stream.ack_num, False, False)
         window.set_sent(sent_seq_num, True)
 
+        now = self.stream.clock()
+        for rate_limit in self.stream.rate_limits:
+            rate_limit.consume(len(segment), now)
+        if self.stream.PACING and self.smoothed_rtt is not None:
+            self.next_send_time = now + self.smoothed_rtt / (
+                self.window_size * self.PACING_GAIN)
+
+    # Seconds to hold the next segment back, for the pacing and for the
+    # rate limits of the stream, and whether the rate limits are the reason
+    def _send_delay(self):
+        now = self.stream.clock()
+        pacing_delay = self.next_send_time - now
+        rate_limit_delay = max(
+            (rate_limit.delay(self.mss, now)
+             for rate_limit in self.stream.rate_limits), default=0)
+        delay = max(pacing_delay, rate_limit_delay)
+        if delay < self.MIN_SEND_DELAY:
+            return 0, False
+        return delay, rate_limit_delay >= pacing_delay
+
+    # Waits up to seconds for a segment, processing the acks meanwhile.
+    # Returns whether a segment arrived
+    def _hold_back(self, seconds, rate_limited):
+        start = self.stream.clock()
+        received_segment, _ = self.stream.read_segment_with_timeout(
+            True, seconds)
+        if rate_limited:
+            self.stream.stats.rate_limited_time += self.stream.clock() - start
+        if received_segment is None:
+            return False
+        self._process_segment(received_segment)
+        return True
+
+    def _add_rtt_sample(self, rtt):
+        self.stream.stats.rtt.observe(rtt)
+        if self.smoothed_rtt is None:
+            self.smoothed_rtt = rtt
+        else:
+            self.smoothed_rtt += self.RTT_SAMPLE_WEIGHT * \
+                (rtt - self.smoothed_rtt)
+
     def _send_ack(self, received_segment):
         if (len(received_segment.data) == 0):
             return
         self.stream.send_segment(
             b'', self.stream.seq_num, received_segment.header.seq_num, False, False)
-        self.buffer_sorter.add_segment(
-            received_segment.header.seq_num, received_segment.data)
+        if not self.buffer_sorter.add_segment(
+                received_segment.header.seq_num, received_segment.data):
+            self.stream.stats.duplicate_segments_received += 1
+        self.stream.stats.reorder_buffer_depth.observe(
+            len(self.buffer_sorter.buffer))
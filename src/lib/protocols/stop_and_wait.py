@@ -1,15 +1,27 @@
 from lib.protocols.selective_repeat import SelectiveRepeat
 
 
+# Selective Repeat with a window of a single segment. Its segments go out
+# through the same send path, so the pacing and the rate limits of the
+# stream apply the same
 class StopAndWait():
 
     def __init__(self, stream, mss):
         self.stream = stream
         self.mss = mss
         self.selective_repeat = SelectiveRepeat(stream, 1, mss)
+        self.buffer_sorter = self.selective_repeat.buffer_sorter
+        self.window = self.selective_repeat.window
 
     def send(self, data):
         self.selective_repeat.send(data)
 
+    def flush(self):
+        self.selective_repeat.flush()
+
     def read(self):
         return self.selective_repeat.read()
+
+    @property
+    def smoothed_rtt(self):
+        return self.selective_repeat.smoothed_rtt
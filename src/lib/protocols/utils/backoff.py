@@ -0,0 +1,31 @@
+import random
+
+
+# Exponential backoff with decorrelated jitter: each wait is drawn between
+# base and GROWTH times the previous one, up to cap. Clients that failed
+# at the same time, as when a server restarts, draw different waits and
+# spread out instead of retrying in lockstep
+class Backoff:
+
+    GROWTH = 3
+
+    def __repr__(self):
+        return f"Backoff(base={self.base}, cap={self.cap}, previous={self.previous})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __init__(self, base, cap, rng=random):
+        if base <= 0 or cap < base:
+            raise ValueError(
+                "The base of a backoff must be positive and not over its cap")
+        self.base = base
+        self.cap = cap
+        self.rng = rng
+        self.previous = base
+
+    # Seconds to wait before the next retry
+    def next(self):
+        self.previous = min(
+            self.cap, self.rng.uniform(self.base, self.previous * self.GROWTH))
+        return self.previous
@@ -13,14 +13,18 @@ class BufferSorter:
     def set_ack_num(self, ack_num):
         self.curr_ack_num = ack_num
 
+    # Returns False if the segment was already received
     def add_segment(self, received_seq_num, data):
         seg_position = received_seq_num - self.curr_ack_num
         if seg_position < 0:
-            return
+            return False
         if seg_position >= len(self.buffer):
             for i in range(seg_position - len(self.buffer) + 1):
                 self.buffer.append((len(self.buffer) + i, None))
+        elif self.buffer[seg_position][1] is not None:
+            return False
         self.buffer[seg_position] = (received_seq_num, data)
+        return True
 
     def pop_available_data(self):
         data_popped = b''
@@ -17,6 +17,7 @@ class SlidingWindow:
 
         self.ack_list = [False for _ in range(self.window_size)]
         self.sent_list = [False for _ in range(self.window_size)]
+        self.highest_sent_seq_num = initial_seq_num - 1
 
     def add_data(self, data):
         self.final_seq_num = self.final_seq_num + len(data)
@@ -57,10 +58,27 @@ class SlidingWindow:
 
     def set_sent(self, seq_num, value: bool):
         self.sent_list[seq_num - self.current_seq_num] = value
+        if value and seq_num > self.highest_sent_seq_num:
+            self.highest_sent_seq_num = seq_num
+
+    # Whether the segment was already sent once
+    def is_retransmission(self, seq_num):
+        return seq_num <= self.highest_sent_seq_num
 
     def finished(self):
         return self.current_seq_num > self.final_seq_num
 
+    def pending_segments(self):
+        return self.final_seq_num - self.current_seq_num + 1
+
+    # Segments sent and still waiting for their ack
+    def in_flight_segments(self):
+        in_flight = 0
+        for i in range(min(self.pending_segments(), self.window_size)):
+            if self.sent_list[i] and not self.ack_list[i]:
+                in_flight += 1
+        return in_flight
+
     def is_available_segment_to_send(self, seq_num):
         return (self.get_sent(seq_num) is False) and (self.get_ack(seq_num) is False)
 
@@ -0,0 +1,48 @@
+from threading import Lock
+
+
+# Limits a sender to rate bytes per second on average, with bursts of up
+# to burst bytes. The tokens are bytes: they refill at rate per second up
+# to burst, and each segment sent takes as many as it carries. A bucket may
+# be shared by the streams of many threads, as the global limit of a server
+class TokenBucket:
+
+    def __repr__(self):
+        return f"TokenBucket(rate={self.rate}, burst={self.burst}, tokens={self.tokens})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __init__(self, rate, burst):
+        if rate <= 0 or burst <= 0:
+            raise ValueError(
+                "The rate and burst of a token bucket must be positive")
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = None
+        self.lock = Lock()
+
+    # Seconds from now until size bytes may be sent, 0 if they may already
+    def delay(self, size, now):
+        with self.lock:
+            self._refill(now)
+            missing = min(size, self.burst) - self.tokens
+        return max(missing, 0) / self.rate
+
+    # Takes the tokens of size bytes sent. They may go below zero when many
+    # streams send at once, and then the next segments wait longer
+    def consume(self, size, now):
+        with self.lock:
+            self._refill(now)
+            self.tokens -= size
+
+    # ======================== FOR PRIVATE USE ========================
+
+    def _refill(self, now):
+        if self.updated_at is not None and now > self.updated_at:
+            self.tokens = min(
+                self.burst,
+                self.tokens + (now - self.updated_at) * self.rate)
+        if self.updated_at is None or now > self.updated_at:
+            self.updated_at = now
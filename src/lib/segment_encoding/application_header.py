@@ -2,7 +2,7 @@
 import ctypes
 import struct
 
-from lib.utils.constant import SelectedTransferType
+from lib.utils.constant import SelectedCompression, SelectedTransferType
 from crc import Calculator, Crc8
 
 
@@ -12,31 +12,69 @@ calculator = Calculator(Crc8.CCITT, optimized=True)
 class ApplicationHeaderRDT():
 
     MAX_FILE_NAME = 40
-    PACKET_FORMAT = '!B40sI'
+    PACKET_FORMAT = '!B40sIIIIBB'
 
     CHECKSUM_SIZE = 1
 
+    NO_TRANSFER_ID = 0
+    # Sent in place of the compression level when it is None, the default
+    # one of the compression
+    DEFAULT_COMPRESSION_LEVEL = 0xFF
+
     def __repr__(self):
-        return "ApplicationHeaderRDT(transfer_type={}, file_name={}, file_size={})".format(
-            self.transfer_type, self.file_name, self.file_size)
+        return "ApplicationHeaderRDT(transfer_type={}, file_name={}, file_size={}, offset={}, length={}, transfer_id={}, compression={}, compression_level={})".format(
+            self.transfer_type, self.file_name, self.file_size,
+            self.offset, self.length, self.transfer_id,
+            self.compression, self.compression_level)
 
     def __str__(self):
         return self.__repr__()
 
+    # offset and length delimit the byte range of the file carried after
+    # the header. If length is not given the range goes until the end of
+    # the file. The transfer_id ties together the stripes of a transfer
+    # split over many connections. The compression is the one used for the
+    # data after the header, or the one requested for a download
     def __init__(self, transfer_type: SelectedTransferType,
                  file_name: str, file_size,
+                 offset=0, length=None, transfer_id=NO_TRANSFER_ID,
+                 compression=SelectedCompression.NONE, compression_level=None
                  ):
         self.transfer_type: ctypes.c_uint8 = transfer_type
         self.file_name: str = file_name
         self.file_size: ctypes.c_uint32 = file_size
+        self.offset: ctypes.c_uint32 = offset
+        self.length: ctypes.c_uint32 = \
+            max(file_size - offset, 0) if length is None else length
+        self.transfer_id: ctypes.c_uint32 = transfer_id
+        self.compression: ctypes.c_uint8 = compression
+        self.compression_level: ctypes.c_uint8 = compression_level
         self.header_checksum: ctypes.c_uint8 = 0
 
     def equals(self, app_header: 'ApplicationHeaderRDT'):
         return self.transfer_type == app_header.transfer_type and \
             self.file_name == app_header.file_name and \
             self.file_size == app_header.file_size and \
+            self.offset == app_header.offset and \
+            self.length == app_header.length and \
+            self.transfer_id == app_header.transfer_id and \
+            self.compression == app_header.compression and \
+            self.compression_level == app_header.compression_level and \
             self.header_checksum == app_header.header_checksum
 
+    def is_striped(self):
+        return self.transfer_id != self.NO_TRANSFER_ID
+
+    # The answer to a rejected request carries the reason in place of the
+    # file name, cut to MAX_FILE_NAME bytes
+    @classmethod
+    def error(cls, message: str):
+        return cls(SelectedTransferType.ERROR,
+                   message[:cls.MAX_FILE_NAME], 0, length=0)
+
+    def is_error(self):
+        return self.transfer_type == SelectedTransferType.ERROR
+
     @classmethod
     def size(cls):
         return struct.calcsize(cls.PACKET_FORMAT) + cls.CHECKSUM_SIZE
@@ -44,7 +82,14 @@ class ApplicationHeaderRDT():
     def as_bytes(self):
         packed_bytes = struct.pack(self.PACKET_FORMAT, self.transfer_type,
                                    self.file_name.encode('utf-8'),
-                                   self.file_size)
+                                   self.file_size,
+                                   self.offset,
+                                   self.length,
+                                   self.transfer_id,
+                                   self.compression,
+                                   self.DEFAULT_COMPRESSION_LEVEL
+                                   if self.compression_level is None
+                                   else self.compression_level)
         self.checksum = calculator.checksum(packed_bytes).to_bytes(
             1, byteorder='big'
         )
@@ -63,10 +108,14 @@ class ApplicationHeaderRDT():
         if calculator.verify(data, checksum) is False:
             raise ValueError("Checksum of ApplicationHeaderRDT is not correct")
 
-        transfer_type, file_name, file_size = \
-            struct.unpack(
+        transfer_type, file_name, file_size, offset, length, transfer_id, \
+            compression, compression_level = struct.unpack(
                 cls.PACKET_FORMAT, data
             )
 
         file_name = file_name.decode('utf-8').strip('\x00')
-        return cls(transfer_type, file_name, file_size)
+        if compression_level == cls.DEFAULT_COMPRESSION_LEVEL:
+            compression_level = None
+        return cls(transfer_type, file_name, file_size,
+                   offset, length, transfer_id,
+                   compression, compression_level)
@@ -9,13 +9,20 @@ calculator = Calculator(Crc8.CCITT, optimized=True)
 
 class HeaderRDT:
 
-    PACKET_FORMAT = '!BIII??'
+    PACKET_FORMAT = '!BIII??H'
 
     CHECKSUM_SIZE = 1
 
+    # Segments out of a multiplexed connection all belong to this stream
+    DEFAULT_STREAM = 0
+    # The SYNs a listener answers with a cookie or a retry after, instead
+    # of starting a connection, carry this stream id. The initiator can't
+    # tell them by their port, which a NAT or a proxy may change
+    LISTENER_ANSWER_STREAM = 0xFFFF
+
     def __repr__(self):
-        return "HeaderRDT(protocol={}, data_size={}, seq_num={}, ack_num={}, syn={}, fin={}, checksum={})".format(
-            self.protocol, self.data_size, self.seq_num, self.ack_num, self.syn, self.fin, self.checksum)
+        return "HeaderRDT(protocol={}, data_size={}, seq_num={}, ack_num={}, syn={}, fin={}, stream_id={}, checksum={})".format(
+            self.protocol, self.data_size, self.seq_num, self.ack_num, self.syn, self.fin, self.stream_id, self.checksum)
 
     def __str__(self):
         return self.__repr__()
@@ -27,7 +34,8 @@ class HeaderRDT:
                  ack_num: ctypes.c_uint32,
                  syn: ctypes.c_bool,
                  fin: ctypes.c_bool,
-                 checksum: ctypes.c_uint8 = 0
+                 checksum: ctypes.c_uint8 = 0,
+                 stream_id: ctypes.c_uint16 = DEFAULT_STREAM
 
                  ):
         self.data_size: ctypes.c_uint32 = data_size
@@ -36,6 +44,7 @@ class HeaderRDT:
         self.ack_num: ctypes.c_uint32 = ack_num
         self.syn: ctypes.c_bool = syn
         self.fin: ctypes.c_bool = fin
+        self.stream_id: ctypes.c_uint16 = stream_id
         # Not included in struct packing:
         self.checksum: ctypes.c_uint8 = checksum
 
@@ -47,7 +56,8 @@ class HeaderRDT:
         packed_bytes = struct.pack(self.PACKET_FORMAT, self.protocol,
                                    self.data_size,
                                    self.seq_num,
-                                   self.ack_num, self.syn, self.fin)
+                                   self.ack_num, self.syn, self.fin,
+                                   self.stream_id)
         self.checksum = calculator.checksum(packed_bytes).to_bytes(
             1, byteorder='big'
         )
@@ -67,7 +77,8 @@ class HeaderRDT:
         if calculator.verify(data, checksum) is False:
             raise ValueError("[HEADER] Checksum of HeaderRDT is not correct")
 
-        protocol, data_size, seq_num, ack_num, syn, fin = struct.unpack(
-            cls.PACKET_FORMAT, data)
+        protocol, data_size, seq_num, ack_num, syn, fin, stream_id = \
+            struct.unpack(cls.PACKET_FORMAT, data)
 
-        return cls(protocol, data_size, seq_num, ack_num, syn, fin, checksum)
+        return cls(protocol, data_size, seq_num, ack_num, syn, fin, checksum,
+                   stream_id)
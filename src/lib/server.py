@@ -1,28 +1,100 @@
 import logging
-from threading import Thread
-from lib.utils.constant import DEFAULT_SV_STORAGE, SelectedProtocol, SelectedTransferType
+import os
+from contextlib import nullcontext
+from threading import Lock, Thread
+from lib.utils.exceptions import ExternalConnectionClosed
+from lib.utils.constant import DEFAULT_SV_CACHE_SIZE, DEFAULT_SV_INTERACTIVE_SIZE, DEFAULT_SV_MAX_CONNECTIONS, DEFAULT_SV_RATE_LIMIT_BURST, DEFAULT_SV_RETRY_AFTER, DEFAULT_SV_STORAGE, SelectedProtocol, SelectedTransferType
+from lib.protocols.utils.token_bucket import TokenBucket
 from lib.transference_handler.downloader import Downloader
+from lib.utils.compression import is_valid_level, negotiate
+from lib.utils.file_cache import CachedFileHandler, FileCache
 from lib.utils.file_handling import FileHandler
+from lib.utils.shared_file import SharedFileHandler, SharedFileStore
 from lib.segment_encoding.application_header import ApplicationHeaderRDT
 
-from lib.sockets_rdt.listener_rdt import AccepterRDT, ListenerRDT
-from lib.transference_handler.uploader import Uploader
+from lib.sockets_rdt.connection_reaper import ConnectionReaper
+from lib.sockets_rdt.fair_scheduler import BULK, INTERACTIVE, FairScheduler
+from lib.sockets_rdt.listener_rdt import SYN_COOKIES_AUTO, AccepterRDT, \
+    ListenerRDT
+from lib.sockets_rdt.multiplexed_connection import MultiplexedConnection
+from lib.sockets_rdt.stream_reader import StreamReader
+from lib.sockets_rdt.stream_stats import StreamStats
+from lib.sockets_rdt.stats_export import write_stats_json
+from lib.transference_handler.delta_sync import DeltaReceiver
+from lib.transference_handler.striped_transfer import StripedTransferRegistry
+from lib.transference_handler.uploader import Uploader, range_length
+from lib.utils.write_behind import WriteBehindWriter
 
 
 class ServerRDT:
 
     MAX_FILE_SIZE_ALLOWED = 500*1024*1024  # 500 MB
     NO_SUCH_FILE = "No such file"
+    RANGE_OUT_OF_FILE = "Range out of file"
+    BAD_COMPRESSION_LEVEL = "Bad compression level"
+    NO_PARTIAL_FILE = "No partial file to resume"
+    INVALID_FILE_NAME = "Invalid file name"
+    TRANSFER_FAILED = "Striped transfer already failed"
 
-    def __init__(self, host, port, protocol=SelectedProtocol.STOP_AND_WAIT):
+    WRITE_TRANSFER_TYPES = (
+        SelectedTransferType.UPLOAD, SelectedTransferType.DELTA_UPLOAD)
+
+    # cache_size is the byte budget of the cache of the files served by
+    # downloads, 0 disables it. fsync_policy is one of
+    # WriteBehindWriter.FSYNC_POLICIES, for the files received. With a
+    # profiler each connection is profiled until it closes. rate_limit caps
+    # the bytes per second sent on each connection and global_rate_limit on
+    # all of them together, 0 for no limit. With a FairScheduler the
+    # connections take turns to send, with the weight of the class of their
+    # current request: the transferences up to interactive_size and the
+    # stats are interactive, the rest bulk. syn_cookies is one of
+    # ListenerRDT.SYN_COOKIES_MODES. Past max_connections, 0 for no limit,
+    # the new clients are asked to retry after retry_after seconds
+    def __init__(self, host, port, protocol=SelectedProtocol.STOP_AND_WAIT,
+                 cache_size=DEFAULT_SV_CACHE_SIZE,
+                 fsync_policy=WriteBehindWriter.FSYNC_NONE, profiler=None,
+                 rate_limit=0, global_rate_limit=0,
+                 rate_limit_burst=DEFAULT_SV_RATE_LIMIT_BURST,
+                 scheduler: FairScheduler = None,
+                 interactive_size=DEFAULT_SV_INTERACTIVE_SIZE,
+                 syn_cookies=SYN_COOKIES_AUTO,
+                 max_connections=DEFAULT_SV_MAX_CONNECTIONS,
+                 retry_after=DEFAULT_SV_RETRY_AFTER):
+        if max_connections < 0 or retry_after <= 0:
+            raise ValueError(
+                "The max connections can't be negative and the retry after must be positive")
         self.host = host
         self.port = port
         self.protocol = protocol
-        self.server_ports_threads = []
+        self.striped_transfers = StripedTransferRegistry()
+        self.file_cache = FileCache(cache_size) if cache_size > 0 else None
+        self.shared_files = SharedFileStore()
+        self.fsync_policy = fsync_policy
+        self.profiler = profiler
+        self.rate_limit = rate_limit
+        self.rate_limit_burst = rate_limit_burst
+        self.global_rate_limit = TokenBucket(
+            global_rate_limit, rate_limit_burst) if global_rate_limit > 0 \
+            else None
+        self.scheduler = scheduler
+        self.interactive_size = interactive_size
+        self.syn_cookies = syn_cookies
+        self.max_connections = max_connections
+        self.retry_after = retry_after
+        # The stats of the closed connections are added up in closed_stats
+        self.stats_lock = Lock()
+        self.open_connections = {}  # id(stream) -> (name, StreamStats)
+        self.closed_stats = StreamStats()
 
+    # Serves each connection on a thread of its own, while a
+    # ConnectionReaper watches them all
     def run(self):
         logging.info("[SERVER] Starting server")
-        listener = ListenerRDT(self.host, self.port, self.protocol)
+        listener = ListenerRDT(self.host, self.port, self.protocol,
+                               self.syn_cookies, self.max_connections,
+                               self.retry_after)
+        reaper = ConnectionReaper()
+        server_ports_threads = []
 
         logging.info("[SERVER] Listening for connections")
         while True:
@@ -37,53 +109,206 @@ class ServerRDT:
                 continue
 
             client_thread = Thread(target=self.server_port_handler,
-                                   args=(accepter,))
-            self.server_ports_threads.append(client_thread)
+                                   args=(accepter, reaper))
+            server_ports_threads.append(client_thread)
             client_thread.start()
 
-            for thread in self.server_ports_threads:
+            for thread in server_ports_threads:
                 if not thread.is_alive():
                     logging.info("[SERVER] Removing dead thread")
-                    self.server_ports_threads.remove(thread)
+                    server_ports_threads.remove(thread)
 
         logging.info("[SERVER] Waiting for threads to finish")
-        for thread in self.server_ports_threads:
+        for thread in server_ports_threads:
             thread.join()
-        logging.info("[SERVER] ALl threads finished")
+        reaper.close()
+        logging.info(f"[SERVER] ALl threads finished, {listener}")
 
+    # A connection carries a session of requests, one after the other,
+    # until the client closes it
     def server_port_handler(
-            self, accepter: AccepterRDT
+            self, accepter: AccepterRDT, reaper: ConnectionReaper
     ):
         try:
             logging.info(
                 f"[PORT HANDLER] Accepting connection from client {accepter.external_host}:{accepter.external_port}")
             stream = accepter.accept()
+        except Exception as e:
+            logging.error(
+                "[PORT HANDLER] Error starting connection: " + str(e))
+            accepter.release()
+            return
+
+        name = f"{accepter.external_host}:{accepter.external_port}"
+        stream.rate_limits = self._rate_limits()
+        if self.scheduler:
+            stream.scheduled_flow = self.scheduler.flow(
+                INTERACTIVE, stream.stats)
+        profile = self.profiler.profile(name) if self.profiler \
+            else nullcontext()
+        with self.stats_lock:
+            self.open_connections[id(stream)] = (name, stream.stats)
+        reaper.add(stream, name)
+        with profile:
+            try:
+                self._run_session(stream)
+            except Exception as e:
+                logging.error(
+                    "[PORT HANDLER] Error handling transference: " + str(e))
+            finally:
+                reaper.remove(stream)
+                stream.close()
+                accepter.release()
+        with self.stats_lock:
+            del self.open_connections[id(stream)]
+            self.closed_stats.add(stream.stats, samples=False)
+        logging.info(
+            f"[PORT HANDLER] Connection with {name} closed: {stream.stats.summary()}")
+
+    # Returns the stats of all the connections added up, and the
+    # (name, stats) of each open one
+    def stats_snapshot(self):
+        total = StreamStats()
+        with self.stats_lock:
+            total.add(self.closed_stats, samples=False)
+            connections = list(self.open_connections.values())
+        for _, stats in connections:
+            total.add(stats, samples=False)
+        return total, connections
+
+    def dump_stats(self, file_path):
+        write_stats_json(*self.stats_snapshot(), file_path)
+        logging.info(f"[SERVER] Stats written to {file_path}")
+
+    # A bucket of its own for each connection, plus the one they all share
+    def _rate_limits(self):
+        rate_limits = []
+        if self.rate_limit > 0:
+            rate_limits.append(
+                TokenBucket(self.rate_limit, self.rate_limit_burst))
+        if self.global_rate_limit is not None:
+            rate_limits.append(self.global_rate_limit)
+        return rate_limits
 
-            initial_data = stream.read()
+    # The size of a download is only known from the file. A request with
+    # an invalid file name is only answered with an error
+    def _transfer_class(self, app_header: ApplicationHeaderRDT):
+        if app_header.transfer_type == SelectedTransferType.STAT or \
+                self._file_name_error(app_header.file_name) is not None:
+            return INTERACTIVE
+        size = app_header.length
+        if app_header.transfer_type == SelectedTransferType.DOWNLOAD \
+                and size == 0:
+            file_path = DEFAULT_SV_STORAGE + app_header.file_name
+            if self._file_exists(file_path):
+                size = self._file_size(file_path) - app_header.offset
+        return INTERACTIVE if size <= self.interactive_size else BULK
+
+    # Serves the requests of a stream until the client closes it. On a
+    # multiplexed connection each of its streams carries its own session
+    def _run_session(self, stream, multiplexed=False):
+        leftover = b''
+        requests = 0
+        while True:
+            try:
+                app_header, initial_data = self._read_request(
+                    stream, leftover)
+            except ExternalConnectionClosed:
+                if requests == 0:
+                    raise
+                logging.info(
+                    f"[PORT HANDLER] Session closed by the client after {requests} requests")
+                return
+            requests += 1
+            if app_header.transfer_type == SelectedTransferType.MULTIPLEX \
+                    and not multiplexed:
+                if stream.scheduled_flow is not None:
+                    stream.scheduled_flow.set_class(BULK)
+                self.serve_multiplexed(stream, app_header)
+                return
+            if not multiplexed and stream.scheduled_flow is not None:
+                stream.scheduled_flow.set_class(
+                    self._transfer_class(app_header))
+            leftover = self.handle_transference(
+                stream, app_header, initial_data)
 
-            app_header_bytes = initial_data[:ApplicationHeaderRDT.size()]
-            app_header = ApplicationHeaderRDT.from_bytes(app_header_bytes)
+    # Answers the request and from then on serves each stream opened by the
+    # client on its own thread, until the client closes the connection
+    def serve_multiplexed(self, stream, app_header: ApplicationHeaderRDT):
+        logging.info("[PORT HANDLER] Transference type: MULTIPLEX")
+        stream.send(app_header.as_bytes())
+        stream.flush()
+
+        connection = MultiplexedConnection(stream, accept_streams=True)
+        threads = []
+        try:
+            while True:
+                substream = connection.accept_stream()
+                thread = Thread(target=self._run_substream_session,
+                                args=(substream,))
+                threads.append(thread)
+                thread.start()
+        except ExternalConnectionClosed:
             logging.info(
-                f"[PORT HANDLER] Reading Applicaton Header: {app_header}")
+                f"[PORT HANDLER] Multiplexed connection closed by the client after {len(threads)} streams")
+        finally:
+            for thread in threads:
+                thread.join()
+            connection.close()
+
+    # The stream is closed once the client closes its side, so both ends
+    # release it
+    def _run_substream_session(self, substream):
+        try:
+            self._run_session(substream, multiplexed=True)
         except Exception as e:
             logging.error(
-                "[PORT HANDLER] Error starting connection: " + str(e))
-            return
+                f"[PORT HANDLER] Error handling transference on stream {substream.stream_id}: {e}")
+        try:
+            substream.close()
+        except Exception as e:
+            logging.debug(
+                f"[PORT HANDLER] Error closing stream {substream.stream_id}: {e}")
 
-        self.handle_transference(stream, app_header, initial_data)
+    # Returns the header of the next request, and the data received with it
+    # (header included)
+    def _read_request(self, stream, leftover):
+        reader = StreamReader(stream, leftover)
+        app_header_bytes = reader.read_exact(ApplicationHeaderRDT.size())
+        app_header = ApplicationHeaderRDT.from_bytes(app_header_bytes)
+        logging.info(
+            f"[PORT HANDLER] Reading Applicaton Header: {app_header}")
+        return app_header, app_header_bytes + reader.take_buffered()
 
+    # Returns the data received after the request, that belongs to the
+    # next one
     def handle_transference(self, stream, app_header: ApplicationHeaderRDT, initial_data: bytes):
         file_name = app_header.file_name
         transfer_type = app_header.transfer_type
         file_handler = None
+        leftover = b''
         try:
+            error = self._file_name_error(file_name)
+            if error is not None:
+                self._send_error(stream, error)
+                return leftover
             if transfer_type == SelectedTransferType.UPLOAD:
                 logging.info(
                     "[PORT HANDLER] Transference type: UPLOAD")
+                initial_data = self._accept_upload(
+                    stream, app_header, initial_data)
+                if initial_data is None:
+                    return leftover
+                if app_header.is_striped():
+                    return self.download_stripe(
+                        stream, app_header, initial_data)
                 logging.info("[PORT HANDLER] Opening file to download")
-                file_handler = FileHandler(
-                    DEFAULT_SV_STORAGE + file_name, file_name, "wb")
-                self.download(
+                if app_header.offset > 0:
+                    file_handler = self._open_file_to_resume(app_header)
+                else:
+                    file_handler = FileHandler(
+                        DEFAULT_SV_STORAGE + file_name, file_name, "wb")
+                leftover = self.download(
                     stream, file_handler, initial_data
                 )
             elif transfer_type == SelectedTransferType.DOWNLOAD:
@@ -91,40 +316,219 @@ class ServerRDT:
                     "[PORT HANDLER] Transference type: DOWNLOAD")
                 logging.info(
                     "[PORT HANDLER] Checking file existence")
-                self._check_if_file_exist(file_name, stream)
-
-                logging.info(
-                    "[PORT HANDLER] Checking file existence")
+                if not self._check_if_file_exist(file_name, stream):
+                    return leftover
+                error = self._download_error(app_header)
+                if error is not None:
+                    self._send_error(stream, error)
+                    return leftover
 
                 logging.info("[PORT HANDLER] Opening file to upload")
-                file_handler = FileHandler(
-                    DEFAULT_SV_STORAGE + file_name, file_name, "rb")
-                self.upload(stream, file_handler)
-        except Exception as e:
-            logging.error(
-                "[PORT HANDLER] Error handling transference: " + str(e))
+                file_handler = self._open_file_to_upload(file_name)
+                self.upload(stream, file_handler, app_header)
+                if self.file_cache:
+                    logging.info(f"[FILE CACHE] {self.file_cache}")
+            elif transfer_type == SelectedTransferType.DELTA_UPLOAD:
+                logging.info(
+                    "[PORT HANDLER] Transference type: DELTA UPLOAD")
+                initial_data = self._accept_upload(
+                    stream, app_header, initial_data)
+                if initial_data is None:
+                    return leftover
+                leftover = self.download_delta(
+                    stream, app_header, initial_data)
+            elif transfer_type == SelectedTransferType.STAT:
+                logging.info(
+                    "[PORT HANDLER] Transference type: STAT")
+                self._send_file_stat(file_name, stream)
+            else:
+                raise ValueError(
+                    f"[PORT HANDLER] Invalid transference type: {transfer_type}")
         finally:
             if (file_handler):
                 file_handler.close()
-            if (stream):
-                stream.close()
+            if transfer_type in self.WRITE_TRANSFER_TYPES:
+                self._invalidate_cache(file_name)
+        return leftover
 
-    def upload(self, stream, file_handler):
-        uploader = Uploader(stream, file_handler)
+    # Sends the range and with the compression asked in the download request
+    def upload(self, stream, file_handler, app_header: ApplicationHeaderRDT):
+        uploader = Uploader(
+            stream, file_handler,
+            app_header.offset, app_header.length or None,
+            compression=app_header.compression,
+            compression_level=app_header.compression_level)
         uploader.run()
 
     def download(self, stream, file_handler, start_of_user_data):
-        downloader = Downloader(stream, file_handler)
-        downloader.run(start_of_user_data)
+        downloader = Downloader(stream, file_handler, write_behind=True,
+                                fsync_policy=self.fsync_policy)
+        return downloader.run(start_of_user_data)
 
-    def _check_if_file_exist(self, file_name, stream):
-        if FileHandler.file_exists(DEFAULT_SV_STORAGE + file_name):
+    def download_stripe(self, stream, app_header: ApplicationHeaderRDT, start_of_user_data):
+        logging.info(
+            f"[PORT HANDLER] Receiving stripe offset={app_header.offset} length={app_header.length} of transfer {app_header.transfer_id}")
+        file_handler = self.striped_transfers.open_stripe(
+            DEFAULT_SV_STORAGE + app_header.file_name, app_header)
+        completed = False
+        try:
+            leftover = self.download(stream, file_handler, start_of_user_data)
+            completed = True
+        finally:
+            file_handler.close()
+            self.striped_transfers.close_stripe(app_header, completed)
+        return leftover
+
+    def download_delta(self, stream, app_header: ApplicationHeaderRDT, start_of_user_data):
+        delta_receiver = DeltaReceiver(
+            stream, DEFAULT_SV_STORAGE + app_header.file_name,
+            app_header.file_name)
+        return delta_receiver.run(start_of_user_data)
+
+    # Concurrent downloads of the same file share the blocks read from it
+    def _open_file_to_upload(self, file_name):
+        file_path = DEFAULT_SV_STORAGE + file_name
+        if self.file_cache:
+            file_handler = CachedFileHandler(
+                self.file_cache, file_path, file_name)
+        else:
+            file_handler = FileHandler(file_path, file_name, "rb")
+        return SharedFileHandler(self.shared_files, file_handler)
+
+    def _invalidate_cache(self, file_name):
+        if self.file_cache:
+            self.file_cache.invalidate(DEFAULT_SV_STORAGE + file_name)
+
+    def _file_exists(self, file_path):
+        if self.file_cache:
+            return self.file_cache.stat(file_path).exists
+        return FileHandler.file_exists(file_path)
+
+    def _file_size(self, file_path):
+        if self.file_cache:
+            return self.file_cache.stat(file_path).size
+        return FileHandler.file_size(file_path)
+
+    # An upload is checked before the file is touched. The client is
+    # answered with the header of the upload accepted, that may change the
+    # compression for one this server has, or with the reason why it can't
+    # upload. Returns the data received with the request, that starts with
+    # the accepted header, or None if it was rejected
+    def _accept_upload(self, stream, app_header: ApplicationHeaderRDT,
+                       initial_data: bytes):
+        error = self._upload_error(app_header)
+        if error is not None:
+            self._send_error(stream, error)
+            return None
+        accepted = self._accepted_header(app_header)
+        logging.info(f"[PORT HANDLER] Accepting upload: {accepted}")
+        stream.send(accepted.as_bytes())
+        self._prepare_to_write(app_header.file_name)
+        return accepted.as_bytes() + initial_data[ApplicationHeaderRDT.size():]
+
+    # Once an upload is accepted the cached copy of the file is dropped and
+    # its directory created
+    def _prepare_to_write(self, file_name):
+        self._invalidate_cache(file_name)
+        os.makedirs(os.path.dirname(DEFAULT_SV_STORAGE + file_name),
+                    exist_ok=True)
+
+    # Returns why the upload can't be done, or None
+    def _upload_error(self, app_header: ApplicationHeaderRDT):
+        if not is_valid_level(app_header.compression,
+                              app_header.compression_level):
+            return self.BAD_COMPRESSION_LEVEL
+        if app_header.offset > 0 and not app_header.is_striped() and \
+                not self._can_resume(app_header):
+            return self.NO_PARTIAL_FILE
+        if app_header.is_striped() and \
+                self.striped_transfers.has_failed(app_header.transfer_id):
+            return self.TRANSFER_FAILED
+        return None
+
+    # Returns why the download can't be done, or None
+    def _download_error(self, app_header: ApplicationHeaderRDT):
+        if not is_valid_level(app_header.compression,
+                              app_header.compression_level):
+            return self.BAD_COMPRESSION_LEVEL
+        if not self._range_in_file(app_header):
+            return self.RANGE_OUT_OF_FILE
+        return None
+
+    def _accepted_header(self, app_header: ApplicationHeaderRDT):
+        compression, compression_level = negotiate(
+            app_header.compression, app_header.compression_level)
+        return ApplicationHeaderRDT(
+            app_header.transfer_type, app_header.file_name,
+            app_header.file_size, app_header.offset, app_header.length,
+            app_header.transfer_id, compression, compression_level)
+
+    def _can_resume(self, app_header: ApplicationHeaderRDT):
+        file_path = DEFAULT_SV_STORAGE + app_header.file_name
+        return FileHandler.file_exists(file_path) and \
+            FileHandler.file_size(file_path) >= app_header.offset
+
+    # A resumed upload continues writing right after the partial copy
+    # kept from the previous attempt
+    def _open_file_to_resume(self, app_header: ApplicationHeaderRDT):
+        file_path = DEFAULT_SV_STORAGE + app_header.file_name
+        if not self._can_resume(app_header):
+            raise ValueError(
+                f"[PORT HANDLER] No partial file to resume from byte {app_header.offset}")
+
+        logging.info(
+            f"[PORT HANDLER] Resuming upload from byte {app_header.offset}")
+        file_handler = FileHandler(file_path, app_header.file_name, "r+b")
+        file_handler.truncate(app_header.offset)
+        file_handler.seek(app_header.offset)
+        return file_handler
+
+    def _send_file_stat(self, file_name, stream):
+        if not self._check_if_file_exist(file_name, stream):
             return
 
+        app_header = ApplicationHeaderRDT(
+            SelectedTransferType.STAT, file_name,
+            self._file_size(DEFAULT_SV_STORAGE + file_name), length=0)
+        logging.info(f"[PORT HANDLER] Sending file stat: {app_header}")
+        stream.send(app_header.as_bytes())
+
+    # If the file does not exist the client is told so, and the session
+    # goes on with its next request
+    def _check_if_file_exist(self, file_name, stream):
+        if self._file_exists(DEFAULT_SV_STORAGE + file_name):
+            return True
+
         app_header = ApplicationHeaderRDT(
             SelectedTransferType.DOWNLOAD, self.NO_SUCH_FILE, 0)
         stream.send(app_header.as_bytes())
 
         logging.error(
             f"[SERVER UPLOAD] Sending App Header, file does not exist: {app_header}")
-        raise ValueError("[SERVER UPLOAD] File doesn't exists")
+        return False
+
+    # A length of 0 asks for the rest of the file
+    def _range_in_file(self, app_header: ApplicationHeaderRDT):
+        file_size = self._file_size(DEFAULT_SV_STORAGE + app_header.file_name)
+        try:
+            range_length(file_size, app_header.offset,
+                         app_header.length or None)
+        except ValueError:
+            return False
+        return True
+
+    # The client is told why its request was rejected, and the session
+    # goes on with its next request
+    def _send_error(self, stream, message):
+        app_header = ApplicationHeaderRDT.error(message)
+        stream.send(app_header.as_bytes())
+        logging.error(
+            f"[PORT HANDLER] Request rejected, sending App Header: {app_header}")
+
+    # File names may include directories, but never point out of the
+    # storage. Returns why the file name can't be used, or None
+    def _file_name_error(self, file_name):
+        parts = file_name.replace("\\", "/").split("/")
+        if not file_name or os.path.isabs(file_name) or ".." in parts:
+            return self.INVALID_FILE_NAME
+        return None
@@ -0,0 +1,58 @@
+import asyncio
+import logging
+from lib.segment_encoding.application_header import ApplicationHeaderRDT
+from lib.segment_encoding.header_rdt import HeaderRDT
+from lib.sockets_rdt.listener_rdt import ListenerRDT
+
+
+# Reads the port of a ListenerRDT on the event loop instead of blocking on
+# listen(), and hands the AccepterRDT of each new connection to on_accept.
+# Unlike a datagram endpoint, that reads a datagram per turn of the loop,
+# each wakeup drains up to MAX_DATAGRAMS_PER_WAKEUP, so the SYNs don't
+# queue up behind the segments of the open connections until the socket
+# drops them
+class AsyncListenerRDT:
+
+    MAX_DATAGRAMS_PER_WAKEUP = 64
+
+    def __repr__(self):
+        return f"AsyncListenerRDT({self.listener})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    # The listener_args are those of ListenerRDT
+    def __init__(self, host, port, protocol, on_accept, **listener_args):
+        self.loop = asyncio.get_running_loop()
+        self.on_accept = on_accept
+        self.listener = ListenerRDT(host, port, protocol, **listener_args)
+        self.listener.socket.setblocking(False)
+        self.loop.add_reader(self.listener.socket, self._read_ready)
+        logging.info("[LISTENER] Listening for incoming connections")
+
+    def close(self):
+        self.loop.remove_reader(self.listener.socket)
+        self.listener.socket.close()
+
+    # ======================== FOR PRIVATE USE ========================
+
+    def _read_ready(self):
+        for _ in range(self.MAX_DATAGRAMS_PER_WAKEUP):
+            try:
+                data, external_address = self.listener.socket.recvfrom(
+                    HeaderRDT.size() + ApplicationHeaderRDT.size())
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logging.debug(f"[LISTENER] Error received: {e}")
+                continue
+            try:
+                accepter = self.listener.admit(data, external_address)
+            except Exception as e:
+                logging.error("Invalid segment received: {}".format(e))
+                continue
+            if accepter is not None:
+                logging.info(
+                    "[HANDSHAKE] Conection attempt from {}".format(
+                        external_address))
+                self.on_accept(accepter)
@@ -0,0 +1,457 @@
+import asyncio
+import logging
+import socket
+import time
+from lib.protocols.selective_repeat import SelectiveRepeat
+from lib.protocols.utils.backoff import Backoff
+from lib.protocols.utils.buffer_sorter import BufferSorter
+from lib.protocols.utils.sliding_window import SlidingWindow
+from lib.segment_encoding.header_rdt import HeaderRDT
+from lib.segment_encoding.segment_rdt import SegmentRDT
+from lib.sockets_rdt.stream_rdt import StreamRDT
+from lib.sockets_rdt.stream_stats import StreamStats
+from lib.utils.constant import (DEFAULT_INITIATOR_SOCKET_READ_CLOSE_TIMEOUT,
+                                DEFAULT_INITIATOR_SOCKET_READ_HANDSAKE_TIMEOUT,
+                                DEFAULT_LISTENER_SOCKET_READ_HANDSAKE_TIMEOUT,
+                                DEFAULT_SOCKET_READ_TIMEOUT, SelectedProtocol)
+from lib.utils.exceptions import ExternalConnectionClosed, PeerTimeoutError
+
+
+# asyncio version of a StreamRDT, that connects to a server or is accepted
+# by one. It speaks the same wire protocol, but its timers run on the event
+# loop instead of blocking on socket timeouts, so a single thread can keep
+# thousands of connections going. A read gives the peer up once it is
+# silent for the peer_timeout() of a StreamRDT, and the idle streams are
+# kept alive with send_keepalive() as those of a ConnectionPool
+class AsyncStreamRDT(asyncio.DatagramProtocol):
+
+    SELECTIVE_REPEAT_WINDOW_SIZE = 5
+    RETRANSMISSION_TIMEOUT = DEFAULT_SOCKET_READ_TIMEOUT
+
+    def __repr__(self):
+        return f"AsyncStreamRDT(external_address={self.external_address}, window={self.window})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __init__(self, selected_protocol, initiator=True):
+        self.selected_protocol = selected_protocol
+        self.initiator = initiator
+        window_size = self.SELECTIVE_REPEAT_WINDOW_SIZE \
+            if selected_protocol == SelectedProtocol.SELECTIVE_REPEAT else 1
+        self.loop = asyncio.get_running_loop()
+        self.transport = None
+        self.external_address = None
+
+        self.seq_num = StreamRDT.START_CONNECT_SEQ if initiator \
+            else StreamRDT.START_LISTENER_SEQ
+        self.ack_num = StreamRDT.START_ACK
+        self.window = SlidingWindow(window_size, self.seq_num)
+        self.buffer_sorter = None
+        self.stats = StreamStats()
+
+        self.listener_address = None
+        self.handshake_reply = None
+        # Seconds a busy listener asked to wait, until they are waited
+        self.retry_after = None
+        self.close_reply = None
+        self.closing = False
+        self.peer_closed = False
+        self.error = None
+        self.waiters = []
+        self.retransmission_timer = None
+        self.timeouts = 0
+        # Send time of the segments sent once, for the RTT samples
+        self.send_times = {}
+        self.smoothed_rtt = None
+        self.last_received = time.monotonic()
+
+    # The counters go to stats when given, so they are kept even if the
+    # handshake fails
+    @classmethod
+    async def connect(cls, protocol, external_host, external_port,
+                      stats: StreamStats = None):
+        loop = asyncio.get_running_loop()
+        address_info = await loop.getaddrinfo(
+            external_host, external_port,
+            family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        listener_address = address_info[0][4]
+
+        _, stream = await loop.create_datagram_endpoint(
+            lambda: cls(protocol), local_addr=('0.0.0.0', 0))
+        if stats is not None:
+            stream.stats = stats
+        try:
+            await stream._run_handshake_as_initiator(listener_address)
+        except BaseException:
+            stream._close_transport()
+            raise
+        return stream
+
+    # Takes the connection of the first SYN of a client, from a new socket
+    # as StreamRDT.from_listener does
+    @classmethod
+    async def accept(cls, protocol, external_address,
+                     first_segment: SegmentRDT):
+        loop = asyncio.get_running_loop()
+        _, stream = await loop.create_datagram_endpoint(
+            lambda: cls(protocol, initiator=False), local_addr=('0.0.0.0', 0))
+        try:
+            await stream._run_handshake_as_listener(
+                external_address, first_segment.header.seq_num)
+        except BaseException:
+            stream._close_transport()
+            raise
+        return stream
+
+    # ======================== FOR PUBLIC USE ========================
+
+    # Queues the data and returns as soon as it fits in the send buffer
+    async def send(self, data: bytes):
+        mss = SegmentRDT.get_max_segment_size()
+        data = memoryview(data)
+        data_segments = [data[i:i+mss] for i in range(0, len(data), mss)]
+
+        position = 0
+        while position < len(data_segments):
+            self._raise_if_failed()
+            free_space = SelectiveRepeat.SEND_BUFFER_SIZE - \
+                self.window.pending_segments()
+            if free_space <= 0:
+                await self._wait()
+                continue
+            self.window.add_data(
+                data_segments[position:position + free_space])
+            position += free_space
+            self._send_available_segments()
+
+    # Waits until every segment handed to send() has been acked
+    async def flush(self):
+        while not self.window.finished():
+            self._raise_if_failed()
+            await self._wait()
+
+    # Raises PeerTimeoutError once the peer is silent for longer than
+    # peer_timeout()
+    async def read(self) -> bytes:
+        while True:
+            ack_num, data = self.buffer_sorter.pop_available_data()
+            if data:
+                self.ack_num = ack_num
+                return data
+            self._raise_if_failed()
+            if self.peer_closed:
+                raise ExternalConnectionClosed(
+                    "[ASYNC STREAM] Connection closed by external host")
+            if self.is_peer_dead():
+                # close() no longer waits for the peer
+                self._fail(PeerTimeoutError(
+                    f"[ASYNC STREAM] {self.external_address} taken for dead after {self.peer_timeout():.3f} s of silence"))
+                self._raise_if_failed()
+            await self._wait(self.peer_timeout())
+
+    # An empty segment acking again the last one received in order, that
+    # only tells the other end this one is still there
+    def send_keepalive(self):
+        self._send_segment(
+            b'', self.seq_num,
+            self.buffer_sorter.get_current_ack_num() - 1, False, False)
+
+    # Seconds the peer may go silent before it is taken for dead, as in a
+    # StreamRDT
+    def peer_timeout(self):
+        return StreamRDT.peer_timeout_for(self.window.finished(),
+                                          self.smoothed_rtt)
+
+    def is_peer_dead(self):
+        return time.monotonic() - self.last_received > self.peer_timeout()
+
+    async def close(self):
+        if self.transport is None or self.transport.is_closing():
+            return
+        try:
+            if not self.peer_closed and self.error is None:
+                await self.flush()
+                start = time.monotonic()
+                await self._run_close_as_initiator()
+                self.stats.add_close_time(time.monotonic() - start)
+        except Exception as e:
+            logging.debug(
+                f"[ASYNC STREAM] Error while closing connection: {e}")
+        finally:
+            self._close_transport()
+
+    # ===================== asyncio.DatagramProtocol =====================
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        try:
+            segment = SegmentRDT.from_bytes(data)
+        except ValueError:
+            return
+        header = segment.header
+        self.stats.segments_received += 1
+        if header.data_size:
+            self.stats.data_segments_received += 1
+            self.stats.bytes_received += header.data_size
+
+        if self.external_address is None:
+            self._process_handshake_reply(segment, address)
+            return
+        if address != self.external_address:
+            return
+        self.last_received = time.monotonic()
+        if not self.initiator:
+            # The last message of the handshake, or any other segment the
+            # initiator sends once connected
+            self._complete_handshake()
+            if header.syn:
+                return
+        elif header.syn:
+            # The other end did not get the last message of the handshake
+            self._send_handshake()
+            return
+
+        self.stats.mark_first_segment()
+        if header.fin:
+            self._process_close(header)
+            return
+        self._process_segment(segment)
+
+    def error_received(self, exc):
+        logging.debug(f"[ASYNC STREAM] Error received: {exc}")
+
+    # ======================== FOR PRIVATE USE ========================
+
+    async def _run_handshake_as_initiator(self, listener_address):
+        start = time.monotonic()
+        self.listener_address = listener_address
+        backoff = Backoff(DEFAULT_INITIATOR_SOCKET_READ_HANDSAKE_TIMEOUT,
+                          StreamRDT.INITIATOR_HANDSHAKE_BACKOFF_CAP,
+                          StreamRDT.rng)
+        timeout = backoff.next()
+        for _ in range(StreamRDT.MAX_INITIATOR_HANDSHAKE_TIMEOUT_RETRIES):
+            self.handshake_reply = self.loop.create_future()
+            self._send_segment(b'', self.seq_num, self.ack_num, True, False,
+                               listener_address)
+            self.stats.connection_attempts += 1
+            try:
+                connected = await asyncio.wait_for(
+                    self.handshake_reply, timeout)
+            except asyncio.TimeoutError:
+                timeout = backoff.next()
+                continue
+            if self.retry_after is not None:
+                self.stats.busy_answers += 1
+                await asyncio.sleep(self.retry_after + backoff.next())
+                self.retry_after = None
+                continue
+            if not connected:
+                continue
+            self._send_handshake()
+            self.stats.connections = 1
+            self.stats.add_handshake_time(time.monotonic() - start)
+            return
+
+        raise TimeoutError(
+            "[HANDSHAKE] Connection not established after {} retries".format(
+                StreamRDT.MAX_INITIATOR_HANDSHAKE_TIMEOUT_RETRIES))
+
+    def _process_handshake_reply(self, segment: SegmentRDT, address):
+        header = segment.header
+        if not header.syn or header.ack_num != self.seq_num or \
+                self.handshake_reply is None or self.handshake_reply.done():
+            return
+        if header.stream_id == HeaderRDT.LISTENER_ANSWER_STREAM:
+            if segment.data:
+                # The listener is busy
+                try:
+                    self.retry_after = StreamRDT.decode_retry_after(
+                        segment.data)
+                except ValueError:
+                    return
+            else:
+                # A cookie of the listener, to send back on the next SYN
+                self.ack_num = header.seq_num
+            self.handshake_reply.set_result(False)
+            return
+        self.external_address = address
+        self.ack_num = header.seq_num
+        self.buffer_sorter = BufferSorter(self.ack_num)
+        self.handshake_reply.set_result(True)
+
+    async def _run_handshake_as_listener(self, external_address,
+                                         client_seq_num):
+        start = time.monotonic()
+        self.external_address = external_address
+        self.ack_num = client_seq_num
+        self.buffer_sorter = BufferSorter(self.ack_num)
+        backoff = Backoff(DEFAULT_LISTENER_SOCKET_READ_HANDSAKE_TIMEOUT,
+                          StreamRDT.LISTENER_HANDSHAKE_BACKOFF_CAP,
+                          StreamRDT.rng)
+        timeout = backoff.next()
+        self.handshake_reply = self.loop.create_future()
+        for _ in range(StreamRDT.MAX_LISTENER_HANDSHAKE_TIMEOUT_RETRIES):
+            self._send_handshake()
+            try:
+                await asyncio.wait_for(
+                    asyncio.shield(self.handshake_reply), timeout)
+            except asyncio.TimeoutError:
+                timeout = backoff.next()
+                continue
+            self.stats.connections = 1
+            self.stats.add_handshake_time(time.monotonic() - start)
+            return
+
+        raise TimeoutError(
+            "[HANDSHAKE] Connection not established after {} retries".format(
+                StreamRDT.MAX_LISTENER_HANDSHAKE_TIMEOUT_RETRIES))
+
+    def _complete_handshake(self):
+        if self.handshake_reply is not None and \
+                not self.handshake_reply.done():
+            self.handshake_reply.set_result(True)
+
+    async def _run_close_as_initiator(self):
+        self.closing = True
+        for _ in range(StreamRDT.MAX_INITIATOR_CLOSE_RETRIES):
+            self.close_reply = self.loop.create_future()
+            self._send_close()
+            try:
+                await asyncio.wait_for(
+                    self.close_reply, DEFAULT_INITIATOR_SOCKET_READ_CLOSE_TIMEOUT)
+            except asyncio.TimeoutError:
+                continue
+            self._send_close()
+            return
+
+        raise TimeoutError(
+            "[CLOSE] Connection exhausted {} retries".format(
+                StreamRDT.MAX_INITIATOR_CLOSE_RETRIES))
+
+    # Every FIN of a closing peer is answered, as StreamRDT does while it
+    # waits for the last one
+    def _process_close(self, header: HeaderRDT):
+        if self.closing:
+            if self.close_reply is not None and not self.close_reply.done():
+                self.close_reply.set_result(None)
+            return
+        self.peer_closed = True
+        self._send_close()
+        self._notify()
+
+    def _process_segment(self, segment: SegmentRDT):
+        header = segment.header
+        if header.data_size == 0:
+            sent_at = self.send_times.pop(header.ack_num, None)
+            if sent_at is not None:
+                self._add_rtt_sample(time.monotonic() - sent_at)
+        first_unacked = self.window.get_current_seq_num()
+        self.window.set_ack(header.ack_num)
+        self.seq_num = self.window.get_current_seq_num()
+
+        if header.data_size > 0:
+            self._send_segment(b'', self.seq_num, header.seq_num, False, False)
+            if not self.buffer_sorter.add_segment(header.seq_num, segment.data):
+                self.stats.duplicate_segments_received += 1
+            self.stats.reorder_buffer_depth.observe(
+                len(self.buffer_sorter.buffer))
+
+        if self.window.get_current_seq_num() != first_unacked:
+            self.timeouts = 0
+            self._stop_retransmission_timer()
+        self._send_available_segments()
+        self._notify()
+
+    def _add_rtt_sample(self, rtt):
+        self.stats.rtt.observe(rtt)
+        if self.smoothed_rtt is None:
+            self.smoothed_rtt = rtt
+        else:
+            self.smoothed_rtt += SelectiveRepeat.RTT_SAMPLE_WEIGHT * \
+                (rtt - self.smoothed_rtt)
+
+    def _send_available_segments(self):
+        window = self.window
+        while window.has_available_segments_to_send():
+            seq_num, data = window.get_first_available_segment()
+            if window.is_retransmission(seq_num):
+                self.stats.retransmitted_segments += 1
+                self.send_times.pop(seq_num, None)
+            else:
+                self.send_times[seq_num] = time.monotonic()
+            self.stats.window_occupancy.observe(
+                seq_num - window.get_current_seq_num() + 1)
+            self._send_segment(data, seq_num, self.ack_num, False, False)
+            window.set_sent(seq_num, True)
+        if self.retransmission_timer is None and \
+                window.in_flight_segments() > 0:
+            self.retransmission_timer = self.loop.call_later(
+                self.RETRANSMISSION_TIMEOUT, self._retransmit)
+
+    def _retransmit(self):
+        self.retransmission_timer = None
+        self.timeouts += 1
+        self.stats.retransmission_timeouts += 1
+        if self.timeouts >= SelectiveRepeat.MAX_TIMEOUT_RETRIES:
+            self._fail(TimeoutError(
+                "[PROTOCOL] Multiple timeouts while tryng to send data and receive corresponding acks"))
+            return
+        self.window.reset_sent_segments()
+        self._send_available_segments()
+
+    def _stop_retransmission_timer(self):
+        if self.retransmission_timer is not None:
+            self.retransmission_timer.cancel()
+            self.retransmission_timer = None
+
+    def _send_handshake(self):
+        self._send_segment(b'', self.seq_num, self.ack_num, True, False)
+
+    def _send_close(self):
+        self._send_segment(b'', self.seq_num, self.ack_num, False, True)
+
+    def _send_segment(self, data, seq_num, ack_num, syn, fin, address=None):
+        if self.transport is None or self.transport.is_closing():
+            return
+        header = HeaderRDT(self.selected_protocol, len(data),
+                           seq_num, ack_num, syn, fin)
+        self.transport.sendto(SegmentRDT(header, data).as_bytes(),
+                              address or self.external_address)
+        self.stats.segments_sent += 1
+        if data:
+            self.stats.data_segments_sent += 1
+            self.stats.bytes_sent += len(data)
+
+    # Returns False if nothing happened in timeout seconds
+    async def _wait(self, timeout=None):
+        waiter = self.loop.create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _notify(self):
+        waiters, self.waiters = self.waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _fail(self, error):
+        if self.error is None:
+            self.error = error
+        self._notify()
+
+    def _raise_if_failed(self):
+        if self.error is not None:
+            raise self.error
+
+    def _close_transport(self):
+        self._stop_retransmission_timer()
+        if self.transport is not None:
+            self.transport.close()
+        self._fail(ExternalConnectionClosed("[ASYNC STREAM] Connection closed"))
@@ -0,0 +1,135 @@
+import logging
+import time
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+from lib.sockets_rdt.stream_rdt import StreamRDT
+from lib.sockets_rdt.stream_stats import StreamStats
+from lib.utils.constant import DEFAULT_KEEPALIVE_INTERVAL
+
+
+# Keeps the connections to a server open between requests, so a sequence
+# of transferences pays for a single handshake and close. The server ends
+# a session it hears nothing from in a while, so a thread sends a
+# keepalive on the connections that sent nothing for keepalive_interval:
+# the idle ones, and those in use while their thread is busy elsewhere.
+# Connections idle for longer than MAX_IDLE_TIME are closed instead of
+# reused. The stats of the connections are added up in stats as they are
+# closed
+class ConnectionPool:
+
+    MAX_IDLE_CONNECTIONS = 8
+    MAX_IDLE_TIME = 30  # seconds
+
+    def __init__(self, protocol, external_host, external_port,
+                 max_idle_connections=MAX_IDLE_CONNECTIONS,
+                 keepalive_interval=DEFAULT_KEEPALIVE_INTERVAL):
+        self.protocol = protocol
+        self.external_host = external_host
+        self.external_port = external_port
+        self.max_idle_connections = max_idle_connections
+        self.keepalive_interval = keepalive_interval
+        self.lock = Lock()
+        self.idle = []  # (stream, time it was released)
+        self.in_use = set()
+        self.connections = 0
+        self.stats = StreamStats()
+        self.closed = Event()
+        self.keepalive_thread = None
+
+    # Yields an open stream. It goes back to the pool if the block ends
+    # normally or raises one of the keep_on errors, which must leave the
+    # session in a known state. Any other error closes it
+    @contextmanager
+    def connection(self, keep_on=()):
+        stream = self.acquire()
+        try:
+            yield stream
+        except keep_on:
+            self.release(stream)
+            raise
+        except BaseException:
+            self.discard(stream)
+            raise
+        self.release(stream)
+
+    def acquire(self) -> StreamRDT:
+        stream = None
+        expired = []
+        with self.lock:
+            while self.idle and stream is None:
+                idle_stream, released_at = self.idle.pop()
+                if time.monotonic() - released_at <= self.MAX_IDLE_TIME:
+                    stream = idle_stream
+                else:
+                    expired.append(idle_stream)
+        for expired_stream in expired:
+            self._close(expired_stream)
+        if stream:
+            logging.debug(
+                f"[CONNECTION POOL] Reusing connection from port {stream.port}")
+            with self.lock:
+                self.in_use.add(stream)
+            return stream
+
+        logging.info("[CONNECTION POOL] Connecting to server")
+        stream = StreamRDT.connect(
+            self.protocol, self.external_host, self.external_port,
+        )
+        with self.lock:
+            self.connections += 1
+            self.in_use.add(stream)
+            if self.keepalive_thread is None and not self.closed.is_set():
+                self.keepalive_thread = Thread(
+                    target=self._send_keepalives, daemon=True)
+                self.keepalive_thread.start()
+        return stream
+
+    def release(self, stream: StreamRDT):
+        with self.lock:
+            self.in_use.discard(stream)
+            if len(self.idle) < self.max_idle_connections:
+                self.idle.append((stream, time.monotonic()))
+                return
+        self._close(stream)
+
+    def discard(self, stream: StreamRDT):
+        with self.lock:
+            self.in_use.discard(stream)
+        self._close(stream)
+
+    def close(self):
+        self.closed.set()
+        with self.lock:
+            idle, self.idle = self.idle, []
+            keepalive_thread = self.keepalive_thread
+        if keepalive_thread is not None:
+            keepalive_thread.join()
+        for stream, _ in idle:
+            self._close(stream)
+        logging.info(
+            f"[CONNECTION POOL] Closed, {self.connections} connections were opened")
+
+    # Checks twice per interval, so no connection stays silent for much
+    # longer than keepalive_interval. A keepalive only writes to the
+    # socket, so it doesn't get in the way of the thread using the stream
+    def _send_keepalives(self):
+        while not self.closed.wait(self.keepalive_interval / 2):
+            with self.lock:
+                streams = [stream for stream, _ in self.idle]
+                streams.extend(self.in_use)
+                for stream in streams:
+                    if not stream.needs_keepalive(self.keepalive_interval):
+                        continue
+                    try:
+                        stream.send_keepalive()
+                    except OSError as e:
+                        logging.debug(
+                            f"[CONNECTION POOL] Error sending keepalive: {e}")
+
+    def _close(self, stream: StreamRDT):
+        try:
+            stream.close()
+        except Exception as e:
+            logging.debug(f"[CONNECTION POOL] Error closing connection: {e}")
+        with self.lock:
+            self.stats.add(stream.stats)
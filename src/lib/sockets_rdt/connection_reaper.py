@@ -0,0 +1,73 @@
+import logging
+from threading import Event, Lock, Thread
+from lib.utils.constant import DEFAULT_KEEPALIVE_INTERVAL
+
+
+# Watches the streams of a server from a single thread. Those that sent
+# nothing for keepalive_interval send a keepalive, so their peer knows
+# this end is there while the thread using them is busy. Those whose peer
+# went silent for longer than its peer_timeout() are reaped, unless the
+# peer spoke while their thread was busy and did not read: its segments
+# are waiting in the socket. The thread using a reaped stream fails on its
+# next read, at most a read timeout later, instead of going through its
+# retries, and closes it without waiting for the peer
+class ConnectionReaper:
+
+    INTERVAL = 0.1  # seconds
+
+    def __repr__(self):
+        return f"ConnectionReaper(streams={len(self.streams)}, reaped={self.reaped})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __init__(self, interval=INTERVAL,
+                 keepalive_interval=DEFAULT_KEEPALIVE_INTERVAL):
+        self.interval = interval
+        self.keepalive_interval = keepalive_interval
+        self.lock = Lock()
+        self.streams = {}  # id(stream) -> (stream, name)
+        self.reaped = 0
+        self.stopping = Event()
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def add(self, stream, name):
+        with self.lock:
+            self.streams[id(stream)] = (stream, name)
+
+    def remove(self, stream):
+        with self.lock:
+            self.streams.pop(id(stream), None)
+
+    def close(self):
+        self.stopping.set()
+        self.thread.join()
+
+    # ======================== FOR PRIVATE USE ========================
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            with self.lock:
+                streams = list(self.streams.values())
+            for stream, name in streams:
+                if stream.reaped:
+                    continue
+                if stream.needs_keepalive(self.keepalive_interval):
+                    self._send_keepalive(stream, name)
+                if not stream.is_peer_dead() or \
+                        stream.collect_pending_segments():
+                    continue
+                stream.reap()
+                stream.stats.reaped_connections += 1
+                with self.lock:
+                    self.reaped += 1
+                logging.warning(
+                    f"[REAPER] Connection with {name} reaped after {stream.clock() - stream.last_received:.3f} s of silence")
+
+    def _send_keepalive(self, stream, name):
+        try:
+            stream.send_keepalive()
+        except OSError as e:
+            logging.debug(
+                f"[REAPER] Error sending keepalive to {name}: {e}")
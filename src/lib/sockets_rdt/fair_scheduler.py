@@ -0,0 +1,114 @@
+import time
+from threading import Condition
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+
+# Weighted fair queuing of the segments sent by the connections of a
+# server. Each connection is a flow with the weight of its class, and each
+# segment it sends moves its finish tag forward by its size over the
+# weight, so the tags of the flows with more weight advance slower. A flow
+# more than QUANTUM ahead of the tag of the flow furthest behind waits
+# until that one catches up or goes idle. Flows of the same share rarely
+# wait, but a thread-per-connection server is bound by the GIL: while a
+# small transference lags behind a few big ones, these wait here and leave
+# it the CPU, instead of each one getting the same slices of it
+class FairScheduler:
+
+    # In bytes over weight. Around a dozen segments: with bigger ones small
+    # transferences end before the rest wait for them, with smaller ones
+    # the flows of the same share keep waking each other up
+    QUANTUM = 16 * 1024
+    # A flow that sent nothing in this long no longer holds the rest back
+    IDLE_TIME = 0.05  # seconds
+
+    def __repr__(self):
+        return f"FairScheduler(weights={self.weights}, flows={len(self.flows)}, waiting={len(self.waiting_tags)})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    # weights maps each transfer class to its weight
+    def __init__(self, weights):
+        if any(weight <= 0 for weight in weights.values()):
+            raise ValueError("The weights of the scheduler must be positive")
+        self.weights = dict(weights)
+        self.condition = Condition()
+        self.flows = set()
+        # Start tags of the segments waiting for their turn
+        self.waiting_tags = []
+
+    # stats is the StreamStats where the time waiting for turns is counted
+    def flow(self, transfer_class, stats=None) -> 'ScheduledFlow':
+        return ScheduledFlow(self, transfer_class, stats)
+
+    # ======================== FOR PRIVATE USE ========================
+
+    def _wait_turn(self, flow: 'ScheduledFlow', size):
+        with self.condition:
+            now = time.monotonic()
+            flow.last_active = now
+            self.flows.add(flow)
+            # A flow back from being idle starts level with the others
+            behind = self._furthest_behind(now, flow)
+            start_tag = flow.finish_tag if behind is None \
+                else max(flow.finish_tag, behind)
+            if behind is not None and start_tag > behind + self.QUANTUM:
+                self.waiting_tags.append(start_tag)
+                while behind is not None and \
+                        start_tag > behind + self.QUANTUM:
+                    self.condition.wait(self.IDLE_TIME)
+                    flow.last_active = time.monotonic()
+                    behind = self._furthest_behind(flow.last_active, flow)
+                self.waiting_tags.remove(start_tag)
+                if flow.stats is not None:
+                    flow.stats.scheduler_wait_time += \
+                        flow.last_active - now
+            flow.finish_tag = start_tag + size / flow.weight
+
+            if self.waiting_tags:
+                behind = self._furthest_behind(flow.last_active)
+                if behind is not None and \
+                        min(self.waiting_tags) <= behind + self.QUANTUM:
+                    self.condition.notify_all()
+
+    # The lowest finish tag of the flows other than flow that sent in the
+    # last IDLE_TIME, None if there is none. The idle flows are dropped
+    def _furthest_behind(self, now, flow=None):
+        behind = None
+        for other in list(self.flows):
+            if now - other.last_active > self.IDLE_TIME:
+                self.flows.discard(other)
+            elif other is not flow and \
+                    (behind is None or other.finish_tag < behind):
+                behind = other.finish_tag
+        return behind
+
+
+# The share of a FairScheduler of a connection. Its class may change with
+# each request of the connection
+class ScheduledFlow:
+
+    def __repr__(self):
+        return f"ScheduledFlow(transfer_class={self.transfer_class}, weight={self.weight}, finish_tag={self.finish_tag})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __init__(self, scheduler: FairScheduler, transfer_class, stats):
+        self.scheduler = scheduler
+        self.stats = stats
+        self.finish_tag = 0
+        self.last_active = 0
+        self.set_class(transfer_class)
+
+    def set_class(self, transfer_class):
+        if transfer_class not in self.scheduler.weights:
+            raise ValueError(f"Unknown transfer class: {transfer_class}")
+        self.transfer_class = transfer_class
+        self.weight = self.scheduler.weights[transfer_class]
+
+    # Blocks until this flow may send size bytes
+    def wait_turn(self, size):
+        self.scheduler._wait_turn(self, size)
@@ -1,43 +1,91 @@
+import hashlib
+import hmac
 import logging
+import os
 import socket
-from lib.utils.constant import SelectedProtocol
+from threading import Lock
+from lib.utils.constant import DEFAULT_SV_RETRY_AFTER, SelectedProtocol
 from lib.segment_encoding.application_header import ApplicationHeaderRDT
 
 from lib.segment_encoding.header_rdt import HeaderRDT
 from lib.segment_encoding.segment_rdt import SegmentRDT
+from lib.sockets_rdt.segment_trace import RECEIVED, SENT
 from lib.sockets_rdt.stream_rdt import StreamRDT
 
-
+SYN_COOKIES_AUTO = "auto"
+SYN_COOKIES_ALWAYS = "always"
+SYN_COOKIES_NEVER = "never"
+
+
+# Every connection is kept in a table by the address and initial seq num
+# of its client, from its first SYN until the server releases it, so the
+# SYNs a client retransmits during the handshake don't start others.
+# With syn_cookies "auto" and more than MAX_PENDING_HANDSHAKES handshakes
+# going on, or always with "always", a new SYN leaves no state: the
+# listener answers from its own socket with a cookie, as the
+# HelloVerifyRequest of DTLS, and the connection, with its thread and
+# socket, is only taken once the client sends the cookie back. With
+# max_connections in the table, a new SYN is answered with the time to
+# retry after, that the client waits before its next SYN
 class ListenerRDT():
 
-    def __init__(self, host, port, protocol=SelectedProtocol.STOP_AND_WAIT):
+    SYN_COOKIES_MODES = (SYN_COOKIES_AUTO, SYN_COOKIES_ALWAYS,
+                         SYN_COOKIES_NEVER)
+    MAX_PENDING_HANDSHAKES = 16
+    # A cookie is valid until the end of the next period
+    COOKIE_PERIOD = 2  # seconds
+    COOKIE_SECRET_SIZE = 16
+
+    def __repr__(self):
+        return f"ListenerRDT(port={self.port}, connections={len(self.connections)}, pending_handshakes={self.pending_handshakes}, duplicate_syns={self.duplicate_syns}, cookies_sent={self.cookies_sent}, busy_answers={self.busy_answers})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    # max_connections is 0 for no limit
+    def __init__(self, host, port, protocol=SelectedProtocol.STOP_AND_WAIT,
+                 syn_cookies=SYN_COOKIES_AUTO, max_connections=0,
+                 retry_after=DEFAULT_SV_RETRY_AFTER):
+        if syn_cookies not in self.SYN_COOKIES_MODES:
+            raise ValueError(f"[LISTENER] Invalid SYN cookies mode: {syn_cookies}")
 
         self.host = host
         self.port = port
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket = StreamRDT.socket_factory(
+            socket.AF_INET, socket.SOCK_DGRAM)
         self.socket.bind(('', self.port))
         self.socket.settimeout(None)  # Desired for the listener
         self.protocol = protocol
 
+        self.syn_cookies = syn_cookies
+        self.max_connections = max_connections
+        self.retry_after = retry_after
+        self.cookie_secret = os.urandom(self.COOKIE_SECRET_SIZE)
+        self.lock = Lock()
+        # (client host, client port, client initial seq num) -> AccepterRDT
+        self.connections = {}
+        self.pending_handshakes = 0
+        self.duplicate_syns = 0
+        self.cookies_sent = 0
+        self.busy_answers = 0
+
     def _check_first_header(self, header: HeaderRDT):
         if header.data_size != 0:
             raise Exception("Invalid data size")
-        if header.ack_num != StreamRDT.START_ACK:
-            raise Exception("Invalid ack number")
         if not header.syn:
             raise Exception("Invalid syn number")
         if header.fin:
             raise Exception("Invalid fin")
 
     def listen(self):
+        logging.info("[LISTENER] Listening for incoming connections")
         while True:
-            logging.info("[LISTENER] Listening for incoming connections")
             try:
                 data, external_address = self.socket.recvfrom(
                     HeaderRDT.size() + ApplicationHeaderRDT.size())
-                segment = SegmentRDT.from_bytes(data)
-                self._check_first_header(segment.header)
-                break
+                accepter = self.admit(data, external_address)
+                if accepter is not None:
+                    break
             except KeyboardInterrupt:
                 raise KeyboardInterrupt
             except socket.timeout:
@@ -50,12 +98,116 @@ class ListenerRDT():
             "[HANDSHAKE] Conection attempt from {}".format(external_address))
         logging.debug("[HANDSHAKE] LISTENER 1 (read)")
 
-        return AccepterRDT(self, segment, external_address)
+        return accepter
+
+    # Takes a datagram received on the port of the listener. Returns the
+    # AccepterRDT of a new connection, None if the SYN belongs to one
+    # already taken or was answered with a cookie or a retry after
+    def admit(self, data, external_address):
+        if StreamRDT.tracer is not None:
+            StreamRDT.tracer.record(
+                RECEIVED, data, (self.host, self.port), external_address, {})
+        segment = SegmentRDT.from_bytes(data)
+        self._check_first_header(segment.header)
+        header = segment.header
+        key = (external_address[0], external_address[1], header.seq_num)
+        with self.lock:
+            if key in self.connections:
+                self.duplicate_syns += 1
+                logging.debug(
+                    f"[LISTENER] Duplicate SYN from {external_address} absorbed")
+                return None
+
+            busy = 0 < self.max_connections <= len(self.connections)
+            if busy:
+                self.busy_answers += 1
+            elif header.ack_num != StreamRDT.START_ACK:
+                if self._is_valid_cookie(key, header.ack_num):
+                    return self._add_connection(key, segment, external_address)
+                if self.syn_cookies == SYN_COOKIES_NEVER:
+                    raise ValueError("Invalid ack number")
+                # Expired, the client is sent a new one
+            elif not self._use_cookies():
+                return self._add_connection(key, segment, external_address)
+
+        if busy:
+            logging.debug(
+                f"[LISTENER] Busy, {external_address} asked to retry after {self.retry_after} s")
+            self._answer(0, key, StreamRDT.encode_retry_after(
+                self.retry_after), external_address)
+        else:
+            self._send_cookie(key, external_address)
+        return None
+
+    def _add_connection(self, key, segment, external_address):
+        accepter = AccepterRDT(self, segment, external_address, key)
+        self.connections[key] = accepter
+        self.pending_handshakes += 1
+        return accepter
+
+    def _use_cookies(self):
+        if self.syn_cookies == SYN_COOKIES_AUTO:
+            return self.pending_handshakes >= self.MAX_PENDING_HANDSHAKES
+        return self.syn_cookies == SYN_COOKIES_ALWAYS
+
+    # The cookie goes as seq num of an answer without data
+    def _send_cookie(self, key, external_address):
+        cookie = self._cookie(key, self._cookie_period())
+        self._answer(cookie, key, b'', external_address)
+        with self.lock:
+            self.cookies_sent += 1
+        logging.debug(f"[LISTENER] Cookie sent to {external_address}")
+
+    # A SYN of the listener itself, acking the seq num of the client
+    def _answer(self, seq_num, key, data, external_address):
+        segment_as_bytes = SegmentRDT(
+            HeaderRDT(self.protocol, len(data), seq_num, key[2], True, False,
+                      stream_id=HeaderRDT.LISTENER_ANSWER_STREAM),
+            data).as_bytes()
+        self.socket.sendto(segment_as_bytes, external_address)
+        if StreamRDT.tracer is not None:
+            StreamRDT.tracer.record(SENT, segment_as_bytes,
+                                    (self.host, self.port), external_address,
+                                    {})
+
+    def _is_valid_cookie(self, key, cookie):
+        period = self._cookie_period()
+        return cookie in (self._cookie(key, period),
+                          self._cookie(key, period - 1))
+
+    # A MAC of the client and the period, never START_ACK
+    def _cookie(self, key, period):
+        message = f"{key[0]}:{key[1]}:{key[2]}:{period}".encode("utf-8")
+        digest = hmac.new(self.cookie_secret, message, hashlib.sha256).digest()
+        return int.from_bytes(digest[:4], "big") or 1
+
+    def _cookie_period(self):
+        return int(StreamRDT.clock() // self.COOKIE_PERIOD)
+
+    # ======================== FOR PRIVATE USE ========================
+
+    def _set_established(self, accepter: 'AccepterRDT'):
+        with self.lock:
+            if not accepter.established:
+                accepter.established = True
+                self.pending_handshakes -= 1
+
+    def _release(self, accepter: 'AccepterRDT'):
+        with self.lock:
+            if self.connections.get(accepter.key) is not accepter:
+                return
+            del self.connections[accepter.key]
+            if not accepter.established:
+                self.pending_handshakes -= 1
 
 
 class AccepterRDT():
 
-    def __init__(self, listener: ListenerRDT, first_segment, external_address):
+    def __init__(self, listener: ListenerRDT, first_segment, external_address,
+                 key):
+        self.listener = listener
+        self.key = key
+        self.established = False
         self.host = listener.host
         self.first_segment = first_segment
         self.external_host = external_address[0]
@@ -69,9 +221,19 @@ class AccepterRDT():
             self.external_host, self.external_port,
             self.first_segment, self.host
         )
+        self.set_established()
 
         logging.info("[LISTENER] Connection established with ({}:{})".format(
             self.external_host, self.external_port)
         )
 
         return stream
+
+    # Once the handshake of the connection is done, by accept() or else
+    def set_established(self):
+        self.listener._set_established(self)
+
+    # Takes the connection out of the table of the listener, once it is
+    # closed or its handshake failed
+    def release(self):
+        self.listener._release(self)
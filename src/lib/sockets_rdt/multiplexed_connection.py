@@ -0,0 +1,434 @@
+import logging
+import time
+from contextlib import contextmanager
+from threading import Condition, RLock, Thread
+from lib.protocols.utils.buffer_sorter import BufferSorter
+from lib.protocols.utils.sliding_window import SlidingWindow
+from lib.segment_encoding.header_rdt import HeaderRDT
+from lib.segment_encoding.segment_rdt import SegmentRDT
+from lib.utils.constant import DEFAULT_SOCKET_READ_TIMEOUT, SelectedProtocol
+from lib.utils.exceptions import ExternalConnectionClosed
+
+
+# One of the streams of a MultiplexedConnection. It has the send(),
+# flush(), read() and close() of a StreamRDT, with its own window, sequence
+# numbers and reassembly buffer, so a lost segment only delays its own
+# stream. Each end closes it with a FIN of its own, that takes a sequence
+# number after its data, and it is released once both FINs went through
+class SubStream:
+
+    def __repr__(self):
+        return f"SubStream(stream_id={self.stream_id}, window={self.window})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __init__(self, connection: 'MultiplexedConnection', stream_id,
+                 window_size):
+        self.connection = connection
+        self.stream_id = stream_id
+        self.window = SlidingWindow(
+            window_size, MultiplexedConnection.START_SEQ)
+        self.buffer_sorter = BufferSorter(MultiplexedConnection.START_SEQ)
+        self.last_progress = time.monotonic()
+        # Send time of the segments sent once, for the RTT samples
+        self.send_times = {}
+        # Only the threads using this stream wait on it
+        self.condition = Condition(connection.lock)
+        # Sequence numbers of the FIN sent and of the one received
+        self.fin_seq = None
+        self.peer_fin_seq = None
+
+    # ======================== FOR PUBLIC USE ========================
+
+    # Queues the data and returns as soon as it fits in the send buffer
+    def send(self, data: bytes):
+        mss = SegmentRDT.get_max_segment_size()
+        data = memoryview(data)
+        data_segments = [data[i:i+mss] for i in range(0, len(data), mss)]
+
+        position = 0
+        while position < len(data_segments):
+            # The turns of the fair scheduler are taken before the lock, so
+            # the acks and the other streams go on while this one waits
+            end = self.connection._wait_turns(data_segments, position)
+            with self.condition:
+                if self.fin_seq is not None:
+                    raise ValueError(
+                        f"[MULTIPLEX] Stream {self.stream_id} already closed")
+                while position < end:
+                    self.connection._raise_if_failed()
+                    free_space = MultiplexedConnection.SEND_BUFFER_SIZE - \
+                        self.window.pending_segments()
+                    if free_space <= 0:
+                        self.connection._wait(self.condition)
+                        continue
+                    if self.window.finished():
+                        self.last_progress = time.monotonic()
+                    added = min(free_space, end - position)
+                    self.window.add_data(
+                        data_segments[position:position + added])
+                    position += added
+                    self.connection._send_available_segments()
+
+    # Blocks until every segment handed to send() has been acked
+    def flush(self):
+        with self.condition:
+            while not self.window.finished():
+                self.connection._raise_if_failed()
+                self.connection._wait(self.condition)
+
+    # Raises ExternalConnectionClosed once the other end closed the
+    # stream and all its data was read
+    def read(self) -> bytes:
+        with self.condition:
+            while True:
+                _, data = self.buffer_sorter.pop_available_data()
+                if data:
+                    return data
+                if self.peer_fin_seq is not None and \
+                        self.buffer_sorter.get_current_ack_num() > self.peer_fin_seq:
+                    raise ExternalConnectionClosed(
+                        f"[MULTIPLEX] Stream {self.stream_id} closed by the other end")
+                self.connection._raise_if_failed()
+                self.connection._wait(self.condition)
+
+    # Sends a FIN after the pending data and waits for all of it to be
+    # acked. The other streams of the connection go on
+    def close(self):
+        with self.condition:
+            if self.fin_seq is None:
+                self.fin_seq = self.window.final_seq_num + 1
+                self.window.add_data([b''])
+                self.connection._send_available_segments()
+            self.flush()
+            self.connection._release_if_closed(self)
+
+    # The streams of a connection share the stats of the StreamRDT under it
+    @property
+    def stats(self):
+        return self.connection.stream.stats
+
+
+# Carries many SubStreams over one StreamRDT, QUIC style. A thread reads
+# every segment of the connection and hands it to its stream. The streams
+# with segments to send take turns, one segment each, while the segments
+# in flight of all of them fit in MAX_SEGMENTS_IN_FLIGHT
+class MultiplexedConnection:
+
+    START_SEQ = 0
+    STREAM_WINDOW_SIZE = 5
+    SEND_BUFFER_SIZE = 128
+    MAX_SEGMENTS_IN_FLIGHT = 16
+
+    # Segments further than this from the next one to be read are dropped,
+    # so a stream nobody reads stops its sender
+    RECEIVE_WINDOW = 256
+
+    READ_TICK = 0.02  # seconds
+    RETRANSMISSION_TIMEOUT = DEFAULT_SOCKET_READ_TIMEOUT
+    MAX_SILENCE = 15 * DEFAULT_SOCKET_READ_TIMEOUT
+    # The segments of a released stream keep being acked this long, in
+    # case the other end did not get the ack of its FIN. By then it gave up
+    CLOSED_STREAM_MEMORY = MAX_SILENCE
+    # On close segments keep being acked until the other end is silent
+    # this long, in case it did not get the last acks
+    LINGER_TIME = 2 * RETRANSMISSION_TIMEOUT
+
+    # The stream is taken over: nothing else may use it until close(). With
+    # accept_streams the streams opened by the other end are accepted
+    def __init__(self, stream, accept_streams=False):
+        self.stream = stream
+        self.accept_streams = accept_streams
+        self.window_size = 1 \
+            if stream.selected_protocol == SelectedProtocol.STOP_AND_WAIT \
+            else self.STREAM_WINDOW_SIZE
+
+        self.lock = RLock()
+        # For the threads waiting on the whole connection
+        self.condition = Condition(self.lock)
+        self.substreams = {}  # stream id -> SubStream
+        self.closed_streams = {}  # stream id -> time it was released
+        self.accepted = []
+        self.next_stream_id = HeaderRDT.DEFAULT_STREAM + 1
+        self.next_turn = 0
+        self.error = None
+        self.stopping = False
+        self.waiting = 0
+        self.last_activity = time.monotonic()
+
+        self.stream.settimeout(self.READ_TICK)
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # ======================== FOR PUBLIC USE ========================
+
+    def open_stream(self) -> SubStream:
+        with self.condition:
+            self._raise_if_failed()
+            substream = self._add_substream(self.next_stream_id)
+            self.next_stream_id += 1
+            return substream
+
+    # Blocks until the other end opens a stream. Raises
+    # ExternalConnectionClosed once the connection is closed
+    def accept_stream(self) -> SubStream:
+        with self.condition:
+            while not self.accepted:
+                self._raise_if_failed()
+                self.condition.wait()
+            return self.accepted.pop(0)
+
+    # Waits for the pending segments of every stream and for the other end
+    # to go silent, and gives the stream back with its original timeout
+    def close(self):
+        with self.condition:
+            while self.error is None and not all(
+                    substream.window.finished()
+                    for substream in self.substreams.values()):
+                self._wait(self.condition)
+            self.stopping = True
+        self.thread.join()
+        self.stream.settimeout(DEFAULT_SOCKET_READ_TIMEOUT)
+        logging.debug(
+            f"[MULTIPLEX] Closed with {len(self.substreams)} streams still open")
+
+    # ======================== FOR PRIVATE USE ========================
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if self.stopping and \
+                        time.monotonic() - self.last_activity > self.LINGER_TIME:
+                    return
+            try:
+                segment, _ = self.stream.read_segment(True)
+            except (TimeoutError, ValueError):
+                segment = None
+            except ExternalConnectionClosed as e:
+                self._fail(e)
+                return
+            except Exception as e:
+                logging.error(f"[MULTIPLEX] Error reading segment: {e}")
+                self._fail(e)
+                return
+
+            with self.condition:
+                now = time.monotonic()
+                if segment is not None:
+                    self.last_activity = now
+                    self._process_segment(segment)
+                elif self._is_waiting_for_peer() and \
+                        now - self.last_activity > self.MAX_SILENCE:
+                    self._fail(TimeoutError(
+                        "[MULTIPLEX] Multiple timeouts while waiting for the other end"))
+                    return
+                self._retransmit_expired(now)
+                self._forget_closed_streams(now)
+                self._send_available_segments()
+
+    def _process_segment(self, segment):
+        header = segment.header
+        substream = self.substreams.get(header.stream_id)
+        if substream is None:
+            if header.stream_id in self.closed_streams:
+                if header.data_size > 0 or header.fin:
+                    self.stream.send_segment(
+                        b'', self.START_SEQ, header.seq_num, False, False,
+                        header.stream_id, scheduled=False)
+                return
+            if header.stream_id == HeaderRDT.DEFAULT_STREAM:
+                # Retransmission from before the connection was multiplexed
+                if header.data_size > 0:
+                    self.stream.send_segment(
+                        b'', self.stream.seq_num, header.seq_num, False, False,
+                        scheduled=False)
+                return
+            if not self.accept_streams or \
+                    (header.data_size == 0 and not header.fin):
+                return
+            substream = self._add_substream(header.stream_id)
+            self.accepted.append(substream)
+            self.condition.notify_all()
+            logging.debug(
+                f"[MULTIPLEX] Accepted stream {header.stream_id}")
+
+        if header.data_size == 0 and not header.fin:
+            sent_at = substream.send_times.pop(header.ack_num, None)
+            if sent_at is not None:
+                self.stream.stats.rtt.observe(time.monotonic() - sent_at)
+            first_unacked = substream.window.get_current_seq_num()
+            substream.window.set_ack(header.ack_num)
+            if substream.window.get_current_seq_num() != first_unacked:
+                substream.last_progress = time.monotonic()
+                substream.condition.notify_all()
+                if substream.window.finished():
+                    self.condition.notify_all()
+                    self._release_if_closed(substream)
+            return
+
+        sorter = substream.buffer_sorter
+        if header.seq_num - sorter.get_current_ack_num() >= self.RECEIVE_WINDOW:
+            return
+        self.stream.send_segment(
+            b'', substream.window.get_current_seq_num(), header.seq_num,
+            False, False, substream.stream_id, scheduled=False)
+        if not sorter.add_segment(header.seq_num, segment.data):
+            self.stream.stats.duplicate_segments_received += 1
+        self.stream.stats.reorder_buffer_depth.observe(len(sorter.buffer))
+        substream.condition.notify_all()
+        if header.fin:
+            substream.peer_fin_seq = header.seq_num
+            self._release_if_closed(substream)
+
+    # Streams take turns to send one segment each. Once a rate limit of the
+    # stream runs out of tokens the rest wait for the next READ_TICK
+    def _send_available_segments(self):
+        substreams = list(self.substreams.values())
+        if not substreams:
+            return
+        in_flight = sum(substream.window.in_flight_segments()
+                        for substream in substreams)
+        sent = True
+        while sent and in_flight < self.MAX_SEGMENTS_IN_FLIGHT:
+            if self._rate_limited():
+                return
+            sent = False
+            for i in range(len(substreams)):
+                substream = substreams[(self.next_turn + i) % len(substreams)]
+                if not substream.window.has_available_segments_to_send():
+                    continue
+                self._send_segment(substream)
+                in_flight += 1
+                sent = True
+                self.next_turn = (self.next_turn + i + 1) % len(substreams)
+                break
+
+    def _send_segment(self, substream: SubStream):
+        window = substream.window
+        seq_num, data = window.get_first_available_segment()
+        stats = self.stream.stats
+        if window.is_retransmission(seq_num):
+            stats.retransmitted_segments += 1
+            substream.send_times.pop(seq_num, None)
+        else:
+            substream.send_times[seq_num] = time.monotonic()
+        stats.window_occupancy.observe(
+            seq_num - window.get_current_seq_num() + 1)
+        self.stream.send_segment(
+            data, seq_num, substream.buffer_sorter.get_current_ack_num(),
+            False, seq_num == substream.fin_seq, substream.stream_id,
+            scheduled=False)
+        window.set_sent(seq_num, True)
+        now = time.monotonic()
+        for rate_limit in self.stream.rate_limits:
+            rate_limit.consume(len(data), now)
+
+    def _rate_limited(self):
+        now = time.monotonic()
+        mss = SegmentRDT.get_max_segment_size()
+        return any(rate_limit.delay(mss, now) > 0
+                   for rate_limit in self.stream.rate_limits)
+
+    def _retransmit_expired(self, now):
+        for substream in self.substreams.values():
+            if substream.window.in_flight_segments() == 0:
+                continue
+            if now - substream.last_progress > self.RETRANSMISSION_TIMEOUT:
+                substream.window.reset_sent_segments()
+                substream.last_progress = now
+                self.stream.stats.retransmission_timeouts += 1
+
+    def _is_waiting_for_peer(self):
+        return self.waiting > 0 or any(
+            substream.window.in_flight_segments() > 0
+            for substream in self.substreams.values())
+
+    def _add_substream(self, stream_id):
+        substream = SubStream(self, stream_id, self.window_size)
+        self.substreams[stream_id] = substream
+        return substream
+
+    # Once both ends closed the stream and its FIN was acked, it is
+    # forgotten. Must be called holding the lock
+    def _release_if_closed(self, substream: SubStream):
+        if substream.fin_seq is None or substream.peer_fin_seq is None or \
+                not substream.window.finished():
+            return
+        if self.substreams.pop(substream.stream_id, None) is None:
+            return
+        self.closed_streams[substream.stream_id] = time.monotonic()
+        logging.debug(
+            f"[MULTIPLEX] Stream {substream.stream_id} released")
+
+    def _forget_closed_streams(self, now):
+        for stream_id, closed_at in list(self.closed_streams.items()):
+            if now - closed_at > self.CLOSED_STREAM_MEMORY:
+                del self.closed_streams[stream_id]
+
+    # Takes the turns of the fair scheduler of the stream to send the data
+    # segments from position on, and returns where the ones with a turn
+    # end. Only the new data takes turns: the acks and the segments sent
+    # again, sent holding the lock, never wait for them. Must be called
+    # without holding the lock
+    def _wait_turns(self, data_segments, position):
+        flow = self.stream.scheduled_flow
+        if flow is None:
+            return len(data_segments)
+        flow.wait_turn(len(data_segments[position]) + HeaderRDT.size())
+        return position + 1
+
+    # Must be called holding the condition
+    def _wait(self, condition: Condition):
+        if self.waiting == 0 and not self._is_waiting_for_peer():
+            self.last_activity = time.monotonic()
+        self.waiting += 1
+        try:
+            condition.wait()
+        finally:
+            self.waiting -= 1
+
+    def _fail(self, error):
+        with self.lock:
+            if self.error is None:
+                self.error = error
+            self.condition.notify_all()
+            for substream in self.substreams.values():
+                substream.condition.notify_all()
+
+    def _raise_if_failed(self):
+        if self.error is not None:
+            raise self.error
+
+
+# Hands out SubStreams with the interface of ConnectionPool.connection(),
+# so the transferences run the same over pooled or multiplexed connections.
+# A stream left in an unknown state by an error is closed, so the other end
+# ends its session, and replaced by a new one
+class SubStreamProvider:
+
+    def __init__(self, multiplexed_connection: MultiplexedConnection):
+        self.multiplexed_connection = multiplexed_connection
+        self.substream = None
+
+    @contextmanager
+    def connection(self, keep_on=()):
+        if self.substream is None:
+            self.substream = self.multiplexed_connection.open_stream()
+        try:
+            yield self.substream
+        except keep_on:
+            raise
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        substream, self.substream = self.substream, None
+        if substream is None:
+            return
+        try:
+            substream.close()
+        except Exception as e:
+            logging.debug(
+                f"[MULTIPLEX] Error closing stream {substream.stream_id}: {e}")
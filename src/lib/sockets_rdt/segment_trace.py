@@ -0,0 +1,213 @@
+import json
+import socket
+import struct
+import time
+from collections import deque
+from functools import lru_cache
+from threading import Event, Thread
+from lib.segment_encoding.header_rdt import HeaderRDT
+
+SENT = "sent"
+RECEIVED = "received"
+
+PCAP_EXTENSIONS = (".pcap", ".pcapng")
+
+
+# Writes the segments sent and received by the streams of the process to a
+# trace file. record() only queues the event: a background thread decodes
+# the queued events and writes them in batches every FLUSH_INTERVAL, so
+# tracing at full rate barely changes the timing of the transferences
+class SegmentTracer:
+
+    FLUSH_INTERVAL = 0.1  # seconds
+    FILE_BUFFER_SIZE = 1024 * 1024
+
+    def __repr__(self):
+        return f"{type(self).__name__}(file={self.file.name}, recorded={self.recorded})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    # vantage_point is "client" or "server"
+    def __init__(self, file_path, vantage_point):
+        self.file = open(file_path, "wb", buffering=self.FILE_BUFFER_SIZE)
+        self.vantage_point = vantage_point
+        self.start_time = time.time()
+        self.events = deque()
+        self.recorded = 0
+        self.stopping = Event()
+        self._write_preamble()
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # A pcapng tracer for the .pcap and .pcapng files, a qlog one otherwise
+    @classmethod
+    def open(cls, file_path, vantage_point) -> 'SegmentTracer':
+        if file_path.lower().endswith(PCAP_EXTENSIONS):
+            return PcapngTracer(file_path, vantage_point)
+        return QlogTracer(file_path, vantage_point)
+
+    # The addresses are (host, port) pairs and state a dict with the state
+    # of the sender at that moment
+    def record(self, direction, segment_bytes, local_address,
+               remote_address, state):
+        self.events.append((time.time(), direction, segment_bytes,
+                            local_address, remote_address, state))
+
+    # Writes the events still queued and closes the file
+    def close(self):
+        self.stopping.set()
+        self.thread.join()
+        self.file.close()
+
+    # ======================== FOR PRIVATE USE ========================
+
+    def _run(self):
+        while not self.stopping.wait(self.FLUSH_INTERVAL):
+            self._write_queued_events()
+        self._write_queued_events()
+
+    def _write_queued_events(self):
+        if not self.events:
+            return
+        while self.events:
+            self._write_event(*self.events.popleft())
+            self.recorded += 1
+        self.file.flush()
+
+    def _write_preamble(self):
+        raise NotImplementedError
+
+    def _write_event(self, timestamp, direction, segment_bytes,
+                     local_address, remote_address, state):
+        raise NotImplementedError
+
+
+# qlog style trace: a JSON object per line, the first one describing the
+# trace and then an event per segment, with its time in milliseconds since
+# the start of the trace
+class QlogTracer(SegmentTracer):
+
+    QLOG_VERSION = "0.3"
+
+    def _write_preamble(self):
+        self._write_json({
+            "qlog_version": self.QLOG_VERSION,
+            "qlog_format": "NDJSON",
+            "title": "fiuba-rdt segment trace",
+            "trace": {
+                "vantage_point": {"type": self.vantage_point},
+                "common_fields": {
+                    "reference_time": self.start_time * 1000,
+                    "time_format": "relative",
+                },
+            },
+        })
+
+    def _write_event(self, timestamp, direction, segment_bytes,
+                     local_address, remote_address, state):
+        self._write_json({
+            "time": (timestamp - self.start_time) * 1000,
+            "name": f"transport:packet_{direction}",
+            "data": {
+                "header": _decode_header(segment_bytes),
+                "raw": {"length": len(segment_bytes)},
+                "local": f"{_ip(local_address[0], remote_address[0])}:{local_address[1]}",
+                "remote": f"{_ip(remote_address[0])}:{remote_address[1]}",
+                "state": state,
+            },
+        })
+
+    def _write_json(self, value):
+        self.file.write(json.dumps(value).encode("utf-8") + b"\n")
+
+
+# pcapng capture that Wireshark and the fiuba-rdt dissector open directly.
+# Each segment goes in a made up IPv4/UDP packet between the addresses of
+# its stream, with the state of the sender in the comment of the packet
+class PcapngTracer(SegmentTracer):
+
+    LINKTYPE_RAW = 101  # IPv4 packets with no link layer header
+    SECTION_HEADER_BLOCK = 0x0A0D0D0A
+    INTERFACE_DESCRIPTION_BLOCK = 1
+    ENHANCED_PACKET_BLOCK = 6
+    BYTE_ORDER_MAGIC = 0x1A2B3C4D
+    OPTION_COMMENT = 1
+
+    def _write_preamble(self):
+        self._write_block(self.SECTION_HEADER_BLOCK, struct.pack(
+            "<IHHq", self.BYTE_ORDER_MAGIC, 1, 0, -1))
+        self._write_block(self.INTERFACE_DESCRIPTION_BLOCK, struct.pack(
+            "<HHI", self.LINKTYPE_RAW, 0, 0))
+
+    def _write_event(self, timestamp, direction, segment_bytes,
+                     local_address, remote_address, state):
+        local = (_ip(local_address[0], remote_address[0]), local_address[1])
+        remote = (_ip(remote_address[0]), remote_address[1])
+        source, destination = (local, remote) if direction == SENT \
+            else (remote, local)
+        packet = _ipv4_udp_packet(source, destination, segment_bytes)
+
+        microseconds = int(timestamp * 1e6)
+        comment = " ".join(f"{key}={value}" for key, value in state.items())
+        body = struct.pack("<IIIII", 0, microseconds >> 32,
+                           microseconds & 0xFFFFFFFF, len(packet),
+                           len(packet)) + _padded(packet)
+        if comment:
+            comment_bytes = f"{direction} {comment}".encode("utf-8")
+            body += struct.pack("<HH", self.OPTION_COMMENT,
+                                len(comment_bytes)) + _padded(comment_bytes)
+            body += struct.pack("<HH", 0, 0)  # end of options
+        self._write_block(self.ENHANCED_PACKET_BLOCK, body)
+
+    def _write_block(self, block_type, body):
+        length = 12 + len(body)
+        self.file.write(struct.pack("<II", block_type, length) + body
+                        + struct.pack("<I", length))
+
+
+def _decode_header(segment_bytes):
+    if len(segment_bytes) < HeaderRDT.size():
+        return None
+    protocol, data_size, seq_num, ack_num, syn, fin, stream_id = \
+        struct.unpack_from(HeaderRDT.PACKET_FORMAT, segment_bytes)
+    return {"protocol": protocol, "data_size": data_size,
+            "seq_num": seq_num, "ack_num": ack_num, "syn": syn, "fin": fin,
+            "stream_id": stream_id}
+
+
+# The IP of host. A socket bound to every interface is given the loopback
+# address when it talks to a loopback peer
+@lru_cache(maxsize=256)
+def _ip(host, peer_host=None):
+    if host in ("", "0.0.0.0"):
+        if peer_host is not None and _ip(peer_host).startswith("127."):
+            return "127.0.0.1"
+        return "0.0.0.0"
+    try:
+        return socket.gethostbyname(host)
+    except OSError:
+        return "0.0.0.0"
+
+
+def _ipv4_udp_packet(source, destination, payload):
+    udp_header = struct.pack("!HHHH", source[1], destination[1],
+                             8 + len(payload), 0)
+    ip_header = struct.pack(
+        "!BBHHHBBH4s4s", 0x45, 0, 20 + len(udp_header) + len(payload),
+        0, 0x4000, 64, socket.IPPROTO_UDP, 0,
+        socket.inet_aton(source[0]), socket.inet_aton(destination[0]))
+    checksum = _internet_checksum(ip_header)
+    return ip_header[:10] + struct.pack("!H", checksum) + ip_header[12:] \
+        + udp_header + payload
+
+
+def _internet_checksum(data):
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def _padded(data):
+    return bytes(data) + b"\0" * (-len(data) % 4)
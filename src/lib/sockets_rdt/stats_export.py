@@ -0,0 +1,130 @@
+import json
+import logging
+import math
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from lib.sockets_rdt.stream_stats import StreamStats
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Prometheus name and help of each counter of StreamStats
+COUNTER_METRICS = {
+    "connections": ("rdt_connections_total", "Connections established"),
+    "reaped_connections": ("rdt_reaped_connections_total",
+                           "Connections closed after their peer went silent"),
+    "connection_attempts": ("rdt_connection_attempts_total",
+                            "SYNs sent to a listener to connect"),
+    "busy_answers": ("rdt_busy_answers_total",
+                     "Answers of a busy server to retry later"),
+    "segments_sent": ("rdt_segments_sent_total", "Segments sent"),
+    "data_segments_sent": ("rdt_data_segments_sent_total",
+                           "Segments with data sent"),
+    "bytes_sent": ("rdt_bytes_sent_total", "Bytes of data sent"),
+    "retransmitted_segments": ("rdt_retransmitted_segments_total",
+                               "Segments sent again after a timeout"),
+    "retransmission_timeouts": ("rdt_retransmission_timeouts_total",
+                                "Expirations of the retransmission timer"),
+    "segments_received": ("rdt_segments_received_total", "Segments received"),
+    "data_segments_received": ("rdt_data_segments_received_total",
+                               "Segments with data received"),
+    "duplicate_segments_received": ("rdt_duplicate_segments_received_total",
+                                    "Segments with data received again"),
+    "bytes_received": ("rdt_bytes_received_total",
+                       "Bytes of data received, duplicates included"),
+    "disk_blocked_time": ("rdt_disk_blocked_seconds_total",
+                          "Time the transferences waited on the files"),
+    "rate_limited_time": ("rdt_rate_limited_seconds_total",
+                          "Time the segments were held back by the rate limits"),
+    "scheduler_wait_time": ("rdt_scheduler_wait_seconds_total",
+                            "Time the segments waited for turns of the fair scheduler"),
+}
+
+HISTOGRAM_METRICS = {
+    "rtt": ("rdt_rtt_seconds", "Round trip time of the segments sent once"),
+    "window_occupancy": ("rdt_window_occupancy_segments",
+                         "Position in the window of each segment sent"),
+    "reorder_buffer_depth": ("rdt_reorder_buffer_depth_segments",
+                             "Segments waiting in the reassembly buffer"),
+    "handshake_duration": ("rdt_handshake_duration_seconds",
+                           "Duration of the handshakes"),
+    "close_duration": ("rdt_close_duration_seconds",
+                       "Duration of the closes started by this end"),
+}
+
+
+# The stats of a server: the sum of all its connections, and those of
+# each open one as (name, stats) pairs
+def stats_as_json(total: StreamStats, connections):
+    return {
+        "time": time.time(),
+        "total": total.as_dict(),
+        "connections": [{"connection": name, **stats.as_dict()}
+                        for name, stats in connections],
+    }
+
+
+# Same as stats_as_json() in the Prometheus text format. The metrics of
+# the open connections carry a connection label, the total ones have none
+def stats_as_prometheus(total: StreamStats, connections):
+    series = [({}, total)] + [({"connection": name}, stats)
+                              for name, stats in connections]
+    lines = []
+    for counter, (metric, help_text) in COUNTER_METRICS.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for labels, stats in series:
+            lines.append(
+                f"{metric}{_labels(labels)} {getattr(stats, counter)}")
+
+    for histogram, (metric, help_text) in HISTOGRAM_METRICS.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} histogram")
+        for labels, stats in series:
+            values = getattr(stats, histogram)
+            cumulative = 0
+            for bound, count in zip(values.bounds + [math.inf],
+                                    values.counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else str(bound)
+                lines.append(
+                    f"{metric}_bucket{_labels({**labels, 'le': le})} {cumulative}")
+            lines.append(f"{metric}_sum{_labels(labels)} {values.sum}")
+            lines.append(f"{metric}_count{_labels(labels)} {values.count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_stats_json(total: StreamStats, connections, file_path):
+    with open(file_path, "w") as file:
+        json.dump(stats_as_json(total, connections), file, indent=2)
+
+
+# Serves stats_as_prometheus() of what snapshot() returns on every GET,
+# from a daemon thread. Returns the HTTP server, to shut it down
+def serve_prometheus(host, port, snapshot):
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            body = stats_as_prometheus(*snapshot()).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug("[STATS] " + format % args)
+
+    http_server = ThreadingHTTPServer((host, port), MetricsHandler)
+    http_server.daemon_threads = True
+    Thread(target=http_server.serve_forever, daemon=True).start()
+    logging.info(f"[STATS] Serving metrics on http://{host}:{port}/metrics")
+    return http_server
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in labels.items())
+    return "{" + pairs + "}"
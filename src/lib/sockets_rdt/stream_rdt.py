@@ -1,11 +1,20 @@
 import logging
+import random
+import select
 import socket
+import struct
+import time
+from collections import deque
+from threading import Lock
 from typing import Tuple
-from lib.utils.constant import DEFAULT_INITIATOR_SOCKET_READ_CLOSE_TIMEOUT, DEFAULT_INITIATOR_SOCKET_READ_HANDSAKE_TIMEOUT, DEFAULT_LISTENER_SOCKET_READ_HANDSAKE_TIMEOUT, DEFAULT_RECEIVER_SOCKET_READ_CLOSE_TIMEOUT, DEFAULT_SOCKET_READ_TIMEOUT,  SelectedProtocol
-from lib.utils.exceptions import AssumeAlreadyConnectedError, ExternalConnectionClosed
+from lib.utils.constant import DEFAULT_IDLE_TIMEOUT, DEFAULT_INITIATOR_HANDSHAKE_BACKOFF_CAP, DEFAULT_INITIATOR_SOCKET_READ_CLOSE_TIMEOUT, DEFAULT_INITIATOR_SOCKET_READ_HANDSAKE_TIMEOUT, DEFAULT_LISTENER_HANDSHAKE_BACKOFF_CAP, DEFAULT_LISTENER_SOCKET_READ_HANDSAKE_TIMEOUT, DEFAULT_RECEIVER_SOCKET_READ_CLOSE_TIMEOUT, DEFAULT_SOCKET_READ_TIMEOUT,  SelectedProtocol
+from lib.utils.exceptions import AssumeAlreadyConnectedError, ExternalConnectionClosed, PeerTimeoutError, ServerBusyError
+from lib.protocols.utils.backoff import Backoff
 from lib.segment_encoding.header_rdt import HeaderRDT
 from lib.segment_encoding.segment_rdt import SegmentRDT
 from lib.protocols.stop_and_wait import StopAndWait, SelectiveRepeat
+from lib.sockets_rdt.segment_trace import RECEIVED, SENT
+from lib.sockets_rdt.stream_stats import StreamStats
 
 
 class StreamRDT():
@@ -16,21 +25,50 @@ class StreamRDT():
 
     MAX_INITIATOR_HANDSHAKE_TIMEOUT_RETRIES = 10  # 4
     MAX_LISTENER_HANDSHAKE_TIMEOUT_RETRIES = 12  # 8
+    # The waits between the handshake retries back off up to these
+    INITIATOR_HANDSHAKE_BACKOFF_CAP = DEFAULT_INITIATOR_HANDSHAKE_BACKOFF_CAP
+    LISTENER_HANDSHAKE_BACKOFF_CAP = DEFAULT_LISTENER_HANDSHAKE_BACKOFF_CAP
+    # Data of the SYN a busy listener answers with: the milliseconds to
+    # retry after
+    RETRY_AFTER_FORMAT = '!I'
 
     MAX_READ_TIMEOUT_RETRIES = 8  # 3
 
     MAX_INITIATOR_CLOSE_RETRIES = 10  # 6
     MAX_RECEIVER_CLOSE_RETRIES = 8  # 4
 
+    SELECTIVE_REPEAT_WINDOW_SIZE = 5
+    RETRANSMISSION_TIMEOUT = DEFAULT_SOCKET_READ_TIMEOUT
+    # Spread the segments of a window along the round trip
+    PACING = True
+
+    # A peer that owes acks is taken for dead after PEER_TIMEOUT_RTTS round
+    # trips without a word, but never before MIN_PEER_TIMEOUT. One that
+    # owes nothing only speaks with its keepalives, it gets IDLE_TIMEOUT
+    # more, time to miss a few of them
+    PEER_TIMEOUT_RTTS = 8
+    MIN_PEER_TIMEOUT = 1  # seconds
+    IDLE_TIMEOUT = DEFAULT_IDLE_TIMEOUT
+
+    # SegmentTracer of every stream of the process, None to not trace
+    tracer = None
+
+    # Where the streams get their sockets, the time and the jitter of their
+    # retries from. The simulator replaces them with an in-memory network, a
+    # virtual clock and a seeded generator
+    socket_factory = socket.socket
+    clock = time.monotonic
+    rng = random.Random()
+
     def __init__(self, selected_protocol, external_host, external_port,
                  seq_num, ack_num, host, port=None):
 
         self.external_host = external_host
         self.external_port = external_port
 
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket = self.socket_factory(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket.bind(('', 0 if port is None else port))
-        self.socket.settimeout(DEFAULT_SOCKET_READ_TIMEOUT)
+        self.socket.settimeout(self.RETRANSMISSION_TIMEOUT)
 
         self.host = host
         self.port = self.socket.getsockname()[1]
@@ -42,6 +80,19 @@ class StreamRDT():
         self.protocol = self._select_protocol()
 
         self.closing = False
+        self.reaped = False
+        self.last_received = self.clock()
+        self.last_sent = self.last_received
+        # Datagrams taken from the socket by collect_pending_segments(),
+        # read before the socket. receive_lock keeps them in order
+        self.backlog = deque()
+        self.receive_lock = Lock()
+        self.stats = StreamStats()
+        # TokenBuckets the data sent must fit in
+        self.rate_limits = []
+        # ScheduledFlow that orders the segments sent with those of other
+        # streams, None to send them right away
+        self.scheduled_flow = None
 
     @classmethod
     def from_listener(
@@ -53,7 +104,7 @@ class StreamRDT():
             cls.START_LISTENER_SEQ, segment.header.seq_num,
             host, port,
         )
-        stream._run_handshake_as_listener()
+        stream._timed_handshake(stream._run_handshake_as_listener)
         return stream
 
     @classmethod
@@ -67,32 +118,112 @@ class StreamRDT():
         )
         logging.info("[CONNECT] Connecting to {}:{} with my port: {}".format(
             external_host, external_port, stream.port))
-        stream._run_handshake_as_initiator()
+        stream._timed_handshake(stream._run_handshake_as_initiator)
         return stream
 
     def settimeout(self, seconds):
         self.socket.settimeout(seconds)
 
+    @classmethod
+    def encode_retry_after(cls, seconds) -> bytes:
+        return struct.pack(cls.RETRY_AFTER_FORMAT, round(seconds * 1000))
+
+    @classmethod
+    def decode_retry_after(cls, data: bytes):
+        try:
+            return struct.unpack(cls.RETRY_AFTER_FORMAT, data)[0] / 1000
+        except struct.error as e:
+            raise ValueError(f"[HANDSHAKE] Invalid retry after: {e}")
+
     # ======================== FOR PUBLIC USE ========================
 
     def send(self, data: bytes):
         mss = SegmentRDT.get_max_segment_size()
 
+        # Segments are views of data, not copies, until they are sent
+        data = memoryview(data)
         data_segments = []
         for i in range(0, len(data), mss):
             data_segments.append(data[i:i+mss])
 
         self.protocol.send(data_segments)
 
+    # Blocks until every segment handed to send() has been acked
+    def flush(self):
+        self.protocol.flush()
+
     def read(self) -> bytes:
         return self.protocol.read()
 
+    # An empty segment acking again the last one received in order, that
+    # only tells the other end this one is still there. It may be sent from
+    # another thread while the stream is in use: the segment it acks was
+    # received, and it never waits for a turn of the scheduler
+    def send_keepalive(self):
+        self.send_segment(
+            b'', self.seq_num,
+            self.protocol.buffer_sorter.get_current_ack_num() - 1,
+            False, False, scheduled=False)
+
+    # Whether nothing was sent for interval seconds, so the peer needs a
+    # keepalive to know this end is still there
+    def needs_keepalive(self, interval):
+        return not (self.closing or self.reaped) and \
+            self.clock() - self.last_sent >= interval
+
+    # Seconds the peer may go silent before it is taken for dead
+    def peer_timeout(self):
+        return self.peer_timeout_for(self.protocol.window.finished(),
+                                     self.protocol.smoothed_rtt)
+
+    # The rule of peer_timeout(), shared with AsyncStreamRDT. idle is
+    # whether the peer owes no acks, smoothed_rtt None before any sample
+    @classmethod
+    def peer_timeout_for(cls, idle, smoothed_rtt):
+        timeout = cls.PEER_TIMEOUT_RTTS * \
+            (smoothed_rtt or cls.RETRANSMISSION_TIMEOUT)
+        if idle:
+            return cls.IDLE_TIMEOUT + timeout
+        return max(cls.MIN_PEER_TIMEOUT, timeout)
+
+    def is_peer_dead(self):
+        return self.clock() - self.last_received > self.peer_timeout()
+
+    # Takes the datagrams waiting in the socket while the thread using the
+    # stream is busy elsewhere, so the peer is heard even if nobody reads.
+    # They are read later, before the socket. Returns whether there was any
+    def collect_pending_segments(self):
+        if not self.receive_lock.acquire(blocking=False):
+            # The thread is reading, it hears the peer itself
+            return False
+        collected = 0
+        try:
+            while select.select([self.socket], [], [], 0)[0]:
+                self.backlog.append(self.socket.recvfrom(
+                    SegmentRDT.MAX_DATA_SIZE + HeaderRDT.size()))
+                collected += 1
+        except (OSError, ValueError) as e:
+            logging.debug(f"[READ SEGMENT] Error collecting segments: {e}")
+        finally:
+            self.receive_lock.release()
+        if collected:
+            self.last_received = self.clock()
+        return collected > 0
+
+    # Takes the peer for dead: the next read of the thread using the stream
+    # raises PeerTimeoutError, and close() no longer waits for the peer
+    def reap(self):
+        self.reaped = True
+
     def close(self):
-        if (self.closing):
+        if (self.closing or self.reaped):
             self.socket.close()
             return
         try:
+            self.flush()
+            start = self.clock()
             self._run_close_as_initiator()
+            self.stats.add_close_time(self.clock() - start)
         except Exception as e:
             logging.debug(
                 f"[CLOSE] Error while closing connection: {str(e)}")
@@ -100,12 +231,19 @@ class StreamRDT():
 
     # ======================== FOR PRIVATE USE ========================
 
+    def _timed_handshake(self, run_handshake):
+        start = self.clock()
+        run_handshake()
+        self.stats.connections = 1
+        self.stats.add_handshake_time(self.clock() - start)
+
     def _select_protocol(self):
         mss = SegmentRDT.get_max_segment_size()
         protocol = StopAndWait(self, mss)
         if self.selected_protocol == SelectedProtocol.SELECTIVE_REPEAT:
             logging.debug("[PROTOCOL] Selected protocol: Selective Repeat")
-            protocol = SelectiveRepeat(self, 5, mss)
+            protocol = SelectiveRepeat(
+                self, self.SELECTIVE_REPEAT_WINDOW_SIZE, mss)
         else:
             logging.debug("[PROTOCOL] Selected protocol: Stop and Wait")
         return protocol
@@ -122,19 +260,33 @@ class StreamRDT():
         return self._base_read_segment(check_address, False)
 
     def read_segment_non_blocking(self, check_address) -> Tuple[SegmentRDT, tuple]:
-        self.settimeout(0)
+        return self.read_segment_with_timeout(check_address, 0)
+
+    # Returns (None, None) if no valid segment arrives in seconds
+    def read_segment_with_timeout(self, check_address, seconds) -> Tuple[SegmentRDT, tuple]:
+        self.settimeout(seconds)
         try:
             result = self._base_read_segment(
-                check_address, True)
-        except Exception:
+                check_address, False)
+        except (TimeoutError, ValueError):
             result = (None, None)
-        self.settimeout(DEFAULT_SOCKET_READ_TIMEOUT)
+        finally:
+            self.settimeout(self.RETRANSMISSION_TIMEOUT)
         return result
 
     def _base_read_segment(self, check_address, expected_syn) -> Tuple[SegmentRDT, tuple]:
+        if self.reaped:
+            raise PeerTimeoutError(
+                f"[READ SEGMENT] {self.external_host}:{self.external_port} taken for dead after {self.peer_timeout():.3f} s of silence")
         try:
-            segment_as_bytes, external_address = self.socket.recvfrom(
-                SegmentRDT.MAX_DATA_SIZE + HeaderRDT.size())
+            with self.receive_lock:
+                if self.backlog:
+                    segment_as_bytes, external_address = \
+                        self.backlog.popleft()
+                else:
+                    segment_as_bytes, external_address = \
+                        self.socket.recvfrom(
+                            SegmentRDT.MAX_DATA_SIZE + HeaderRDT.size())
             logging.debug("[READ SEGMENT] Received data from {}:{} ->  {}:{}".format(
                 external_address[0], external_address[1], self.host, self.port)
             )
@@ -143,45 +295,88 @@ class StreamRDT():
         except Exception as e:
             raise ValueError(
                 "[READ SEGMENT] Error while reading: " + str(e))
+        if self.tracer is not None:
+            self._trace(RECEIVED, segment_as_bytes, external_address)
 
         if (check_address):
             self._check_address(external_address)
+        self.last_received = self.clock()
 
         segment = SegmentRDT.from_bytes(segment_as_bytes)
         logging.debug(f"[READ SEGMENT] Received segment {segment}")
+        self.stats.segments_received += 1
+        if segment.header.data_size:
+            self.stats.data_segments_received += 1
+            self.stats.bytes_received += segment.header.data_size
+        if not segment.header.syn and self.stats.connections:
+            self.stats.mark_first_segment()
         if (expected_syn is True and segment.header.syn is False):
             raise AssumeAlreadyConnectedError(
                 "[READ SEGMENT] Invalid segment received: SYN flag not set")
         if (expected_syn != segment.header.syn):
             raise ValueError(
                 "[READ SEGMENT] Invalid segment received: SYN flag set")
-        if not self.closing and segment.header.fin:
+        # The FIN of a stream of a MultiplexedConnection only closes it
+        if not self.closing and segment.header.fin and \
+                segment.header.stream_id == HeaderRDT.DEFAULT_STREAM:
             self._run_close_as_receiver()
             raise ExternalConnectionClosed(
                 "[READ SEGMENT] Connection closed by external host")
         return segment, external_address
 
-    def send_segment(self, data: bytes, seq_num, ack_num, syn, fin):
+    # With scheduled False the segment does not wait for a turn of the
+    # fair scheduler, it was already taken or it is not to be taken
+    def send_segment(self, data: bytes, seq_num, ack_num, syn, fin,
+                     stream_id=HeaderRDT.DEFAULT_STREAM, scheduled=True):
+        if scheduled and self.scheduled_flow is not None:
+            self.scheduled_flow.wait_turn(len(data) + HeaderRDT.size())
 
         logging.debug("[SEND SEGMENT] Sending data from {}:{} ->  {}:{}".format(
             self.host, self.port, self.external_host, self.external_port))
 
         header = HeaderRDT(self.selected_protocol, len(data),
-                           seq_num, ack_num, syn, fin)
+                           seq_num, ack_num, syn, fin, stream_id=stream_id)
         segment = SegmentRDT(header, data)
+        segment_as_bytes = segment.as_bytes()
 
         self.socket.sendto(
-            segment.as_bytes(),
+            segment_as_bytes,
             (self.external_host, self.external_port)
         )
+        self.last_sent = self.clock()
+        if self.tracer is not None:
+            self._trace(SENT, segment_as_bytes,
+                        (self.external_host, self.external_port))
+        self.stats.segments_sent += 1
+        if data:
+            self.stats.data_segments_sent += 1
+            self.stats.bytes_sent += len(data)
         logging.debug(
             f"[SEND SEGMENT] Sending segment with Header: {segment.header}")
 
+    # Records the segment with the state of the window and the timer
+    def _trace(self, direction, segment_as_bytes, external_address):
+        window = self.protocol.window
+        state = {
+            "window_start": window.current_seq_num,
+            "window_size": window.window_size,
+            "last_seq_num": window.final_seq_num,
+            "highest_sent_seq_num": window.highest_sent_seq_num,
+            "rto": self.socket.gettimeout(),
+            "retransmission_timeouts": self.stats.retransmission_timeouts,
+            "reorder_buffer_depth": len(self.protocol.buffer_sorter.buffer),
+        }
+        self.tracer.record(direction, segment_as_bytes,
+                           (self.host, self.port), external_address, state)
+
     # ---- Handshake related ----
 
     def _send_handshake(self):
         self.send_segment(b'', self.seq_num, self.ack_num, syn=True, fin=False)
 
+    # Returns None when the answer is a cookie of the listener, that the
+    # initiator must send back on its SYN. Raises ServerBusyError when the
+    # listener answers that it takes no more connections for now
     def _read_handshake(self):
         try:
             segment, external_address = self._base_read_segment(
@@ -190,6 +385,15 @@ class StreamRDT():
             raise TimeoutError(
                 "[HANDSHAK READ] Timeout while reading handshake")
 
+        if segment.header.stream_id == HeaderRDT.LISTENER_ANSWER_STREAM:
+            if self.seq_num != segment.header.ack_num:
+                raise ValueError("[HANDSHAK READ] Invalid cookie")
+            if segment.data:
+                raise ServerBusyError(self.decode_retry_after(segment.data))
+            self.ack_num = segment.header.seq_num
+            logging.debug("[HANDSHAKE] Cookie received")
+            return None
+
         self.external_host = external_address[0]
         self.external_port = external_address[1]
         self.ack_num = segment.header.seq_num
@@ -201,9 +405,13 @@ class StreamRDT():
 
     def _initiatior_handshake_messages_exchange(self):
         self._send_handshake()
+        self.stats.connection_attempts += 1
         logging.debug("[HANDSHAKE] INITIATOR 1 (send)")
 
-        self._read_handshake()
+        while self._read_handshake() is None:
+            self._send_handshake()
+            self.stats.connection_attempts += 1
+            logging.debug("[HANDSHAKE] INITIATOR 1 (send with cookie)")
         logging.debug("[HANDSHAKE] INITIATOR 2 (read)")
 
         self._send_handshake()
@@ -223,15 +431,27 @@ class StreamRDT():
         logging.debug("[HANDSHAKE] LISTENER 3 (read)")
 
     def _run_handshake_as_initiator(self):
+        backoff = Backoff(DEFAULT_INITIATOR_SOCKET_READ_HANDSAKE_TIMEOUT,
+                          self.INITIATOR_HANDSHAKE_BACKOFF_CAP, self.rng)
+        timeout = backoff.next()
         retries = 0
         while retries < self.MAX_INITIATOR_HANDSHAKE_TIMEOUT_RETRIES:
             try:
-                self.settimeout(DEFAULT_INITIATOR_SOCKET_READ_HANDSAKE_TIMEOUT)
+                self.settimeout(timeout)
                 self._initiatior_handshake_messages_exchange()
-                self.settimeout(DEFAULT_SOCKET_READ_TIMEOUT)
+                self.settimeout(self.RETRANSMISSION_TIMEOUT)
                 return
+            except ServerBusyError as e:
+                retries += 1
+                self.stats.busy_answers += 1
+                # The jitter spreads the clients turned away together
+                wait = e.retry_after + backoff.next()
+                logging.info(
+                    f"[HANDSHAKE] Server busy, retrying in {wait:.3f} s")
+                self._pause_handshake(wait)
             except (ValueError, TimeoutError):
                 retries += 1
+                timeout = backoff.next()
 
         logging.error("[HANDSHAKE] Connection exhausted {} retries".format(
             self.MAX_INITIATOR_HANDSHAKE_TIMEOUT_RETRIES))
@@ -243,15 +463,19 @@ class StreamRDT():
     def _run_handshake_as_listener(
             self
     ):
+        backoff = Backoff(DEFAULT_LISTENER_SOCKET_READ_HANDSAKE_TIMEOUT,
+                          self.LISTENER_HANDSHAKE_BACKOFF_CAP, self.rng)
+        timeout = backoff.next()
         retries = 0
         while retries < self.MAX_LISTENER_HANDSHAKE_TIMEOUT_RETRIES:
             try:
-                self.settimeout(DEFAULT_LISTENER_SOCKET_READ_HANDSAKE_TIMEOUT)
+                self.settimeout(timeout)
                 self._listener_handshake_messages_exchange()
-                self.settimeout(DEFAULT_SOCKET_READ_TIMEOUT)
+                self.settimeout(self.RETRANSMISSION_TIMEOUT)
                 return
             except (ValueError, TimeoutError):
                 retries += 1
+                timeout = backoff.next()
 
         logging.error("[HANDSHAKE] Connection exhausted {} retries".format(
             self.MAX_LISTENER_HANDSHAKE_TIMEOUT_RETRIES))
@@ -260,6 +484,18 @@ class StreamRDT():
                 self.MAX_LISTENER_HANDSHAKE_TIMEOUT_RETRIES)
         )
 
+    # Waits without sending, dropping the answers to the SYNs sent before
+    def _pause_handshake(self, seconds):
+        deadline = self.clock() + seconds
+        remaining = seconds
+        while remaining > 0:
+            self.settimeout(remaining)
+            try:
+                self.socket.recvfrom(SegmentRDT.MAX_DATA_SIZE + HeaderRDT.size())
+            except socket.timeout:
+                pass
+            remaining = deadline - self.clock()
+
     # ---- Close related ----
 
     def _send_close(self):
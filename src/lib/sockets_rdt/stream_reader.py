@@ -0,0 +1,22 @@
+# Reads exact amounts of bytes from a stream, whose read() returns
+# whatever data happens to be available
+class StreamReader:
+
+    def __init__(self, stream, initial_data=b''):
+        self.stream = stream
+        self.buffer = bytearray(initial_data)
+
+    def read_exact(self, size) -> bytes:
+        while len(self.buffer) < size:
+            data = self.stream.read()
+            if data:
+                self.buffer += data
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    # Returns and forgets the data read from the stream but not consumed
+    def take_buffered(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
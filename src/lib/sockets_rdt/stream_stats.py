@@ -0,0 +1,182 @@
+import math
+import time
+from bisect import bisect_left
+
+DURATION_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                    0.5, 1, 2.5, 5, 10]  # seconds
+SEGMENTS_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+
+
+# Counts of the observed values that fall in each bucket, given by their
+# upper bounds as in Prometheus, plus one for the values over the last
+# bound. Observing a value costs a bisect and a few additions
+class Histogram:
+
+    def __repr__(self):
+        return f"Histogram(count={self.count}, sum={self.sum})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    # Returns the upper bound of the bucket with the given percentile, None
+    # if nothing was observed
+    def percentile(self, percent):
+        if self.count == 0:
+            return None
+        rank = self.count * percent / 100
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def add(self, other: 'Histogram'):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def as_dict(self):
+        return {"bounds": list(self.bounds), "counts": list(self.counts),
+                "count": self.count, "sum": self.sum}
+
+
+# Counters of a StreamRDT, or the sum of those of many streams. They are
+# plain attributes updated by the thread using the stream, so keeping them
+# costs an addition per segment
+class StreamStats:
+
+    COUNTERS = (
+        "connections",
+        # connections closed after their peer went silent
+        "reaped_connections",
+        # SYNs sent to a listener to connect
+        "connection_attempts",
+        # answers of a busy listener to wait before trying again
+        "busy_answers",
+        "segments_sent",
+        "data_segments_sent",
+        "bytes_sent",
+        "retransmitted_segments",
+        # Expirations of the retransmission timer, each one resends every
+        # segment of the window without ack
+        "retransmission_timeouts",
+        "segments_received",
+        "data_segments_received",
+        "duplicate_segments_received",
+        "bytes_received",
+        # seconds the transference waited on reads and writes of the file
+        "disk_blocked_time",
+        # seconds the segments were held back by the rate limits
+        "rate_limited_time",
+        # seconds waited for turns of the fair scheduler of the server
+        "scheduler_wait_time",
+    )
+
+    HISTOGRAMS = {
+        "rtt": DURATION_BUCKETS,
+        # Distance from the first segment without ack to each one sent
+        "window_occupancy": SEGMENTS_BUCKETS,
+        # Segments in the reassembly buffer after each one received
+        "reorder_buffer_depth": SEGMENTS_BUCKETS,
+        "handshake_duration": DURATION_BUCKETS,
+        "close_duration": DURATION_BUCKETS,
+    }
+
+    def __repr__(self):
+        return f"StreamStats({self.as_dict()})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __init__(self):
+        for counter in self.COUNTERS:
+            setattr(self, counter, 0)
+        for histogram, bounds in self.HISTOGRAMS.items():
+            setattr(self, histogram, Histogram(bounds))
+        self.handshake_times = []  # seconds
+        self.close_times = []  # seconds
+        # time.monotonic() of the first segment received after the
+        # handshake, the first byte of the answer to a request
+        self.first_segment_at = None
+
+    def mark_first_segment(self):
+        if self.first_segment_at is None:
+            self.first_segment_at = time.monotonic()
+
+    def add_handshake_time(self, seconds):
+        self.handshake_times.append(seconds)
+        self.handshake_duration.observe(seconds)
+
+    def add_close_time(self, seconds):
+        self.close_times.append(seconds)
+        self.close_duration.observe(seconds)
+
+    def retransmission_ratio(self):
+        if self.data_segments_sent == 0:
+            return 0.0
+        return self.retransmitted_segments / self.data_segments_sent
+
+    def duplicate_ratio(self):
+        if self.data_segments_received == 0:
+            return 0.0
+        return self.duplicate_segments_received / self.data_segments_received
+
+    # Adds the counters of other into these. Without samples the handshake
+    # and close times are only added to the histograms, so the stats of a
+    # long running server do not grow with each connection
+    def add(self, other: 'StreamStats', samples=True):
+        for counter in self.COUNTERS:
+            setattr(self, counter,
+                    getattr(self, counter) + getattr(other, counter))
+        for histogram in self.HISTOGRAMS:
+            getattr(self, histogram).add(getattr(other, histogram))
+        if samples:
+            self.handshake_times += other.handshake_times
+            self.close_times += other.close_times
+        if other.first_segment_at is not None:
+            if self.first_segment_at is None or \
+                    other.first_segment_at < self.first_segment_at:
+                self.first_segment_at = other.first_segment_at
+
+    def as_dict(self):
+        stats = {counter: getattr(self, counter) for counter in self.COUNTERS}
+        stats["retransmission_ratio"] = self.retransmission_ratio()
+        stats["duplicate_ratio"] = self.duplicate_ratio()
+        stats["handshake_times"] = list(self.handshake_times)
+        stats["close_times"] = list(self.close_times)
+        for histogram in self.HISTOGRAMS:
+            stats[histogram] = getattr(self, histogram).as_dict()
+        return stats
+
+    # One line for the end of a transference
+    def summary(self):
+        rtt_p50 = self.rtt.percentile(50)
+        rtt_p99 = self.rtt.percentile(99)
+        return (
+            f"{self.connections} connections, "
+            f"{self.bytes_sent} bytes sent in {self.data_segments_sent} segments "
+            f"({self.retransmitted_segments} retransmitted after "
+            f"{self.retransmission_timeouts} timeouts), "
+            f"{self.bytes_received} bytes received in {self.data_segments_received} segments "
+            f"({self.duplicate_segments_received} duplicated), "
+            f"rtt p50 <= {_format_seconds(rtt_p50)} p99 <= {_format_seconds(rtt_p99)}, "
+            f"{self.disk_blocked_time:.3f} s blocked on disk, "
+            f"{self.rate_limited_time:.3f} s rate limited, "
+            f"{self.scheduler_wait_time:.3f} s waiting for the scheduler")
+
+
+def _format_seconds(bound):
+    return "-" if bound is None else f"{bound} s"
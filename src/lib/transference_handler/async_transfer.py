@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+from lib.utils.constant import SelectedCompression, SelectedTransferType
+from lib.utils.exceptions import RequestRejectedError
+from lib.utils.file_handling import FileHandler
+from lib.segment_encoding.application_header import ApplicationHeaderRDT
+from lib.transference_handler.uploader import range_length
+
+
+# asyncio version of Uploader, for an AsyncStreamRDT. The file is read on
+# the threads of the default executor so the event loop never waits on the
+# disk. The data always goes uncompressed. With read_answer the data is
+# sent once the server accepts the upload
+class AsyncUploader():
+    def __init__(self, stream, file_handler: FileHandler,
+                 offset=0, length=None, read_answer=False):
+        self.stream = stream
+        self.file_handler = file_handler
+        self.offset = offset
+        self.length = length
+        self.read_answer = read_answer
+
+    def transfer_type(self):
+        return SelectedTransferType.UPLOAD
+
+    async def run(self):
+        logging.info("[ASYNC UPLOADER] Checking file existence")
+        if self.file_handler.exists() is False:
+            raise ValueError("[ASYNC UPLOADER] File doesn't exist")
+
+        file_size = self.file_handler.size()
+        length = range_length(file_size, self.offset, self.length)
+
+        logging.info("[ASYNC UPLOADER] Sending application header")
+        app_header = ApplicationHeaderRDT(
+            self.transfer_type(), self.file_handler.get_file_name(), file_size,
+            self.offset, length)
+        await self.stream.send(app_header.as_bytes())
+        if self.read_answer:
+            logging.info(
+                "[ASYNC UPLOADER] Waiting for the server to accept it")
+            await read_upload_answer_async(self.stream)
+
+        logging.info("[ASYNC UPLOADER] Sending file data in chunks")
+        await _timed(self.stream.stats, self.file_handler.seek, self.offset)
+        sent = 0
+        while sent < length:
+            data = await _timed(
+                self.stream.stats, self.file_handler.read,
+                min(FileHandler.MAX_RW_SIZE, length - sent))
+            if not data:
+                raise ValueError(
+                    f"[ASYNC UPLOADER] File shorter than expected: {sent} of {length} bytes")
+            await self.stream.send(data)
+            sent += len(data)
+
+        logging.info("[ASYNC UPLOADER] Waiting for the last acks")
+        await self.stream.flush()
+        logging.info("[ASYNC UPLOADER] Upload finished")
+
+
+# asyncio version of Downloader, for an AsyncStreamRDT. The file is written
+# on the threads of the default executor. Compressed data is not supported
+class AsyncDownloader():
+    def __init__(self, stream, file_handler: FileHandler):
+        self.stream = stream
+        self.file_handler = file_handler
+
+    def transfer_type(self):
+        return SelectedTransferType.DOWNLOAD
+
+    # Writes the received range at the current position of the file.
+    # Returns the data received after the range, that belongs to the next
+    # request of the session
+    async def run(self, initial_data):
+        logging.info("[ASYNC DOWNLOADER] Decoding application header")
+        app_header = ApplicationHeaderRDT.from_bytes(
+            initial_data[:ApplicationHeaderRDT.size()])
+
+        if app_header.file_name != self.file_handler.get_file_name():
+            raise ValueError(
+                f"[ASYNC DOWNLOADER] Requested file does not exist: {app_header.file_name}")
+        if app_header.compression != SelectedCompression.NONE:
+            raise ValueError(
+                "[ASYNC DOWNLOADER] Compressed transferences are not supported")
+
+        logging.info("[ASYNC DOWNLOADER] Reading file data by chunks")
+        data = initial_data[ApplicationHeaderRDT.size():]
+        received = 0
+        while True:
+            chunk = data[:app_header.length - received]
+            if chunk:
+                await _timed(
+                    self.stream.stats, self.file_handler.write, chunk)
+                received += len(chunk)
+            if received >= app_header.length:
+                break
+            data = await self.stream.read()
+
+        logging.info("[ASYNC DOWNLOADER] Download finished")
+        return data[len(chunk):]
+
+
+# Reads until the application header of a request or a response is
+# complete. Returns it, and the data received with it (header included)
+async def read_app_header(stream, data=b''):
+    while len(data) < ApplicationHeaderRDT.size():
+        data += await stream.read()
+    app_header = ApplicationHeaderRDT.from_bytes(
+        data[:ApplicationHeaderRDT.size()])
+    return app_header, data
+
+
+# asyncio version of read_upload_answer
+async def read_upload_answer_async(stream):
+    answer, _ = await read_app_header(stream)
+    if answer.is_error():
+        raise RequestRejectedError(
+            f"[ASYNC UPLOADER] Upload rejected by the server: {answer.file_name}")
+    return answer
+
+
+# Runs the file operation on the default executor, adding the time waited
+# for it to the stats
+async def _timed(stats, operation, *args):
+    start = time.monotonic()
+    result = await asyncio.get_running_loop().run_in_executor(
+        None, operation, *args)
+    stats.disk_blocked_time += time.monotonic() - start
+    return result
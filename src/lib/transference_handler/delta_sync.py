@@ -0,0 +1,322 @@
+import hashlib
+import logging
+import os
+import struct
+from lib.utils.constant import SelectedTransferType
+from lib.utils.file_handling import FileHandler
+from lib.utils.rolling_checksum import (STRONG_CHECKSUM_SIZE,
+                                        choose_block_size,
+                                        find_weak_matches, strong_checksum,
+                                        weak_checksum)
+from lib.segment_encoding.application_header import ApplicationHeaderRDT
+from lib.sockets_rdt.stream_reader import StreamReader
+from lib.transference_handler.uploader import read_upload_answer
+
+
+# Delta transference (rsync like). After the application header:
+#   server -> client: the header that accepts the upload, and the block
+#                     signatures of the server's copy of the file
+#   client -> server: instructions to rebuild the new file, COPY ranges of
+#                     blocks of the old copy or LITERAL data, and an END
+#                     with the checksum of the whole new file
+OP_COPY = b'C'
+OP_LITERAL = b'L'
+OP_END = b'E'
+
+COPY_FORMAT = '!II'  # first block, amount of blocks
+LITERAL_FORMAT = '!I'  # data size
+SIGNATURES_FORMAT = '!II'  # block size, amount of blocks
+BLOCK_SIGNATURE_FORMAT = f'!I{STRONG_CHECKSUM_SIZE}s'  # weak, strong
+
+FILE_CHECKSUM_SIZE = 16
+
+
+def _file_checksum():
+    return hashlib.blake2b(digest_size=FILE_CHECKSUM_SIZE)
+
+
+class BlockSignatures:
+
+    # Bytes of the file whose signatures are sent at once by from_file()
+    SEND_SIZE = 2**20
+
+    def __init__(self, block_size, signatures):
+        self.block_size = block_size
+        # List of (weak, strong) checksums of each complete block
+        self.signatures = signatures
+
+        self.blocks_by_weak = {}
+        for index, (weak, strong) in enumerate(signatures):
+            self.blocks_by_weak.setdefault(weak, []).append((strong, index))
+
+    # Computing the signatures of a big file takes longer than the peer
+    # waits for a word, so they are handed to send, as in as_bytes(), every
+    # SEND_SIZE bytes of the file
+    @classmethod
+    def from_file(cls, file_handler: FileHandler, send=lambda data: None):
+        block_size = choose_block_size(file_handler.size())
+        blocks = file_handler.size() // block_size
+        blocks_per_send = max(1, cls.SEND_SIZE // block_size)
+        send(struct.pack(SIGNATURES_FORMAT, block_size, blocks))
+
+        signatures = []
+        pending = bytearray()
+        for index in range(blocks):
+            block = file_handler.read(block_size)
+            if len(block) < block_size:
+                raise ValueError(
+                    "[DELTA SIGNATURES] File truncated while reading it")
+            signature = (weak_checksum(block), strong_checksum(block))
+            signatures.append(signature)
+            pending += struct.pack(BLOCK_SIGNATURE_FORMAT, *signature)
+            if (index + 1) % blocks_per_send == 0:
+                send(bytes(pending))
+                pending = bytearray()
+        if pending:
+            send(bytes(pending))
+        return cls(block_size, signatures)
+
+    @classmethod
+    def empty(cls):
+        return cls(choose_block_size(0), [])
+
+    def find_block(self, weak, block):
+        candidates = self.blocks_by_weak.get(weak, [])
+        if not candidates:
+            return None
+        strong = strong_checksum(block)
+        for candidate_strong, index in candidates:
+            if candidate_strong == strong:
+                return index
+        return None
+
+    def as_bytes(self):
+        return struct.pack(SIGNATURES_FORMAT, self.block_size,
+                           len(self.signatures)) + \
+            b''.join(struct.pack(BLOCK_SIGNATURE_FORMAT, weak, strong)
+                     for weak, strong in self.signatures)
+
+    @classmethod
+    def read_from(cls, reader: StreamReader):
+        block_size, blocks = struct.unpack(
+            SIGNATURES_FORMAT,
+            reader.read_exact(struct.calcsize(SIGNATURES_FORMAT)))
+        data = reader.read_exact(
+            blocks * struct.calcsize(BLOCK_SIGNATURE_FORMAT))
+        return cls(block_size, list(
+            struct.iter_unpack(BLOCK_SIGNATURE_FORMAT, data)))
+
+
+# Client side: sends only the parts of the file that the server's copy
+# does not already have
+class DeltaUploader():
+
+    # Amount of bytes whose rolling checksums are computed at once
+    BATCH_SIZE = 2**20
+
+    def __init__(self, stream, file_handler: FileHandler):
+        self.stream = stream
+        self.file_handler = file_handler
+
+        self.output = bytearray()
+        self.literal = bytearray()
+        self.copy = None
+        self.literal_bytes = 0
+        self.copied_bytes = 0
+
+    def transfer_type(self):
+        return SelectedTransferType.DELTA_UPLOAD
+
+    def run(self):
+        logging.info("[DELTA UPLOADER] Sending application header")
+        file_size = self.file_handler.size()
+        app_header = ApplicationHeaderRDT(
+            self.transfer_type(), self.file_handler.get_file_name(),
+            file_size, length=0
+        )
+        self.stream.send(app_header.as_bytes())
+
+        logging.info("[DELTA UPLOADER] Waiting for block signatures")
+        reader = StreamReader(self.stream)
+        read_upload_answer(reader)
+        signatures = BlockSignatures.read_from(reader)
+        logging.info(
+            f"[DELTA UPLOADER] Received {len(signatures.signatures)} signatures of {signatures.block_size} bytes blocks")
+
+        file_checksum = self._send_delta(signatures, file_size)
+
+        self._flush_pending_ops()
+        self.output += OP_END + file_checksum
+        self.stream.send(bytes(self.output))
+        self.stream.flush()
+
+        logging.info(
+            f"[DELTA UPLOADER] Delta upload finished: {self.literal_bytes} literal bytes, {self.copied_bytes} bytes reused")
+
+    def _send_delta(self, signatures: BlockSignatures, file_size):
+        block_size = signatures.block_size
+        weak_checksums = signatures.blocks_by_weak.keys()
+        file_checksum = _file_checksum()
+
+        base = 0
+        while base < file_size:
+            self.file_handler.seek(base)
+            data = self.file_handler.read(self.BATCH_SIZE + block_size - 1)
+            # Windows starting after the batch are left for the next one,
+            # unless this is the end of the file
+            last_batch = len(data) < self.BATCH_SIZE + block_size - 1
+            batch_end = len(data) if last_batch else self.BATCH_SIZE
+
+            position = 0
+            for offset, weak in find_weak_matches(
+                    data, block_size, weak_checksums):
+                if offset < position or offset >= batch_end:
+                    continue
+                index = signatures.find_block(
+                    weak, data[offset:offset + block_size])
+                if index is None:
+                    continue
+                self._add_literal(data[position:offset])
+                self._add_copy(index, block_size)
+                position = offset + block_size
+
+            if position < batch_end:
+                self._add_literal(data[position:batch_end])
+            processed = max(position, batch_end)
+            file_checksum.update(data[:processed])
+            base += processed
+            # Scanning a batch takes a while, the server hears from the
+            # client after each one even if all of it was copied
+            self._flush_pending_ops()
+            self._send_output(force=True)
+
+        return file_checksum.digest()
+
+    def _add_literal(self, data):
+        if not data:
+            return
+        self._flush_copy()
+        self.literal += data
+        self.literal_bytes += len(data)
+        if len(self.literal) >= FileHandler.MAX_RW_SIZE:
+            self._flush_literal()
+
+    def _add_copy(self, index, block_size):
+        self._flush_literal()
+        self.copied_bytes += block_size
+        if self.copy is not None and self.copy[0] + self.copy[1] == index:
+            self.copy = (self.copy[0], self.copy[1] + 1)
+            return
+        self._flush_copy()
+        self.copy = (index, 1)
+
+    def _flush_literal(self):
+        if not self.literal:
+            return
+        self.output += OP_LITERAL + \
+            struct.pack(LITERAL_FORMAT, len(self.literal)) + self.literal
+        self.literal = bytearray()
+        self._send_output()
+
+    def _flush_copy(self):
+        if self.copy is None:
+            return
+        self.output += OP_COPY + struct.pack(COPY_FORMAT, *self.copy)
+        self.copy = None
+        self._send_output()
+
+    def _flush_pending_ops(self):
+        self._flush_literal()
+        self._flush_copy()
+
+    def _send_output(self, force=False):
+        if self.output and (force or
+                            len(self.output) >= FileHandler.MAX_RW_SIZE):
+            self.stream.send(bytes(self.output))
+            self.output = bytearray()
+
+
+# Server side: rebuilds the new file from its old copy and the
+# instructions sent by the client
+class DeltaReceiver():
+
+    TMP_SUFFIX = '.delta'
+
+    def __init__(self, stream, file_path, file_name):
+        self.stream = stream
+        self.file_path = file_path
+        self.file_name = file_name
+
+    # Returns the data received after the delta, that belongs to the next
+    # request of the session
+    def run(self, initial_data):
+        reader = StreamReader(
+            self.stream, initial_data[ApplicationHeaderRDT.size():])
+
+        old_file = None
+        new_file = None
+        try:
+            if FileHandler.file_exists(self.file_path):
+                old_file = FileHandler(self.file_path, self.file_name, "rb")
+                signatures = BlockSignatures.from_file(
+                    old_file, self.stream.send)
+            else:
+                signatures = BlockSignatures.empty()
+                self.stream.send(signatures.as_bytes())
+
+            logging.info(
+                f"[DELTA RECEIVER] Sent {len(signatures.signatures)} block signatures")
+
+            new_file = FileHandler(
+                self.file_path + self.TMP_SUFFIX, self.file_name, "wb")
+            self._rebuild(reader, signatures.block_size, old_file, new_file)
+        except Exception:
+            if new_file:
+                new_file.close()
+                os.remove(new_file.get_file_path())
+            raise
+        finally:
+            if old_file:
+                old_file.close()
+
+        new_file.close()
+        os.replace(new_file.get_file_path(), self.file_path)
+        logging.info("[DELTA RECEIVER] File rebuilt from delta")
+        return reader.take_buffered()
+
+    def _rebuild(self, reader: StreamReader, block_size, old_file, new_file):
+        file_checksum = _file_checksum()
+        while True:
+            op = reader.read_exact(1)
+            if op == OP_COPY:
+                first_block, blocks = struct.unpack(
+                    COPY_FORMAT,
+                    reader.read_exact(struct.calcsize(COPY_FORMAT)))
+                self._copy_blocks(old_file, new_file, file_checksum,
+                                  first_block * block_size,
+                                  blocks * block_size)
+                continue
+            elif op == OP_LITERAL:
+                size, = struct.unpack(
+                    LITERAL_FORMAT,
+                    reader.read_exact(struct.calcsize(LITERAL_FORMAT)))
+                data = reader.read_exact(size)
+            elif op == OP_END:
+                break
+            else:
+                raise ValueError(f"[DELTA RECEIVER] Invalid operation: {op}")
+            new_file.write(data)
+            file_checksum.update(data)
+
+        if reader.read_exact(FILE_CHECKSUM_SIZE) != file_checksum.digest():
+            raise ValueError(
+                "[DELTA RECEIVER] Checksum of the rebuilt file is not correct")
+
+    def _copy_blocks(self, old_file, new_file, file_checksum, offset, size):
+        if old_file is None:
+            raise ValueError("[DELTA RECEIVER] No old file to copy from")
+        old_file.seek(offset)
+        for position in range(0, size, FileHandler.MAX_RW_SIZE):
+            data = old_file.read(min(FileHandler.MAX_RW_SIZE, size - position))
+            new_file.write(data)
+            file_checksum.update(data)
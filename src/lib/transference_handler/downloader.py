@@ -1,42 +1,99 @@
 
 import logging
-from lib.utils.constant import SelectedTransferType
+import time
+from lib.utils.compression import ChunkDecompressor
+from lib.utils.constant import SelectedCompression, SelectedTransferType
 from lib.utils.file_handling import FileHandler
 from lib.segment_encoding.application_header import ApplicationHeaderRDT
+from lib.sockets_rdt.stream_reader import StreamReader
+from lib.utils.write_behind import WriteBehindWriter
 
 
 class Downloader():
-    def __init__(self, stream,  file_handler: FileHandler):
+    # With write_behind the disk writes are done by a WriteBehindWriter
+    # thread, fsync_policy is one of WriteBehindWriter.FSYNC_POLICIES
+    def __init__(self, stream,  file_handler: FileHandler, write_behind=False,
+                 fsync_policy=WriteBehindWriter.FSYNC_NONE):
         self.stream = stream
         self.file_handler = file_handler
+        self.write_behind = write_behind
+        self.fsync_policy = fsync_policy
+        self.writer = file_handler
 
     def transfer_type(self):
         return SelectedTransferType.DOWNLOAD
 
+    # Writes the received range at the current position of the file.
+    # Returns the data received after the range, that belongs to the next
+    # request of the session
     def run(self, initial_data):
         logging.info("[DOWNLOADER] Decoding application header")
         app_header_bytes = initial_data[:ApplicationHeaderRDT.size()]
         app_header = ApplicationHeaderRDT.from_bytes(app_header_bytes)
 
         logging.info("[DOWNLOADER] Checking file existence")
-        if app_header.file_name != self.file_handler.get_file_name() or app_header.file_size == 0:
+        if app_header.file_name != self.file_handler.get_file_name():
             raise ValueError(
                 f"[DOWNLOADER] Requested file does not exist: {app_header.file_name}"
             )
 
         logging.info("[DOWNLOADER] Reading file data by chunks")
         data = initial_data[ApplicationHeaderRDT.size():]
+        if self.write_behind:
+            self.writer = WriteBehindWriter(
+                self.file_handler, self.fsync_policy)
+        try:
+            if app_header.compression != SelectedCompression.NONE:
+                leftover = self._read_compressed(app_header, data)
+            else:
+                leftover = self._read_raw(app_header, data)
+        finally:
+            if self.writer is not self.file_handler:
+                self.writer.close()
+                self.writer = self.file_handler
+
+        logging.info("[DOWNLOADER] Download finished")
+        return leftover
+
+    def _read_raw(self, app_header: ApplicationHeaderRDT, data):
         data_size = len(data)
+        leftover = b''
+
+        try:
+            while data_size < app_header.length:
+                if (len(data) >= self.file_handler.MAX_RW_SIZE):
+                    self._write(
+                        data[:self.file_handler.MAX_RW_SIZE])
+                    data = data[self.file_handler.MAX_RW_SIZE:]
+                new_data = self.stream.read()
+                if (new_data is not None) and (new_data != b''):
+                    data = data + new_data
+                    data_size += len(new_data)
+
+            extra = data_size - app_header.length
+            if extra > 0:
+                leftover = data[len(data) - extra:]
+                data = data[:len(data) - extra]
+        finally:
+            # On failure keep everything received so far, so the
+            # transference can be resumed later
+            if (data is not None and len(data) != 0):
+                self._write(data)
+        return leftover
+
+    # The time blocked on the writer is added to the stats of the stream
+    def _write(self, data):
+        start = time.monotonic()
+        self.writer.write(data)
+        self.stream.stats.disk_blocked_time += time.monotonic() - start
 
-        while data_size < app_header.file_size:
-            if (data_size >= self.file_handler.MAX_RW_SIZE):
-                self.file_handler.write(data[:self.file_handler.MAX_RW_SIZE])
-                data = data[self.file_handler.MAX_RW_SIZE:]
-            new_data = self.stream.read()
-            if (new_data is not None) and (new_data != b''):
-                data = data + new_data
-                data_size += len(new_data)
-        if (data is not None and len(data) != 0):
-            self.file_handler.write(data)
-
-        logging.info("[DOWNLOADER] Download finished, closing connection")
+    def _read_compressed(self, app_header: ApplicationHeaderRDT, initial_data):
+        decompressor = ChunkDecompressor(app_header.compression)
+        reader = StreamReader(self.stream, initial_data)
+        data_size = 0
+        while data_size < app_header.length:
+            data = decompressor.read_chunk(
+                reader, app_header.length - data_size)
+            self._write(data)
+            data_size += len(data)
+        return reader.take_buffered()
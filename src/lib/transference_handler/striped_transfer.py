@@ -0,0 +1,90 @@
+import logging
+import time
+from threading import Lock
+from lib.utils.file_handling import FileHandler
+from lib.segment_encoding.application_header import ApplicationHeaderRDT
+
+
+# A stripe costs a connection of its own, so none is made smaller than this
+MIN_STRIPE_SIZE = FileHandler.MAX_RW_SIZE
+
+
+# Splits a file in (offset, length) ranges, one for each stream. Files
+# under streams * MIN_STRIPE_SIZE are split in fewer ranges, down to a
+# single one that covers the whole file, even if it is empty
+def split_in_stripes(file_size, streams):
+    streams = max(1, min(streams, file_size // MIN_STRIPE_SIZE))
+    stripe_size = -(-file_size // streams)
+    if stripe_size == 0:
+        return [(0, 0)]
+    return [
+        (offset, min(stripe_size, file_size - offset))
+        for offset in range(0, file_size, stripe_size)
+    ]
+
+
+# Ties together the stripes of the same transfer received by the server
+# over different connections. The file is created and preallocated by the
+# first stripe that arrives, each stripe writes its own range of it. The
+# transfer is dropped as soon as one of its stripes fails, the client
+# gives it up then, and its id is remembered for FAILED_TRANSFER_MEMORY
+# seconds so a late stripe can't create the file again over what the
+# others wrote
+class StripedTransferRegistry:
+
+    FAILED_TRANSFER_MEMORY = 60  # seconds
+
+    def __init__(self):
+        self.lock = Lock()
+        self.transfers = {}  # transfer id -> bytes pending
+        self.failed = {}  # transfer id -> time it failed
+
+    def has_failed(self, transfer_id):
+        with self.lock:
+            self._forget_failed(time.monotonic())
+            return transfer_id in self.failed
+
+    def open_stripe(self, file_path, app_header: ApplicationHeaderRDT):
+        with self.lock:
+            self._forget_failed(time.monotonic())
+            if app_header.transfer_id in self.failed:
+                raise ValueError(
+                    f"[STRIPES] Striped transfer {app_header.transfer_id} of {app_header.file_name} already failed")
+            if app_header.transfer_id not in self.transfers:
+                logging.info(
+                    f"[STRIPES] New striped transfer {app_header.transfer_id} for {app_header.file_name}")
+                file_handler = FileHandler(
+                    file_path, app_header.file_name, "wb")
+                file_handler.truncate(app_header.file_size)
+                file_handler.close()
+                self.transfers[app_header.transfer_id] = app_header.file_size
+
+        file_handler = FileHandler(file_path, app_header.file_name, "r+b")
+        file_handler.seek(app_header.offset)
+        return file_handler
+
+    def close_stripe(self, app_header: ApplicationHeaderRDT, completed):
+        with self.lock:
+            pending = self.transfers.get(app_header.transfer_id)
+            if pending is None:
+                # Another stripe of the transfer already failed
+                return
+            if not completed:
+                logging.error(
+                    f"[STRIPES] Striped transfer {app_header.transfer_id} of {app_header.file_name} left incomplete")
+                del self.transfers[app_header.transfer_id]
+                self.failed[app_header.transfer_id] = time.monotonic()
+                return
+
+            pending -= app_header.length
+            if pending > 0:
+                self.transfers[app_header.transfer_id] = pending
+                return
+            logging.info(
+                f"[STRIPES] Striped transfer {app_header.transfer_id} of {app_header.file_name} finished")
+            del self.transfers[app_header.transfer_id]
+
+    def _forget_failed(self, now):
+        for transfer_id, failed_at in list(self.failed.items()):
+            if now - failed_at > self.FAILED_TRANSFER_MEMORY:
+                del self.failed[transfer_id]
@@ -1,33 +1,109 @@
 import logging
-from lib.utils.constant import SelectedTransferType
+import time
+from lib.utils.compression import ChunkCompressor, negotiate
+from lib.utils.constant import SelectedCompression, SelectedTransferType
 from lib.utils.file_handling import FileHandler
+from lib.utils.exceptions import RequestRejectedError
 from lib.segment_encoding.application_header import ApplicationHeaderRDT
+from lib.sockets_rdt.stream_reader import StreamReader
 
 
 class Uploader():
-    def __init__(self, stream,  file_handler: FileHandler):
+    # With read_answer the data is sent once the server accepts the
+    # upload, with the compression it answers with
+    def __init__(self, stream,  file_handler: FileHandler,
+                 offset=0, length=None,
+                 transfer_id=ApplicationHeaderRDT.NO_TRANSFER_ID,
+                 compression=SelectedCompression.NONE, compression_level=None,
+                 read_answer=False):
         self.stream = stream
         self.file_handler = file_handler
+        self.offset = offset
+        self.length = length
+        self.transfer_id = transfer_id
+        self.read_answer = read_answer
+        self.compression, self.compression_level = negotiate(
+            compression, compression_level)
 
     def transfer_type(self):
         return SelectedTransferType.UPLOAD
 
     def run(self):
         logging.info("[UPLOADER] Checking file existence")
-        if FileHandler.file_exists(self.file_handler.get_file_path()) is False:
+        if self.file_handler.exists() is False:
             raise ValueError("[UPLOADER] File doesn't exist")
 
+        file_size = self.file_handler.size()
+        length = range_length(file_size, self.offset, self.length)
+
         logging.info("[UPLOADER] Sending application header")
         app_header = ApplicationHeaderRDT(
-            self.transfer_type(), self.file_handler.get_file_name(), self.file_handler.size()
+            self.transfer_type(), self.file_handler.get_file_name(), file_size,
+            self.offset, length, self.transfer_id,
+            self.compression, self.compression_level
         )
         self.stream.send(app_header.as_bytes())
-
-        chunk_size = FileHandler.MAX_RW_SIZE
+        if self.read_answer:
+            logging.info("[UPLOADER] Waiting for the server to accept it")
+            answer = read_upload_answer(StreamReader(self.stream))
+            self.compression = answer.compression
+            self.compression_level = answer.compression_level
 
         logging.info("[UPLOADER] Sending file data in chunks")
-        for _ in range(0, self.file_handler.size(), chunk_size):
-            data = self.file_handler.read(chunk_size)
-            self.stream.send(data)
+        self.file_handler.seek(self.offset)
+        reader = self.file_handler.read_ahead(length)
+        chunks = _timed_reads(reader, self.stream.stats)
+        compressor = None
+        if self.compression != SelectedCompression.NONE:
+            compressor = ChunkCompressor(
+                self.compression, self.compression_level)
+            chunks = compressor.compress_chunks(chunks)
+        try:
+            for data in chunks:
+                self.stream.send(data)
+        finally:
+            reader.close()
+
+        logging.info("[UPLOADER] Waiting for the last acks")
+        self.stream.flush()
 
+        if compressor:
+            logging.info(
+                f"[UPLOADER] Compressed {compressor.raw_bytes} bytes into {compressor.sent_bytes}")
         logging.info("[UPLOADER] Upload finished, closing connection")
+
+
+# Reads the answer of the server to an upload request. Returns the header
+# it accepted the upload with, raises RequestRejectedError if it did not
+def read_upload_answer(reader: StreamReader):
+    answer = ApplicationHeaderRDT.from_bytes(
+        reader.read_exact(ApplicationHeaderRDT.size()))
+    if answer.is_error():
+        raise RequestRejectedError(
+            f"[UPLOADER] Upload rejected by the server: {answer.file_name}")
+    return answer
+
+
+# Returns the length of the range of a file of file_size bytes that starts
+# at offset, until the end of the file if length is None. Raises ValueError
+# if the range does not fit in the file
+def range_length(file_size, offset, length=None):
+    if length is None:
+        length = file_size - offset
+    if offset < 0 or length < 0 or offset + length > file_size:
+        raise ValueError(
+            f"[UPLOADER] Range out of file: offset={offset}, length={length}")
+    return length
+
+
+# Yields the chunks of reader, adding the time blocked waiting for each one
+# to the stats
+def _timed_reads(reader, stats):
+    chunks = iter(reader)
+    while True:
+        start = time.monotonic()
+        data = next(chunks, None)
+        stats.disk_blocked_time += time.monotonic() - start
+        if data is None:
+            return
+        yield data
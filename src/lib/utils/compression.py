@@ -0,0 +1,159 @@
+import lzma
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from lib.utils.constant import SelectedCompression
+from lib.sockets_rdt.stream_reader import StreamReader
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSION_BY_NAME = {
+    "none": SelectedCompression.NONE,
+    "zlib": SelectedCompression.ZLIB,
+    "lzma": SelectedCompression.LZMA,
+    "zstd": SelectedCompression.ZSTD,
+}
+
+DEFAULT_LEVELS = {
+    SelectedCompression.ZLIB: 6,
+    SelectedCompression.LZMA: 6,
+    SelectedCompression.ZSTD: 3,
+}
+
+
+# Levels taken by each compression, besides None for its default one
+LEVEL_RANGES = {
+    SelectedCompression.NONE: range(0),
+    SelectedCompression.ZLIB: range(1, 10),
+    SelectedCompression.LZMA: range(0, 10),
+    SelectedCompression.ZSTD: range(1, 23),
+}
+
+
+def is_available(compression):
+    if compression == SelectedCompression.ZSTD:
+        return zstandard is not None
+    return compression in COMPRESSION_BY_NAME.values()
+
+
+def is_valid_level(compression, level):
+    return level is None or level in LEVEL_RANGES.get(compression, range(0))
+
+
+# Picks the compression to use for a requested one, falling back to zlib
+# with its default level when it is not available in this host. Returns
+# (compression, level)
+def negotiate(requested, level=None):
+    if is_available(requested):
+        return requested, level
+    return SelectedCompression.ZLIB, None
+
+
+# Each chunk of data goes in a frame, compressed or raw if it does not
+# compress: flag, payload size and payload
+FRAME_FORMAT = '!BI'
+RAW_FRAME = 0
+COMPRESSED_FRAME = 1
+
+
+class ChunkCompressor:
+
+    # A chunk is sent raw when a sample of it does not shrink below this
+    # ratio with the fastest zlib level
+    PROBE_SIZE = 4096
+    MIN_PROBE_RATIO = 0.9
+
+    # Chunks being compressed by the worker threads ahead of the sender
+    WORKERS = 2
+    DEPTH = 4
+
+    def __init__(self, compression, level=None):
+        self.compression = compression
+        self.level = DEFAULT_LEVELS[compression] if level is None else level
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    def compress(self, chunk: bytes) -> bytes:
+        payload = chunk
+        flag = RAW_FRAME
+        if self._looks_compressible(chunk):
+            compressed = self._compress(chunk)
+            if len(compressed) < len(chunk):
+                payload = compressed
+                flag = COMPRESSED_FRAME
+        return struct.pack(FRAME_FORMAT, flag, len(payload)) + payload
+
+    # Compresses the chunks on worker threads, so the sender keeps working
+    # meanwhile. Frames are yielded in the same order as the chunks
+    def compress_chunks(self, chunks):
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            pending = deque()
+            for chunk in chunks:
+                pending.append((len(chunk), executor.submit(self.compress, chunk)))
+                if len(pending) >= self.DEPTH:
+                    yield self._frame_result(*pending.popleft())
+            while pending:
+                yield self._frame_result(*pending.popleft())
+
+    def _frame_result(self, raw_size, future):
+        frame = future.result()
+        self.raw_bytes += raw_size
+        self.sent_bytes += len(frame)
+        return frame
+
+    def _looks_compressible(self, chunk):
+        sample = chunk[:self.PROBE_SIZE]
+        return len(zlib.compress(sample, 1)) < len(sample) * self.MIN_PROBE_RATIO
+
+    def _compress(self, chunk):
+        if self.compression == SelectedCompression.ZLIB:
+            return zlib.compress(chunk, self.level)
+        if self.compression == SelectedCompression.LZMA:
+            return lzma.compress(chunk, preset=self.level)
+        return zstandard.ZstdCompressor(level=self.level).compress(chunk)
+
+
+class ChunkDecompressor:
+
+    def __init__(self, compression):
+        if not is_available(compression):
+            raise ValueError(
+                f"[COMPRESSION] Unsupported compression: {compression}")
+        self.compression = compression
+
+    # Raises ValueError if the chunk holds more than max_length bytes, a
+    # bad frame is never inflated past the range being received
+    def read_chunk(self, reader: StreamReader, max_length) -> bytes:
+        flag, size = struct.unpack(
+            FRAME_FORMAT, reader.read_exact(struct.calcsize(FRAME_FORMAT)))
+        if flag == RAW_FRAME and size > max_length:
+            raise ValueError(
+                f"[COMPRESSION] Chunk of {size} bytes past the {max_length} bytes left")
+        payload = reader.read_exact(size)
+        if flag == RAW_FRAME:
+            return payload
+        chunk = self._decompress(payload, max_length)
+        if len(chunk) > max_length:
+            raise ValueError(
+                f"[COMPRESSION] Chunk inflates past the {max_length} bytes left")
+        return chunk
+
+    # Stops one byte after max_length, that is enough to tell the chunk
+    # is too large
+    def _decompress(self, payload, max_length):
+        if self.compression == SelectedCompression.ZSTD:
+            with zstandard.ZstdDecompressor().stream_reader(payload) as reader:
+                return reader.read(max_length + 1)
+        if self.compression == SelectedCompression.ZLIB:
+            decompressor = zlib.decompressobj()
+        else:
+            decompressor = lzma.LZMADecompressor()
+        chunk = decompressor.decompress(payload, max_length + 1)
+        if not decompressor.eof and len(chunk) <= max_length:
+            raise ValueError("[COMPRESSION] Truncated compressed chunk")
+        return chunk
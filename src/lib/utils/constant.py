@@ -9,15 +9,45 @@ class SelectedProtocol:
 class SelectedTransferType:
     UPLOAD: ctypes.c_int8 = 0
     DOWNLOAD: ctypes.c_int8 = 1
+    STAT: ctypes.c_int8 = 2
+    DELTA_UPLOAD: ctypes.c_int8 = 3
+    MULTIPLEX: ctypes.c_int8 = 4
+    ERROR: ctypes.c_int8 = 5
+
+
+class SelectedCompression:
+    NONE: ctypes.c_int8 = 0
+    ZLIB: ctypes.c_int8 = 1
+    LZMA: ctypes.c_int8 = 2
+    ZSTD: ctypes.c_int8 = 3
 
 
 # DEFAULT FILE PATHS
 DEFAULT_SV_STORAGE = './misc/sv_storage/'
 DEFAULT_DOWNLOAD_DST = './misc/downloads/'
+DEFAULT_SV_STATS_FILE = './server-stats.json'
+DEFAULT_PROFILE_DIR = './profiles/'
+
+# DEFAULT SERVER FILE CACHE SIZE
+DEFAULT_SV_CACHE_SIZE = 64 * 1024 * 1024
+
+# DEFAULT BURST OF THE SERVER RATE LIMITS
+DEFAULT_SV_RATE_LIMIT_BURST = 64 * 1024
+
+# DEFAULT FAIR SCHEDULER OF THE SERVER
+DEFAULT_SV_INTERACTIVE_WEIGHT = 8
+DEFAULT_SV_BULK_WEIGHT = 1
+# Transferences up to this size are interactive, the bigger ones bulk
+DEFAULT_SV_INTERACTIVE_SIZE = 1024 * 1024
+# Past this many connections the server answers new ones with the time to
+# retry after
+DEFAULT_SV_MAX_CONNECTIONS = 256
+DEFAULT_SV_RETRY_AFTER = 1  # seconds
 
 # DEFAULT ADDRESSES
 LOCALHOST = 'localhost'
 DEFAULT_SV_PORT = 14000
+DEFAULT_PROXY_PORT = 15000
 
 
 # DEFAULT TIMEOUTS
@@ -26,5 +56,16 @@ DEFAULT_SOCKET_READ_TIMEOUT = 0.2  # 0.75
 DEFAULT_LISTENER_SOCKET_READ_HANDSAKE_TIMEOUT = 0.1  # 0.5
 DEFAULT_INITIATOR_SOCKET_READ_HANDSAKE_TIMEOUT = DEFAULT_LISTENER_SOCKET_READ_HANDSAKE_TIMEOUT * 3
 
+# The waits between the handshake retries back off from the timeouts above
+# up to these
+DEFAULT_INITIATOR_HANDSHAKE_BACKOFF_CAP = 1  # seconds
+DEFAULT_LISTENER_HANDSHAKE_BACKOFF_CAP = 0.5  # seconds
+
 DEFAULT_RECEIVER_SOCKET_READ_CLOSE_TIMEOUT = DEFAULT_INITIATOR_SOCKET_READ_HANDSAKE_TIMEOUT
 DEFAULT_INITIATOR_SOCKET_READ_CLOSE_TIMEOUT = DEFAULT_LISTENER_SOCKET_READ_HANDSAKE_TIMEOUT
+
+# DEFAULT KEEPALIVES
+# The clients send a keepalive on their idle connections this often, and
+# the server takes a client silent for DEFAULT_IDLE_TIMEOUT for dead
+DEFAULT_KEEPALIVE_INTERVAL = 0.5  # seconds
+DEFAULT_IDLE_TIMEOUT = 4 * DEFAULT_KEEPALIVE_INTERVAL
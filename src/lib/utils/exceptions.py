@@ -9,3 +9,30 @@ class AssumeAlreadyConnectedError(Exception):
 
 class ExternalConnectionClosed(Exception):
     pass
+
+
+# Raised by the reads of a stream once its peer was taken for dead
+class PeerTimeoutError(Exception):
+    pass
+
+
+# Raised while connecting when the server answers that it is busy, with
+# the seconds it asked to wait before trying again
+class ServerBusyError(Exception):
+
+    def __init__(self, retry_after):
+        super().__init__(
+            f"[HANDSHAKE] Server busy, retry after {retry_after:.3f} s")
+        self.retry_after = retry_after
+
+
+# Raised by the client when the server answers a request with an error,
+# after which the session goes on with the next request
+class RequestRejectedError(Exception):
+    pass
+
+
+# Raised in the threads of a simulation still running when it ends, so
+# they unwind. It is not an Exception so the retry loops let it through
+class SimulationEnded(BaseException):
+    pass
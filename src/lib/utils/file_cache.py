@@ -0,0 +1,190 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from lib.utils.exceptions import FileHandlerError
+from lib.utils.file_handling import FileHandler
+
+
+class FileMetadata:
+
+    def __repr__(self):
+        return f"FileMetadata(exists={self.exists}, size={self.size}, mtime={self.mtime}, checked_at={self.checked_at})"
+
+    # checked_at is the time.monotonic() when it was read from the disk
+    def __init__(self, exists, size=0, mtime=0, checked_at=0):
+        self.exists = exists
+        self.size = size
+        self.mtime = mtime
+        self.checked_at = checked_at
+
+
+# Server side cache of file metadata and file blocks, shared by all the
+# connections. Blocks are evicted least recently used first until they fit
+# in the byte budget. Entries of a file have to be invalidated whenever the
+# server writes it. Files changed by someone else are noticed when their
+# metadata is read again from the disk, at most METADATA_TTL after it was
+# cached, and their blocks are dropped then. Missing files are never
+# cached, as they can be uploaded at any moment
+class FileCache:
+
+    MAX_METADATA_ENTRIES = 4096
+    METADATA_TTL = 1.0  # seconds
+
+    def __repr__(self):
+        return "FileCache(used_bytes={}, max_bytes={}, blocks={}, hits={}, misses={}, metadata_hits={}, metadata_misses={})".format(
+            self.used_bytes, self.max_bytes, len(self.blocks),
+            self.hits, self.misses, self.metadata_hits, self.metadata_misses)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __init__(self, max_bytes, block_size=FileHandler.MAX_RW_SIZE):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.lock = Lock()
+
+        self.metadata = OrderedDict()  # file path -> FileMetadata
+        self.blocks = OrderedDict()  # (file path, mtime, index) -> bytes
+        self.used_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.metadata_hits = 0
+        self.metadata_misses = 0
+        # Goes up on each invalidate(), so what was read from the disk
+        # before it is not cached after it
+        self.generation = 0
+
+    def stat(self, file_path) -> FileMetadata:
+        with self.lock:
+            metadata = self.metadata.get(file_path)
+            if metadata is not None and \
+                    time.monotonic() - metadata.checked_at <= self.METADATA_TTL:
+                self.metadata.move_to_end(file_path)
+                self.metadata_hits += 1
+                return metadata
+            self.metadata_misses += 1
+            generation = self.generation
+
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return FileMetadata(False)
+        metadata = FileMetadata(
+            True, stat.st_size, stat.st_mtime_ns, time.monotonic())
+
+        with self.lock:
+            if self.generation != generation:
+                return metadata
+            cached = self.metadata.get(file_path)
+            if cached is not None and \
+                    (cached.size, cached.mtime) != (metadata.size, metadata.mtime):
+                logging.debug(
+                    f"[FILE CACHE] Changed on disk: {file_path}")
+                self._drop_blocks(file_path)
+            self.metadata[file_path] = metadata
+            self.metadata.move_to_end(file_path)
+            if len(self.metadata) > self.MAX_METADATA_ENTRIES:
+                self.metadata.popitem(last=False)
+        return metadata
+
+    # Returns the block from the cache, or reads it with read_from_disk
+    def get_block(self, file_path, mtime, index, read_from_disk) -> bytes:
+        key = (file_path, mtime, index)
+        with self.lock:
+            block = self.blocks.get(key)
+            if block is not None:
+                self.blocks.move_to_end(key)
+                self.hits += 1
+                return block
+            self.misses += 1
+            generation = self.generation
+
+        block = read_from_disk(index * self.block_size, self.block_size)
+        self._add_block(key, block, generation)
+        return block
+
+    def invalidate(self, file_path):
+        with self.lock:
+            self.generation += 1
+            self.metadata.pop(file_path, None)
+            self._drop_blocks(file_path)
+        logging.debug(f"[FILE CACHE] Invalidated: {file_path}")
+
+    # ======================== FOR PRIVATE USE ========================
+
+    # Must be called with the lock held
+    def _drop_blocks(self, file_path):
+        for key in [key for key in self.blocks if key[0] == file_path]:
+            self.used_bytes -= len(self.blocks.pop(key))
+
+    def _add_block(self, key, block, generation):
+        if len(block) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.blocks or self.generation != generation:
+                return
+            while self.used_bytes + len(block) > self.max_bytes:
+                _, evicted = self.blocks.popitem(last=False)
+                self.used_bytes -= len(evicted)
+            self.blocks[key] = block
+            self.used_bytes += len(block)
+
+
+# Read only FileHandler that serves the data from a FileCache. The file is
+# only opened if a block has to be read from disk
+class CachedFileHandler(FileHandler):
+
+    def __init__(self, file_cache: FileCache, file_path: str, file_name: str):
+        self.file_cache = file_cache
+        self.file_path = file_path
+        self.file_name = file_name
+        self.mode = "rb"
+        self.read_ahead_size = self.MAX_RW_SIZE
+        self.read_ahead_depth = self.READ_AHEAD_DEPTH
+        self.file = None
+        self.position = 0
+
+        self.metadata = file_cache.stat(file_path)
+        if not self.metadata.exists:
+            logging.error("[FILE HANDLER] Error opening file: " + file_path)
+            raise FileHandlerError("[FILE HANDLER] Error opening file")
+
+    def size(self):
+        return self.metadata.size
+
+    def exists(self):
+        return self.metadata.exists
+
+    def read(self, read_size):
+        block_size = self.file_cache.block_size
+        end = min(self.position + read_size, self.metadata.size)
+        pieces = []
+        while self.position < end:
+            index = self.position // block_size
+            block = self.file_cache.get_block(
+                self.file_path, self.metadata.mtime, index,
+                self._read_from_disk)
+            start = self.position - index * block_size
+            piece = block[start:start + end - self.position]
+            if not piece:
+                break
+            pieces.append(piece)
+            self.position += len(piece)
+        return pieces[0] if len(pieces) == 1 else b''.join(pieces)
+
+    def seek(self, offset):
+        self.position = offset
+
+    def close(self):
+        if self.file:
+            super().close()
+
+    def _read_from_disk(self, offset, size):
+        if self.file is None:
+            super().__init__(self.file_path, self.file_name, "rb",
+                             self.read_ahead_size, self.read_ahead_depth)
+        super().seek(offset)
+        return super().read(size)
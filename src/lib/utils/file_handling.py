@@ -2,6 +2,7 @@ import logging
 import os
 
 from lib.utils.exceptions import FileHandlerError
+from lib.utils.read_ahead import ReadAheadReader
 
 
 # Mainly an exception handler for whenever an error occurs at
@@ -11,11 +12,18 @@ class FileHandler:
 
     ALL_DATA = -1
     MAX_RW_SIZE = 2**16
+    READ_AHEAD_DEPTH = 4
 
-    def __init__(self, file_path: str, file_name: str, mode: str):
+    # read_ahead_size and read_ahead_depth are the chunk size and the
+    # amount of chunks read ahead by read_ahead()
+    def __init__(self, file_path: str, file_name: str, mode: str,
+                 read_ahead_size=MAX_RW_SIZE,
+                 read_ahead_depth=READ_AHEAD_DEPTH):
         self.file_path = file_path
         self.file_name = file_name
         self.mode = mode
+        self.read_ahead_size = read_ahead_size
+        self.read_ahead_depth = read_ahead_depth
         try:
             self.file = open(file_path, mode)
             if mode == "wb":
@@ -24,6 +32,9 @@ class FileHandler:
             elif mode == "rb":
                 logging.debug(
                     f"[FILE HANDLER] Opened file in: {file_path}; read mode")
+            elif mode == "r+b":
+                logging.debug(
+                    f"[FILE HANDLER] Opened file in: {file_path}; update mode")
         except Exception as e:
             logging.error(e)
             logging.error("[FILE HANDLER] Error opening file: " + file_path)
@@ -32,10 +43,17 @@ class FileHandler:
     def size(self):
         return os.path.getsize(self.file_path)
 
+    def exists(self):
+        return self.file_exists(self.file_path)
+
     @classmethod
     def file_exists(cls, file_path):
         return os.path.isfile(file_path)
 
+    @classmethod
+    def file_size(cls, file_path):
+        return os.path.getsize(file_path)
+
     def get_file_name(self):
         return self.file_name
 
@@ -54,6 +72,25 @@ class FileHandler:
                 "[FILE HANDLER] Error reading from file: " + self.file_path)
             raise FileHandlerError("[FILE HANDLER] Error reading from file")
 
+    # Returns an iterator over the chunks of the next length bytes, read
+    # ahead by a background thread. Close it if not consumed entirely
+    def read_ahead(self, length):
+        return ReadAheadReader(
+            self, length, self.read_ahead_size, self.read_ahead_depth)
+
+    # Tells the kernel the next length bytes will be read in order, so it
+    # reads them ahead. Does nothing where posix_fadvise is not available
+    def advise_sequential(self, length):
+        if self.file is None or not hasattr(os, "posix_fadvise"):
+            return
+        try:
+            fd = self.file.fileno()
+            offset = self.file.tell()
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+        except OSError as e:
+            logging.debug(f"[FILE HANDLER] posix_fadvise failed: {e}")
+
     def write(self, data):
         try:
             self.file.write(data)
@@ -64,6 +101,35 @@ class FileHandler:
                 "[FILE HANDLER] Error writing to file: " + self.file_path)
             raise FileHandlerError("[FILE HANDLER] Error writing to file")
 
+    def seek(self, offset):
+        try:
+            self.file.seek(offset)
+        except Exception:
+            logging.error(
+                "[FILE HANDLER] Error seeking in file: " + self.file_path)
+            raise FileHandlerError("[FILE HANDLER] Error seeking in file")
+
+    # Sets the file size, used to preallocate files written by ranges
+    def truncate(self, size):
+        try:
+            self.file.truncate(size)
+            logging.debug(
+                f"[FILE HANDLER] Truncated file to {size} bytes: {self.file_path}")
+        except Exception:
+            logging.error(
+                "[FILE HANDLER] Error truncating file: " + self.file_path)
+            raise FileHandlerError("[FILE HANDLER] Error truncating file")
+
+    # Forces the written data to reach the disk
+    def fsync(self):
+        try:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        except Exception:
+            logging.error(
+                "[FILE HANDLER] Error syncing file: " + self.file_path)
+            raise FileHandlerError("[FILE HANDLER] Error syncing file")
+
     def close(self):
         self.file.close()
         logging.debug("Closed file: " + self.file_path)
@@ -0,0 +1,56 @@
+import glob
+import os
+
+GLOB_CHARACTERS = "*?["
+
+
+# Returns the (file path, file name) pairs of the files to upload. Sources
+# may be files, directories (with all the files inside them) or glob
+# patterns. A single file is named name, or after its base name. Otherwise
+# files are named after their path from the directory given, inside the
+# remote directory name if given
+def files_to_upload(sources, name=None):
+    if len(sources) == 1 and os.path.isfile(sources[0]):
+        return [(sources[0], name or os.path.basename(sources[0]))]
+
+    files = []
+    for source in sources:
+        paths = [source]
+        if any(character in source for character in GLOB_CHARACTERS):
+            paths = sorted(glob.glob(source, recursive=True))
+        if not paths:
+            raise ValueError(f"No file matches {source}")
+
+        for path in paths:
+            if os.path.isdir(path):
+                files += _files_in_directory(path)
+            elif os.path.isfile(path):
+                files.append((path, os.path.basename(path)))
+            else:
+                raise ValueError(f"No such file or directory: {path}")
+
+    if name:
+        files = [(path, name.rstrip("/") + "/" + file_name)
+                 for path, file_name in files]
+    return files
+
+
+# Returns the (file path, file name) pairs where each requested file is
+# saved. A single file is saved at dst unless it is a directory, several
+# files are saved inside the directory dst
+def download_destinations(file_names, dst):
+    if len(file_names) == 1 and not (
+            os.path.isdir(dst) or dst.endswith(("/", os.sep))):
+        return [(dst, file_names[0])]
+    return [(os.path.join(dst, file_name), file_name)
+            for file_name in file_names]
+
+
+def _files_in_directory(directory):
+    files = []
+    for root, _, file_names in os.walk(directory):
+        for file_name in sorted(file_names):
+            path = os.path.join(root, file_name)
+            relative_path = os.path.relpath(path, directory)
+            files.append((path, relative_path.replace(os.sep, "/")))
+    return sorted(files)
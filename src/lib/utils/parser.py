@@ -1,7 +1,16 @@
 import argparse
-from lib.utils.constant import (DEFAULT_DOWNLOAD_DST,
-                                DEFAULT_SV_STORAGE, LOCALHOST,
-                                DEFAULT_SV_PORT)
+from lib.utils.compression import COMPRESSION_BY_NAME, LEVEL_RANGES, \
+    is_valid_level
+from lib.utils.constant import (DEFAULT_DOWNLOAD_DST, DEFAULT_PROFILE_DIR,
+                                DEFAULT_PROXY_PORT, DEFAULT_SV_CACHE_SIZE,
+                                DEFAULT_SV_BULK_WEIGHT,
+                                DEFAULT_SV_INTERACTIVE_SIZE,
+                                DEFAULT_SV_INTERACTIVE_WEIGHT,
+                                DEFAULT_SV_MAX_CONNECTIONS,
+                                DEFAULT_SV_RATE_LIMIT_BURST,
+                                DEFAULT_SV_RETRY_AFTER,
+                                DEFAULT_SV_STATS_FILE, DEFAULT_SV_STORAGE,
+                                LOCALHOST, DEFAULT_SV_PORT)
 
 # ====================== Pub functions ======================
 
@@ -17,46 +26,581 @@ def parse_server_args():
         help="specify the server's storage path",
     )
 
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_SV_CACHE_SIZE // (1024 * 1024),
+        metavar="MB",
+        help="memory budget of the cache of served files, 0 to disable it",
+    )
+
+    parser.add_argument(
+        "--fsync",
+        choices=["none", "close", "batch"],
+        default="none",
+        help="when to force the received files to disk",
+    )
+
+    parser.add_argument(
+        "--stats-file",
+        default=DEFAULT_SV_STATS_FILE,
+        metavar="FILEPATH",
+        help="where the stats of the connections are written as JSON on SIGUSR1",
+    )
+
+    parser.add_argument(
+        "--stats-port",
+        type=int,
+        metavar="PORT",
+        help="serve the stats of the connections in the Prometheus text format on this local TCP port",
+    )
+
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        default=0,
+        metavar="KBPS",
+        help="max KB per second sent on each connection, 0 for no limit",
+    )
+
+    parser.add_argument(
+        "--global-rate-limit",
+        type=int,
+        default=0,
+        metavar="KBPS",
+        help="max KB per second sent on all the connections together, 0 for no limit",
+    )
+
+    parser.add_argument(
+        "--rate-limit-burst",
+        type=int,
+        default=DEFAULT_SV_RATE_LIMIT_BURST // 1024,
+        metavar="KB",
+        help="KB the rate limits let through at once after being idle",
+    )
+
+    parser.add_argument(
+        "--no-scheduler",
+        action="store_true",
+        help="let the connections send as they go instead of taking turns by weighted fair queuing",
+    )
+
+    parser.add_argument(
+        "--interactive-weight",
+        type=float,
+        default=DEFAULT_SV_INTERACTIVE_WEIGHT,
+        metavar="WEIGHT",
+        help="share of the turns to send of the stats and the transferences up to --interactive-size",
+    )
+
+    parser.add_argument(
+        "--bulk-weight",
+        type=float,
+        default=DEFAULT_SV_BULK_WEIGHT,
+        metavar="WEIGHT",
+        help="share of the turns to send of the bigger transferences",
+    )
+
+    parser.add_argument(
+        "--interactive-size",
+        type=int,
+        default=DEFAULT_SV_INTERACTIVE_SIZE // 1024,
+        metavar="KB",
+        help="size up to which a transference is interactive",
+    )
+
+    parser.add_argument(
+        "--syn-cookies",
+        choices=["auto", "always", "never"],
+        default="auto",
+        help="when to answer new connections with a cookie to send back before taking them: with many handshakes going on, always or never",
+    )
+
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=DEFAULT_SV_MAX_CONNECTIONS,
+        metavar="N",
+        help="connections open at the same time, past them the new ones are asked to retry later, 0 for no limit",
+    )
+
+    parser.add_argument(
+        "--retry-after",
+        type=float,
+        default=DEFAULT_SV_RETRY_AFTER,
+        metavar="SECONDS",
+        help="time the new connections are asked to wait past --max-connections",
+    )
+
+    parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="serve every connection on a single asyncio event loop instead of a thread each; only uploads, downloads and stats, uncompressed, without rate limits nor scheduler",
+    )
+
+    _add_trace_args(parser)
+    _add_profile_args(parser)
+
     args = parser.parse_args()
+    # The asyncio server would take them and send as fast as it can
+    if args.asyncio and (args.rate_limit or args.global_rate_limit):
+        parser.error(
+            "--rate-limit and --global-rate-limit can't be used with --asyncio")
 
     return args
 
 
 # Returns an object containing all parsed args for the upload program
 def parse_upload_args():
-    parser = _get_parser_for_client_programs("Upload a file to the server")
+    parser = _get_parser_for_client_programs(
+        "Upload files to the server",
+        "name of the file in the server, or of the server directory to upload many files to")
 
     parser.add_argument(
-        "-s", "--src", dest="src", metavar="FILEPATH",
+        "-s", "--src", dest="src", metavar="FILEPATH", nargs="+",
         required=True,
-        help="path to the file to upload"
+        help="paths, directories or glob patterns of the files to upload"
+    )
+
+    parser.add_argument(
+        "--delta", action="store_true",
+        help="send only the parts of the file that changed from the server's copy"
     )
 
     args = parser.parse_args()
+    _check_transfer_args(parser, args)
+    if args.delta and (args.resume or args.streams > 1):
+        parser.error("--delta can't be used with --resume or --streams")
+    if args.name and len(args.name) > 1:
+        parser.error("only one --name can be given for uploads")
+    args.name = args.name[0] if args.name else None
 
     return args
 
 
 # Returns an object containing all parsed args for the download program
 def parse_download_args():
-    parser = _get_parser_for_client_programs("Download a file from the server")
+    parser = _get_parser_for_client_programs(
+        "Download files from the server",
+        "names of the files to request to the server")
 
     parser.add_argument(
         "-d", "--dst", dest="dst", metavar="FILEPATH",
         default=DEFAULT_DOWNLOAD_DST,
-        help="destination file path"
+        help="destination file path, or directory if many files are requested"
+    )
+
+    parser.add_argument(
+        "--offset", type=int, default=0, metavar="BYTES",
+        help="first byte of the range to download"
+    )
+
+    parser.add_argument(
+        "--length", type=int, default=0, metavar="BYTES",
+        help="size of the range to download, until the end of file if 0"
+    )
+
+    args = parser.parse_args()
+    _check_transfer_args(parser, args)
+    if not args.name:
+        parser.error("the following arguments are required: -n/--name")
+    if args.offset < 0 or args.length < 0:
+        parser.error("--offset and --length can't be negative")
+    if (args.resume or args.streams > 1 or len(args.name) > 1) and \
+            (args.offset or args.length):
+        parser.error(
+            "--offset/--length can't be used with --resume, --streams or many files")
+
+    return args
+
+
+# Returns an object containing all parsed args for the impairment proxy.
+# Percentages and milliseconds are left as given
+def parse_proxy_args():
+    parser = argparse.ArgumentParser(
+        description="Forward UDP traffic to the server through an impaired link")
+    _add_verbosity_args(parser)
+
+    parser.add_argument(
+        "-H", "--host", default=LOCALHOST, metavar="ADDR",
+        help="the proxy's listening IP address",
+    )
+    parser.add_argument(
+        "-p", "--port", type=int, default=DEFAULT_PROXY_PORT,
+        help="the proxy's listening port, where clients connect",
+    )
+    parser.add_argument(
+        "--server-host", default=LOCALHOST, metavar="ADDR",
+        help="the server's listening IP address",
+    )
+    parser.add_argument(
+        "--server-port", type=int, default=DEFAULT_SV_PORT, metavar="PORT",
+        help="the server's listening port",
+    )
+
+    parser.add_argument(
+        "--loss", type=float, default=0, metavar="PERCENT",
+        help="independent loss of each segment",
+    )
+    parser.add_argument(
+        "--burst-loss", type=float, nargs=2, metavar=("P", "R"),
+        help="Gilbert-Elliott bursty loss: percent chance of going from the "
+        "good to the bad state (P) and back (R). --loss applies in the good "
+        "state",
+    )
+    parser.add_argument(
+        "--bad-state-loss", type=float, default=100, metavar="PERCENT",
+        help="loss in the bad state of --burst-loss",
+    )
+    parser.add_argument(
+        "--delay", type=float, default=0, metavar="MS",
+        help="one way delay",
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0, metavar="MS",
+        help="random variation of the delay, up to this much either way",
+    )
+    parser.add_argument(
+        "--reorder", type=float, default=0, metavar="PERCENT",
+        help="segments held back so later ones overtake them",
+    )
+    parser.add_argument(
+        "--reorder-gap", type=float, default=10, metavar="MS",
+        help="extra delay of the reordered segments",
+    )
+    parser.add_argument(
+        "--duplicate", type=float, default=0, metavar="PERCENT",
+        help="segments delivered twice",
+    )
+    parser.add_argument(
+        "--corrupt", type=float, default=0, metavar="PERCENT",
+        help="segments with a bit flipped",
+    )
+    parser.add_argument(
+        "--bandwidth", type=float, default=0, metavar="KBIT",
+        help="link rate in kbit/s, 0 for unlimited",
+    )
+    parser.add_argument(
+        "--queue", type=int, default=100, metavar="SEGMENTS",
+        help="segments waiting for a --bandwidth limited link before "
+        "dropping new ones",
+    )
+    parser.add_argument(
+        "--direction", choices=["both", "up", "down"], default="both",
+        help="impair segments to the server (up), to the client (down) or both",
+    )
+    parser.add_argument(
+        "--seed", type=int,
+        help="seed of the random decisions, to reproduce a run",
+    )
+
+    args = parser.parse_args()
+    percentages = [args.loss, args.bad_state_loss, args.reorder,
+                   args.duplicate, args.corrupt] + (args.burst_loss or [])
+    if any(not 0 <= percentage <= 100 for percentage in percentages):
+        parser.error("percentages must be between 0 and 100")
+    if min(args.delay, args.jitter, args.reorder_gap, args.bandwidth) < 0:
+        parser.error("times and bandwidth can't be negative")
+    if args.queue < 1:
+        parser.error("--queue must be at least 1")
+
+    return args
+
+
+# Returns an object containing all parsed args for the benchmark program
+def parse_benchmark_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark transferences between a local server and clients")
+    _add_verbosity_args(parser)
+
+    parser.add_argument(
+        "--protocols", nargs="+", choices=["saw", "sr"], default=["saw", "sr"],
+        help="protocols to benchmark",
+    )
+    parser.add_argument(
+        "--directions", nargs="+", choices=["upload", "download"],
+        default=["upload", "download"],
+        help="transference directions to benchmark",
+    )
+    parser.add_argument(
+        "--sizes", nargs="+", type=_size, default=[1024, 64 * 1024, 1024 * 1024],
+        metavar="SIZE",
+        help="file sizes, in bytes or with a K, M or G suffix",
+    )
+    parser.add_argument(
+        "--clients", nargs="+", type=int, default=[1], metavar="N",
+        help="numbers of clients transferring at the same time",
+    )
+    parser.add_argument(
+        "--loss", nargs="+", type=float, default=[0], metavar="PERCENT",
+        help="loss rates, emulated with the impairment proxy",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=1, metavar="N",
+        help="runs of each scenario, the median of each metric is reported",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="seed of the file contents and of the emulated loss",
+    )
+    parser.add_argument(
+        "--in-process", action="store_true",
+        help="run the clients in this process instead of a subprocess",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=600, metavar="SECONDS",
+        help="time limit for the clients of each scenario",
+    )
+    parser.add_argument(
+        "-o", "--output", metavar="FILEPATH",
+        help="save the results as JSON",
+    )
+    parser.add_argument(
+        "--baseline", metavar="FILEPATH",
+        help="compare the results with those saved in a previous run",
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=10, metavar="PERCENT",
+        help="change of a metric over the baseline reported as a regression",
     )
+    # Internal: runs the clients of a scenario read from stdin
+    parser.add_argument("--worker", action="store_true",
+                        help=argparse.SUPPRESS)
 
     args = parser.parse_args()
+    if min(args.clients) < 1 or args.repeat < 1:
+        parser.error("--clients and --repeat must be at least 1")
+    if any(not 0 <= loss < 100 for loss in args.loss):
+        parser.error("--loss must be between 0 and 100")
+    if max(args.sizes) > 500 * 1024 * 1024:
+        parser.error("the server does not take files over 500 MB")
+
+    return args
+
+
+# Returns an object containing all parsed args for the microbenchmark
+# program
+def parse_microbenchmark_args():
+    parser = argparse.ArgumentParser(
+        description="Time the per packet encoding and window primitives")
+    _add_verbosity_args(parser)
+
+    parser.add_argument(
+        "-k", "--filter", metavar="TEXT",
+        help="run only the benchmarks whose name contains TEXT",
+    )
+    parser.add_argument(
+        "--window-sizes", nargs="+", type=int, default=[1, 8, 64, 512, 4096],
+        metavar="N",
+        help="window sizes of the sliding window benchmarks",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, metavar="N",
+        help="timed runs of each benchmark, the best one is reported",
+    )
+    parser.add_argument(
+        "--min-time", type=float, default=0.2, metavar="SECONDS",
+        help="minimum duration of each timed run",
+    )
+    parser.add_argument(
+        "--no-allocations", action="store_true",
+        help="skip measuring the allocations with tracemalloc",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="seed of the arrival order in the reordered benchmarks",
+    )
+    parser.add_argument(
+        "-o", "--output", metavar="FILEPATH",
+        help="save the results as JSON",
+    )
+    parser.add_argument(
+        "--baseline", metavar="FILEPATH",
+        help="compare the results with those saved in a previous run",
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=10, metavar="PERCENT",
+        help="slowdown over the baseline reported as a regression",
+    )
+
+    args = parser.parse_args()
+    if args.repeat < 1 or min(args.window_sizes) < 1:
+        parser.error("--repeat and --window-sizes must be at least 1")
+
+    return args
+
+
+# Returns an object containing all parsed args for the load generator
+def parse_load_generator_args():
+    parser = _get_parser_with_common_args(
+        "Open many client connections against a server to find its limits")
+
+    parser.add_argument(
+        "-c", "--clients", type=int, default=100, metavar="N",
+        help="number of clients, each one uploads or downloads one file",
+    )
+    parser.add_argument(
+        "--rate", type=float, default=0, metavar="PER_SECOND",
+        help="mean arrivals of clients per second, 0 to start all at once",
+    )
+    parser.add_argument(
+        "--max-concurrent", type=int, metavar="N",
+        help="clients connected at the same time, the rest wait their turn",
+    )
+    parser.add_argument(
+        "--file-size", type=_size, default=64 * 1024, metavar="SIZE",
+        help="mean file size, in bytes or with a K, M or G suffix",
+    )
+    parser.add_argument(
+        "--size-distribution", choices=["fixed", "exponential", "lognormal"],
+        default="fixed",
+        help="distribution of the file sizes around their mean",
+    )
+    parser.add_argument(
+        "--upload-ratio", type=float, default=0.5, metavar="RATIO",
+        help="fraction of the clients that upload, the rest download",
+    )
+    parser.add_argument(
+        "--interval", type=float, default=1, metavar="SECONDS",
+        help="width of the buckets of the report over time",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="seed of the arrivals, file sizes and file contents",
+    )
+    parser.add_argument(
+        "-o", "--output", metavar="FILEPATH",
+        help="save the results as JSON",
+    )
+
+    args = parser.parse_args()
+    if args.clients < 1 or (args.max_concurrent is not None
+                            and args.max_concurrent < 1):
+        parser.error("--clients and --max-concurrent must be at least 1")
+    if args.rate < 0 or args.interval <= 0:
+        parser.error("--rate can not be negative and --interval must be positive")
+    if not 0 <= args.upload_ratio <= 1:
+        parser.error("--upload-ratio must be between 0 and 1")
+    if not 0 < args.file_size <= 500 * 1024 * 1024:
+        parser.error("--file-size must be between 1 byte and 500 MB")
+
+    return args
+
+
+# Returns an object containing all parsed args for the simulator.
+# Percentages and milliseconds are left as given
+def parse_simulator_args():
+    parser = argparse.ArgumentParser(
+        description="Simulate transferences over an in-memory network with a virtual clock")
+    _add_verbosity_args(parser)
+
+    parser.add_argument(
+        "--protocols", nargs="+", choices=["saw", "sr"], default=["saw", "sr"],
+        help="protocols to simulate",
+    )
+    parser.add_argument(
+        "--directions", nargs="+", choices=["upload", "download"],
+        default=["upload"],
+        help="transference directions to simulate",
+    )
+    parser.add_argument(
+        "--sizes", nargs="+", type=_size, default=[64 * 1024],
+        metavar="SIZE",
+        help="file sizes, in bytes or with a K, M or G suffix",
+    )
+    parser.add_argument(
+        "--loss", nargs="+", type=float, default=[0, 5], metavar="PERCENT",
+        help="independent loss rates of each segment",
+    )
+    parser.add_argument(
+        "--window-sizes", nargs="+", type=int, default=[5], metavar="N",
+        help="Selective Repeat window sizes",
+    )
+    parser.add_argument(
+        "--timeouts", nargs="+", type=float, default=[200], metavar="MS",
+        help="retransmission timeouts",
+    )
+    parser.add_argument(
+        "--delay", type=float, default=10, metavar="MS",
+        help="one way delay",
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0, metavar="MS",
+        help="random variation of the delay, up to this much either way",
+    )
+    parser.add_argument(
+        "--reorder", type=float, default=0, metavar="PERCENT",
+        help="segments held back so later ones overtake them",
+    )
+    parser.add_argument(
+        "--reorder-gap", type=float, default=10, metavar="MS",
+        help="extra delay of the reordered segments",
+    )
+    parser.add_argument(
+        "--duplicate", type=float, default=0, metavar="PERCENT",
+        help="segments delivered twice",
+    )
+    parser.add_argument(
+        "--corrupt", type=float, default=0, metavar="PERCENT",
+        help="segments with a bit flipped",
+    )
+    parser.add_argument(
+        "--bandwidth", type=float, default=0, metavar="KBIT",
+        help="link rate in kbit/s, 0 for unlimited",
+    )
+    parser.add_argument(
+        "--queue", type=int, default=100, metavar="SEGMENTS",
+        help="segments waiting for a --bandwidth limited link before "
+        "dropping new ones",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=10, metavar="N",
+        help="runs of each combination, each with its own seed",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="seed of the first run, the following ones use the next seeds",
+    )
+    parser.add_argument(
+        "--time-limit", type=float, default=3600, metavar="SECONDS",
+        help="virtual time after which a run is given up",
+    )
+    parser.add_argument(
+        "-o", "--output", metavar="FILEPATH",
+        help="save the results as JSON",
+    )
+
+    args = parser.parse_args()
+    percentages = args.loss + [args.reorder, args.duplicate, args.corrupt]
+    if any(not 0 <= percentage <= 100 for percentage in percentages):
+        parser.error("percentages must be between 0 and 100")
+    if min(args.delay, args.jitter, args.reorder_gap, args.bandwidth) < 0:
+        parser.error("times and bandwidth can't be negative")
+    if min(args.window_sizes) < 1 or args.runs < 1 or args.queue < 1:
+        parser.error("--window-sizes, --runs and --queue must be at least 1")
+    if min(args.timeouts) <= 0 or args.time_limit <= 0:
+        parser.error("--timeouts and --time-limit must be positive")
 
     return args
 
 
 # ====================== Priv functions ======================
 
-# Returns a parser with the common arguments for the client and server
-def _get_parser_with_common_args(command_description: str):
-    parser = argparse.ArgumentParser(description=command_description)
+# Parses sizes like 1024, 64K or 500M
+def _size(value: str):
+    multipliers = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    multiplier = multipliers.get(value[-1:].upper(), 1)
+    number = value[:-1] if multiplier > 1 else value
+    try:
+        size = int(float(number) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {value}")
+    if size < 0:
+        raise argparse.ArgumentTypeError(f"invalid size: {value}")
+    return size
+
+
+def _add_verbosity_args(parser):
     exclusive_group = parser.add_mutually_exclusive_group()
     # group to require only one of the two following arguments
     exclusive_group.add_argument(
@@ -67,6 +611,12 @@ def _get_parser_with_common_args(command_description: str):
         "-q", "--quiet", action="store_true", help="decrease output verbosity"
     )
 
+
+# Returns a parser with the common arguments for the client and server
+def _get_parser_with_common_args(command_description: str):
+    parser = argparse.ArgumentParser(description=command_description)
+    _add_verbosity_args(parser)
+
     parser.add_argument(
         "-H",
         "--host",
@@ -102,15 +652,99 @@ def _get_parser_with_common_args(command_description: str):
 
 # Returns a parser with the common arguments for
 # the client programs (upload and download)
-def _get_parser_for_client_programs(command_description: str):
+def _get_parser_for_client_programs(command_description: str,
+                                    name_help: str):
     parser = _get_parser_with_common_args(command_description)
 
     parser.add_argument(
         "-n", "--name",
         dest="name",
-        required=True,
+        nargs="+",
         metavar="FILENAME",
-        help="name of the file to request to the server"
+        help=name_help
+    )
+
+    parser.add_argument(
+        "--streams",
+        type=int,
+        default=1,
+        metavar="N",
+        help="split the file transference over N parallel connections"
+    )
+
+    parser.add_argument(
+        "--multiplex",
+        type=int,
+        default=1,
+        metavar="N",
+        help="transfer up to N files at the same time over a single connection"
+    )
+
+    parser.add_argument(
+        "--compression",
+        choices=["none", "zlib", "lzma", "zstd"],
+        default="none",
+        help="compress the file data on the wire (zstd falls back to zlib if not installed)"
+    )
+
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        default=None,
+        metavar="LEVEL",
+        help="compression level: 1-9 for zlib, 0-9 for lzma, 1-22 for zstd, the default of each algorithm if not given"
     )
 
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue a previously interrupted transference"
+    )
+
+    _add_trace_args(parser)
+    _add_profile_args(parser)
+
     return parser
+
+
+def _add_trace_args(parser):
+    parser.add_argument(
+        "--trace",
+        metavar="FILEPATH",
+        help="write every segment sent and received to a pcapng file (.pcap or .pcapng) or to a qlog JSON file",
+    )
+
+
+def _add_profile_args(parser):
+    parser.add_argument(
+        "--profile",
+        choices=["cprofile", "sample", "memory"],
+        help="profile each connection with cProfile, a stack sampler (collapsed stacks for flame graphs) or tracemalloc",
+    )
+
+    parser.add_argument(
+        "--profile-dir",
+        default=DEFAULT_PROFILE_DIR,
+        metavar="DIRPATH",
+        help="where the profile of each connection is written when it closes",
+    )
+
+
+# Checks the transfer options shared by the client programs. Exits with an
+# error if the compression level is not one of the algorithm, if --resume
+# or --multiplex are combined with striped transferences, or if --streams
+# is not positive
+def _check_transfer_args(parser, args):
+    compression = COMPRESSION_BY_NAME[args.compression]
+    if not is_valid_level(compression, args.compression_level):
+        levels = LEVEL_RANGES[compression]
+        if not levels:
+            parser.error("--compression-level needs a --compression")
+        parser.error(
+            f"{args.compression} compression levels go from {levels.start} to {levels[-1]}")
+    if args.streams < 1:
+        parser.error("--streams must be at least 1")
+    if args.resume and args.streams > 1:
+        parser.error("--resume can't be used with --streams")
+    if args.multiplex > 1 and args.streams > 1:
+        parser.error("--multiplex can't be used with --streams")
@@ -0,0 +1,84 @@
+import logging
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+
+
+# Iterates over the next length bytes of a FileHandler in chunks of
+# chunk_size, read by a thread that keeps up to depth chunks ahead of the
+# consumer, so the disk reads overlap with the sends. With depth 0 the
+# chunks are read by the consumer itself
+class ReadAheadReader:
+
+    PUT_TIMEOUT = 0.1
+
+    _END = None
+
+    def __init__(self, file_handler, length, chunk_size, depth):
+        self.file_handler = file_handler
+        self.length = length
+        self.chunk_size = chunk_size
+        self.depth = depth
+        self.error = None
+        self.stopped = Event()
+        self.queue = None
+        self.thread = None
+
+    def __iter__(self):
+        if self.depth <= 0:
+            yield from self._read_chunks()
+            return
+
+        self.queue = Queue(maxsize=self.depth)
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+        try:
+            while True:
+                chunk = self.queue.get()
+                if chunk is self._END:
+                    break
+                yield chunk
+        finally:
+            self.close()
+        if self.error:
+            raise self.error
+
+    # Stops the reading thread, needed when the consumer stops early
+    def close(self):
+        self.stopped.set()
+        if self.thread:
+            self._drain()
+            self.thread.join()
+            self.thread = None
+
+    def _read_chunks(self):
+        self.file_handler.advise_sequential(self.length)
+        for position in range(0, self.length, self.chunk_size):
+            yield self.file_handler.read(
+                min(self.chunk_size, self.length - position))
+
+    def _run(self):
+        try:
+            for chunk in self._read_chunks():
+                if not self._put(chunk):
+                    return
+        except Exception as e:
+            logging.error(f"[READ AHEAD] Error reading file: {e}")
+            self.error = e
+        self._put(self._END)
+
+    # Blocks while the queue is full, unless the reader was closed
+    def _put(self, chunk):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(chunk, timeout=self.PUT_TIMEOUT)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _drain(self):
+        try:
+            while True:
+                self.queue.get_nowait()
+        except Empty:
+            pass
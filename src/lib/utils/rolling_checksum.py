@@ -0,0 +1,82 @@
+import hashlib
+import math
+from itertools import accumulate, compress, repeat
+from operator import and_, sub
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+MIN_BLOCK_SIZE = 512
+MAX_BLOCK_SIZE = 2**16
+STRONG_CHECKSUM_SIZE = 16
+
+
+# rsync block size heuristic: square root of the file size
+def choose_block_size(file_size):
+    block_size = math.isqrt(file_size) // 8 * 8
+    return min(max(block_size, MIN_BLOCK_SIZE), MAX_BLOCK_SIZE)
+
+
+# rsync weak checksum: a = sum(x_i), b = sum((L - i) * x_i), both mod 2^16.
+# b is also the sum of the prefix sums of the block
+def weak_checksum(block: bytes):
+    prefix_sums = list(accumulate(block))
+    return _combine(prefix_sums[-1], sum(prefix_sums))
+
+
+def strong_checksum(block: bytes):
+    return hashlib.blake2b(block, digest_size=STRONG_CHECKSUM_SIZE).digest()
+
+
+# Finds the offsets of data where a block_size window has one of the given
+# weak checksums. The whole batch is processed at once instead of rolling
+# the checksum byte by byte: windows are first filtered by the low half of
+# the checksum and the full checksum is only computed for the survivors.
+# Returns a list of (offset, weak checksum)
+def find_weak_matches(data: bytes, block_size, weak_checksums):
+    windows = len(data) - block_size + 1
+    if windows <= 0 or not weak_checksums:
+        return []
+    if np is not None:
+        return _numpy_find_weak_matches(
+            data, block_size, windows, weak_checksums)
+
+    # S[j] = sum(x_i, i < j), P[j] = sum(S_i, i <= j)
+    # a_k = S[k+L] - S[k], b_k = P[k+L] - P[k] - L * S[k]
+    low_halves = {weak & 0xffff for weak in weak_checksums}
+    s = list(accumulate(data, initial=0))
+    a = list(map(sub, s[block_size:], s[:windows]))
+    candidates = list(compress(
+        range(windows),
+        map(low_halves.__contains__, map(and_, a, repeat(0xffff)))
+    ))
+    if not candidates:
+        return []
+
+    p = list(accumulate(s))
+    matches = []
+    for k in candidates:
+        b = p[k + block_size] - p[k] - block_size * s[k]
+        weak = _combine(a[k], b)
+        if weak in weak_checksums:
+            matches.append((k, weak))
+    return matches
+
+
+def _numpy_find_weak_matches(data, block_size, windows, weak_checksums):
+    x = np.frombuffer(data, dtype=np.uint8).astype(np.int64)
+    s = np.concatenate(([0], np.cumsum(x)))
+    p = np.cumsum(s)
+    a = s[block_size:] - s[:windows]
+    b = p[block_size:] - p[:windows] - block_size * s[:windows]
+    weak = (a & 0xffff) | ((b & 0xffff) << 16)
+    offsets = np.nonzero(
+        np.isin(weak, np.fromiter(weak_checksums, dtype=np.int64)))[0]
+    return list(zip(offsets.tolist(), weak[offsets].tolist()))
+
+
+def _combine(a, b):
+    return (a & 0xffff) | ((b & 0xffff) << 16)
@@ -0,0 +1,145 @@
+import logging
+import os
+from threading import Lock
+from lib.utils.exceptions import FileHandlerError
+from lib.utils.file_handling import FileHandler
+
+
+# Blocks of a file that is being sent to one or more connections at the
+# same time. Each block is read from disk once and kept until every reader
+# has gone past it. The segments queued in the windows are views of these
+# blocks, so a block is freed once it is dropped here and every connection
+# got the acks of its segments
+class SharedFile:
+
+    def __repr__(self):
+        return f"SharedFile(readers={len(self.positions)}, blocks={len(self.blocks)}, disk_reads={self.disk_reads})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __init__(self, key, block_size):
+        self.key = key
+        self.block_size = block_size
+        self.lock = Lock()
+
+        self.blocks = {}  # block index -> bytes
+        self.positions = {}  # reader -> position of its next read
+        self.disk_reads = 0
+
+    # Returns the block, reading it with read_from_disk if no other reader
+    # has it loaded
+    def get_block(self, index, read_from_disk) -> bytes:
+        with self.lock:
+            block = self.blocks.get(index)
+            if block is None:
+                block = read_from_disk(
+                    index * self.block_size, self.block_size)
+                self.blocks[index] = block
+                self.disk_reads += 1
+            return block
+
+    def move_reader(self, reader, position):
+        with self.lock:
+            self.positions[reader] = position
+            self._drop_passed_blocks()
+
+    def _drop_passed_blocks(self):
+        if not self.positions:
+            self.blocks.clear()
+            return
+        first_needed = min(self.positions.values()) // self.block_size
+        for index in [i for i in self.blocks if i < first_needed]:
+            del self.blocks[index]
+
+
+# Server side registry of the files being sent, so that concurrent downloads
+# of the same file version share a single SharedFile
+class SharedFileStore:
+
+    def __init__(self, block_size=FileHandler.MAX_RW_SIZE):
+        self.block_size = block_size
+        self.lock = Lock()
+        self.files = {}  # (file path, mtime) -> SharedFile
+
+    def open(self, file_path, reader) -> SharedFile:
+        try:
+            key = (file_path, os.stat(file_path).st_mtime_ns)
+        except OSError:
+            logging.error("[FILE HANDLER] Error opening file: " + file_path)
+            raise FileHandlerError("[FILE HANDLER] Error opening file")
+
+        with self.lock:
+            shared_file = self.files.get(key)
+            if shared_file is None:
+                shared_file = SharedFile(key, self.block_size)
+                self.files[key] = shared_file
+            else:
+                logging.info(
+                    f"[SHARED FILE] Joining the readers of {file_path}: {shared_file}")
+            shared_file.move_reader(reader, 0)
+        return shared_file
+
+    def close(self, shared_file: SharedFile, reader):
+        with self.lock:
+            with shared_file.lock:
+                shared_file.positions.pop(reader, None)
+                shared_file._drop_passed_blocks()
+                if shared_file.positions:
+                    return
+            if self.files.get(shared_file.key) is shared_file:
+                del self.files[shared_file.key]
+        logging.debug(f"[SHARED FILE] Released {shared_file.key[0]}: {shared_file}")
+
+
+# Read only FileHandler that takes the blocks of the file from a
+# SharedFileStore, and reads the missing ones with the wrapped handler.
+# read() returns views of the shared blocks instead of copies
+class SharedFileHandler(FileHandler):
+
+    def __init__(self, store: SharedFileStore, file_handler: FileHandler):
+        self.file_handler = file_handler
+        self.file_path = file_handler.get_file_path()
+        self.file_name = file_handler.get_file_name()
+        self.mode = "rb"
+        self.read_ahead_size = file_handler.read_ahead_size
+        self.read_ahead_depth = file_handler.read_ahead_depth
+        self.file = None
+        self.position = 0
+
+        self.store = store
+        self.shared_file = store.open(self.file_path, self)
+
+    def size(self):
+        return self.file_handler.size()
+
+    def exists(self):
+        return self.file_handler.exists()
+
+    def read(self, read_size):
+        block_size = self.shared_file.block_size
+        end = min(self.position + read_size, self.size())
+        pieces = []
+        while self.position < end:
+            index = self.position // block_size
+            block = self.shared_file.get_block(index, self._read_from_disk)
+            start = self.position - index * block_size
+            piece = memoryview(block)[start:start + end - self.position]
+            if not piece:
+                break
+            pieces.append(piece)
+            self.position += len(piece)
+        self.shared_file.move_reader(self, self.position)
+        return pieces[0] if len(pieces) == 1 else b''.join(pieces)
+
+    def seek(self, offset):
+        self.position = offset
+        self.shared_file.move_reader(self, offset)
+
+    def close(self):
+        self.store.close(self.shared_file, self)
+        self.file_handler.close()
+
+    def _read_from_disk(self, offset, size):
+        self.file_handler.seek(offset)
+        return self.file_handler.read(size)
@@ -0,0 +1,80 @@
+import logging
+from queue import Empty, Queue
+from threading import Thread
+from lib.utils.file_handling import FileHandler
+
+
+# Writes to a FileHandler from a dedicated thread, so the thread that
+# receives (and acks) the segments never waits for the disk. Queued chunks
+# are joined into bigger writes. When the queue is full write() blocks,
+# the receiver stops reading from the stream and the sender's window
+# stalls instead of the queue growing without limit
+class WriteBehindWriter:
+
+    FSYNC_NONE = "none"
+    FSYNC_ON_CLOSE = "close"
+    FSYNC_EVERY_BATCH = "batch"
+    FSYNC_POLICIES = (FSYNC_NONE, FSYNC_ON_CLOSE, FSYNC_EVERY_BATCH)
+
+    MAX_QUEUED_CHUNKS = 64
+    MAX_BATCH_SIZE = 2**20
+
+    _STOP = None
+
+    def __init__(self, file_handler: FileHandler, fsync_policy=FSYNC_NONE):
+        self.file_handler = file_handler
+        self.fsync_policy = fsync_policy
+        self.queue = Queue(maxsize=self.MAX_QUEUED_CHUNKS)
+        self.error = None
+        self.written_bytes = 0
+        self.writes = 0
+
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, data):
+        self._raise_if_failed()
+        if data:
+            self.queue.put(data)
+
+    # Waits until every queued chunk is written. Does not close the file
+    def close(self):
+        self.queue.put(self._STOP)
+        self.thread.join()
+        self._raise_if_failed()
+        if self.fsync_policy == self.FSYNC_ON_CLOSE:
+            self.file_handler.fsync()
+        logging.debug(
+            f"[WRITE BEHIND] Wrote {self.written_bytes} bytes in {self.writes} writes to {self.file_handler.get_file_path()}")
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self.queue.get()]
+            size = 0 if batch[0] is self._STOP else len(batch[0])
+            while size < self.MAX_BATCH_SIZE and batch[-1] is not self._STOP:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+                if batch[-1] is not self._STOP:
+                    size += len(batch[-1])
+            if batch[-1] is self._STOP:
+                stopping = True
+                batch.pop()
+
+            if not batch or self.error:
+                continue
+            try:
+                self.file_handler.write(b''.join(batch))
+                if self.fsync_policy == self.FSYNC_EVERY_BATCH:
+                    self.file_handler.fsync()
+                self.written_bytes += size
+                self.writes += 1
+            except Exception as e:
+                # Keep draining the queue so the receiver never blocks
+                self.error = e
+
+    def _raise_if_failed(self):
+        if self.error:
+            raise self.error
@@ -0,0 +1,35 @@
+import logging
+from lib.perf.load_generator import (LoadGenerator, format_results,
+                                     save_results)
+from lib.utils.constant import SelectedProtocol
+from lib.utils.log_setup import configure_logger
+from lib.utils.parser import parse_load_generator_args
+
+
+def main():
+    args = parse_load_generator_args()
+    configure_logger(args, "load-generator.log")
+
+    protocol = SelectedProtocol.SELECTIVE_REPEAT if args.selective_repeat else SelectedProtocol.STOP_AND_WAIT
+
+    generator = LoadGenerator(
+        args.host, args.port, protocol, args.clients, args.rate,
+        args.max_concurrent, args.file_size, args.size_distribution,
+        args.upload_ratio, args.interval, args.seed)
+    try:
+        results = generator.run()
+    except KeyboardInterrupt:
+        logging.error("Load generator interrupted")
+        exit(1)
+    except ValueError as e:
+        logging.error("Error generating load: " + str(e))
+        exit(1)
+
+    print("\n".join(format_results(results)))
+    if args.output:
+        save_results(results, args.output)
+        logging.info(f"[LOAD GENERATOR] Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import json
+import logging
+from lib.perf.microbenchmark import (compare, format_results,
+                                     microbenchmarks, run_microbenchmarks)
+from lib.utils.log_setup import configure_logger
+from lib.utils.parser import parse_microbenchmark_args
+
+
+def main():
+    args = parse_microbenchmark_args()
+    configure_logger(args, "microbenchmark.log")
+
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error("Error loading baseline: " + str(e))
+            exit(1)
+
+    benchmarks = [benchmark
+                  for benchmark in microbenchmarks(args.window_sizes, args.seed)
+                  if not args.filter or args.filter in benchmark.name]
+    results = run_microbenchmarks(benchmarks, args.repeat, args.min_time,
+                                  not args.no_allocations)
+
+    print("\n".join(format_results(results)))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if baseline:
+        lines, regressions = compare(results, baseline, args.threshold)
+        print("\n".join(lines))
+        if regressions:
+            logging.error(
+                f"[MICROBENCHMARK] {regressions} benchmarks got slower than {args.threshold}%")
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
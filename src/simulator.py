@@ -0,0 +1,43 @@
+import logging
+from lib.perf.impairment_proxy import LinkImpairments
+from lib.perf.simulator import format_results, save_results, sweep
+from lib.utils.log_setup import configure_logger
+from lib.utils.parser import parse_simulator_args
+
+
+def main():
+    args = parse_simulator_args()
+    configure_logger(args, "simulator.log")
+    # The streams log each connection they open, too much for thousands of
+    # runs unless asked for with -v
+    if not args.verbose:
+        logging.getLogger().setLevel(
+            max(logging.getLogger().level, logging.WARNING))
+
+    impairments = LinkImpairments(
+        delay=args.delay / 1000,
+        jitter=args.jitter / 1000,
+        reorder=args.reorder / 100,
+        reorder_gap=args.reorder_gap / 1000,
+        duplicate=args.duplicate / 100,
+        corrupt=args.corrupt / 100,
+        bandwidth=args.bandwidth * 1000 / 8,
+        queue_size=args.queue,
+    )
+    timeouts = [timeout / 1000 for timeout in args.timeouts]
+    try:
+        results = sweep(args.protocols, args.directions, args.sizes,
+                        args.loss, args.window_sizes, timeouts, impairments,
+                        args.runs, args.seed, args.time_limit)
+    except KeyboardInterrupt:
+        logging.error("Simulation interrupted")
+        exit(1)
+
+    print("\n".join(format_results(results)))
+    if args.output:
+        save_results(results, args.output)
+        logging.info(f"[SIMULATOR] Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,16 @@
+import asyncio
 import logging
-from lib.utils.constant import SelectedProtocol
+import signal
+from lib.perf.profiler import Profiler
+from lib.sockets_rdt.fair_scheduler import BULK, INTERACTIVE, FairScheduler
+from lib.sockets_rdt.segment_trace import SegmentTracer
+from lib.sockets_rdt.stats_export import serve_prometheus
+from lib.sockets_rdt.stream_rdt import StreamRDT
+from lib.utils.constant import LOCALHOST, SelectedProtocol
 from lib.utils.log_setup import configure_logger
 from lib.utils.parser import parse_server_args
 from lib.server import ServerRDT
+from lib.async_server import AsyncServerRDT
 
 
 def main():
@@ -11,12 +19,71 @@ def main():
 
     protocol = SelectedProtocol.SELECTIVE_REPEAT if args.selective_repeat else SelectedProtocol.STOP_AND_WAIT
 
-    server = ServerRDT(args.host, args.port, protocol)
+    profiler = None
+    if args.profile:
+        try:
+            profiler = Profiler.open(args.profile, args.profile_dir)
+        except OSError as e:
+            logging.error("Error creating profile directory: " + str(e))
+            exit(1)
+
     try:
-        server.run()
+        scheduler = None if args.no_scheduler else FairScheduler(
+            {INTERACTIVE: args.interactive_weight, BULK: args.bulk_weight})
+        if args.asyncio:
+            server = AsyncServerRDT(args.host, args.port, protocol,
+                                    args.cache_size * 1024 * 1024,
+                                    args.syn_cookies, args.max_connections,
+                                    args.retry_after)
+        else:
+            server = ServerRDT(args.host, args.port, protocol,
+                               args.cache_size * 1024 * 1024, args.fsync,
+                               profiler, args.rate_limit * 1024,
+                               args.global_rate_limit * 1024,
+                               args.rate_limit_burst * 1024, scheduler,
+                               args.interactive_size * 1024, args.syn_cookies,
+                               args.max_connections, args.retry_after)
+    except ValueError as e:
+        logging.error("Invalid server settings: " + str(e))
+        exit(1)
+
+    signal.signal(signal.SIGUSR1,
+                  lambda *_: server.dump_stats(args.stats_file))
+    if args.stats_port is not None:
+        try:
+            serve_prometheus(LOCALHOST, args.stats_port,
+                             server.stats_snapshot)
+        except OSError as e:
+            logging.error("Error serving stats: " + str(e))
+            exit(1)
+
+    if args.trace:
+        try:
+            StreamRDT.tracer = SegmentTracer.open(args.trace, "server")
+        except OSError as e:
+            logging.error("Error opening trace file: " + str(e))
+            exit(1)
+
+    try:
+        if args.asyncio:
+            run_async(server)
+        else:
+            server.run()
     except Exception as e:
         logging.error("Error running server: " + str(e))
         exit(1)
+    finally:
+        if StreamRDT.tracer:
+            StreamRDT.tracer.close()
+        if profiler:
+            profiler.close()
+
+
+def run_async(server: AsyncServerRDT):
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        logging.debug("[SERVER] Keyboard interrupt received, closing server")
 
 
 if __name__ == "__main__":
@@ -1,4 +1,11 @@
+import logging
+from contextlib import nullcontext
+from lib.perf.profiler import Profiler
+from lib.sockets_rdt.segment_trace import SegmentTracer
+from lib.sockets_rdt.stream_rdt import StreamRDT
+from lib.utils.compression import COMPRESSION_BY_NAME
 from lib.utils.constant import SelectedProtocol
+from lib.utils.file_selection import files_to_upload
 from lib.utils.log_setup import configure_logger
 from lib.utils.parser import parse_upload_args
 from lib.client import ClientRDT
@@ -10,8 +17,46 @@ def main():
 
     protocol = SelectedProtocol.SELECTIVE_REPEAT if args.selective_repeat else SelectedProtocol.STOP_AND_WAIT
 
-    client = ClientRDT(args.host, args.port, protocol)
-    client.upload(args.src, args.name)
+    compression = COMPRESSION_BY_NAME[args.compression]
+
+    try:
+        files = files_to_upload(args.src, args.name)
+    except ValueError as e:
+        logging.error("[CLIENT UPLOAD] " + str(e))
+        exit(1)
+
+    if args.trace:
+        try:
+            StreamRDT.tracer = SegmentTracer.open(args.trace, "client")
+        except OSError as e:
+            logging.error("[CLIENT UPLOAD] Error opening trace file: " + str(e))
+            exit(1)
+
+    profiler = None
+    if args.profile:
+        try:
+            profiler = Profiler.open(args.profile, args.profile_dir)
+        except OSError as e:
+            logging.error("[CLIENT UPLOAD] Error creating profile directory: " + str(e))
+            exit(1)
+    profile = profiler.profile("upload", all_threads=True) if profiler \
+        else nullcontext()
+
+    client = ClientRDT(args.host, args.port, protocol,
+                       compression, args.compression_level)
+    with profile:
+        try:
+            failed = client.upload_files(files, args.streams, args.resume,
+                                         args.delta, args.multiplex)
+        finally:
+            client.close()
+            if StreamRDT.tracer:
+                StreamRDT.tracer.close()
+    if profiler:
+        profiler.close()
+    logging.info(f"[CLIENT UPLOAD] Summary: {client.pool.stats.summary()}")
+    if failed:
+        exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,80 @@
+import os
+import sys
+from contextlib import contextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from lib.perf.simulator import (  # noqa: E402
+    CLIENT_HOST, SERVER_HOST, Simulation)
+from lib.server import ServerRDT  # noqa: E402
+from lib.sockets_rdt.listener_rdt import ListenerRDT  # noqa: E402
+from lib.sockets_rdt.stream_rdt import StreamRDT  # noqa: E402
+from lib.utils.constant import (  # noqa: E402
+    DEFAULT_SV_PORT, DEFAULT_SV_STORAGE, SelectedProtocol)
+
+
+# Runs client(stream) and server(stream) on the two ends of a connection
+# over the simulator, and returns what they returned once both ended
+@pytest.fixture
+def simulate():
+    def run(client, server, protocol=SelectedProtocol.SELECTIVE_REPEAT,
+            upstream=None, downstream=None, seed=0, stream_settings=None,
+            time_limit=600):
+        simulation = Simulation(upstream, downstream, seed, stream_settings,
+                                time_limit)
+
+        def serve():
+            listener = ListenerRDT(SERVER_HOST, DEFAULT_SV_PORT, protocol)
+            accepter = listener.listen()
+            stream = accepter.accept()
+            try:
+                return server(stream)
+            finally:
+                stream.close()
+                accepter.release()
+
+        def connect():
+            stream = StreamRDT.connect(protocol, SERVER_HOST,
+                                       DEFAULT_SV_PORT)
+            try:
+                return client(stream)
+            finally:
+                stream.close()
+
+        server_thread = simulation.spawn(SERVER_HOST, serve)
+        client_thread = simulation.spawn(CLIENT_HOST, connect)
+        simulation.run()
+        assert not simulation.timed_out
+        for thread in (client_thread, server_thread):
+            if thread.error is not None:
+                raise thread.error
+        return client_thread.result, server_thread.result
+    return run
+
+
+# A ServerRDT with its storage in an empty temporary directory. Its
+# _run_session serves the connections of simulate()
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(DEFAULT_SV_STORAGE, exist_ok=True)
+    return ServerRDT(SERVER_HOST, DEFAULT_SV_PORT, cache_size=0)
+
+
+class SingleStream:
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    @contextmanager
+    def connection(self, keep_on=()):
+        yield self.stream
+
+
+# Returns the connections argument of the ClientRDT transferences, to make
+# them over the stream given by simulate()
+@pytest.fixture
+def connections():
+    return SingleStream
@@ -0,0 +1,223 @@
+import asyncio
+import os
+import random
+import socket
+import time
+from contextlib import contextmanager
+from threading import Event, Thread
+
+import pytest
+
+from lib.async_client import AsyncClientRDT
+from lib.async_server import AsyncServerRDT
+from lib.client import ClientRDT
+from lib.segment_encoding.application_header import ApplicationHeaderRDT
+from lib.segment_encoding.header_rdt import HeaderRDT
+from lib.server import ServerRDT
+from lib.sockets_rdt.connection_reaper import ConnectionReaper
+from lib.sockets_rdt.listener_rdt import ListenerRDT
+from lib.sockets_rdt.stream_rdt import StreamRDT
+from lib.sockets_rdt.stream_reader import StreamReader
+from lib.transference_handler.striped_transfer import MIN_STRIPE_SIZE
+from lib.utils.constant import DEFAULT_SV_STORAGE, SelectedProtocol, \
+    SelectedTransferType
+from lib.utils.exceptions import RequestRejectedError
+
+# The event loop and the sockets of asyncio do not run on the simulator,
+# these tests go over localhost
+HOST = "127.0.0.1"
+PROTOCOL = SelectedProtocol.SELECTIVE_REPEAT
+DATA = random.Random(5).randbytes(3 * MIN_STRIPE_SIZE + 1000)
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("", 0))
+        return sock.getsockname()[1]
+
+
+# Serves the connections as ServerRDT.run() does, until stopping is set
+def serve_threaded(server, stopping):
+    listener = ListenerRDT(HOST, server.port, PROTOCOL)
+    listener.socket.settimeout(0.05)
+    reaper = ConnectionReaper()
+    threads = []
+    while not stopping.is_set():
+        try:
+            data, address = listener.socket.recvfrom(
+                HeaderRDT.size() + ApplicationHeaderRDT.size())
+        except socket.timeout:
+            continue
+        accepter = listener.admit(data, address)
+        if accepter is not None:
+            thread = Thread(target=server.server_port_handler,
+                            args=(accepter, reaper))
+            threads.append(thread)
+            thread.start()
+    for thread in threads:
+        thread.join()
+    reaper.close()
+    listener.socket.close()
+
+
+def serve_async(server, started, stopping):
+    async def serve():
+        task = asyncio.ensure_future(server.serve())
+        started.set()
+        await asyncio.get_running_loop().run_in_executor(None, stopping.wait)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    asyncio.run(serve())
+
+
+# A server of the kind, with its storage in an empty temporary directory
+@contextmanager
+def running(kind, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(DEFAULT_SV_STORAGE)
+    port = free_port()
+    stopping = Event()
+    if kind == "threaded":
+        server = ServerRDT(HOST, port, PROTOCOL)
+        thread = Thread(target=serve_threaded, args=(server, stopping))
+        thread.start()
+    else:
+        server = AsyncServerRDT(HOST, port, PROTOCOL)
+        started = Event()
+        thread = Thread(target=serve_async,
+                        args=(server, started, stopping))
+        thread.start()
+        started.wait()
+    try:
+        yield server
+    finally:
+        stopping.set()
+        thread.join()
+
+
+@pytest.fixture(params=["threaded", "async"])
+def any_server(request, tmp_path, monkeypatch):
+    with running(request.param, tmp_path, monkeypatch) as server:
+        yield server
+
+
+@pytest.fixture
+def async_server(tmp_path, monkeypatch):
+    with running("async", tmp_path, monkeypatch) as server:
+        yield server
+
+
+@pytest.fixture
+def local_file(tmp_path):
+    path = tmp_path / "local"
+    path.write_bytes(DATA)
+    return str(path)
+
+
+# An upload ends for the client once its data is acked, the server may
+# still be writing it until the connection closes
+def wait_for_sessions(server, timeout=5):
+    deadline = time.monotonic() + timeout
+    while server.open_connections and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not server.open_connections
+
+
+def stored(file_name):
+    with open(DEFAULT_SV_STORAGE + file_name, "rb") as file:
+        return file.read()
+
+
+def test_async_client_goes_up_and_down(any_server, local_file, tmp_path):
+    client = AsyncClientRDT(HOST, any_server.port, PROTOCOL)
+    downloaded = str(tmp_path / "downloaded")
+
+    async def transfer():
+        await client.upload(local_file, "async")
+        await asyncio.get_running_loop().run_in_executor(
+            None, wait_for_sessions, any_server)
+        await client.download(downloaded, "async", 100, 5000)
+    asyncio.run(transfer())
+
+    assert stored("async") == DATA
+    with open(downloaded, "rb") as file:
+        assert file.read() == DATA[100:5100]
+
+
+# Both requests go over the same pooled connection
+def test_threaded_client_goes_up_and_down(any_server, local_file, tmp_path):
+    client = ClientRDT(HOST, any_server.port, PROTOCOL)
+    downloaded = str(tmp_path / "downloaded")
+    try:
+        client._upload_file(local_file, "threaded", 1, False, False)
+        client._download_file(downloaded, "threaded", 1, False)
+    finally:
+        client.close()
+    wait_for_sessions(any_server)
+
+    assert stored("threaded") == DATA
+    with open(downloaded, "rb") as file:
+        assert file.read() == DATA
+    assert client.pool.stats.connections == 1
+
+
+@pytest.mark.parametrize("streams, delta", [(3, False), (1, True)],
+                         ids=["striped", "delta"])
+def test_the_async_server_rejects_what_it_does_not_serve(
+        async_server, local_file, streams, delta):
+    with open(DEFAULT_SV_STORAGE + "kept", "wb") as file:
+        file.write(b"old copy")
+    client = ClientRDT(HOST, async_server.port, PROTOCOL)
+    try:
+        with pytest.raises(RequestRejectedError):
+            client._upload_file(local_file, "kept", streams, False, delta)
+        # The session goes on
+        client._upload_file(local_file, "accepted", 1, False, False)
+    finally:
+        client.close()
+    wait_for_sessions(async_server)
+    assert stored("kept") == b"old copy"
+    assert stored("accepted") == DATA
+
+
+def stat_request(stream):
+    stream.send(ApplicationHeaderRDT(
+        SelectedTransferType.STAT, "stat", 0, length=0).as_bytes())
+    return ApplicationHeaderRDT.from_bytes(
+        StreamReader(stream).read_exact(ApplicationHeaderRDT.size()))
+
+
+# The client is told the connection can't be multiplexed, and the
+# session goes on
+def test_the_async_server_rejects_multiplexing(async_server):
+    with open(DEFAULT_SV_STORAGE + "stat", "wb") as file:
+        file.write(b"12345")
+    client = ClientRDT(HOST, async_server.port, PROTOCOL)
+    stream = StreamRDT.connect(PROTOCOL, HOST, async_server.port)
+    try:
+        with pytest.raises(ValueError):
+            client._start_multiplexing(stream)
+        assert stat_request(stream).file_size == 5
+    finally:
+        stream.close()
+
+
+# The asyncio server gives up silent clients after the peer timeout of a
+# StreamRDT, and the keepalives of an idle one keep it alive
+@pytest.mark.parametrize("keepalives", [True, False])
+def test_the_async_server_gives_up_silent_clients(
+        async_server, monkeypatch, keepalives):
+    monkeypatch.setattr(StreamRDT, "IDLE_TIMEOUT", 0.3)
+    with open(DEFAULT_SV_STORAGE + "stat", "wb") as file:
+        file.write(b"12345")
+    stream = StreamRDT.connect(PROTOCOL, HOST, async_server.port)
+    try:
+        assert stat_request(stream).file_size == 5
+        for _ in range(10):
+            time.sleep(0.1)
+            if keepalives:
+                stream.send_keepalive()
+        open_connections = len(async_server.open_connections)
+    finally:
+        stream.close()
+    assert open_connections == (1 if keepalives else 0)
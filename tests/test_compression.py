@@ -0,0 +1,190 @@
+import os
+import random
+import struct
+
+import pytest
+
+from lib.client import ClientRDT
+from lib.segment_encoding.application_header import ApplicationHeaderRDT
+from lib.sockets_rdt.stream_reader import StreamReader
+from lib.transference_handler.uploader import Uploader
+from lib.utils import compression
+from lib.utils.compression import DEFAULT_LEVELS, FRAME_FORMAT, \
+    RAW_FRAME, ChunkCompressor, ChunkDecompressor, is_available, \
+    is_valid_level, negotiate
+from lib.utils.constant import DEFAULT_SV_PORT, DEFAULT_SV_STORAGE, \
+    SelectedCompression, SelectedTransferType
+from lib.utils.exceptions import ExternalConnectionClosed, \
+    RequestRejectedError
+from lib.utils.file_handling import FileHandler
+
+CODECS = [SelectedCompression.ZLIB, SelectedCompression.LZMA,
+          pytest.param(SelectedCompression.ZSTD, marks=pytest.mark.skipif(
+              not is_available(SelectedCompression.ZSTD),
+              reason="zstandard is not installed"))]
+TEXT = b"".join(b"line %d of a compressible file\n" % i
+                for i in range(20000))
+NOISE = random.Random(9).randbytes(50000)
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_chunks_come_back_as_they_were_compressed(codec):
+    compressor = ChunkCompressor(codec)
+    frames = b"".join(compressor.compress_chunks([TEXT, NOISE, b"x"]))
+    assert compressor.sent_bytes < compressor.raw_bytes
+
+    reader = StreamReader(None, frames)
+    decompressor = ChunkDecompressor(codec)
+    assert [decompressor.read_chunk(reader, len(TEXT)) for _ in range(3)] \
+        == [TEXT, NOISE, b"x"]
+
+
+def test_chunks_that_do_not_compress_go_raw():
+    frame = ChunkCompressor(SelectedCompression.ZLIB).compress(NOISE)
+    flag, size = struct.unpack_from(FRAME_FORMAT, frame)
+    assert (flag, size) == (RAW_FRAME, len(NOISE))
+
+
+@pytest.mark.parametrize("codec, level, valid", [
+    (SelectedCompression.NONE, None, True),
+    (SelectedCompression.NONE, 0, False),
+    (SelectedCompression.ZLIB, 9, True), (SelectedCompression.ZLIB, 15, False),
+    (SelectedCompression.LZMA, 0, True), (SelectedCompression.LZMA, 10, False),
+    (SelectedCompression.ZSTD, 22, True),
+    (SelectedCompression.ZSTD, 23, False), (7, None, True), (7, 1, False)])
+def test_levels_are_checked_against_the_range_of_the_codec(codec, level,
+                                                           valid):
+    assert is_valid_level(codec, level) == valid
+
+
+def test_zstd_falls_back_to_zlib_with_its_default_level(monkeypatch):
+    monkeypatch.setattr(compression, "zstandard", None)
+    assert negotiate(SelectedCompression.ZSTD, 19) == \
+        (SelectedCompression.ZLIB, None)
+    assert negotiate(SelectedCompression.LZMA, 9) == \
+        (SelectedCompression.LZMA, 9)
+
+
+# Level 0 of lzma is a level of its own, not the default one
+def test_an_explicit_level_0_is_kept():
+    assert ChunkCompressor(SelectedCompression.LZMA, 0).level == 0
+    assert ChunkCompressor(SelectedCompression.LZMA).level == \
+        DEFAULT_LEVELS[SelectedCompression.LZMA]
+    app_header = ApplicationHeaderRDT.from_bytes(
+        upload_request(SelectedCompression.LZMA, 0))
+    assert app_header.compression_level == 0
+    app_header = ApplicationHeaderRDT.from_bytes(
+        upload_request(SelectedCompression.LZMA, None))
+    assert app_header.compression_level is None
+
+
+# A chunk that inflates past the bytes left of the range is refused
+@pytest.mark.parametrize("codec", CODECS)
+def test_chunks_past_the_range_are_refused(codec):
+    compressor = ChunkCompressor(codec)
+    frames = compressor.compress(TEXT) + compressor.compress(NOISE)
+    reader = StreamReader(None, frames)
+    decompressor = ChunkDecompressor(codec)
+    with pytest.raises(ValueError):
+        decompressor.read_chunk(reader, len(TEXT) - 1)
+    reader = StreamReader(None, frames[len(compressor.compress(TEXT)):])
+    with pytest.raises(ValueError):
+        decompressor.read_chunk(reader, len(NOISE) - 1)
+
+
+def upload_request(codec, level):
+    return ApplicationHeaderRDT(
+        SelectedTransferType.UPLOAD, "compressed", len(TEXT),
+        compression=codec, compression_level=level).as_bytes()
+
+
+def read_answer(stream):
+    return ApplicationHeaderRDT.from_bytes(
+        StreamReader(stream).read_exact(ApplicationHeaderRDT.size()))
+
+
+# The server picks a codec it has before any data is sent
+def test_the_server_answers_with_the_codec_to_upload_with(simulate, server,
+                                                          monkeypatch):
+    monkeypatch.setattr(compression, "zstandard", None)
+
+    def client(stream):
+        stream.send(upload_request(SelectedCompression.ZSTD, 19))
+        return read_answer(stream)
+
+    # The client leaves without uploading
+    def session(stream):
+        with pytest.raises(ExternalConnectionClosed):
+            server._run_session(stream)
+
+    answer, _ = simulate(client, session)
+    assert not answer.is_error()
+    assert (answer.compression, answer.compression_level) == \
+        (SelectedCompression.ZLIB, None)
+
+
+def test_a_bad_level_is_rejected_before_touching_the_file(simulate, server,
+                                                          tmp_path):
+    local_path = tmp_path / "local"
+    local_path.write_bytes(TEXT)
+    stored_path = DEFAULT_SV_STORAGE + "compressed"
+    with open(stored_path, "wb") as file:
+        file.write(NOISE)
+
+    def client(stream):
+        file_handler = FileHandler(str(local_path), "compressed", "rb")
+        try:
+            with pytest.raises(RequestRejectedError):
+                Uploader(stream, file_handler,
+                         compression=SelectedCompression.ZLIB,
+                         compression_level=15, read_answer=True).run()
+        finally:
+            file_handler.close()
+
+    simulate(client, server._run_session)
+    with open(stored_path, "rb") as file:
+        assert file.read() == NOISE
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_compressed_files_go_up_and_down_intact(simulate, server,
+                                                connections, tmp_path,
+                                                codec):
+    local_path = str(tmp_path / "local")
+    downloaded_path = str(tmp_path / "downloaded")
+    with open(local_path, "wb") as file:
+        file.write(TEXT + NOISE)
+
+    def client(stream):
+        client = ClientRDT(None, DEFAULT_SV_PORT, compression=codec,
+                           compression_level=1)
+        client._upload_file(local_path, "compressed", 1, False, False,
+                            connections(stream))
+        client._download_file(downloaded_path, "compressed", 1, False,
+                              connections=connections(stream))
+        return stream.stats.bytes_sent
+
+    sent, _ = simulate(client, server._run_session)
+    assert sent < len(TEXT + NOISE)
+    with open(DEFAULT_SV_STORAGE + "compressed", "rb") as file:
+        assert file.read() == TEXT + NOISE
+    with open(downloaded_path, "rb") as file:
+        assert file.read() == TEXT + NOISE
+
+
+def test_a_download_with_a_bad_level_leaves_no_file(simulate, server,
+                                                    connections, tmp_path):
+    downloaded_path = str(tmp_path / "downloaded")
+    with open(DEFAULT_SV_STORAGE + "compressed", "wb") as file:
+        file.write(TEXT)
+
+    def client(stream):
+        client = ClientRDT(None, DEFAULT_SV_PORT,
+                           compression=SelectedCompression.LZMA,
+                           compression_level=15)
+        with pytest.raises(RequestRejectedError):
+            client._download_file(downloaded_path, "compressed", 1, False,
+                                  connections=connections(stream))
+
+    simulate(client, server._run_session)
+    assert not os.path.exists(downloaded_path)
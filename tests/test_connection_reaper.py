@@ -0,0 +1,165 @@
+import socket
+import time
+from threading import Thread
+
+import pytest
+
+from lib.sockets_rdt.connection_pool import ConnectionPool
+from lib.sockets_rdt.connection_reaper import ConnectionReaper
+from lib.sockets_rdt.listener_rdt import ListenerRDT
+from lib.sockets_rdt.stream_rdt import StreamRDT
+from lib.utils.constant import SelectedProtocol
+
+# The reaper and the keepalives run on threads of their own, which do not
+# run on the simulator, these tests go over localhost
+HOST = "127.0.0.1"
+PROTOCOL = SelectedProtocol.SELECTIVE_REPEAT
+IDLE_TIMEOUT = 0.3
+
+
+@pytest.fixture
+def short_timeouts(monkeypatch):
+    monkeypatch.setattr(StreamRDT, "IDLE_TIMEOUT", IDLE_TIMEOUT)
+    monkeypatch.setattr(StreamRDT, "MIN_PEER_TIMEOUT", IDLE_TIMEOUT)
+
+
+# A listener on a local port, and the server end of the connections to it
+@pytest.fixture
+def listener():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("", 0))
+        port = sock.getsockname()[1]
+    listener = ListenerRDT(HOST, port, PROTOCOL)
+    yield listener
+    listener.socket.close()
+
+
+def accept(listener):
+    accepted = []
+    thread = Thread(
+        target=lambda: accepted.append(listener.listen().accept()))
+    thread.start()
+    return thread, accepted
+
+
+@pytest.fixture
+def reaper():
+    reaper = ConnectionReaper(interval=0.02, keepalive_interval=10)
+    yield reaper
+    reaper.close()
+
+
+# Seconds a reaper takes a silent peer that owes nothing for dead, and
+# some more
+def past_the_idle_timeout():
+    return StreamRDT.peer_timeout_for(True, None) + 0.2
+
+
+def connect(listener):
+    thread, accepted = accept(listener)
+    client_stream = StreamRDT.connect(PROTOCOL, HOST, listener.port)
+    thread.join()
+    return client_stream, accepted[0]
+
+
+# A peer that speaks while the thread of the stream is busy elsewhere is
+# alive, even if nobody reads what it sent
+def test_the_reaper_hears_a_peer_nobody_reads(
+        listener, reaper, short_timeouts):
+    client_stream, server_stream = connect(listener)
+    reaper.add(server_stream, "client")
+    try:
+        deadline = time.monotonic() + past_the_idle_timeout()
+        while time.monotonic() < deadline:
+            time.sleep(IDLE_TIMEOUT / 3)
+            client_stream.send_keepalive()
+        assert not server_stream.reaped
+        client_stream.send(b"request")
+        data = b''
+        while not data:
+            data = server_stream.read()
+        assert data == b"request"
+    finally:
+        reaper.remove(server_stream)
+        client_stream.close()
+        server_stream.close()
+    assert reaper.reaped == 0
+
+
+def test_the_reaper_reaps_a_silent_peer(listener, reaper, short_timeouts):
+    client_stream, server_stream = connect(listener)
+    reaper.add(server_stream, "client")
+    try:
+        time.sleep(past_the_idle_timeout())
+        assert server_stream.reaped
+    finally:
+        reaper.remove(server_stream)
+        client_stream.reap()
+        client_stream.close()
+        server_stream.close()
+
+
+# A stream busy elsewhere sends keepalives from the reaper, so the peer
+# knows the server is still there
+def test_the_reaper_keeps_busy_streams_alive(listener, short_timeouts):
+    reaper = ConnectionReaper(interval=0.02, keepalive_interval=0.05)
+    client_stream, server_stream = connect(listener)
+    reaper.add(server_stream, "client")
+    try:
+        time.sleep(past_the_idle_timeout())
+        assert client_stream.collect_pending_segments()
+        assert server_stream.stats.segments_sent > 1
+    finally:
+        reaper.remove(server_stream)
+        reaper.close()
+        client_stream.close()
+        server_stream.close()
+
+
+# The pool sends keepalives on the streams in use that send nothing, so
+# the server keeps them while the client is busy elsewhere
+def test_the_pool_keeps_streams_in_use_alive(
+        listener, reaper, short_timeouts):
+    pool = ConnectionPool(PROTOCOL, HOST, listener.port,
+                          keepalive_interval=0.05)
+    thread, accepted = accept(listener)
+    try:
+        with pool.connection() as client_stream:
+            thread.join()
+            server_stream = accepted[0]
+            reaper.add(server_stream, "client")
+            time.sleep(past_the_idle_timeout())
+            assert not server_stream.reaped
+            client_stream.send(b"request")
+            data = b''
+            while not data:
+                data = server_stream.read()
+            assert data == b"request"
+        reaper.remove(server_stream)
+        assert reaper.reaped == 0
+    finally:
+        pool.close()
+        server_stream.close()
+
+
+# A keepalive acks the last segment received in order, never the first
+# one the peer is still sending
+def test_a_keepalive_acks_nothing_new(listener):
+    client_stream, server_stream = connect(listener)
+    try:
+        acked = server_stream.protocol.buffer_sorter.get_current_ack_num()
+        segments = []
+        server_stream.send_segment = \
+            lambda data, seq_num, ack_num, *args, **kwargs: \
+            segments.append(ack_num)
+        server_stream.send_keepalive()
+        assert segments == [acked - 1]
+    finally:
+        del server_stream.send_segment
+        client_stream.close()
+        server_stream.close()
+
+
+def test_the_idle_timeout_grows_with_the_rtt():
+    assert StreamRDT.peer_timeout_for(True, 0.5) > \
+        StreamRDT.peer_timeout_for(True, 0.01) > StreamRDT.IDLE_TIMEOUT
@@ -0,0 +1,170 @@
+import random
+import socket
+import time
+from threading import Thread
+
+import pytest
+
+from lib.client import ClientRDT
+from lib.server import ServerRDT
+from lib.sockets_rdt.connection_reaper import ConnectionReaper
+from lib.sockets_rdt.listener_rdt import ListenerRDT
+from lib.sockets_rdt.stream_rdt import StreamRDT
+from lib.transference_handler.delta_sync import BlockSignatures, \
+    DeltaUploader
+from lib.utils.constant import DEFAULT_SV_STORAGE, SelectedProtocol
+from lib.utils import rolling_checksum
+from lib.utils.file_handling import FileHandler
+from lib.utils.rolling_checksum import MAX_BLOCK_SIZE, MIN_BLOCK_SIZE, \
+    choose_block_size, find_weak_matches, weak_checksum
+
+BLOCK_SIZE = 16
+
+
+def naive_weak_checksum(block):
+    a = sum(block)
+    b = sum((len(block) - i) * x for i, x in enumerate(block))
+    return (a & 0xffff) | ((b & 0xffff) << 16)
+
+
+@pytest.mark.parametrize("size", [1, 15, 512, 5000])
+def test_weak_checksum_is_the_rsync_one(size):
+    block = random.Random(size).randbytes(size)
+    assert weak_checksum(block) == naive_weak_checksum(block)
+
+
+@pytest.mark.parametrize("file_size, block_size", [
+    (0, MIN_BLOCK_SIZE), (10**6, 1000), (2**40, MAX_BLOCK_SIZE)])
+def test_block_size_is_the_square_root_within_bounds(file_size, block_size):
+    assert choose_block_size(file_size) == block_size
+
+
+@pytest.fixture(params=["python", "numpy"])
+def matcher(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(rolling_checksum, "np", None)
+    return find_weak_matches
+
+
+# Every window with one of the checksums is found, the ones planted and
+# any other that happens to collide
+def test_weak_matches_are_the_windows_with_those_checksums(matcher):
+    rng = random.Random(7)
+    data = bytearray(rng.randbytes(4000))
+    block = rng.randbytes(BLOCK_SIZE)
+    for offset in (0, 1000, 3984):
+        data[offset:offset + BLOCK_SIZE] = block
+    weak_checksums = {weak_checksum(block), weak_checksum(data[50:66])}
+
+    expected = [(k, weak_checksum(data[k:k + BLOCK_SIZE]))
+                for k in range(len(data) - BLOCK_SIZE + 1)
+                if weak_checksum(data[k:k + BLOCK_SIZE]) in weak_checksums]
+    assert matcher(bytes(data), BLOCK_SIZE, weak_checksums) == expected
+    assert {0, 50, 1000, 3984} <= {offset for offset, _ in expected}
+
+
+def test_no_weak_matches_in_data_shorter_than_a_block(matcher):
+    assert matcher(b'abc', BLOCK_SIZE, {1}) == []
+
+
+def edited(data):
+    data = bytearray(data)
+    data[1000:1000] = b'inserted in the middle'
+    del data[90000:90100]
+    data[150000:150010] = b'x' * 10
+    return bytes(data)
+
+
+# (old copy in the server or None, new file in the client)
+OLD_DATA = random.Random(8).randbytes(200000)
+CASES = {
+    "no old copy": (None, OLD_DATA),
+    "same file": (OLD_DATA, OLD_DATA),
+    "edited file": (OLD_DATA, edited(OLD_DATA)),
+    "truncated file": (OLD_DATA, OLD_DATA[:123457]),
+}
+
+
+@pytest.mark.parametrize(
+    "old_data, new_data", CASES.values(), ids=CASES.keys())
+def test_delta_upload_rebuilds_the_new_file(simulate, server, tmp_path,
+                                            old_data, new_data):
+    local_path = tmp_path / "local"
+    local_path.write_bytes(new_data)
+    server_path = tmp_path / DEFAULT_SV_STORAGE / "delta"
+    if old_data is not None:
+        server_path.write_bytes(old_data)
+
+    def client(stream):
+        file_handler = FileHandler(str(local_path), "delta", "rb")
+        try:
+            uploader = DeltaUploader(stream, file_handler)
+            uploader.run()
+        finally:
+            file_handler.close()
+        return uploader.literal_bytes, uploader.copied_bytes
+
+    (literal_bytes, copied_bytes), _ = simulate(client, server._run_session)
+    assert server_path.read_bytes() == new_data
+    assert literal_bytes + copied_bytes == len(new_data)
+    if old_data is not None:
+        assert literal_bytes < len(new_data) // 10
+
+
+def test_signatures_are_sent_as_they_are_computed(tmp_path, monkeypatch):
+    monkeypatch.setattr(BlockSignatures, "SEND_SIZE", 10000)
+    path = tmp_path / "old"
+    path.write_bytes(OLD_DATA)
+    sent = []
+    file_handler = FileHandler(str(path), "old", "rb")
+    try:
+        signatures = BlockSignatures.from_file(file_handler, sent.append)
+    finally:
+        file_handler.close()
+    assert len(sent) > 2
+    assert b''.join(sent) == signatures.as_bytes()
+
+
+# Scanning a big file takes longer than the server waits for a silent
+# client, which has to speak while it scans. The reaper runs on a thread,
+# so this one goes over localhost
+def test_a_long_delta_upload_keeps_the_session_alive(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / DEFAULT_SV_STORAGE).mkdir(parents=True)
+    monkeypatch.setattr(StreamRDT, "IDLE_TIMEOUT", 0.2)
+    monkeypatch.setattr(StreamRDT, "MIN_PEER_TIMEOUT", 0.2)
+    # Batches scanned in well under that
+    monkeypatch.setattr(DeltaUploader, "BATCH_SIZE", 2**17)
+    protocol = SelectedProtocol.SELECTIVE_REPEAT
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("", 0))
+        port = sock.getsockname()[1]
+    server = ServerRDT("127.0.0.1", port, protocol, cache_size=0)
+    listener = ListenerRDT("127.0.0.1", port, protocol)
+    reaper = ConnectionReaper(interval=0.02)
+    local_path = tmp_path / "local"
+    local_path.write_bytes(random.Random(9).randbytes(3 * 2**20))
+    client = ClientRDT("127.0.0.1", port, protocol)
+    # Only the delta itself keeps the session alive
+    client.pool.keepalive_interval = 60
+
+    def serve():
+        accepter = listener.listen()
+        server.server_port_handler(accepter, reaper)
+    thread = Thread(target=serve)
+    thread.start()
+    try:
+        client._upload_file(str(local_path), "big", 1, False, False)
+        start = time.monotonic()
+        client._upload_file(str(local_path), "big", 1, False, True)
+        assert time.monotonic() - start > 3 * StreamRDT.IDLE_TIMEOUT
+    finally:
+        client.close()
+        thread.join()
+        reaper.close()
+        listener.socket.close()
+    assert reaper.reaped == 0
+    server_path = tmp_path / DEFAULT_SV_STORAGE / "big"
+    assert server_path.read_bytes() == local_path.read_bytes()
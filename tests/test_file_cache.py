@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+from lib.utils import file_cache
+from lib.utils.file_cache import CachedFileHandler, FileCache
+
+BLOCK_SIZE = 100
+
+
+@pytest.fixture
+def cache():
+    return FileCache(10 * BLOCK_SIZE, BLOCK_SIZE)
+
+
+@pytest.fixture
+def file_path(tmp_path):
+    path = tmp_path / "cached"
+    path.write_bytes(bytes(range(250)))
+    return str(path)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(file_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def read_all(cache, file_path):
+    file_handler = CachedFileHandler(cache, file_path, "cached")
+    try:
+        return file_handler.read(file_handler.size())
+    finally:
+        file_handler.close()
+
+
+def test_blocks_are_read_from_the_disk_once(cache, file_path):
+    assert read_all(cache, file_path) == bytes(range(250))
+    assert read_all(cache, file_path) == bytes(range(250))
+    assert (cache.misses, cache.hits) == (3, 3)
+
+
+def test_missing_files_are_not_cached(cache, tmp_path):
+    file_path = str(tmp_path / "uploaded later")
+    assert not cache.stat(file_path).exists
+    with open(file_path, "wb") as file:
+        file.write(b"new")
+    assert cache.stat(file_path).size == 3
+
+
+def test_metadata_is_served_from_memory_until_it_expires(cache, file_path,
+                                                         clock):
+    cache.stat(file_path)
+    clock[0] += FileCache.METADATA_TTL
+    cache.stat(file_path)
+    assert (cache.metadata_misses, cache.metadata_hits) == (1, 1)
+
+    clock[0] += 0.001
+    cache.stat(file_path)
+    assert cache.metadata_misses == 2
+
+
+# The file is changed without going through the server
+def test_files_changed_on_disk_are_noticed_once_expired(cache, file_path,
+                                                        clock):
+    read_all(cache, file_path)
+    with open(file_path, "wb") as file:
+        file.write(b"changed")
+    os.utime(file_path, ns=(0, 0))
+
+    clock[0] += FileCache.METADATA_TTL + 1
+    assert read_all(cache, file_path) == b"changed"
+    assert cache.used_bytes == len(b"changed")
+
+
+# Both race with an upload that invalidates the file while the disk is
+# read, what was read before it must not be cached
+def test_an_invalidate_during_a_stat_is_not_undone(cache, file_path,
+                                                   monkeypatch):
+    stat = os.stat
+
+    def stat_and_invalidate(path):
+        result = stat(path)
+        cache.invalidate(path)
+        return result
+
+    monkeypatch.setattr(file_cache.os, "stat", stat_and_invalidate)
+    assert cache.stat(file_path).size == 250
+    assert file_path not in cache.metadata
+
+
+def test_an_invalidate_during_a_block_read_is_not_undone(cache, file_path):
+    def read_and_invalidate(offset, size):
+        cache.invalidate(file_path)
+        return b"stale"
+
+    cache.get_block(file_path, 0, 0, read_and_invalidate)
+    assert cache.blocks == {}
+    assert cache.used_bytes == 0
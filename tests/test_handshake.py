@@ -0,0 +1,242 @@
+import random
+import socket
+from threading import Thread
+
+import pytest
+
+from lib.perf.impairment_proxy import ImpairmentProxy, LinkImpairments
+from lib.perf.simulator import CLIENT_HOST, SERVER_HOST, Simulation
+from lib.protocols.utils.backoff import Backoff
+from lib.segment_encoding.application_header import ApplicationHeaderRDT
+from lib.segment_encoding.header_rdt import HeaderRDT
+from lib.segment_encoding.segment_rdt import SegmentRDT
+from lib.sockets_rdt.listener_rdt import SYN_COOKIES_ALWAYS, \
+    SYN_COOKIES_AUTO, SYN_COOKIES_NEVER, ListenerRDT
+from lib.sockets_rdt.stream_rdt import StreamRDT
+from lib.utils.constant import DEFAULT_SV_PORT, SelectedProtocol
+from lib.utils.exceptions import ExternalConnectionClosed
+
+PROTOCOL = SelectedProtocol.SELECTIVE_REPEAT
+CLIENT_ADDRESS = ("127.0.0.1", 5555)
+SEQ_NUM = StreamRDT.START_CONNECT_SEQ
+SYN_SIZE = HeaderRDT.size() + ApplicationHeaderRDT.size()
+
+
+def test_backoff_stays_between_its_base_and_its_cap():
+    backoff = Backoff(0.1, 1, random.Random(3))
+    waits = [backoff.next() for _ in range(50)]
+    assert all(0.1 <= wait <= 1 for wait in waits)
+    assert max(waits) == 1
+
+
+# Clients turned away together retry at different times
+def test_backoffs_with_different_seeds_spread_apart():
+    first, second = (Backoff(0.1, 1, random.Random(seed))
+                     for seed in (1, 2))
+    assert [first.next() for _ in range(5)] != \
+        [second.next() for _ in range(5)]
+
+
+@pytest.mark.parametrize("base, cap", [(0, 1), (-1, 1), (2, 1)])
+def test_backoff_rejects_bad_bounds(base, cap):
+    with pytest.raises(ValueError):
+        Backoff(base, cap)
+
+
+# Listeners on a local port, whose answers to the made up client address
+# go nowhere
+@pytest.fixture
+def listener_with():
+    listeners = []
+
+    def create(**kwargs):
+        listener = ListenerRDT("127.0.0.1", 0, PROTOCOL, **kwargs)
+        listeners.append(listener)
+        return listener
+    yield create
+    for listener in listeners:
+        listener.socket.close()
+
+
+def syn(ack_num=StreamRDT.START_ACK):
+    return SegmentRDT(HeaderRDT(PROTOCOL, 0, SEQ_NUM, ack_num, True, False),
+                      b'').as_bytes()
+
+
+def test_duplicate_syns_are_absorbed(listener_with):
+    listener = listener_with()
+    assert listener.admit(syn(), CLIENT_ADDRESS) is not None
+    assert listener.admit(syn(), CLIENT_ADDRESS) is None
+    assert (len(listener.connections), listener.duplicate_syns) == (1, 1)
+
+
+def test_a_syn_is_answered_with_a_cookie_that_takes_no_state(
+        listener_with):
+    listener = listener_with(syn_cookies=SYN_COOKIES_ALWAYS)
+    assert listener.admit(syn(), CLIENT_ADDRESS) is None
+    assert (listener.connections, listener.cookies_sent) == ({}, 1)
+
+    cookie = listener._cookie(CLIENT_ADDRESS + (SEQ_NUM,),
+                              listener._cookie_period())
+    assert listener.admit(syn(cookie), CLIENT_ADDRESS) is not None
+    assert len(listener.connections) == 1
+
+
+def test_auto_cookies_once_too_many_handshakes_are_pending(listener_with):
+    listener = listener_with(syn_cookies=SYN_COOKIES_AUTO)
+    for port in range(ListenerRDT.MAX_PENDING_HANDSHAKES):
+        assert listener.admit(syn(), ("127.0.0.1", port + 1)) is not None
+    assert listener.admit(syn(), CLIENT_ADDRESS) is None
+    assert listener.cookies_sent == 1
+
+
+@pytest.mark.parametrize("syn_cookies, cookies_sent", [
+    (SYN_COOKIES_ALWAYS, 1), (SYN_COOKIES_NEVER, 0)])
+def test_a_forged_cookie_is_not_accepted(listener_with, syn_cookies,
+                                         cookies_sent):
+    listener = listener_with(syn_cookies=syn_cookies)
+    forged = syn(12345)
+    if syn_cookies == SYN_COOKIES_NEVER:
+        with pytest.raises(ValueError):
+            listener.admit(forged, CLIENT_ADDRESS)
+    else:
+        assert listener.admit(forged, CLIENT_ADDRESS) is None
+    assert (listener.connections, listener.cookies_sent) == \
+        ({}, cookies_sent)
+
+
+def read_until_closed(stream):
+    received = b""
+    try:
+        while True:
+            received += stream.read() or b''
+    except ExternalConnectionClosed:
+        return received
+
+
+# Runs the threads on the simulator and returns what they returned
+def run_simulation(*targets):
+    simulation = Simulation(seed=4)
+    threads = [simulation.spawn(host, target) for host, target in targets]
+    simulation.run()
+    assert not simulation.timed_out
+    for thread in threads:
+        if thread.error is not None:
+            raise thread.error
+    return [thread.result for thread in threads]
+
+
+def test_the_client_sends_the_cookie_back_and_connects():
+    def serve():
+        listener = ListenerRDT(SERVER_HOST, DEFAULT_SV_PORT, PROTOCOL,
+                               syn_cookies=SYN_COOKIES_ALWAYS)
+        accepter = listener.listen()
+        stream = accepter.accept()
+        received = read_until_closed(stream)
+        stream.close()
+        accepter.release()
+        return received, listener.cookies_sent
+
+    def connect():
+        stream = StreamRDT.connect(PROTOCOL, SERVER_HOST, DEFAULT_SV_PORT)
+        stream.send(b"with a cookie")
+        stream.close()
+        return stream.stats.connection_attempts
+
+    (received, cookies_sent), attempts = run_simulation(
+        (SERVER_HOST, serve), (CLIENT_HOST, connect))
+    assert (received, cookies_sent, attempts) == (b"with a cookie", 1, 2)
+
+
+# The second client is told to retry after the first one is done
+def test_a_busy_server_defers_the_client_until_it_has_room():
+    simulation_threads = []
+
+    def serve():
+        listener = ListenerRDT(SERVER_HOST, DEFAULT_SV_PORT, PROTOCOL,
+                               max_connections=1, retry_after=0.5)
+        accepter = listener.listen()
+        stream = accepter.accept()
+        data, address = listener.socket.recvfrom(SYN_SIZE)
+        assert listener.admit(data, address) is None
+        stream.close()
+        accepter.release()
+
+        accepter = listener.listen()
+        stream = accepter.accept()
+        received = read_until_closed(stream)
+        stream.close()
+        accepter.release()
+        return received, listener.busy_answers
+
+    def connect_later():
+        stream = StreamRDT.connect(PROTOCOL, SERVER_HOST, DEFAULT_SV_PORT)
+        stream.send(b"deferred")
+        stream.close()
+        return stream.stats.busy_answers, stream.stats.connection_attempts
+
+    def connect_first():
+        stream = StreamRDT.connect(PROTOCOL, SERVER_HOST, DEFAULT_SV_PORT)
+        simulation_threads.append(
+            stream.socket.simulation.spawn(CLIENT_HOST, connect_later))
+        read_until_closed(stream)
+        stream.close()
+
+    (received, busy_answers), _ = run_simulation(
+        (SERVER_HOST, serve), (CLIENT_HOST, connect_first))
+    later = simulation_threads[0]
+    assert later.error is None
+    assert (received, busy_answers) == (b"deferred", 1)
+    assert later.result == (1, 2)
+
+
+# The proxy does not run on the simulator, these go over localhost
+@pytest.fixture
+def proxied_listener():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("", 0))
+        port = sock.getsockname()[1]
+    listener = ListenerRDT("127.0.0.1", port, PROTOCOL,
+                           syn_cookies=SYN_COOKIES_ALWAYS)
+    proxy = ImpairmentProxy("127.0.0.1", 0, "127.0.0.1", port,
+                            LinkImpairments(), seed=1).start()
+    yield listener, proxy
+    proxy.close()
+    listener.socket.close()
+
+
+# The answers of the listener come out of the port of the proxy, marked as
+# such, as they would from the server
+def test_the_proxy_answers_cookies_from_its_port(proxied_listener):
+    listener, proxy = proxied_listener
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+        client.settimeout(5)
+        client.sendto(syn(), ("127.0.0.1", proxy.port))
+        data, address = listener.socket.recvfrom(SYN_SIZE)
+        assert listener.admit(data, address) is None
+        answer, answer_address = client.recvfrom(SYN_SIZE)
+    assert answer_address[1] == proxy.port
+    assert SegmentRDT.from_bytes(answer).header.stream_id == \
+        HeaderRDT.LISTENER_ANSWER_STREAM
+
+
+def test_the_client_connects_with_a_cookie_through_the_proxy(
+        proxied_listener):
+    listener, proxy = proxied_listener
+    received = []
+
+    def serve():
+        accepter = listener.listen()
+        stream = accepter.accept()
+        received.append(read_until_closed(stream))
+        stream.close()
+        accepter.release()
+    thread = Thread(target=serve)
+    thread.start()
+    stream = StreamRDT.connect(PROTOCOL, "127.0.0.1", proxy.port)
+    stream.send(b"with a cookie")
+    stream.close()
+    thread.join()
+    assert received == [b"with a cookie"]
+    assert (listener.cookies_sent, stream.stats.connection_attempts) == \
+        (1, 2)
@@ -0,0 +1,157 @@
+import socket
+import struct
+from threading import Event, Thread
+
+import pytest
+
+from lib.sockets_rdt.listener_rdt import ListenerRDT
+from lib.sockets_rdt.multiplexed_connection import MultiplexedConnection
+from lib.sockets_rdt.stream_rdt import StreamRDT
+from lib.utils.constant import SelectedProtocol
+from lib.utils.exceptions import ExternalConnectionClosed
+
+# The reader thread of a MultiplexedConnection does not run on the
+# simulator, these tests go over localhost
+HOST = "127.0.0.1"
+STREAMS = 3
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("", 0))
+        return sock.getsockname()[1]
+
+
+def read_until_closed(substream):
+    data = b""
+    while True:
+        try:
+            data += substream.read()
+        except ExternalConnectionClosed:
+            return data
+
+
+# Both ends of a connection, the one of the server accepting streams
+@pytest.fixture
+def ends():
+    port = free_port()
+    listener = ListenerRDT(HOST, port, SelectedProtocol.SELECTIVE_REPEAT)
+    accepted = []
+
+    def accept():
+        accepter = listener.listen()
+        accepted.append((accepter, accepter.accept()))
+
+    thread = Thread(target=accept)
+    thread.start()
+    stream = StreamRDT.connect(SelectedProtocol.SELECTIVE_REPEAT, HOST, port)
+    thread.join()
+    accepter, server_stream = accepted[0]
+
+    client = MultiplexedConnection(stream)
+    server = MultiplexedConnection(server_stream, accept_streams=True)
+    yield client, server
+    client.close()
+    server.close()
+    stream.close()
+    server_stream.close()
+    accepter.release()
+    listener.socket.close()
+
+
+# Each stream is answered with the size of what was sent on it, after the
+# client closed its side
+def echo_sizes(server, results):
+    def answer(substream):
+        size = len(read_until_closed(substream))
+        substream.send(struct.pack("!I", size))
+        substream.close()
+
+    threads = [Thread(target=answer, args=(server.accept_stream(),))
+               for _ in range(STREAMS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.append(True)
+
+
+def test_closed_streams_are_released_on_both_ends(ends):
+    client, server = ends
+    results = []
+    server_thread = Thread(target=echo_sizes, args=(server, results))
+    server_thread.start()
+
+    substreams = [client.open_stream() for _ in range(STREAMS)]
+    for i, substream in enumerate(substreams):
+        substream.send(b"x" * 1000 * (i + 1))
+        substream.close()
+    sizes = [struct.unpack("!I", read_until_closed(substream))[0]
+             for substream in substreams]
+    server_thread.join()
+
+    assert results == [True]
+    assert sizes == [1000, 2000, 3000]
+    assert client.substreams == {}
+    assert server.substreams == {}
+
+
+# The FIN of a stream does not close the connection under it
+def test_the_other_streams_go_on_after_one_is_closed(ends):
+    client, server = ends
+    closed = client.open_stream()
+    closed.send(b"first")
+    closed.close()
+    accepted = server.accept_stream()
+    assert read_until_closed(accepted) == b"first"
+
+    open_stream = client.open_stream()
+    open_stream.send(b"second")
+    assert server.accept_stream().read() == b"second"
+
+
+def test_a_closed_stream_can_not_send(ends):
+    client, _ = ends
+    substream = client.open_stream()
+    substream.close()
+    with pytest.raises(ValueError):
+        substream.send(b"late")
+
+
+# Holds every segment back until the gate opens
+class GatedFlow:
+
+    def __init__(self):
+        self.gate = Event()
+        self.waiting = Event()
+
+    def wait_turn(self, size):
+        self.waiting.set()
+        self.gate.wait()
+
+
+# The stream waiting for a turn of the fair scheduler does not hold the
+# connection: the reader thread still delivers what the other end sends
+def test_a_stream_waiting_for_its_turn_does_not_block_the_rest(ends):
+    client, server = ends
+    substream = client.open_stream()
+    substream.send(b"request")
+    accepted = server.accept_stream()
+    assert accepted.read() == b"request"
+
+    flow = GatedFlow()
+    client.stream.scheduled_flow = flow
+    sender = Thread(target=substream.send, args=(b"held back",))
+    sender.start()
+    assert flow.waiting.wait(5)
+
+    answers = []
+    reader = Thread(target=lambda: answers.append(substream.read()))
+    accepted.send(b"answer")
+    reader.start()
+    reader.join(5)
+    flow.gate.set()
+    sender.join()
+
+    assert answers == [b"answer"]
+    assert accepted.read() == b"held back"
@@ -0,0 +1,108 @@
+import os
+
+import pytest
+
+from lib.client import ClientRDT
+from lib.segment_encoding.application_header import ApplicationHeaderRDT
+from lib.server import ServerRDT
+from lib.sockets_rdt.fair_scheduler import INTERACTIVE
+from lib.sockets_rdt.stream_reader import StreamReader
+from lib.transference_handler.uploader import range_length
+from lib.utils.constant import DEFAULT_SV_PORT, DEFAULT_SV_STORAGE, \
+    SelectedTransferType
+from lib.utils.exceptions import RequestRejectedError
+
+FILE_NAME = "ranged"
+FILE_DATA = bytes(range(256)) * 8
+
+
+@pytest.mark.parametrize("offset, length, expected", [
+    (0, None, 2048), (100, None, 1948), (2048, None, 0), (100, 50, 50),
+    (0, 2048, 2048)])
+def test_range_length_of_ranges_in_the_file(offset, length, expected):
+    assert range_length(len(FILE_DATA), offset, length) == expected
+
+
+@pytest.mark.parametrize("offset, length", [
+    (2049, None), (-1, None), (0, -1), (2000, 49)])
+def test_range_length_rejects_ranges_out_of_the_file(offset, length):
+    with pytest.raises(ValueError):
+        range_length(len(FILE_DATA), offset, length)
+
+
+@pytest.fixture(autouse=True)
+def stored_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(DEFAULT_SV_STORAGE, exist_ok=True)
+    with open(DEFAULT_SV_STORAGE + FILE_NAME, "wb") as file:
+        file.write(FILE_DATA)
+
+
+def download_request(offset, length):
+    return ApplicationHeaderRDT(SelectedTransferType.DOWNLOAD, FILE_NAME, 0,
+                                offset, length).as_bytes()
+
+
+# The rejected request leaves the session ready for the next one
+def test_a_range_out_of_the_file_is_answered_with_an_error(simulate,
+                                                           server):
+    def client(stream):
+        reader = StreamReader(stream)
+        stream.send(download_request(len(FILE_DATA) + 1, 0))
+        rejected = ApplicationHeaderRDT.from_bytes(
+            reader.read_exact(ApplicationHeaderRDT.size()))
+        stream.send(download_request(10, 20))
+        accepted = ApplicationHeaderRDT.from_bytes(
+            reader.read_exact(ApplicationHeaderRDT.size()))
+        return rejected, accepted, reader.read_exact(accepted.length)
+
+    (rejected, accepted, data), _ = simulate(client, server._run_session)
+    assert rejected.is_error()
+    assert rejected.file_name == ServerRDT.RANGE_OUT_OF_FILE
+    assert (accepted.offset, accepted.length) == (10, 20)
+    assert data == FILE_DATA[10:30]
+
+
+def test_a_rejected_download_leaves_no_file(simulate, server, connections,
+                                            tmp_path):
+    file_path = str(tmp_path / "downloaded")
+
+    def client(stream):
+        client = ClientRDT("127.0.0.1", DEFAULT_SV_PORT)
+        with pytest.raises(RequestRejectedError):
+            client._download_file(file_path, FILE_NAME, 1, False,
+                                  offset=len(FILE_DATA) + 1,
+                                  connections=connections(stream))
+
+    simulate(client, server._run_session)
+    assert not os.path.exists(file_path)
+
+
+# The session goes on after a request for a file out of the storage
+@pytest.mark.parametrize("transfer_type", [
+    SelectedTransferType.DOWNLOAD, SelectedTransferType.UPLOAD,
+    SelectedTransferType.STAT])
+def test_an_invalid_file_name_is_answered_with_an_error(simulate, server,
+                                                        transfer_type):
+    def client(stream):
+        reader = StreamReader(stream)
+        stream.send(ApplicationHeaderRDT(
+            transfer_type, "../" + FILE_NAME, 10, length=0).as_bytes())
+        rejected = ApplicationHeaderRDT.from_bytes(
+            reader.read_exact(ApplicationHeaderRDT.size()))
+        stream.send(download_request(10, 20))
+        accepted = ApplicationHeaderRDT.from_bytes(
+            reader.read_exact(ApplicationHeaderRDT.size()))
+        return rejected, accepted, reader.read_exact(accepted.length)
+
+    (rejected, accepted, data), _ = simulate(client, server._run_session)
+    assert rejected.is_error()
+    assert rejected.file_name == ServerRDT.INVALID_FILE_NAME
+    assert data == FILE_DATA[10:30]
+
+
+def test_an_invalid_file_name_is_scheduled_as_interactive(server):
+    server.interactive_size = 0
+    app_header = ApplicationHeaderRDT(
+        SelectedTransferType.DOWNLOAD, "/" + FILE_NAME, 0, length=0)
+    assert server._transfer_class(app_header) == INTERACTIVE
@@ -0,0 +1,117 @@
+import random
+
+import pytest
+
+from lib.perf.impairment_proxy import GilbertElliottLoss, LinkImpairments
+from lib.protocols.selective_repeat import SelectiveRepeat
+from lib.protocols.utils.token_bucket import TokenBucket
+from lib.segment_encoding.segment_rdt import SegmentRDT
+from lib.utils.constant import SelectedProtocol
+from lib.utils.exceptions import ExternalConnectionClosed
+
+MSS = SegmentRDT.get_max_segment_size()
+DELAYED = LinkImpairments(delay=0.01)
+
+
+def read_until_closed(stream):
+    received = bytearray()
+    try:
+        while True:
+            received += stream.read() or b''
+    except ExternalConnectionClosed:
+        return bytes(received)
+
+
+def read_exactly(stream, size):
+    received = bytearray()
+    while len(received) < size:
+        received += stream.read() or b''
+    return bytes(received)
+
+
+def test_send_returns_before_the_acks_and_flush_waits_for_them(simulate):
+    payload = random.Random(1).randbytes(10 * MSS)
+
+    def client(stream):
+        stream.send(payload)
+        pending = stream.protocol.window.pending_segments()
+        stream.flush()
+        return pending, stream.protocol.window.finished()
+
+    (pending, finished), received = simulate(
+        client, read_until_closed, upstream=DELAYED)
+    assert pending > 0
+    assert finished
+    assert received == payload
+
+
+def test_send_blocks_only_once_the_send_buffer_is_full(simulate):
+    payload = random.Random(2).randbytes(
+        (SelectiveRepeat.SEND_BUFFER_SIZE + 50) * MSS)
+
+    def client(stream):
+        stream.send(payload)
+        return stream.protocol.window.pending_segments()
+
+    pending, received = simulate(client, read_until_closed, upstream=DELAYED)
+    assert 0 < pending <= SelectiveRepeat.SEND_BUFFER_SIZE
+    assert received == payload
+
+
+@pytest.mark.parametrize("protocol", [SelectedProtocol.STOP_AND_WAIT,
+                                      SelectedProtocol.SELECTIVE_REPEAT])
+def test_many_sends_arrive_intact_over_a_lossy_link(simulate, protocol):
+    chunks = [random.Random(i).randbytes(random.Random(i).randint(1, 3000))
+              for i in range(40)]
+    lossy = LinkImpairments(GilbertElliottLoss(good_loss=0.1), delay=0.005)
+
+    def client(stream):
+        for chunk in chunks:
+            stream.send(chunk)
+        stream.flush()
+
+    _, received = simulate(client, read_until_closed, protocol=protocol,
+                           upstream=lossy, seed=3)
+    assert received == b''.join(chunks)
+
+
+# Both ends send before reading, so each one gets the data of the other
+# while it waits for its own acks
+def test_read_returns_the_data_received_while_sending(simulate):
+    client_payload = random.Random(4).randbytes(20 * MSS)
+    server_payload = random.Random(5).randbytes(20 * MSS)
+
+    def client(stream):
+        stream.send(client_payload)
+        return read_exactly(stream, len(server_payload))
+
+    def server(stream):
+        stream.send(server_payload)
+        return read_exactly(stream, len(client_payload))
+
+    from_server, from_client = simulate(client, server, upstream=DELAYED)
+    assert from_server == server_payload
+    assert from_client == client_payload
+
+
+# Stop and wait is the default protocol of the server, its --rate-limit
+# must hold as well
+@pytest.mark.parametrize("protocol", [SelectedProtocol.STOP_AND_WAIT,
+                                      SelectedProtocol.SELECTIVE_REPEAT])
+def test_the_rate_limits_of_the_stream_hold_with_both_protocols(simulate,
+                                                                protocol):
+    payload = random.Random(6).randbytes(40 * MSS)
+    rate, burst = 20 * MSS, 4 * MSS
+
+    def client(stream):
+        stream.rate_limits = [TokenBucket(rate, burst)]
+        start = stream.clock()
+        stream.send(payload)
+        stream.flush()
+        return stream.clock() - start, stream.stats.rate_limited_time
+
+    (elapsed, rate_limited_time), received = simulate(
+        client, read_until_closed, protocol=protocol)
+    assert received == payload
+    assert elapsed >= (len(payload) - burst) / rate * 0.95
+    assert rate_limited_time > 0
@@ -0,0 +1,122 @@
+import time
+
+import pytest
+
+from lib.segment_encoding.application_header import ApplicationHeaderRDT
+from lib.transference_handler import striped_transfer
+from lib.transference_handler.striped_transfer import MIN_STRIPE_SIZE, \
+    StripedTransferRegistry, split_in_stripes
+from lib.transference_handler.uploader import Uploader
+from lib.utils.constant import DEFAULT_SV_STORAGE, SelectedTransferType
+from lib.utils.exceptions import RequestRejectedError
+from lib.utils.file_handling import FileHandler
+
+TRANSFER_ID = 7
+
+
+@pytest.mark.parametrize("file_size, streams", [
+    (10 * MIN_STRIPE_SIZE, 4), (10 * MIN_STRIPE_SIZE + 1, 3),
+    (4 * MIN_STRIPE_SIZE, 4), (MIN_STRIPE_SIZE * 3 - 1, 8)])
+def test_stripes_cover_the_file_once(file_size, streams):
+    stripes = split_in_stripes(file_size, streams)
+    assert len(stripes) <= streams
+    offset = 0
+    for stripe_offset, length in stripes:
+        assert stripe_offset == offset
+        assert length >= MIN_STRIPE_SIZE or len(stripes) == 1
+        offset += length
+    assert offset == file_size
+
+
+@pytest.mark.parametrize("file_size", [0, 1, MIN_STRIPE_SIZE * 2 - 1])
+def test_small_files_go_in_a_single_stripe(file_size):
+    assert split_in_stripes(file_size, 4) == [(0, file_size)]
+
+
+def stripe_header(offset, length, file_size):
+    return ApplicationHeaderRDT(
+        SelectedTransferType.UPLOAD, "striped", file_size, offset, length,
+        TRANSFER_ID)
+
+
+def test_stripes_write_their_range_and_the_transfer_ends(tmp_path):
+    registry = StripedTransferRegistry()
+    file_path = str(tmp_path / "striped")
+    data = bytes(range(200))
+    headers = [stripe_header(0, 120, 200), stripe_header(120, 80, 200)]
+
+    handlers = [registry.open_stripe(file_path, header)
+                for header in headers]
+    for header, handler in zip(headers, handlers):
+        handler.write(data[header.offset:header.offset + header.length])
+        handler.close()
+        registry.close_stripe(header, completed=True)
+
+    assert registry.transfers == {}
+    with open(file_path, "rb") as file:
+        assert file.read() == data
+
+
+@pytest.mark.parametrize("failed_first", [True, False])
+def test_a_failed_stripe_drops_the_transfer(tmp_path, failed_first):
+    registry = StripedTransferRegistry()
+    file_path = str(tmp_path / "striped")
+    failed = stripe_header(0, 100, 200)
+    completed = stripe_header(100, 100, 200)
+    for header in (failed, completed):
+        registry.open_stripe(file_path, header).close()
+
+    if failed_first:
+        registry.close_stripe(failed, completed=False)
+        assert registry.transfers == {}
+        registry.close_stripe(completed, completed=True)
+    else:
+        registry.close_stripe(completed, completed=True)
+        registry.close_stripe(failed, completed=False)
+    assert registry.transfers == {}
+
+
+# A stripe arriving after another one failed must not create the file
+# again over what the rest wrote
+def test_a_late_stripe_of_a_failed_transfer_is_refused(tmp_path,
+                                                       monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(striped_transfer.time, "monotonic", lambda: now[0])
+    registry = StripedTransferRegistry()
+    file_path = str(tmp_path / "striped")
+    written = registry.open_stripe(file_path, stripe_header(0, 100, 200))
+    written.write(b"x" * 100)
+    written.close()
+    registry.close_stripe(stripe_header(0, 100, 200), completed=False)
+
+    with pytest.raises(ValueError):
+        registry.open_stripe(file_path, stripe_header(100, 100, 200))
+    assert registry.has_failed(TRANSFER_ID)
+    with open(file_path, "rb") as file:
+        assert file.read(100) == b"x" * 100
+
+    now[0] += StripedTransferRegistry.FAILED_TRANSFER_MEMORY + 1
+    assert not registry.has_failed(TRANSFER_ID)
+
+
+def test_the_server_rejects_the_stripes_of_a_failed_transfer(
+        simulate, server, tmp_path):
+    local_path = tmp_path / "local"
+    local_path.write_bytes(b"y" * 200)
+    stored_path = DEFAULT_SV_STORAGE + "striped"
+    with open(stored_path, "wb") as file:
+        file.write(b"written by the other stripes")
+    server.striped_transfers.failed[TRANSFER_ID] = time.monotonic()
+
+    def client(stream):
+        file_handler = FileHandler(str(local_path), "striped", "rb")
+        try:
+            with pytest.raises(RequestRejectedError):
+                Uploader(stream, file_handler, 100, 100, TRANSFER_ID,
+                         read_answer=True).run()
+        finally:
+            file_handler.close()
+
+    simulate(client, server._run_session)
+    with open(stored_path, "rb") as file:
+        assert file.read() == b"written by the other stripes"
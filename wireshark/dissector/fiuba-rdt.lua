@@ -7,9 +7,10 @@ local Seq_num = ProtoField.uint32("fiubardt.SeqNum","SeqNum",base.DEC)
 local Ack_num = ProtoField.uint32("fiubardt.AckNum","AckNum",base.DEC)
 local Syn = ProtoField.bool("fiubardt.Syn","Syn")
 local Fin = ProtoField.bool("fiubardt.Fin","Fin")
+local Stream_id = ProtoField.uint16("fiubardt.StreamId","StreamId",base.DEC)
 local Checksum = ProtoField.uint8("fiubardt.Checksum","Checksum",base.DEC)
 
-p_fiubardt.fields = { Protocol, Data_size, Seq_num, Ack_num, Syn, Fin, Checksum }
+p_fiubardt.fields = { Protocol, Data_size, Seq_num, Ack_num, Syn, Fin, Stream_id, Checksum }
 
 local function heuristic_checker(buffer, pinfo, tree)
   -- guard for length
@@ -44,7 +45,8 @@ function p_fiubardt.dissector (buf, pkt, root)
   subtree:add(Ack_num, buf(9,4))
   subtree:add(Syn, buf(13,1))
   subtree:add(Fin, buf(14,1))
-  subtree:add(Checksum, buf(15,1))
+  subtree:add(Stream_id, buf(15,2))
+  subtree:add(Checksum, buf(17,1))
 end
 
 -- Initialization routine